@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+import sys
+from logging import Formatter, getLogger, INFO
+from logging.handlers import RotatingFileHandler
+from tempfile import mkdtemp
+from time import perf_counter
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.server.access_log import AccessLogWriter, ModuleCtx as AccessLogCtx
+from zato.server.base.parallel.http import HTTPHandler
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Requests = 100_000
+    Max_Bytes = 20_000_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _InlineWriter:
+    """ Formats and writes each entry as soon as it is pushed, which is how the access log used to be written.
+    """
+    def __init__(self, access_logger):
+        self.access_logger = access_logger
+        self.writer = AccessLogWriter(access_logger)
+
+    def push(self, record):
+        fields, = self.writer._get_fields([record])
+        self.access_logger._log(INFO, '', None, None, fields) # type: ignore
+
+    def stop(self):
+        pass
+
+# ################################################################################################################################
+
+class _Server:
+    """ Provides everything HTTPHandler.on_wsgi_request needs.
+    """
+    client_address_headers = ['REMOTE_ADDR']
+    needs_all_access_log = True
+    access_log_ignore = set()
+    worker_store = None
+
+    def __init__(self, access_log_writer):
+        self.needs_access_log = bool(access_log_writer)
+        self.access_log_writer = access_log_writer
+
+    def request_dispatcher_dispatch(self, cid, req_timestamp, wsgi_environ, worker_store):
+        wsgi_environ['zato.http.response.status'] = '200 OK'
+        return b'{"customer_id":123}'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_access_logger(name):
+
+    path = os.path.join(mkdtemp(prefix='zato-bench-access-log-'), 'http_access.log')
+
+    handler = RotatingFileHandler(path, maxBytes=ModuleCtx.Max_Bytes, backupCount=1, encoding='utf8')
+    handler.setFormatter(Formatter(AccessLogCtx.Default_Format))
+
+    access_logger = getLogger('zato_access_log.bench.{}'.format(name))
+    access_logger.propagate = False
+    access_logger.setLevel(INFO)
+    access_logger.addHandler(handler)
+
+    return access_logger
+
+# ################################################################################################################################
+
+def run(name, access_log_writer, requests):
+
+    server = _Server(access_log_writer)
+    on_wsgi_request = HTTPHandler.on_wsgi_request
+
+    def start_response(status, headers):
+        pass
+
+    start = perf_counter()
+
+    for idx in range(requests):
+        wsgi_environ = {
+            'REMOTE_ADDR': '127.0.0.1',
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/api/customer',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_USER_AGENT': 'bench',
+        }
+        _ = on_wsgi_request(server, wsgi_environ, start_response)
+
+        # Let the writer run, as it would between requests in a server
+        if access_log_writer and not idx % 1000:
+            sleep(0)
+
+    request_time = perf_counter() - start
+
+    # Also include the time needed to write whatever is still buffered
+    if access_log_writer:
+        access_log_writer.stop()
+
+    total_time = perf_counter() - start
+
+    print('{:>12}: {:.0f} req/s (request path), {:.0f} req/s (including writes)'.format(
+        name, requests / request_time, requests / total_time))
+
+# ################################################################################################################################
+
+def main(requests):
+
+    run('Off', None, requests)
+    run('Inline', _InlineWriter(get_access_logger('inline')), requests)
+
+    writer = AccessLogWriter(get_access_logger('batched'))
+    writer.start()
+    run('Batched', writer, requests)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.Requests)
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import logging
+import sys
+from json import dumps
+from time import process_time
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# ws4py
+from ws4py.streaming import Stream
+
+# Zato
+from zato.common.util.api import new_cid
+from zato.server.connection.web_socket import WebSocket, WebSocketContainer
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Messages = 10
+    Request = {'my.key': 'my.value' * 100}
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class BenchWebSocket(WebSocket):
+    """ A WebSocket whose socket only counts what is written to it.
+    """
+    def __init__(self, idx):
+
+        # We do not call the parent's __init__ because there is no socket
+        self._json_dump_func = dumps
+        self._initialized = True
+        self.python_id = 'bench.python_id.{}'.format(idx)
+        self.pub_client_id = 'bench.pub_client_id.{}'.format(idx)
+        self.ext_client_id = 'bench.ext_client_id.{}'.format(idx)
+        self.ext_client_name = 'bench.ext_client_name.{}'.format(idx)
+        self.peer_conn_info_pretty = 'bench.peer.{}'.format(idx)
+        self.is_audit_log_sent_active = False
+        self.stream = Stream(always_mask=False)
+        self.responses_pending = {}
+        self.frames_pending = []
+        self.is_sending_frames = False
+        self._disconnect_requested = False
+
+        self.num_writes = 0
+        self.num_bytes = 0
+
+    def _write(self, data):
+        self.num_writes += 1
+        self.num_bytes += len(data)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_container(num_clients):
+
+    container = WebSocketContainer.__new__(WebSocketContainer)
+    container.config = Bunch(name='bench.channel')
+    container.clients = {}
+
+    for idx in range(num_clients):
+        client = BenchWebSocket(idx)
+        container.clients[client.pub_client_id] = client
+
+    return container
+
+# ################################################################################################################################
+
+def broadcast_per_client(container, cid, request):
+    """ This is how broadcasts were made previously - each client built and serialised its own message.
+    """
+    return [spawn(client.invoke_client, cid, request, wait_for_response=False) for client in container.clients.values()]
+
+# ################################################################################################################################
+
+def run(name, num_clients, broadcast_func):
+
+    container = get_container(num_clients)
+    greenlets = []
+
+    start = process_time()
+
+    for _ in range(ModuleCtx.Messages):
+        greenlets.extend(broadcast_func(container, new_cid(), ModuleCtx.Request) or [])
+
+    # Wait until all the messages have been written
+    joinall(greenlets)
+
+    while any(client.is_sending_frames for client in container.clients.values()):
+        sleep(0.001)
+
+    cpu_time = process_time() - start
+    clients = container.clients.values()
+
+    print('{} {:>6} clients: CPU {:.3f}s ({:.2f}us per client and message), writes:{}, bytes:{}'.format(
+        name, num_clients, cpu_time, cpu_time / num_clients / ModuleCtx.Messages * 1_000_000,
+        sum(client.num_writes for client in clients), sum(client.num_bytes for client in clients)))
+
+# ################################################################################################################################
+
+def main(max_clients):
+
+    # Each invocation is logged, which we are not interested in
+    logging.basicConfig(level=logging.WARNING)
+
+    num_clients = 100
+
+    while num_clients <= max_clients:
+        run('Per client', num_clients, broadcast_per_client)
+        run('Fan-out   ', num_clients, WebSocketContainer.broadcast)
+        num_clients *= 10
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
+
+# ################################################################################################################################
+# ################################################################################################################################
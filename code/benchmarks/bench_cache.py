@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from random import randrange
+from time import sleep
+from timeit import default_timer
+
+# Zato
+from zato.cache import Cache
+
+# ################################################################################################################################
+
+# How many entries the cache holds in each run
+cache_sizes = [1_000, 10_000, 100_000, 1_000_000]
+
+# How many operations to measure in each run
+iterations = 50_000
+
+# ################################################################################################################################
+
+def main():
+
+    print('{:>10} {:>12} {:>12} {:>18}'.format('entries', 'get us/op', 'set us/op', 'delete_expired ms'))
+
+    for size in cache_sizes:
+
+        c = Cache(size)
+
+        for idx in range(size):
+            c.set('key{}'.format(idx), idx, 0.0, None)
+
+        keys = ['key{}'.format(randrange(size)) for _ in range(iterations)]
+
+        start = default_timer()
+        for key in keys:
+            c.get(key, None, False)
+        get_us = (default_timer() - start) / iterations * 1_000_000
+
+        # Overwrite existing keys as well as add new ones, which will evict the least recently used ones
+        new_keys = ['new{}'.format(idx) if idx % 2 else key for idx, key in enumerate(keys)]
+
+        start = default_timer()
+        for key in new_keys:
+            c.set(key, 1, 0.0, None)
+        set_us = (default_timer() - start) / iterations * 1_000_000
+
+        # Make a tenth of the keys expire
+        for key in c.keys()[::10]:
+            c.expire(key, 0.001, None)
+        sleep(0.01)
+
+        start = default_timer()
+        c.delete_expired()
+        delete_expired_ms = (default_timer() - start) * 1000
+
+        print('{:>10,} {:>12.2f} {:>12.2f} {:>18.2f}'.format(size, get_us, set_us, delete_expired_ms))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from timeit import default_timer
+
+# Zato
+from zato.cache import Cache
+
+# ################################################################################################################################
+
+# How many entries the cache holds in each run
+cache_sizes = [10_000, 100_000, 1_000_000]
+
+# How many prefix look-ups and deletions to measure in each run
+iterations = 1_000
+
+# ################################################################################################################################
+
+def main():
+
+    print('{:>10} {:>10} {:>20} {:>20}'.format('entries', 'index', 'get_by_prefix ms/op', 'delete_by_prefix ms/op'))
+
+    for size in cache_sizes:
+        for has_key_index in (False, True):
+
+            c = Cache(size, has_key_index=has_key_index)
+
+            for idx in range(size):
+                c.set('customer:{}:name'.format(idx), idx, 0.0, None)
+
+            start = default_timer()
+            for idx in range(iterations):
+                c.get_by_prefix('customer:{}:'.format(idx), False, 0)
+            get_ms = (default_timer() - start) / iterations * 1000
+
+            start = default_timer()
+            for idx in range(iterations):
+                c.delete_by_prefix('customer:{}:'.format(idx), False, 0)
+            delete_ms = (default_timer() - start) / iterations * 1000
+
+            print('{:>10} {:>10} {:>20.4f} {:>20.4f}'.format(size, str(has_key_index), get_ms, delete_ms))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
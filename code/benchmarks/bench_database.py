@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from tempfile import mkdtemp
+from time import perf_counter
+
+# Zato
+from zato.server.connection.connector.subprocess_.impl.events.database import EventsDatabase, OpCode
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Len_Services = 50
+    Len_Batch = 10_000
+    History_Days = 30
+    Sync_Threshold = 100_000_000
+    Sync_Interval  = 100_000_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def push_batch(events_db, start, len_batch):
+
+    step = timedelta(days=1) / len_batch
+
+    for idx in range(len_batch):
+        events_db.access_state(OpCode.Push, {
+            'timestamp': (start + step * idx).isoformat(),
+            'object_id': 'service-{}'.format(idx % ModuleCtx.Len_Services),
+            'total_time_ms': idx % 100,
+        })
+
+# ################################################################################################################################
+
+def main(history_days):
+
+    logger = logging.getLogger('bench')
+    fs_data_path = os.path.join(mkdtemp(prefix='zato-bench-events-'), 'zato.events')
+
+    events_db = EventsDatabase(logger, fs_data_path, ModuleCtx.Sync_Threshold, ModuleCtx.Sync_Interval)
+
+    # Each day of history is synced a few times, the same way a server would do it
+    start = datetime.utcnow() - timedelta(days=history_days)
+
+    for day in range(history_days + 1):
+        day_start = start + timedelta(days=day)
+
+        push_batch(events_db, day_start, ModuleCtx.Len_Batch)
+
+        sync_start = perf_counter()
+        events_db.sync_state()
+        sync_time = perf_counter() - sync_start
+
+        table_start = perf_counter()
+        _ = events_db.get_table()
+        table_time = perf_counter() - table_start
+
+        print('History: {:>7} events; sync: {:.3f}s; get_table: {:.3f}s'.format(
+            events_db.total_events, sync_time, table_time))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.History_Days)
+
+# ################################################################################################################################
+# ################################################################################################################################
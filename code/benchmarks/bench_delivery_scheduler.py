@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+import sys
+from random import choice
+from time import process_time, time
+
+# gevent
+from gevent import sleep
+
+# Zato
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zato-server', 'test', 'zato', 'pubsub'))
+from test_delivery_scheduler import DeliverySchedulerTestCase, _PubSub
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Idle_Time = 3
+    Pool_Size = 100
+    Messages = 5000
+    Publish_Interval = 0.0005
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+# ################################################################################################################################
+
+def main(len_sub_keys):
+
+    # Publication time of each message, by its data
+    published = {}
+
+    # Delivery latency of each message
+    latency = []
+
+    def deliver_func(sub_key, msg_list):
+        now = time()
+        for msg in msg_list:
+            latency.append(now - published.pop(msg.data))
+
+    # We are only interested in the helper methods of the test case
+    test = DeliverySchedulerTestCase()
+
+    pubsub = _PubSub(ModuleCtx.Pool_Size, deliver_func=deliver_func)
+    sub_keys = ['sk.{}'.format(idx) for idx in range(len_sub_keys)]
+
+    start = time()
+    tool = test._get_tool(pubsub, sub_keys)
+    print('Created {} delivery tasks in {:.2f}s'.format(len_sub_keys, time() - start))
+
+    # How much CPU time the server uses when there are no messages to deliver ..
+    start = process_time()
+    sleep(ModuleCtx.Idle_Time)
+    idle_cpu = (process_time() - start) / ModuleCtx.Idle_Time * 100
+
+    print('Idle CPU: {:.2f}%, delivery runs while idle: {}'.format(idle_cpu, pubsub.delivery_scheduler.len_runs))
+
+    # .. and how long it takes for a message to be delivered once it is enqueued.
+    for idx in range(ModuleCtx.Messages):
+        sub_key = choice(sub_keys)
+        msg, = test._get_messages(sub_key, 1, 'bench.{}'.format(idx))
+        published[msg['data']] = time()
+        tool.add_non_gd_messages_by_sub_key(sub_key, [msg])
+        sleep(ModuleCtx.Publish_Interval)
+
+    while published:
+        sleep(0.1)
+
+    print('Latency of {} messages: p50:{:.3f}ms, p99:{:.3f}ms, max:{:.3f}ms'.format(len(latency),
+        get_percentile(latency, 50) * 1000, get_percentile(latency, 99) * 1000, max(latency) * 1000))
+
+    pubsub.delivery_scheduler.stop()
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import sys
+from time import perf_counter
+
+# Zato
+from zato.common.ext.dataclasses import dataclass
+from zato.common.marshal_.api import MarshalAPI, Model
+from zato.common.typing_ import cast_, list_, optional
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.server.service import Service
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Len_Elems = 1000
+    Iterations = 100
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+@dataclass(init=False, repr=False)
+class Attr(Model):
+    name: str
+    value: optional[str]
+
+@dataclass(init=False, repr=False)
+class Item(Model):
+    item_id: int
+    name: str
+    price: float
+    description: optional[str]
+    attr_list: list_[Attr]
+
+@dataclass(init=True, repr=False)
+class Order(Model):
+    order_id: int
+    customer: str
+    item_list: list_[Item]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_order(len_elems):
+    return {
+        'order_id': 123,
+        'customer': 'customer.1',
+        'item_list': [{
+            'item_id': idx,
+            'name': 'item.{}'.format(idx),
+            'price': idx / 10.0,
+            'attr_list': [{'name': 'attr.1', 'value': 'value.1'}, {'name': 'attr.2'}],
+        } for idx in range(len_elems)]
+    }
+
+# ################################################################################################################################
+
+def main(len_elems, iterations):
+
+    api = MarshalAPI()
+    service = cast_('Service', None)
+    data = get_order(len_elems)
+
+    # The first call compiles the plans, which the server does when services are deployed
+    start = perf_counter()
+    _ = api.from_dict(service, data, Order)
+    first_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(iterations):
+        order = api.from_dict(service, data, Order)
+    total_time = perf_counter() - start
+
+    len_models = 1 + len_elems * 3
+    per_call = total_time / iterations
+
+    print('Orders with {} items ({} models each): first call: {:.3f}ms; per call: {:.3f}ms; per model: {:.2f}us'.format(
+        len_elems, len_models, first_time * 1000, per_call * 1000, per_call / len_models * 1_000_000))
+
+    return order # type: ignore
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.Len_Elems, ModuleCtx.Iterations)
+
+# ################################################################################################################################
+# ################################################################################################################################
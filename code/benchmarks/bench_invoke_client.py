@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import logging
+import sys
+from json import dumps
+from time import process_time, time
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+from gevent.queue import Queue
+
+# Zato
+from zato.common.util.api import new_cid
+from zato.server.connection.web_socket import WebSocket
+from zato.server.connection.web_socket.msg import InvokeClientRequest
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Timeout = 30
+
+    # How long it takes a client to respond
+    Echo_Delay = 0.001
+
+    # How often the previous implementation checked if a response had arrived
+    Poll_Interval = 0.01
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class EchoWebSocket(WebSocket):
+    """ A WebSocket connected to a client that responds with the same data that it receives. There is no network involved,
+    only the server-side code that correlates requests with responses, but, like with a real connection, responses are
+    received by a single greenlet, one by one.
+    """
+    def __init__(self):
+
+        # We do not call the parent's __init__ because there is no socket
+        self._json_dump_func = dumps
+        self.python_id = 'bench.python_id'
+        self.pub_client_id = 'bench.pub_client_id'
+        self.ext_client_id = 'bench.ext_client_id'
+        self.ext_client_name = 'bench.ext_client_name'
+        self.peer_conn_info_pretty = 'bench.peer'
+        self.responses_pending = {}
+
+        self.client_requests = Queue()
+        self.client = spawn(self._run_client)
+
+    def _run_client(self):
+        while True:
+            sent_at, cid, data = self.client_requests.get()
+
+            delay = sent_at + ModuleCtx.Echo_Delay - time()
+            if delay > 0:
+                sleep(delay)
+
+            self._receive_response(cid, Bunch(in_reply_to=cid, data=data))
+
+    def _receive_response(self, cid, msg):
+        self._handle_client_response(cid, msg)
+
+    def send(self, data='', cid='', in_reply_to=''):
+        self.client_requests.put((time(), cid, data))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class PollingEchoWebSocket(EchoWebSocket):
+    """ The same as above but it waits for responses the way the channel did previously,
+    by checking periodically if a response has been received.
+    """
+    def __init__(self):
+        super().__init__()
+        self.responses_received = {}
+
+    def _receive_response(self, cid, msg):
+        self.responses_received[cid] = msg
+
+    def invoke_client(self, cid, request, timeout=5, **ignored):
+
+        # Serialise the request the same way the current implementation does so that only waiting for responses differs
+        msg = InvokeClientRequest(cid, request, None)
+        self.send(msg.serialize(self._json_dump_func), msg.id)
+
+        until = time() + timeout
+
+        while time() < until:
+            response = self.responses_received.pop(cid, None)
+            if response:
+                return response.data
+            sleep(ModuleCtx.Poll_Interval)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def run(ws, num_invocations):
+
+    # Round-trip time of each invocation
+    latency = []
+
+    def invoke(idx):
+        start = time()
+        response = ws.invoke_client(new_cid(), {'idx': idx}, ModuleCtx.Timeout)
+        if response:
+            latency.append(time() - start)
+
+    start = time()
+    cpu_start = process_time()
+
+    joinall([spawn(invoke, idx) for idx in range(num_invocations)])
+
+    total_time = time() - start
+    cpu_time = process_time() - cpu_start
+
+    ws.client.kill()
+
+    print('{}: {} responses, p50:{:.3f}ms, p99:{:.3f}ms, total:{:.2f}s, CPU:{:.2f}s ({:.0f}%)'.format(
+        ws.__class__.__name__, len(latency), get_percentile(latency, 50) * 1000, get_percentile(latency, 99) * 1000,
+        total_time, cpu_time, cpu_time / total_time * 100))
+
+# ################################################################################################################################
+
+def main(num_invocations):
+
+    # Each invocation is logged, which we are not interested in
+    logging.basicConfig(level=logging.WARNING)
+
+    run(PollingEchoWebSocket(), num_invocations)
+    run(EchoWebSocket(), num_invocations)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
+
+# ################################################################################################################################
+# ################################################################################################################################
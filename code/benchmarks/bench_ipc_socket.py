@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, spawn
+
+# Zato
+from zato.common.aux_server.base import AuxServerConfig
+from zato.common.ipc.client import IPCClient
+from zato.common.ipc.server import IPCServer
+from zato.common.ipc.socket_ import IPCSocketClient, IPCSocketServer
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Username = 'bench.username'
+    Password = 'bench.password'
+    Calls = 2000
+    Concurrency = 20
+    Request = {'Hello': 'World'}
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def callback_func(msg):
+    return {'echo': msg['data']}
+
+# ################################################################################################################################
+
+def start_http_server():
+
+    # Any free port will do
+    config = AuxServerConfig()
+    config.main = Bunch(crypto=Bunch(use_tls=False), bind=Bunch(host='127.0.0.1', port=0))
+    config.username = ModuleCtx.Username
+    config.password = ModuleCtx.Password
+    config.callback_func = callback_func
+
+    server = IPCServer(config)
+    server.api_server.start()
+    port = server.api_server.server_port
+
+    client = IPCClient('127.0.0.1', port, ModuleCtx.Username, ModuleCtx.Password)
+    return lambda: client.invoke('bench.service', ModuleCtx.Request, 'bench')
+
+# ################################################################################################################################
+
+def start_socket_server():
+
+    path = os.path.join(mkdtemp(prefix='zato-bench-ipc-'), 'ipc.sock')
+
+    server = IPCSocketServer(path, ModuleCtx.Username, ModuleCtx.Password, callback_func)
+    server.start()
+
+    client = IPCSocketClient(path, ModuleCtx.Username, ModuleCtx.Password)
+    return lambda: client.invoke('bench.service', ModuleCtx.Request)
+
+# ################################################################################################################################
+
+def run(name, invoke_func, calls):
+
+    # Warm up first, e.g. to have the socket connection established
+    response = invoke_func()
+    assert response['status'] == 'ok', response
+
+    # Round-trip latency of one call at a time ..
+    start = perf_counter()
+    for _ in range(calls):
+        _ = invoke_func()
+    latency = (perf_counter() - start) / calls
+
+    # .. and throughput with concurrent callers.
+    def invoke_many(count):
+        for _ in range(count):
+            _ = invoke_func()
+
+    start = perf_counter()
+    _ = joinall([spawn(invoke_many, calls // ModuleCtx.Concurrency) for _ in range(ModuleCtx.Concurrency)])
+    calls_per_second = calls / (perf_counter() - start)
+
+    print('{:>6}: latency: {:.3f}ms; {} concurrent callers: {:.0f} calls/s'.format(
+        name, latency * 1000, ModuleCtx.Concurrency, calls_per_second))
+
+# ################################################################################################################################
+
+def main(calls):
+    run('HTTP', start_http_server(), calls)
+    run('Socket', start_socket_server(), calls)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.Calls)
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+# Cryptography
+from cryptography.fernet import Fernet
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common.odb.model import KVData
+from zato.server.jwt_ import JWT
+from zato.server.jwt_cache import JWTTokenCache
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Username = 'user.1'
+    TTL = 3600
+    Requests = 5000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _ODB:
+    """ An SQLite-based ODB with the key/value table only, which is all that JWT tokens need.
+    """
+    def __init__(self):
+        path = os.path.join(mkdtemp(prefix='zato-bench-jwt-'), 'odb.db')
+        engine = create_engine('sqlite:///{}'.format(path))
+        KVData.__table__.create(engine)
+        self.session = sessionmaker(bind=engine)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def run(odb, secret, token, token_cache, requests):
+
+    start = perf_counter()
+
+    for _ in range(requests):
+
+        # This is what a channel does on each request to check its JWT security definition
+        result = JWT(odb, None, secret, token_cache).validate(ModuleCtx.Username, token)
+        assert result.valid, result
+
+    return requests / (perf_counter() - start)
+
+# ################################################################################################################################
+
+def main(requests):
+
+    odb = _ODB()
+    secret = Fernet.generate_key()
+
+    backend = JWT(odb, None, secret)
+    token = backend._create_token(username=ModuleCtx.Username, ttl=ModuleCtx.TTL).encode('utf8')
+    backend.cache.put(token, token, ModuleCtx.TTL, is_async=False)
+
+    without_cache = run(odb, secret, token, None, requests)
+    with_cache = run(odb, secret, token, JWTTokenCache(), requests)
+
+    print('Requests: {}; without cache: {:.0f} req/s; with cache: {:.0f} req/s'.format(
+        requests, without_cache, with_cache))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.Requests)
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from ipaddress import ip_address
+from random import randrange, seed
+from timeit import default_timer
+
+# Zato
+from zato.common.rate_limiting import RateLimiting
+from zato.common.rate_limiting.common import Const
+
+# ################################################################################################################################
+
+# How many requests to check in each run - one second's worth at 50k req/s
+requests = 50_000
+
+# How many networks there are in a definition
+network_counts = [1, 10, 100]
+
+# How many distinct client addresses the requests come from
+address_count = 5_000
+
+object_dict = {
+    'id': 1,
+    'type_': 'http_soap',
+    'name': 'my.channel',
+    'is_active': True,
+    'parent_type': None,
+    'parent_name': None,
+}
+
+# ################################################################################################################################
+
+def main():
+
+    seed(1)
+
+    print('{:>10} {:>16} {:>12} {:>12}'.format('networks', 'engine', 'us/request', 'req/s'))
+
+    for network_count in network_counts:
+
+        # The last network is a catch-all one so each address matches but only after all the others were checked
+        networks = ['10.{}.0.0/16 = 1000000/m'.format(idx) for idx in range(network_count - 1)]
+        networks.append('0.0.0.0/0 = 1000000/m')
+        definition = '\n'.join(networks)
+
+        addresses = [str(ip_address(randrange(0, 2 ** 32))) for _ in range(address_count)]
+        addresses = [addresses[randrange(address_count)] for _ in range(requests)]
+
+        for engine in (Const.Engine.approximate, Const.Engine.sliding_window):
+
+            api = RateLimiting()
+            api.engine = engine
+            api.create(object_dict, definition, False)
+
+            start = default_timer()
+            for address in addresses:
+                api.check_limit('cid', 'http_soap', 'my.channel', address)
+            elapsed = default_timer() - start
+
+            print('{:>10} {:>16} {:>12.2f} {:>12,.0f}'.format(network_count, engine, elapsed / requests * 1_000_000,
+                requests / elapsed))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import gc
+import sys
+from collections import Counter
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+# gevent
+from gevent import sleep
+
+# greenlet
+from greenlet import greenlet
+
+# Zato
+from zato.server.pattern.retry_scheduler import Default, RetryScheduler
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Run_Time = 75
+    Num_Targets = 100
+    Retry_Repeats = 5
+    Retry_Seconds = 1
+    Call_Time = 0.001
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_max_rss_mb():
+    return getrusage(RUSAGE_SELF).ru_maxrss / 1024.0
+
+def get_num_greenlets():
+    return sum(1 for item in gc.get_objects() if isinstance(item, greenlet))
+
+# ################################################################################################################################
+
+def main(num_retries, breaker_failures):
+
+    base_dir = mkdtemp(prefix='zato-bench-retry-')
+
+    # How many attempts were made in each second of the run
+    attempts = Counter()
+    start = time()
+
+    # All the targets keep failing, which is when retries pile up
+    def attempt_func(entry):
+        attempts[int(time() - start)] += 1
+        sleep(ModuleCtx.Call_Time)
+        raise Exception('Target failure')
+
+    def callback_func(entry, is_ok, response):
+        pass
+
+    # With a high enough number of failures, the breakers never open, which shows how backoff and jitter alone spread retries
+    scheduler = RetryScheduler(base_dir, attempt_func, callback_func, breaker_failures=breaker_failures)
+    scheduler.start()
+
+    rss_before = get_max_rss_mb()
+    greenlets_before = get_num_greenlets()
+
+    for idx in range(num_retries):
+        scheduler.schedule({
+            'source': 'bench.source',
+            'target': 'bench.target.{}'.format(idx % ModuleCtx.Num_Targets),
+            'retry_repeats': ModuleCtx.Retry_Repeats,
+            'retry_seconds': ModuleCtx.Retry_Seconds,
+            'orig_cid': 'orig-cid-{}'.format(idx),
+            'call_cid': 'call-cid-{}'.format(idx),
+            'callback': None,
+            'callback_context': None,
+            'args': ('bench.request',),
+            'kwargs': {},
+            'req_ts_utc': '2023-01-01T00:00:00',
+        })
+
+    print('Scheduled {} retries in {:.2f}s'.format(num_retries, time() - start))
+
+    sleep(ModuleCtx.Run_Time)
+
+    print('Max RSS: {:.1f} MB (+{:.1f} MB), greenlets: {} (before: {}), journal: {:.1f} MB'.format(
+        get_max_rss_mb(), get_max_rss_mb() - rss_before, get_num_greenlets(), greenlets_before,
+        scheduler.journal.size / 1024.0 / 1024.0))
+
+    print('Stats: {}'.format({key: value if not isinstance(value, list) else len(value)
+        for key, value in scheduler.get_stats().items()}))
+
+    # Attempts should be spread over time rather than made in bursts whenever a lot of retries become due at once
+    print('Attempts per second:')
+    for second in range(ModuleCtx.Run_Time):
+        print('  {:>3}s {:>7}'.format(second, attempts[second]))
+
+    scheduler.stop()
+    rmtree(base_dir, ignore_errors=True)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    num_retries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    breaker_failures = int(sys.argv[2]) if len(sys.argv) > 2 else Default.breaker_failures
+
+    main(num_retries, breaker_failures)
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import socket
+import sys
+from datetime import datetime
+from time import perf_counter
+
+# gevent
+from gevent import spawn
+
+# Zato
+from zato.common.events.client import Client as EventsClient
+from zato.server.connection.stats import ServiceStatsClient
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Events = 100_000
+    Len_Services = 50
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_client():
+    """ Returns a client connected to a socket whose other end only reads whatever it receives.
+    """
+    client_socket, server_socket = socket.socketpair()
+
+    def drain():
+        while server_socket.recv(1_000_000):
+            pass
+
+    _ = spawn(drain)
+
+    client = EventsClient('<bench>', -1)
+    client.socket = client_socket
+    client.is_connected = True
+
+    return client
+
+# ################################################################################################################################
+
+def run(name, stats_client, events):
+
+    timestamp = datetime.utcnow().isoformat()
+    service_names = ['my.service.{}'.format(idx) for idx in range(ModuleCtx.Len_Services)]
+
+    # This is what each service invocation does ..
+    start = perf_counter()
+    for idx in range(events):
+        stats_client.push('cid', timestamp, service_names[idx % ModuleCtx.Len_Services], False, idx % 100)
+    push_time = perf_counter() - start
+
+    # .. and this is what the flusher does in background.
+    start = perf_counter()
+    stats_client.flush()
+    flush_time = perf_counter() - start
+
+    print('{:>10}: per push: {:.2f}us; flush: {:.3f}s; total: {:.0f} events/s'.format(
+        name, push_time / events * 1_000_000, flush_time, events / (push_time + flush_time)))
+
+# ################################################################################################################################
+
+class _OneByOneClient(EventsClient):
+    """ Sends each event in a batch individually, as JSON, which is how events used to be sent.
+    """
+    def push_batch(self, ctx_list):
+        for ctx in ctx_list:
+            self.push(ctx)
+
+# ################################################################################################################################
+
+def main(events):
+
+    stats_client = ServiceStatsClient()
+    stats_client.impl = get_client()
+    stats_client.impl.__class__ = _OneByOneClient
+    run('One by one', stats_client, events)
+
+    stats_client = ServiceStatsClient()
+    stats_client.impl = get_client()
+    run('Batched', stats_client, events)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ModuleCtx.Events)
+
+# ################################################################################################################################
+# ################################################################################################################################
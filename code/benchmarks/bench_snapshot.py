@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import sys
+from importlib import import_module
+from inspect import isclass
+from subprocess import check_output
+from tempfile import mkdtemp
+from time import perf_counter
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Deployment_Key = 'bench'
+    Runs = 5
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_internal_modules():
+
+    # Zato
+    from zato.common.api import default_internal_modules
+
+    return sorted(default_internal_modules)
+
+# ################################################################################################################################
+
+def import_modules():
+    """ What each worker had to do at startup before snapshots - import all the internal modules
+    and visit each service class found in them.
+    """
+    # Zato
+    from zato.server.service import Service
+
+    services = []
+
+    for mod_name in get_internal_modules():
+        try:
+            mod = import_module(mod_name)
+        except Exception as e:
+            print('Skipping {} ({})'.format(mod_name, e), file=sys.stderr)
+            continue
+
+        for name in sorted(dir(mod)):
+            item = getattr(mod, name)
+            if isclass(item) and issubclass(item, Service) and item.__module__ == mod_name:
+                services.append(item)
+
+    return services
+
+# ################################################################################################################################
+
+def restore_snapshot(path):
+    """ What each worker other than the first one does at startup now.
+    """
+    # Zato
+    from zato.server.service.snapshot import get_snapshot_key, LazyServiceInfo, load_service_class, ServiceSnapshot
+
+    snapshot = ServiceSnapshot.load(path, get_snapshot_key(get_internal_modules()), ModuleCtx.Deployment_Key)
+    if not snapshot:
+        raise Exception('Could not load snapshot from `{}`'.format(path))
+
+    services = {}
+
+    for entry in snapshot.services:
+        services[entry['impl_name']] = LazyServiceInfo(load_service_class, entry, name=entry['name'])
+
+    return services
+
+# ################################################################################################################################
+
+def create_snapshot(path):
+
+    # Zato
+    from zato.common.api import SourceCodeInfo
+    from zato.server.service.snapshot import get_snapshot_key, ServiceSnapshot
+
+    snapshot = ServiceSnapshot(path, get_snapshot_key(get_internal_modules()), ModuleCtx.Deployment_Key)
+
+    for idx, class_ in enumerate(import_modules()):
+        snapshot.add(class_, class_.get_name(), class_.get_impl_name(), idx, True, 99999, {}, SourceCodeInfo(), False)
+
+    snapshot.save()
+
+    return len(snapshot.services)
+
+# ################################################################################################################################
+
+def run_in_new_process(action, path):
+    """ Each measurement needs a new process, one that has not imported anything yet, the same as a new worker.
+    """
+    output = check_output([sys.executable, __file__, action, path], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.decode('utf8').split()[-1])
+
+# ################################################################################################################################
+
+def main():
+
+    path = os.path.join(mkdtemp(prefix='zato-bench-snapshot-'), 'internal-snapshot.dat')
+    num_services = create_snapshot(path)
+
+    print('Internal services: {}'.format(num_services))
+
+    for action in 'import', 'restore':
+        times = [run_in_new_process(action, path) for _ in range(ModuleCtx.Runs)]
+        print('{:>8}: {:.3f}s (best of {})'.format(action.capitalize(), min(times), ModuleCtx.Runs))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 3:
+
+        # Common imports are not part of what is measured
+        import zato.server.service # noqa: F401
+
+        action, path = sys.argv[1:]
+        func = import_modules if action == 'import' else (lambda: restore_snapshot(path))
+
+        start = perf_counter()
+        _ = func()
+        print(perf_counter() - start)
+
+    else:
+        main()
+
+# ################################################################################################################################
+# ################################################################################################################################
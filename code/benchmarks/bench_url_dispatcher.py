@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import sys
+from timeit import default_timer
+
+# Zato
+from zato.bunch import bunchify
+from zato.url_dispatcher import CyURLData
+
+# Zato - tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zato-cy', 'test', 'zato', 'cy'))
+from test_url_dispatcher import accept_any, get_channel
+
+# ################################################################################################################################
+
+# How many channels to route among
+channel_counts = [10, 1_000, 10_000]
+
+# How many requests to route in each run
+iterations = 20_000
+
+# ################################################################################################################################
+
+def get_channel_data(count):
+    return [get_channel('channel.{:06}'.format(idx), '/api/{}/customer/{{customer_id}}/order/{{order_id}}'.format(idx))
+        for idx in range(count)]
+
+# ################################################################################################################################
+
+def run_linear(channel_data, url_paths):
+    """ Matches URL paths the way it was done before the routing index was added.
+    """
+    for url_path in url_paths:
+        target = ':::GET:::{}:::{}'.format(accept_any, url_path)
+        for item in channel_data:
+            match = item['match_target_compiled'].match(target)
+            if match is not None:
+                bunchify(item)
+                break
+
+# ################################################################################################################################
+
+def run_index(url_data, url_paths):
+    for url_path in url_paths:
+        url_data.match(url_path, 'GET', accept_any)
+
+# ################################################################################################################################
+
+def main():
+
+    print('{:>8} {:>16} {:>16} {:>10}'.format('channels', 'linear req/s', 'index req/s', 'speed-up'))
+
+    for count in channel_counts:
+
+        channel_data = get_channel_data(count)
+        url_data = CyURLData(channel_data)
+
+        # Spread requests evenly among all the channels
+        url_paths = ['/api/{}/customer/123/order/456'.format(idx % count) for idx in range(iterations)]
+
+        # The linear scan is much slower with many channels so it runs fewer iterations,
+        # still spread evenly among all the channels.
+        step = max(count * count // (iterations * 10), 1)
+        linear_paths = url_paths[::step]
+
+        start = default_timer()
+        run_linear(channel_data, linear_paths)
+        linear_per_sec = len(linear_paths) / (default_timer() - start)
+
+        start = default_timer()
+        run_index(url_data, url_paths)
+        index_per_sec = len(url_paths) / (default_timer() - start)
+
+        print('{:>8} {:>16,.0f} {:>16,.0f} {:>9.1f}x'.format(count, linear_per_sec, index_per_sec, index_per_sec / linear_per_sec))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    main()
+
+# ################################################################################################################################
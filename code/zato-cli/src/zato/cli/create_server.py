@@ -136,6 +136,8 @@ return_json_schema_errors=False
 sftp_genkey_command=dropbearkey
 posix_ipc_skip_platform=darwin
 service_invoker_allow_internal="pub.zato.ping", "/zato/api/invoke/service_name"
+rate_limiting_engine=approximate
+rate_limiting_exact_block_size=1
 
 [events]
 fs_data_path = {{events_fs_data_path}}
@@ -148,6 +150,10 @@ methods_allowed=GET, POST, DELETE, PUT, PATCH, HEAD, OPTIONS
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
 
+[cache]
+sync_batch_size=500
+sync_batch_interval=0.05 # In seconds
+
 [kvdb]
 host={{kvdb_host}}
 port={{kvdb_port}}
@@ -230,6 +236,9 @@ log_if_wsx_deliv_server_not_found=False
 data_prefix_len=2048
 data_prefix_short_len=64
 sk_server_table_columns=6, 15, 8, 6, 17, 75
+delivery_pool_size=100
+gd_batch_size=100
+gd_batch_interval=0.005 # In seconds
 
 [pubsub_meta_topic]
 enabled=True
@@ -280,6 +289,34 @@ size=0.1 # In MB
 
 [logging]
 http_access_log_ignore=
+http_access_log_buffer_size=100000
+http_access_log_batch_size=1000
+http_access_log_flush_interval=1
+http_access_log_overflow=drop_oldest
+http_access_log_sample_rate=1.0
+
+[async_pools]
+# Each pool runs up to max_concurrency tasks at a time and up to queue_size more wait in its queue.
+# Once the queue is full, overflow is one of:
+#   reject - invoke_async raises an exception
+#   block  - invoke_async waits up to block_timeout seconds for room in the queue,
+#            though invocations from tasks of any pool raise an exception rather than wait
+#   spill  - tasks are written to disk and read back once there is room for them
+#   spawn  - tasks run immediately, in addition to the ones already running
+# The default pool is used by invoke_async calls without a pool of their own, so it spawns rather than blocks.
+[[default]]
+max_concurrency=1000
+queue_size=10000
+overflow=spawn
+block_timeout=30
+
+[invoke_retry]
+max_concurrency=100
+backoff_factor=2
+max_seconds=3600
+jitter=0.5
+breaker_failures=5
+breaker_reset_seconds=30
 
 [greenify]
 #/path/to/oracle/instantclient_19_3/libclntsh.so.19.1=True
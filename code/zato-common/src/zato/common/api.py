@@ -8,9 +8,11 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 from collections import OrderedDict
-from io import StringIO
+from collections.abc import Generator
+from io import IOBase, StringIO
 from numbers import Number
 from sys import maxsize
+from tempfile import SpooledTemporaryFile
 
 # Bunch
 from bunch import Bunch
@@ -93,6 +95,10 @@ FALSE_TRUE = 'false_true'
 
 simple_types = (bytes, str, dict, list, tuple, bool, Number)
 
+# Payloads of these types are sent to HTTP clients chunk by chunk, as they are read or produced.
+# Note that Generator covers both Python and Cython generators, e.g. streamed SimpleIO output.
+stream_types = (IOBase, SpooledTemporaryFile, Generator)
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -430,6 +436,8 @@ class CACHE:
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 10000 # In characters for string/unicode, bytes otherwise
+        SYNC_BATCH_SIZE = 500
+        SYNC_BATCH_INTERVAL = 0.05 # In seconds
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -784,6 +792,9 @@ class PUBSUB:
         PUB_BUFFER_SIZE_GD = 0
         TASK_SYNC_INTERVAL = 500
         TASK_DELIVERY_INTERVAL = 2000
+        DELIVERY_POOL_SIZE = 100
+        GD_BATCH_SIZE = 100
+        GD_BATCH_INTERVAL = 0.005 # In seconds
         WAIT_TIME_SOCKET_ERROR = 10
         WAIT_TIME_NON_SOCKET_ERROR = 3
         ON_NO_SUBS_PUB = 'accept'
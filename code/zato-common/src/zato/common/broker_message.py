@@ -137,6 +137,9 @@ class SECURITY(Constants):
     TLS_KEY_CERT_EDIT = ValueConstant('')
     TLS_KEY_CERT_DELETE = ValueConstant('')
 
+    # This one is at the end so as not to change codes of the messages above
+    JWT_TOKEN_DELETE = ValueConstant('')
+
 class DEFINITION(Constants):
     code_start = 100600
 
@@ -479,6 +482,8 @@ class CACHE(Constants):
     MEMCACHED_EDIT = ValueConstant('')
     MEMCACHED_DELETE = ValueConstant('')
 
+    BUILTIN_STATE_CHANGED_BATCH = ValueConstant('')
+
 class GENERIC(Constants):
     code_start = 107000
 
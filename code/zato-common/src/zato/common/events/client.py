@@ -19,7 +19,7 @@ from gevent.lock import RLock
 from orjson import dumps
 
 # Zato
-from zato.common.events.common import Action
+from zato.common.events.common import Action, BatchCodec
 from zato.common.typing_ import asdict
 from zato.common.util.api import new_cid
 from zato.common.util.json_ import json_loads
@@ -90,8 +90,8 @@ class Client:
 
 # ################################################################################################################################
 
-    def send(self, action, data=b''):
-        # type: (bytes) -> None
+    def send(self, action, data=b'', should_raise=False):
+        # type: (bytes, bytes, bool) -> None
         with self.lock:
             try:
                 self.socket.sendall(action + data + b'\n')
@@ -99,6 +99,12 @@ class Client:
                 self.is_connected = False
                 logger.info('Socket send error `%s` -> %s', e.args, self.remote_addr_str)
                 self.close()
+
+                # Callers that need to know if their data was sent will reconnect the next time they send it ..
+                if should_raise:
+                    raise
+
+                # .. whereas for everyone else we reconnect immediately.
                 self.connect()
 
 # ################################################################################################################################
@@ -151,6 +157,22 @@ class Client:
         # .. and send it across (there will be no response).
         self.send(Action.Push, data)
 
+# ################################################################################################################################
+
+    def push_batch(self, ctx_list):
+        # type: (list) -> None
+
+        # Encode all the contexts at once ..
+        data = BatchCodec.encode(ctx_list)
+
+        # .. reconnect if the previous batch could not be sent ..
+        self.connect()
+
+        # .. and send them across - the payload is binary so the line with the action
+        # .. is followed by its length rather than by the payload itself (there will be no response).
+        # .. If the batch cannot be sent, an exception is raised so that our caller knows to send it again.
+        self.send(Action.PushBatch, b'%d\n' % len(data) + data, should_raise=True)
+
 # ################################################################################################################################
 
     def get_table(self):
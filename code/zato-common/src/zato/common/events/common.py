@@ -7,6 +7,8 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from logging import getLogger
+from struct import Struct
 from typing import Optional as optional
 
 # Zato
@@ -15,6 +17,11 @@ from zato.common.typing_ import dataclass
 # ################################################################################################################################
 # ################################################################################################################################
 
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class Default:
 
     # This is relative to server.conf's main.work_dir
@@ -26,6 +33,15 @@ class Default:
     # .. or once in that many seconds.
     sync_interval = 30
 
+    # Servers push events to the database in batches of up to that many events ..
+    push_batch_size = 1000
+
+    # .. once in that many seconds or as soon as a full batch is ready ..
+    push_flush_interval = 1
+
+    # .. and events that do not fit in a buffer of that size are dropped.
+    push_buffer_size = 100_000
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -50,6 +66,7 @@ class Action:
     GetTable       = b'04'
     GetTableReply  = b'05'
     SyncState      = b'06'
+    PushBatch      = b'07'
 
     LenAction = len(Ping)
 
@@ -79,3 +96,171 @@ class PushCtx:
 
 # ################################################################################################################################
 # ################################################################################################################################
+
+class BatchCodec:
+    """ Encodes batches of PushCtx objects in a compact binary form and decodes them back to dicts.
+
+    A batch begins with a header with the format version, the number of events and the number of object IDs. Object IDs,
+    e.g. service names, repeat across events so each of them is encoded once, in a table that follows the header,
+    and events refer to them by their index in the table. Each event is encoded as a fixed-size part, followed by
+    the strings that the event contains. All strings are UTF-8, preceded by their length.
+
+    Events that cannot be encoded, e.g. because one of their fields is of an unexpected type, are left out of the batch.
+    """
+    Version = 1
+
+    # Format version, number of events and number of object IDs
+    Header = Struct('!BII')
+
+    # Which optional fields are given, event type, object type, index of object ID and total time
+    Event = Struct('!BIIIq')
+
+    # Length of a string
+    Length = Struct('!I')
+
+    # Flags of optional fields
+    Has_CID           = 0b0001
+    Has_Timestamp     = 0b0010
+    Has_Object_ID     = 0b0100
+    Has_Total_Time_MS = 0b1000
+
+# ################################################################################################################################
+
+    @staticmethod
+    def encode(ctx_list):
+        # type: (list) -> bytes
+
+        # Local aliases
+        _pack_event = BatchCodec.Event.pack
+        _pack_length = BatchCodec.Length.pack
+
+        # Object ID, already encoded -> Its index in the table of object IDs
+        object_id_idx = {}
+
+        events = []
+        len_events = 0
+
+        for ctx in ctx_list: # type: PushCtx
+
+            try:
+                flags = 0
+                strings = [ctx.id.encode('utf8')]
+
+                if ctx.cid is not None:
+                    flags |= BatchCodec.Has_CID
+                    strings.append(ctx.cid.encode('utf8'))
+
+                if ctx.timestamp is not None:
+                    flags |= BatchCodec.Has_Timestamp
+                    strings.append(ctx.timestamp.encode('utf8'))
+
+                # An object ID is added to the table only once we know that its event can be encoded
+                if ctx.object_id is None:
+                    idx = 0
+                else:
+                    flags |= BatchCodec.Has_Object_ID
+                    object_id = ctx.object_id.encode('utf8')
+                    idx = object_id_idx.get(object_id, len(object_id_idx))
+
+                if ctx.total_time_ms is None:
+                    total_time_ms = 0
+                else:
+                    flags |= BatchCodec.Has_Total_Time_MS
+                    total_time_ms = int(ctx.total_time_ms)
+
+                event = [_pack_event(flags, ctx.event_type, ctx.object_type, idx, total_time_ms)]
+
+                for value in strings:
+                    event.append(_pack_length(len(value)))
+                    event.append(value)
+
+            # A single event that cannot be encoded must not prevent the whole batch from being sent
+            except Exception as e:
+                logger.warning('Dropping event `%s` that could not be encoded, e:`%s`', getattr(ctx, 'id', None), e)
+
+            else:
+                if flags & BatchCodec.Has_Object_ID:
+                    object_id_idx[object_id] = idx
+
+                events.extend(event)
+                len_events += 1
+
+        # The table of object IDs, in the order of their indexes
+        object_ids = []
+
+        for object_id in object_id_idx:
+            object_ids.append(_pack_length(len(object_id)))
+            object_ids.append(object_id)
+
+        header = BatchCodec.Header.pack(BatchCodec.Version, len_events, len(object_id_idx))
+
+        return b''.join([header] + object_ids + events)
+
+# ################################################################################################################################
+
+    @staticmethod
+    def decode(data):
+        # type: (bytes) -> list
+
+        # Local aliases
+        _unpack_event = BatchCodec.Event.unpack_from
+        _unpack_length = BatchCodec.Length.unpack_from
+        _event_size = BatchCodec.Event.size
+        _length_size = BatchCodec.Length.size
+
+        def read_string(offset):
+            # type: (int) -> tuple
+            length, = _unpack_length(data, offset)
+            offset += _length_size
+            return data[offset:offset+length].decode('utf8'), offset + length
+
+        version, len_events, len_object_ids = BatchCodec.Header.unpack_from(data)
+
+        if version != BatchCodec.Version:
+            raise ValueError('Unsupported batch version `{}`'.format(version))
+
+        offset = BatchCodec.Header.size
+        object_ids = []
+
+        for _ in range(len_object_ids):
+            object_id, offset = read_string(offset)
+            object_ids.append(object_id)
+
+        out = []
+
+        for _ in range(len_events):
+
+            flags, event_type, object_type, idx, total_time_ms = _unpack_event(data, offset)
+            offset += _event_size
+
+            id, offset = read_string(offset)
+
+            if flags & BatchCodec.Has_CID:
+                cid, offset = read_string(offset)
+            else:
+                cid = None
+
+            if flags & BatchCodec.Has_Timestamp:
+                timestamp, offset = read_string(offset)
+            else:
+                timestamp = None
+
+            # The same keys that asdict(PushCtx) would return
+            out.append({
+                'id': id,
+                'cid': cid,
+                'timestamp': timestamp,
+                'event_type': event_type,
+                'source_type': None,
+                'source_id': None,
+                'object_type': object_type,
+                'object_id': object_ids[idx] if flags & BatchCodec.Has_Object_ID else None,
+                'recipient_type': None,
+                'recipient_id': None,
+                'total_time_ms': total_time_ms if flags & BatchCodec.Has_Total_Time_MS else None,
+            })
+
+        return out
+
+# ################################################################################################################################
+# ################################################################################################################################
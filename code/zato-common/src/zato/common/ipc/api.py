@@ -8,18 +8,22 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 import logging
+import os
+from traceback import format_exc
 
 # Zato
 from zato.common.api import IPC
 from zato.common.ipc.client import IPCClient
 from zato.common.ipc.server import IPCServer
-from zato.common.util.api import fs_safe_name, load_ipc_pid_port
+from zato.common.ipc.socket_ import IPCSocketClient, IPCSocketServer, IPCTimeout
+from zato.common.util.api import fs_safe_name, get_ipc_pid_socket_path, load_ipc_pid_port
 
 # ################################################################################################################################
 # ################################################################################################################################
 
 if 0:
-    from zato.common.typing_ import anydict, callable_
+    from zato.common.typing_ import anydict, callable_, dict_, tuple_
+    _pid_key = tuple_[str, str, int]
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -42,6 +46,15 @@ class IPCAPI:
         self.username = IPC.Credentials.Username
         self.password = ''
 
+        # Our own server that other processes connect to over a Unix socket
+        self.socket_server = None # type: IPCSocketServer | None
+
+        # (Cluster name, server name, PID) -> A persistent connection to that process
+        self.socket_clients = {} # type: dict_[_pid_key, IPCSocketClient]
+
+        # (Cluster name, server name, PID) -> The HTTP port of that process, if it cannot be invoked over a Unix socket
+        self.pid_ports = {} # type: dict_[_pid_key, int]
+
 # ################################################################################################################################
 
     def set_password(self, password:'str') -> 'None':
@@ -76,6 +89,56 @@ class IPCAPI:
             server_type_suffix=server_type_suffix
         )
 
+# ################################################################################################################################
+
+    def start_socket_server(
+        self,
+        path,          # type: str
+        *,
+        username='',   # type: str
+        password='',   # type: str
+        callback_func, # type: callable_
+    ) -> 'None':
+        """ Starts a server that other processes can invoke us through over a Unix socket. Unlike start_server,
+        this one does not block.
+        """
+        username = username or self.username
+        password = password or self.password
+
+        self.socket_server = IPCSocketServer(path, username, password, callback_func)
+        self.socket_server.start()
+
+# ################################################################################################################################
+
+    def stop_socket_server(self) -> 'None':
+
+        if self.socket_server:
+            self.socket_server.stop()
+            self.socket_server = None
+
+        for client in self.socket_clients.values():
+            client.close()
+
+# ################################################################################################################################
+
+    def _get_socket_client(self, key:'_pid_key') -> 'IPCSocketClient | None':
+        """ Returns a connection to a process by its PID, or None if that process does not listen on a Unix socket.
+        """
+        client = self.socket_clients.get(key)
+
+        if not client:
+            path = get_ipc_pid_socket_path(*key)
+            if os.path.exists(path):
+                client = self.socket_clients[key] = IPCSocketClient(path, IPC.Credentials.Username, self.password)
+
+        return client
+
+# ################################################################################################################################
+
+    def _drop_socket_client(self, key:'_pid_key', client:'IPCSocketClient') -> 'None':
+        _ = self.socket_clients.pop(key, None)
+        client.close()
+
 # ################################################################################################################################
 
     def invoke_by_pid(
@@ -89,12 +152,43 @@ class IPCAPI:
     ) -> 'anydict':
         """ Invokes a service in a specific process synchronously through IPC.
         """
+        key = (cluster_name, server_name, target_pid)
+
+        # Prefer a persistent connection over a Unix socket, if the process has one ..
+        client = self._get_socket_client(key)
+
+        if client:
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Invoking %s on %s:%s:%s-uds', service, cluster_name, server_name, target_pid)
+
+            try:
+                return client.invoke(service, request, timeout=timeout)
+
+            except IPCTimeout:
+
+                # .. the process is there but it did not reply in time, and it may still be running the service,
+                # which is why we do not invoke it again over HTTP ..
+                self._drop_socket_client(key, client)
+                raise
+
+            except Exception:
+
+                # .. the process may be gone, in which case we will check its socket again next time,
+                # but for now, it is still possible that it can be invoked over HTTP ..
+                logger.info('Could not invoke %s on %s:%s:%s-uds, falling back to HTTP, e:`%s`',
+                    service, cluster_name, server_name, target_pid, format_exc())
+                self._drop_socket_client(key, client)
+
+        # .. otherwise, use HTTP.
 
         # This is constant
         ipc_host = '127.0.0.1'
 
-        # Get the port that we can find the PID listening on
-        ipc_port = load_ipc_pid_port(cluster_name, server_name, target_pid)
+        # Get the port that we can find the PID listening on, reading it only once
+        ipc_port = self.pid_ports.get(key)
+        if not ipc_port:
+            ipc_port = self.pid_ports[key] = load_ipc_pid_port(cluster_name, server_name, target_pid)
 
         # Log what we are about to do
         log_msg = f'Invoking {service} on {cluster_name}:{server_name}:{target_pid}-tcp:{ipc_port}'
@@ -105,8 +199,15 @@ class IPCAPI:
         url_path = fs_safe_name(url_path)
 
         client = IPCClient(ipc_host, ipc_port, IPC.Credentials.Username, self.password)
-        response = client.invoke(service, request, url_path, timeout=timeout)
-        response
+
+        try:
+            response = client.invoke(service, request, url_path, timeout=timeout)
+        except Exception:
+
+            # The process may have been restarted on a different port
+            _ = self.pid_ports.pop(key, None)
+            raise
+
         return response
 
 # ################################################################################################################################
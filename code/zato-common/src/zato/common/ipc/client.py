@@ -56,7 +56,7 @@ class IPCClient:
         })
 
         # .. invoke the server ..
-        response = requests_post(url, data)
+        response = requests_post(url, data, timeout=timeout)
 
         # .. de-serialize the response ..
         response = loads(response.text)
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from json import dumps, loads
+from logging import getLogger
+from socket import AF_UNIX, SOCK_STREAM
+from struct import Struct
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import spawn
+from gevent.event import AsyncResult
+from gevent.lock import RLock, Semaphore
+from gevent.server import StreamServer
+from gevent.socket import socket
+
+# Zato
+from zato.common.broker_message import SERVER_IPC
+from zato.common.crypto.api import is_string_equal
+from zato.common.util.api import new_cid
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from gevent import Greenlet
+    from zato.common.typing_ import any_, anydict, callable_, dict_, tuple_
+    _pending = dict_[int, AsyncResult]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # Length of the payload, ID of the request it belongs to and frame type
+    Header = Struct('!IIB')
+
+    # Request IDs wrap around once they reach this value
+    Max_Request_ID = 2 ** 32 - 1
+
+    # Frames longer than this are rejected
+    Max_Frame_Size = 2 ** 26
+
+    # Auth frames carry only credentials, which is why a connection that is not authenticated yet
+    # cannot make us allocate more than this.
+    Max_Auth_Frame_Size = 4096
+
+    # How long each side waits for a connection to be authenticated
+    Auth_Timeout = 10
+
+    Listen_Backlog = 128
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class FrameType:
+    Auth     = 1
+    Auth_OK  = 2
+    Request  = 3
+    Response = 4
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ConnectionClosed(Exception):
+    """ Raised when the other side closes a connection.
+    """
+
+class IPCTimeout(Exception):
+    """ Raised when a response to a request is not received in time.
+    """
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def _recv_exactly(sock:'socket', size:'int') -> 'bytes':
+    """ Receives exactly size bytes from a socket or raises ConnectionClosed if the connection was closed.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+
+    while received < size:
+        len_received = sock.recv_into(view[received:])
+        if not len_received:
+            raise ConnectionClosed()
+        received += len_received
+
+    return bytes(buffer)
+
+# ################################################################################################################################
+
+def read_frame(sock:'socket', max_size:'int'=ModuleCtx.Max_Frame_Size) -> 'tuple_[int, int, bytes]':
+    """ Reads a frame from a socket and returns its type, request ID and payload.
+    """
+    header = _recv_exactly(sock, ModuleCtx.Header.size)
+    size, request_id, frame_type = ModuleCtx.Header.unpack(header)
+
+    if size > max_size:
+        raise ValueError('IPC frame too long ({} > {})'.format(size, max_size))
+
+    payload = _recv_exactly(sock, size) if size else b''
+    return frame_type, request_id, payload
+
+# ################################################################################################################################
+
+def write_frame(sock:'socket', lock:'Semaphore', frame_type:'int', request_id:'int', payload:'bytes') -> 'None':
+    """ Writes a frame to a socket, making sure that frames from concurrent greenlets are not interleaved.
+    """
+    data = ModuleCtx.Header.pack(len(payload), request_id, frame_type) + payload
+    with lock:
+        sock.sendall(data)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class IPCSocketServer:
+    """ Accepts persistent connections from other processes over a Unix socket. Each connection is authenticated once,
+    with the first frame it sends, after which any number of requests can be sent over it, also concurrently,
+    each one identified by its own request ID that the response is sent with.
+    """
+    cid_prefix = 'zipc'
+
+    def __init__(
+        self,
+        path,          # type: str
+        username,      # type: str
+        password,      # type: str
+        callback_func, # type: callable_
+    ) -> 'None':
+
+        self.path = path
+        self.username = username
+        self.password = password
+        self.callback_func = callback_func
+        self.server = None # type: StreamServer | None
+
+# ################################################################################################################################
+
+    def start(self) -> 'None':
+
+        # A socket may have been left over by a previous process of the same PID
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        listener = socket(AF_UNIX, SOCK_STREAM)
+        listener.bind(self.path)
+
+        # Only processes of the same user can connect to us
+        os.chmod(self.path, 0o600)
+        listener.listen(ModuleCtx.Listen_Backlog)
+
+        self.server = StreamServer(listener, self._handle_connection)
+        self.server.start()
+
+        logger.info('IPC socket server started (%s)', self.path)
+
+# ################################################################################################################################
+
+    def stop(self) -> 'None':
+
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# ################################################################################################################################
+
+    def _is_authenticated(self, frame_type:'int', payload:'bytes') -> 'bool':
+
+        if frame_type != FrameType.Auth:
+            logger.info('Expected an IPC auth frame instead of %s', frame_type)
+            return False
+
+        credentials = loads(payload)
+
+        username = credentials.get('username') or ''
+        password = credentials.get('password') or ''
+
+        # Check both of them so as not to reveal which one was invalid
+        is_username_ok = is_string_equal(self.username, username)
+        is_password_ok = is_string_equal(self.password, password)
+
+        if not (is_username_ok and is_password_ok):
+            logger.info('Invalid IPC username or password')
+            return False
+
+        return True
+
+# ################################################################################################################################
+
+    def _handle_connection(self, sock:'socket', _ignored_address:'any_') -> 'None':
+
+        # Responses to concurrent requests are written by different greenlets
+        write_lock = Semaphore()
+
+        try:
+
+            # The first frame authenticates the connection, and it needs to be sent in time ..
+            sock.settimeout(ModuleCtx.Auth_Timeout)
+
+            frame_type, request_id, payload = read_frame(sock, ModuleCtx.Max_Auth_Frame_Size)
+            if not self._is_authenticated(frame_type, payload):
+                return
+
+            write_frame(sock, write_lock, FrameType.Auth_OK, request_id, b'')
+            sock.settimeout(None)
+
+            # .. and all the subsequent ones are requests, each handled in its own greenlet.
+            while True:
+                frame_type, request_id, payload = read_frame(sock)
+                _ = spawn(self._handle_request, sock, write_lock, request_id, payload)
+
+        except ConnectionClosed:
+            pass
+
+        except Exception:
+            logger.warning('IPC connection error, e:`%s`', format_exc())
+
+        finally:
+            sock.close()
+
+# ################################################################################################################################
+
+    def _handle_request(self, sock:'socket', write_lock:'Semaphore', request_id:'int', payload:'bytes') -> 'None':
+
+        cid = '{}{}'.format(self.cid_prefix, new_cid())
+        response = {}
+
+        try:
+            request = Bunch(loads(payload))
+            response = self.callback_func(request)
+            status_text = 'ok'
+
+        except Exception:
+            logger.warning(format_exc())
+            status_text = 'error'
+
+        # Build our response ..
+        return_data = {
+            'cid': cid,
+            'status': status_text,
+            'response': response
+        }
+
+        # .. make sure that we return bytes representing a JSON object ..
+        try:
+            return_data = dumps(return_data)
+        except TypeError:
+            return_data = '{}'
+
+        # .. and send it to the caller, unless it has already disconnected.
+        try:
+            write_frame(sock, write_lock, FrameType.Response, request_id, return_data.encode('utf8'))
+        except Exception:
+            logger.info('Could not send IPC response (cid:%s), e:`%s`', cid, format_exc())
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class IPCSocketClient:
+    """ A persistent connection to an IPCSocketServer, established and authenticated with the first request.
+    Any number of greenlets can invoke the server concurrently through the same connection.
+    """
+    def __init__(
+        self,
+        path,     # type: str
+        username, # type: str
+        password, # type: str
+    ) -> 'None':
+
+        self.path = path
+        self.username = username
+        self.password = password
+
+        self.sock = None # type: socket | None
+        self.reader = None # type: Greenlet | None
+        self.connect_lock = RLock()
+        self.write_lock = Semaphore()
+
+        # Request ID -> The result that the invoker waits for, a new dict for each connection
+        self.pending = {} # type: _pending
+
+        # The ID of the last request sent
+        self.request_id = 0
+
+# ################################################################################################################################
+
+    def _connect(self) -> 'socket':
+
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.settimeout(ModuleCtx.Auth_Timeout)
+
+        try:
+            sock.connect(self.path)
+
+            credentials = dumps({'username': self.username, 'password': self.password}).encode('utf8')
+            write_frame(sock, self.write_lock, FrameType.Auth, 0, credentials)
+
+            frame_type, _, _ = read_frame(sock, ModuleCtx.Max_Auth_Frame_Size)
+            if frame_type != FrameType.Auth_OK:
+                raise Exception('Unexpected IPC frame type {} in response to auth'.format(frame_type))
+
+        except ConnectionClosed:
+            sock.close()
+            raise Exception('IPC connection to {} rejected, check credentials'.format(self.path))
+
+        except Exception:
+            sock.close()
+            raise
+
+        # From now on, the reader greenlet waits for responses indefinitely
+        sock.settimeout(None)
+
+        return sock
+
+# ################################################################################################################################
+
+    def _get_connection(self) -> 'tuple_[socket, _pending]':
+
+        with self.connect_lock:
+            if not self.sock:
+                self.sock = self._connect()
+                self.pending = {}
+                self.reader = spawn(self._read_responses, self.sock, self.pending)
+
+            return self.sock, self.pending
+
+# ################################################################################################################################
+
+    def _read_responses(self, sock:'socket', pending:'_pending') -> 'None':
+
+        error = ConnectionClosed('IPC connection to {} closed'.format(self.path)) # type: Exception
+
+        try:
+            while True:
+                _, request_id, payload = read_frame(sock)
+                result = pending.pop(request_id, None)
+
+                # The invoker may have already given up waiting for the response
+                if result:
+                    result.set(payload)
+
+        except ConnectionClosed:
+            pass
+
+        except Exception as e:
+            logger.info('IPC connection to %s failed, e:`%s`', self.path, format_exc())
+            error = e
+
+        finally:
+            self._on_disconnected(sock, pending, error)
+
+# ################################################################################################################################
+
+    def _on_disconnected(self, sock:'socket', pending:'_pending', error:'Exception') -> 'None':
+
+        with self.connect_lock:
+            if self.sock is sock:
+                self.sock = None
+                self.reader = None
+
+        sock.close()
+
+        # Nothing will be received for requests that are still waiting
+        for result in list(pending.values()):
+            result.set_exception(error)
+        pending.clear()
+
+# ################################################################################################################################
+
+    def _get_request_id(self) -> 'int':
+
+        self.request_id += 1
+        if self.request_id > ModuleCtx.Max_Request_ID:
+            self.request_id = 1
+
+        return self.request_id
+
+# ################################################################################################################################
+
+    def invoke(self, service:'str', data:'any_', timeout:'float | None'=None) -> 'anydict':
+
+        # Prepare the full request, without credentials, because the connection is already authenticated ..
+        request = dumps({
+            'action':  SERVER_IPC.INVOKE.value,
+            'service': service,
+            'data': data,
+        }).encode('utf8')
+
+        # .. get a connection along with a new ID that the response will be sent with ..
+        sock, pending = self._get_connection()
+        request_id = self._get_request_id()
+        result = pending[request_id] = AsyncResult()
+
+        try:
+
+            # .. send the request ..
+            try:
+                write_frame(sock, self.write_lock, FrameType.Request, request_id, request)
+            except Exception:
+                self.close()
+                raise
+
+            # .. wait for the response, raising our own exception rather than gevent's Timeout, which is not an Exception ..
+            _ = result.wait(timeout)
+            if not result.ready():
+                raise IPCTimeout('No IPC response from {} within {}s'.format(self.path, timeout))
+
+            response = result.get()
+
+        finally:
+            _ = pending.pop(request_id, None)
+
+        # .. and return it, de-serialized, to our caller.
+        return loads(response)
+
+# ################################################################################################################################
+
+    def close(self) -> 'None':
+
+        with self.connect_lock:
+            sock = self.sock
+            self.sock = None
+
+        if sock:
+            sock.close()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -11,6 +11,7 @@ from dataclasses import asdict, _FIELDS, MISSING, _PARAMS # type: ignore
 from http.client import BAD_REQUEST
 from inspect import isclass
 from typing import Any
+from weakref import WeakKeyDictionary
 
 try:
     from typing import _GenericAlias as _ListBaseClass # type: ignore
@@ -37,7 +38,7 @@ from zato.common.typing_ import cast_, extract_from_union, is_union
 
 if 0:
     from dataclasses import Field
-    from zato.common.typing_ import any_, anydict, boolnone, dictnone, intnone, optional
+    from zato.common.typing_ import any_, anydict, anytuple, callable_, dictnone, list_, optional
     from zato.server.service import Service
 
     Field = Field
@@ -176,160 +177,188 @@ class ElementIsNotAList(ElementMissing):
 # ################################################################################################################################
 # ################################################################################################################################
 
-class DictCtx:
-    def __init__(
-        self,
-        service:      'Service',
-        current_dict: 'anydict | Model',
-        DataClass:    'any_',
-        extra:        'dictnone',
-        list_idx:     'intnone',
-        parent:       'optional[FieldCtx]' = None
-        ) -> 'None':
+def _get_empty_value_factory(field_type:'any_') -> 'callable_':
+    """ Returns a callable producing a value for an optional field that has no value on input nor a default one.
+    """
+    # This is the most reliable way
+    if 'typing.List' in str(field_type):
+        return list
+    elif field_type is Any:
+        return _get_none
+    elif issubclass(field_type, str):
+        return str
+    elif issubclass(field_type, int):
+        return int
+    elif issubclass(field_type, list):
+        return list
+    elif issubclass(field_type, dict):
+        return dict
+    elif issubclass(field_type, float):
+        return float
+    else:
+        return _get_none
+
+def _get_none() -> 'None':
+    return None
+
+# ################################################################################################################################
+# ################################################################################################################################
 
-        # We get these on input ..
-        self.service      = service
-        self.current_dict = current_dict
-        self.extra        = extra
-        self.DataClass    = DataClass
-        self.list_idx     = list_idx
-        self.parent       = parent
+class FieldPlan:
+    """ Describes how to obtain the value of a single field of a model. Everything here is based on the field's declaration
+    only, which is why it is computed once for each model rather than each time a dict is converted to the model.
+    """
+    __slots__ = ('name', 'field', 'field_type', 'is_required', 'is_model', 'is_list', 'model_class', 'contains_model',
+        'default', 'default_factory', 'plan', 'empty_value_factory')
 
-        # .. while these we need to build ourselves in self.init.
-        self.has_init = None # type: boolnone
+    def __init__(self, field:'Field') -> 'None':
 
-        # These are the Field object that we expect this dict will contain,
-        # i.e. it will be possible to map ourselves to these Field objects.
-        self.fields = None # type: dictnone
+        self.field = field
+        self.name = field.name # type: str
+        self.default = field.default
+        self.default_factory = field.default_factory
 
-        # This will be populated with parameters to the dataclass's __init__ method, assuming that the class has one.
-        self.init_attrs = {}
+        # Assume we are required ..
+        self.is_required = True
 
-        # This will be populated with parameters to be set via setattr, in case the class does not have __init__.
-        self.setattr_attrs = {}
+        # This will be the same as field.type unless field.type is a union (e.g. optional[str]).
+        # In this case, self.field_type will be str whereas field.type will be the original type ..
+        self.field_type = field.type
 
-        # We can check it once upfront and make it point to either init_attrs or setattr_attrs
-        self.attrs_container = cast_('dict', None) # type: dictnone
+        # .. and a union with None means that this field is really optional[type_].
+        if is_union(field.type):
+            _, self.field_type, union_with = extract_from_union(field.type)
+            self.is_required = not (union_with is _None_Type)
 
-# ################################################################################################################################
+        is_class = isclass(field.type)
 
-    def init(self):
+        # This indicates if the field itself points to a model
+        self.is_model = is_class and issubclass(field.type, Model)
+        self.is_list = is_list(field.type, is_class) # type: ignore
 
-        # Whether the dataclass defines the __init__method
-        dataclass_params = getattr(self.DataClass, _PARAMS, None)
-        self.has_init = dataclass_params.init if dataclass_params else False
+        # By default, assume we have no type information (we do not know what model class it is) ..
+        self.model_class = None # type: any_
 
-        self.attrs_container = self.init_attrs if self.has_init else self.setattr_attrs
-        self.fields = getattr(self.DataClass, _FIELDS) # type: dictnone
+        # .. and that we are not a list that contains Model instances. Note that self.model_class may point
+        # to a class such as str rather than to a model, as is the case with strlist definitions.
+        self.contains_model = False
+
+        # If this is a list, we need to check if its definition contains information about the actual type of elements inside.
+        # If it does, in runtime, we will be extracting that particular type. Otherwise, we will just pass this list on as it is.
+        if self.is_list:
+            self.model_class = extract_model_class(field.type) # type: ignore
+            self.contains_model = bool(self.model_class and hasattr(self.model_class, _FIELDS))
+
+        # A plan of the model that we point to, or that our list elements are of, if any ..
+        self.plan = None # type: optional[ModelPlan]
+
+        # .. and what to use if we are optional yet there is no value for us, computed the first time it is needed.
+        self.empty_value_factory = None # type: optional[callable_]
+
+# ################################################################################################################################
+
+    def get_empty_value(self) -> 'any_':
+        if not self.empty_value_factory:
+            self.empty_value_factory = _get_empty_value_factory(self.field_type)
+        return self.empty_value_factory()
 
 # ################################################################################################################################
 # ################################################################################################################################
 
-class FieldCtx:
-    def __init__(self, dict_ctx, field, parent):
-        # type: (DictCtx, Field, optional[FieldCtx]) -> None
+class ModelPlan:
+    """ A flat list of fields of a model, in the order they are visited in, along with everything about the model itself
+    that is needed to create its instances from dicts.
+    """
+    __slots__ = ('DataClass', 'has_init', 'fields')
 
-        # We get these on input ..
-        self.dict_ctx   = dict_ctx
-        self.field      = field
-        self.parent     = parent
-        self.name       = self.field.name # type: str
+    def __init__(self, DataClass:'any_') -> 'None':
 
-        # This will be the same as self.field.type unless self.field.type is a union (e.g. optional[str]).
-        # In this case, self.field_type will be str whereas self.field.type will be the original type.
-        self.field_type = None # type: object
+        self.DataClass = DataClass
 
-        # .. by default, assume we have no type information (we do not know what model class it is)
-        self.model_class = None # type: object
+        # Whether the dataclass defines the __init__method. If it does not, attributes are set via setattr.
+        dataclass_params = getattr(DataClass, _PARAMS, None)
+        self.has_init = dataclass_params.init if dataclass_params else False
 
-        # .. while these we need to build ourselves in self.init ..
-        self.value    = None # type: any_
-        self.is_class = None # type: boolnone
-        self.is_list  = None # type: boolnone
-        self.is_required = None # type: boolnone
+        self.fields = [] # type: list_[FieldPlan]
 
-        # This indicates if ourselves, we are a Model instance
-        self.is_model = None # type: boolnone
+# ################################################################################################################################
+# ################################################################################################################################
 
-        # This indicates whether we are a list that contains a Model instance.
-        # The value is based on whether self.model_class exists or not
-        # and whether self.is_model points to a Model rather than, for instance, the str class,
-        # as the latter is possible in strlist definitions.
-        self.contains_model = False
+# Model class -> Its plan. Model classes are keys in a weak dictionary, so their plans go away when services are redeployed.
+_model_plans = WeakKeyDictionary() # type: WeakKeyDictionary[any_, ModelPlan]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MarshalAPI:
+
+    def __init__(self):
 
-        # We set this flag to True only if there is some extra data that we have
-        # and if we are a top-level element, as indicated by the lack of parent.
-        self.has_extra = self.dict_ctx.extra and (not self.dict_ctx.parent)
+        # All the instances share the same plans because a plan depends on a model class only
+        self._model_plans = _model_plans
 
 # ################################################################################################################################
 
-    def init(self):
+    def get_model_plan(self, DataClass:'any_') -> 'ModelPlan':
+        """ Returns a plan for creating instances of the input model class, compiling it first if it does not exist yet.
+        """
+        plan = self._model_plans.get(DataClass)
+        if plan is None:
+            plan = self._compile_model_plan(DataClass)
+        return plan
 
-        # Assume that we do not have any value
-        value = ZatoNotGiven
+# ################################################################################################################################
 
-        # If we have extra data, that will take priority over our regular dict, which is why we check it first here.
-        if self.has_extra:
-            if self.dict_ctx.extra:
-                value = self.dict_ctx.extra.get(self.name, ZatoNotGiven)
+    def _compile_model_plan(self, DataClass:'any_') -> 'ModelPlan':
 
-        # If we do not have a value here, it means that we have no extra,
-        # or that it did not contain the expected value so we look it up in the current dictionary.
-        if value == ZatoNotGiven:
-            if isinstance(self.dict_ctx.current_dict, dict):
-                value = self.dict_ctx.current_dict.get(self.name, ZatoNotGiven)
-            elif isinstance(self.dict_ctx.current_dict, Model): # type: ignore
-                value = getattr(self.dict_ctx.current_dict, self.name, ZatoNotGiven)
+        plan = ModelPlan(DataClass)
 
-        # At this point, we know there will be something to assign although it still may be ZatoNotGiven.
-        self.value = value
+        # We store the plan before visiting its fields so that models pointing to themselves,
+        # directly or through other models, can reuse it instead of recursing infinitely ..
+        self._model_plans[DataClass] = plan
 
-        self.is_class = isclass(self.field.type)
-        self.is_model = self.is_class and issubclass(self.field.type, Model)
-        self.is_list = is_list(self.field.type, self.is_class) # type: ignore
+        try:
+            # .. visit all the fields, always in the same order ..
+            for _ignored_name, _field in sorted(getattr(DataClass, _FIELDS).items()):
 
-        #
-        # This is a list and we need to check if its definition
-        # contains information about the actual type of elements inside.
-        #
-        # If it does, in runtime, we will be extracting that particular type.
-        # Otherwise, we will just pass this list on as it is.
-        #
-        if self.is_list:
-            self.model_class = extract_model_class(self.field.type) # type: ignore
-            self.contains_model = bool(self.model_class and hasattr(self.model_class, _FIELDS))
+                field_plan = FieldPlan(_field)
 
-# ################################################################################################################################
+                # .. nested models and lists of models reuse plans of the models they point to ..
+                if field_plan.is_model:
+                    field_plan.plan = self.get_model_plan(_field.type)
 
-    def get_name(self):
-        if self.dict_ctx.list_idx is not None:
-            return '{}[{}]'.format(self.name, self.dict_ctx.list_idx)
-        else:
-            return self.name
+                elif field_plan.contains_model:
+                    field_plan.plan = self.get_model_plan(field_plan.model_class)
 
-# ################################################################################################################################
-# ################################################################################################################################
+                plan.fields.append(field_plan)
 
-class MarshalAPI:
+        except Exception:
 
-    def __init__(self):
-        self._field_cache = {}
+            # .. and we do not keep partial plans around.
+            _ = self._model_plans.pop(DataClass, None)
+            raise
+
+        return plan
 
 # ################################################################################################################################
 
     def get_validation_error(
         self,
-        field_ctx,                 # type: FieldCtx
+        name,                      # type: str
+        parent,                    # type: anytuple | None
         error_class=ElementMissing # type: any_
     ) -> 'ModelValidationError':
 
         # This will always exist
-        elem_path = [field_ctx.name]
+        elem_path = [name]
 
         # Keep checking parent fields as long as they exist
-        while field_ctx.parent:
-            elem_path.append(field_ctx.parent.get_name())
-            field_ctx = field_ctx.parent
+        while parent:
+            parent, parent_name, list_idx = parent
+            if list_idx is None:
+                elem_path.append(parent_name)
+            else:
+                elem_path.append('{}[{}]'.format(parent_name, list_idx))
 
         # We need to reverse it now to present a top-down view
         elem_path = reversed(elem_path)
@@ -341,51 +370,23 @@ class MarshalAPI:
 
 # ################################################################################################################################
 
-    def _self_require_dict(self, field_ctx):
-        # type: (FieldCtx) -> None
-        if not isinstance(field_ctx.value, dict):
-            raise self.get_validation_error(field_ctx)
-
-# ################################################################################################################################
-
-    def _visit_list(self, field_ctx):
-        # type: (FieldCtx) -> list
+    def _visit_list(self, service:'Service', value:'any_', field_plan:'FieldPlan', parent:'anytuple | None') -> 'list':
 
         # Local aliases
-        service     = field_ctx.dict_ctx.service
-        model_class = field_ctx.model_class
+        plan = cast_('ModelPlan', field_plan.plan)
+        name = field_plan.name
 
         # Respone to produce
         out = []
 
-        # Visit each element in the list ..
-        for idx, elem in enumerate(field_ctx.value):
-
-            if field_ctx.is_list:
-                field_ctx.dict_ctx.list_idx = idx
-
-            # .. convert it to a model instance ..
-            instance = self.from_dict(service, elem, model_class, list_idx=idx, parent=field_ctx)
-
-            # .. and append it for our caller ..
+        # Convert each element in the list to a model instance ..
+        for idx, elem in enumerate(value):
+            instance = self._from_plan(plan, service, elem, None, (parent, name, idx))
             out.append(instance)
 
-        # .. finally, return the response.
+        # .. and return the response.
         return out
 
-# ################################################################################################################################
-
-    def from_field_ctx(self, field_ctx):
-        # type: (FieldCtx) -> any_
-        return self.from_dict(field_ctx.dict_ctx.service, field_ctx.value, field_ctx.field.type,
-            extra=None, list_idx=field_ctx.dict_ctx.list_idx, parent=field_ctx)
-
-# ################################################################################################################################
-
-    def _ensure_value_is_a_list(self, field_ctx:'FieldCtx', value:'any_') -> 'None':
-        if not isinstance(value, list):
-            raise self.get_validation_error(field_ctx, error_class=ElementIsNotAList)
-
 # ################################################################################################################################
 
     def from_dict(
@@ -394,70 +395,79 @@ class MarshalAPI:
         current_dict: 'dict',
         DataClass:    'any_',
         extra:        'dictnone' = None,
-        list_idx:     'intnone'  = None,
-        parent:       'optional[FieldCtx]' = None
+        parent:       'anytuple | None' = None
         ) -> 'any_':
 
-        dict_ctx = DictCtx(service, current_dict, DataClass, extra, list_idx, parent)
-        dict_ctx.init()
+        return self._from_plan(self.get_model_plan(DataClass), service, current_dict, extra, parent)
 
-        # All fields that we will visit
-        field_items = sorted(dict_ctx.fields.items()) # type: any_
+# ################################################################################################################################
 
-        for _ignored_name, _field in field_items:
+    def _from_plan(
+        self,
+        plan:         'ModelPlan',
+        service:      'Service',
+        current_dict: 'anydict | Model',
+        extra:        'dictnone',
+        parent:       'anytuple | None'
+        ) -> 'any_':
+
+        # Parameters to the dataclass's __init__ method or, if it does not have one, attributes to set via setattr
+        attrs = {}
 
-            # Assume we are required ..
-            is_required = True
+        # We can check it once upfront for all the fields
+        is_dict = isinstance(current_dict, dict)
+        is_model = (not is_dict) and isinstance(current_dict, Model)
 
-            # Use this by default ..
-            field_type = _field.type
+        for field_plan in plan.fields:
 
-            # .. unless it is a union with None = this field is really optional[type_]
-            if is_union(_field.type):
-                result = extract_from_union(_field.type)
-                _, field_type, union_with = result
+            name = field_plan.name
 
-                # .. check if this was an optional field.
-                is_required = not (union_with is _None_Type)
+            # Assume that we do not have any value
+            value = ZatoNotGiven
 
-            # Represents a current field in the model in the context of the input dict ..
-            field_ctx = FieldCtx(dict_ctx, _field, parent)
-            field_ctx.is_required = is_required
-            field_ctx.field_type = field_type
+            # If we have extra data, that will take priority over our regular dict, which is why we check it first here.
+            # Note that we are given extra data only if we are a top-level element, never for nested models, because
+            # we can only ever overwrite top-level elements with what extra contains.
+            if extra:
+                value = extra.get(name, ZatoNotGiven)
 
-            # .. this call will populate the initial value of the field as well (field_ctx..
-            field_ctx.init()
+            # If we do not have a value here, it means that we have no extra,
+            # or that it did not contain the expected value so we look it up in the current dictionary.
+            if value is ZatoNotGiven:
+                if is_dict:
+                    value = current_dict.get(name, ZatoNotGiven) # type: ignore
+                elif is_model:
+                    value = getattr(current_dict, name, ZatoNotGiven)
 
             # If this field points to a model ..
-            if field_ctx.is_model:
+            if field_plan.is_model:
 
                 # .. first, we need a dict as value as it is the only container that we can extract model fields from ..
-                self._self_require_dict(field_ctx)
+                if not isinstance(value, dict):
+                    raise self.get_validation_error(name, parent)
 
-                # .. if we are here, it means that we can check the dict and extract its fields,
-                # but note that we do not pass extra data on to nested models
-                # because we can only ever overwrite top-level elements with what extra contains.
-                field_ctx.value = self.from_field_ctx(field_ctx)
+                # .. if we are here, it means that we can check the dict and extract its fields.
+                value = self._from_plan(cast_('ModelPlan', field_plan.plan), service, value, None, (parent, name, None))
 
             # .. if this field points to a list ..
-            elif field_ctx.is_list:
+            elif field_plan.is_list:
 
                 # If we have a model class the elements of the list are of,
                 # we need to visit each of them now.
-                if field_ctx.model_class:
+                if field_plan.model_class:
 
                     # Enter further only if we have any value at all to check ..
-                    if field_ctx.value and field_ctx.value != ZatoNotGiven: # type: ignore
+                    if value and value is not ZatoNotGiven:
 
                         # .. if the field is required, make sure that what we have on input really is a list object ..
-                        if field_ctx.is_required:
-                            self._ensure_value_is_a_list(field_ctx, field_ctx.value)
+                        if field_plan.is_required and not isinstance(value, list):
+                            raise self.get_validation_error(name, parent, ElementIsNotAList)
 
                         # However, that model class may actually point to <type 'str'> types
                         # in case of fields like strlist, and we need to take that into account
                         # before entering the _visit_list method below.
-                        if field_ctx.is_model or field_ctx.contains_model:
-                            field_ctx.value = self._visit_list(field_ctx)
+                        if field_plan.contains_model:
+                            value = self._visit_list(service, value, field_plan, parent)
 
                     # .. if we are here, it may be because the value is a dictlist instance
                     # .. for which there will be no underlying model and we can just assign it as is ..
@@ -474,72 +484,54 @@ class MarshalAPI:
                         #     my_list: anylistnone = list_field()
                         #     my_dict: anydictnone = dict_field()
                         #
-                        if field_ctx.name in current_dict:
+                        if name in current_dict:
 
                             # .. extract the value first ..
-                            value = current_dict[field_ctx.name]
+                            value = current_dict[name]
 
                             # .. if the field is required, make sure that what we have on input really is a list object ..
-                            if field_ctx.is_required:
-                                self._ensure_value_is_a_list(field_ctx, value)
-
-                            # .. assign the list now.
-                            field_ctx.value = value
+                            if field_plan.is_required and not isinstance(value, list):
+                                raise self.get_validation_error(name, parent, ElementIsNotAList)
 
             # If we do not have a value yet, perhaps we will find a default one
-            if field_ctx.value == ZatoNotGiven:
+            if value is ZatoNotGiven:
 
-                default = field_ctx.field.default
-                default_factory = field_ctx.field.default_factory
+                default = field_plan.default
+                default_factory = field_plan.default_factory
 
                 if default is not MISSING:
-                    field_ctx.value = default
+                    value = default
 
                 elif default_factory and default_factory is not MISSING:
-                    field_ctx.value = default_factory()
+                    value = default_factory()
 
             # Let's check if we found any value
-            if field_ctx.value != ZatoNotGiven:
-                value = field_ctx.value
-            else:
-                if field_ctx.is_required:
-                    raise self.get_validation_error(field_ctx)
+            if value is ZatoNotGiven:
+                if field_plan.is_required:
+                    raise self.get_validation_error(name, parent)
                 else:
-                    # This is the most reliable way
-                    if 'typing.List' in str(field_ctx.field_type):
-                        value = []
-                    elif field_ctx.field_type is Any:
-                        value = None
-                    elif issubclass(field_ctx.field_type, str):
-                        value = ''
-                    elif issubclass(field_ctx.field_type, int):
-                        value = 0
-                    elif issubclass(field_ctx.field_type, list):
-                        value = []
-                    elif issubclass(field_ctx.field_type, dict):
-                        value = {}
-                    elif issubclass(field_ctx.field_type, float):
-                        value = 0.0
-                    else:
-                        value = None
+                    value = field_plan.get_empty_value()
 
             # Assign the value now
-            dict_ctx.attrs_container[field_ctx.name] = value # type: ignore
+            attrs[name] = value
 
         # Create a new instance, potentially with attributes ..
-        instance = DataClass(**dict_ctx.init_attrs) # type: Model
+        if plan.has_init:
+            instance = plan.DataClass(**attrs) # type: Model
 
-        # .. and add extra ones in case __init__ was not defined ..
-        for k, v in dict_ctx.setattr_attrs.items():
-            setattr(instance, k, v)
+        # .. or add them in case __init__ was not defined ..
+        else:
+            instance = plan.DataClass() # type: Model
+            for k, v in attrs.items():
+                setattr(instance, k, v)
 
         # .. run the post-creation hook ..
         if instance.after_created:
 
             ctx = ModelCtx()
             ctx.service = service
-            ctx.data = dict_ctx.current_dict
-            ctx.DataClass = DataClass
+            ctx.data = current_dict
+            ctx.DataClass = plan.DataClass
 
             instance.after_created(ctx)
 
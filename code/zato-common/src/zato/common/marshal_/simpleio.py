@@ -7,6 +7,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from inspect import isclass
 from logging import getLogger
 from traceback import format_exc
 
@@ -15,7 +16,7 @@ from orjson import loads
 
 # Zato
 from zato.common import DATA_FORMAT
-from zato.common.marshal_.api import Model
+from zato.common.marshal_.api import MarshalAPI, Model
 from zato.common.pubsub import PubSubMessage
 
 # ################################################################################################################################
@@ -87,6 +88,17 @@ class DataClassSimpleIO:
             logger.warning('Could not attach DataClassSimpleIO to class `%s`, e:`%s`', class_, format_exc())
             raise
 
+        # Compile the input model's plan now rather than when the first request arrives ..
+        sio_input = getattr(user_sio, 'input', None)
+        if isclass(sio_input) and issubclass(sio_input, Model):
+            try:
+                _ = MarshalAPI().get_model_plan(sio_input)
+            except Exception:
+
+                # .. if it cannot be compiled, the service can still be deployed
+                # .. and the same exception will be raised when the service is invoked.
+                logger.warning('Could not compile input model of class `%s`, e:`%s`', class_, format_exc())
+
 # ################################################################################################################################
 
     def parse_input(
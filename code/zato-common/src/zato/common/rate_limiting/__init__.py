@@ -23,7 +23,7 @@ from sqlalchemy import and_
 
 # Zato
 from zato.common.rate_limiting.common import Const, DefinitionItem, ObjectInfo
-from zato.common.rate_limiting.limiter import Approximate, Exact, RateLimitStateDelete, RateLimitStateTable
+from zato.common.rate_limiting.limiter import Approximate, Exact, RateLimitStateDelete, RateLimitStateTable, SlidingWindow
 
 # Python 2/3 compatibility
 from zato.common.py23_.past.builtins import unicode
@@ -142,7 +142,8 @@ class DefinitionParser:
 class RateLimiting:
     """ Main API for the management of rate limiting functionality.
     """
-    __slots__ = 'parser', 'config_store', 'lock', 'sql_session_func', 'global_lock_func', 'cluster_id'
+    __slots__ = 'parser', 'config_store', 'lock', 'sql_session_func', 'global_lock_func', 'cluster_id', 'engine', \
+        'exact_block_size'
 
     def __init__(self):
         self.parser = DefinitionParser() # type: DefinitionParser
@@ -152,6 +153,12 @@ class RateLimiting:
         self.sql_session_func = None     # type: Callable
         self.cluster_id = None           # type: int
 
+        # Which limiter to use for objects that do not need exact rate limiting, one of Const.Engine
+        self.engine = Const.Engine.approximate
+
+        # How many requests each server reserves at a time for exact rate limiting
+        self.exact_block_size = 1
+
 # ################################################################################################################################
 
     def _get_config_key(self, object_type, object_name):
@@ -186,7 +193,13 @@ class RateLimiting:
         else:
             has_from_any = False
 
-        config = Exact(self.cluster_id, self.sql_session_func) if is_exact else Approximate(self.cluster_id) # type: BaseLimiter
+        if is_exact:
+            config = Exact(self.cluster_id, self.sql_session_func, self.exact_block_size) # type: BaseLimiter
+        elif self.engine == Const.Engine.sliding_window:
+            config = SlidingWindow(self.cluster_id)
+        else:
+            config = Approximate(self.cluster_id)
+
         config.is_active = object_dict['is_active']
         config.is_exact = is_exact
         config.api = self
@@ -221,14 +234,13 @@ class RateLimiting:
         """
         # type: (unicode, unicode, unicode, unicode)
 
-        with self.lock:
-            config = self._get_config_by_object(object_type, object_name)
+        # No need for self.lock here - this is a single dict look-up and configuration is always replaced in whole
+        config = self._get_config_by_object(object_type, object_name)
 
         # It is possible that we do not have configuration for such an object,
-        # in which case we will log a warning.
+        # in which case we will log a warning. Otherwise, each limiter takes care of its own locking.
         if config:
-            with config.lock:
-                config.check_limit(cid, from_)
+            config.check_limit(cid, from_)
         else:
             if needs_warn:
                 logger.warning('No such rate limiting object `%s` (%s)', object_name, object_type)
@@ -33,6 +33,17 @@ class Const:
         hour   = 'h'
         day    = 'd'
 
+    # How many seconds there are in each unit
+    unit_seconds = {
+        Unit.minute: 60,
+        Unit.hour: 3600,
+        Unit.day: 86400,
+    }
+
+    class Engine:
+        approximate = 'approximate'
+        sliding_window = 'sliding-window'
+
     @staticmethod
     def all_units():
         return {Const.Unit.minute, Const.Unit.hour, Const.Unit.day}
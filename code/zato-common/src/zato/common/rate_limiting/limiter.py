@@ -12,10 +12,16 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from contextlib import closing
 from copy import deepcopy
 from datetime import datetime
+from ipaddress import ip_address
+from time import time
 
 # gevent
 from gevent.lock import RLock
 
+# SQLAlchemy
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+
 # netaddr
 from netaddr import IPAddress
 
@@ -325,11 +331,22 @@ class Approximate(BaseLimiter):
 # ################################################################################################################################
 
 class Exact(BaseLimiter):
+    """ A cluster-wide limiter. Servers reserve blocks of requests in the ODB, atomically incrementing the number
+    of requests in a given period, and then admit requests from their blocks without accessing the ODB. Each server
+    may keep up to block_size - 1 requests reserved but not used in each period so, across the cluster, the limit is never
+    exceeded but up to (block_size - 1) * servers requests may be rejected before it is reached. With block_size set to 1,
+    each request is reserved individually.
+    """
+    __slots__ = 'sql_session_func', 'block_size'
 
-    def __init__(self, cluster_id, sql_session_func):
-        # type: (int, Callable)
+    # How many times to try to reserve a block if other servers keep changing the same row concurrently
+    max_reserve_attempts = 3
+
+    def __init__(self, cluster_id, sql_session_func, block_size=1):
+        # type: (int, Callable, int)
         super(Exact, self).__init__(cluster_id)
         self.sql_session_func = sql_session_func
+        self.block_size = block_size
 
 # ################################################################################################################################
 
@@ -345,8 +362,76 @@ class Exact(BaseLimiter):
 
 # ################################################################################################################################
 
-    def _get_current_state(self, current_period, network_found):
-        # type: (str, str) -> dict
+    def _reserve(self, current_period, network_found, rate, cid, orig_from, now):
+        """ Reserves in the ODB a new block of requests for the input network in the current period. Returns the number
+        of requests reserved, possibly fewer than block_size if the limit is close, or 0 if there are none left.
+        """
+        # type: (str, str, int, str, str, datetime) -> int
+
+        block = min(self.block_size, rate)
+        if block <= 0:
+            return 0
+
+        columns = RateLimitStateTable.c
+        where = and_(
+            columns.cluster_id==self.cluster_id,
+            columns.object_type==self.object_info.type_,
+            columns.object_id==self.object_info.id,
+            columns.period==current_period,
+            columns.last_network==network_found,
+        )
+
+        with closing(self.sql_session_func()) as session:
+            for _ in range(self.max_reserve_attempts):
+
+                # Try to increment the number of requests by the whole block ..
+                result = session.execute(RateLimitStateTable.update().where(and_(where, columns.requests + block <= rate)).
+                    values(
+                        requests=columns.requests + block,
+                        last_cid=cid,
+                        last_from=orig_from,
+                        last_request_time_utc=now,
+                    ))
+
+                if result.rowcount:
+                    session.commit()
+                    return block
+
+                # .. if we could not, it may be because there is no such row yet ..
+                requests = session.execute(select([columns.requests]).where(where)).scalar()
+
+                if requests is None:
+                    try:
+                        session.execute(RateLimitStateTable.insert().values(
+                            cluster_id=self.cluster_id,
+                            object_type=self.object_info.type_,
+                            object_id=self.object_info.id,
+                            period=current_period,
+                            requests=block,
+                            last_cid=cid,
+                            last_from=orig_from,
+                            last_network=network_found,
+                            last_request_time_utc=now,
+                        ))
+                        session.commit()
+                    except IntegrityError:
+                        # Another server inserted it in the meantime so we need to try again
+                        session.rollback()
+                    else:
+                        return block
+
+                # .. or there are fewer requests left than a full block, in which case we try to reserve what is left.
+                else:
+                    block = rate - requests
+                    if block <= 0:
+                        return 0
+
+        return 0
+
+# ################################################################################################################################
+
+    def _raise_exact_limit_exceeded(self, rate, unit, orig_from, network_found, current_period, cid,
+            def_object_id, def_object_name, def_object_type):
 
         current_state = deepcopy(self.initial_state) # type: dict
 
@@ -356,39 +441,51 @@ class Exact(BaseLimiter):
         if item:
             current_state.update(item.asdict())
 
-        return current_state
+        self._raise_rate_limit_exceeded(rate, unit, orig_from, network_found, current_state, cid,
+            def_object_id, def_object_name, def_object_type)
 
 # ################################################################################################################################
 
-    def _set_new_state(self, current_state, cid, orig_from, network_found, now, current_period):
+    def _check_limit(self, cid, orig_from, network_found, rate, unit, def_object_id, def_object_name, def_object_type,
+        _rate_any=Const.rate_any, _utcnow=datetime.utcnow):
+        # type: (str, str, str, int, str, str, object, str, str)
 
-        # We just need a string representation of this object
-        network_found = str(network_found)
+        # Increase invocation counter
+        self.invocation_no += 1
 
-        with closing(self.sql_session_func()) as session:
-            item = self._fetch_current_state(session, current_period, network_found)
+        # Unless we are allowed to have any rate, in which case there is nothing to keep track of ..
+        if rate != _rate_any:
 
-            if item:
-                item.last_cid = cid
-                item.last_from = orig_from
-                item.last_request_time_utc = now
-            else:
-                item = RateLimitState()
-                item.cluster_id = self.cluster_id
-                item.object_type = self.object_info.type_
-                item.object_id = self.object_info.id
-                item.requests = 0
-                item.period = current_period
-                item.network = network_found
-                item.last_cid = cid
-                item.last_from = orig_from
-                item.last_network = network_found
-                item.last_request_time_utc = now
-
-            item.requests += 1
-
-            session.add(item)
-            session.commit()
+            now = _utcnow()
+
+            # We just need a string representation of this object
+            network_found = str(network_found)
+
+            # Get current period, e.g. current day, hour or minute, and how many requests we have left in it
+            current_period = self.current_period_func[unit](now)
+            period_dict = self.by_period.setdefault(current_period, {}) # type: dict
+            remaining = period_dict.get(network_found, 0) # type: int
+
+            # .. if there are none, we need to reserve a new block of them ..
+            if not remaining:
+                remaining = self._reserve(current_period, network_found, rate, cid, orig_from, now)
+
+                # .. which may not be possible if the limit is already reached ..
+                if not remaining:
+                    self._raise_exact_limit_exceeded(rate, unit, orig_from, network_found, current_period, cid,
+                        def_object_id, def_object_name, def_object_type)
+
+            # .. if we are here, it means that the request is allowed.
+            period_dict[network_found] = remaining - 1
+
+        # Above, we checked our own rate limit but it is still possible that we have a parent
+        # that also wants to check it.
+        if self.has_parent:
+            self.api.check_limit(cid, self.parent_type, self.parent_name, orig_from)
+
+        # Clean up old entries periodically
+        if self.invocation_no % 1000 == 0:
+            self.cleanup()
 
 # ################################################################################################################################
 
@@ -399,6 +496,12 @@ class Exact(BaseLimiter):
 # ################################################################################################################################
 
     def _delete_periods(self, to_delete):
+
+        # Requests reserved but not used in these periods will not be needed anymore ..
+        for item in to_delete: # item: str
+            self.by_period.pop(item, None)
+
+        # .. and the same goes for what is in the ODB.
         with closing(self.sql_session_func()) as session:
             session.execute(RateLimitStateDelete().where(
                 RateLimitStateTable.c.period.in_(to_delete)
@@ -407,3 +510,193 @@ class Exact(BaseLimiter):
 
 # ################################################################################################################################
 # ################################################################################################################################
+
+class NetworkTree:
+    """ A binary radix tree of IP networks from a rate limiting definition. Looking up an address returns the same definition
+    line that checking the lines one by one would, i.e. the first one whose network contains the address.
+    """
+    __slots__ = 'roots', 'from_any'
+
+    # How many bits there are in addresses of each IP version
+    bits_by_version = {4: 32, 6: 128}
+
+    def __init__(self, definition, _from_any=Const.from_any):
+        # type: (list, str)
+
+        # Each node is a list of [child for bit 0, child for bit 1, definition line or None]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+
+        # The first catch-all * line, if there is any
+        self.from_any = None # type: DefinitionItem
+
+        for line in definition: # type: DefinitionItem
+            if line.from_ == _from_any:
+                if not self.from_any:
+                    self.from_any = line
+            else:
+                self._add(line)
+
+# ################################################################################################################################
+
+    def _add(self, line):
+        # type: (DefinitionItem)
+
+        network = line.from_
+        bits = self.bits_by_version[network.version]
+        value = network.first
+        node = self.roots[network.version]
+
+        for shift in range(bits - 1, bits - 1 - network.prefixlen, -1):
+            bit = (value >> shift) & 1
+            child = node[bit]
+            if not child:
+                child = node[bit] = [None, None, None]
+            node = child
+
+        # Lines are added in the order of their appearance so an earlier one for the same network takes precedence
+        if not node[2]:
+            node[2] = line
+
+# ################################################################################################################################
+
+    def get(self, address):
+        """ Returns the first definition line matching the input ipaddress object or None if there is no such line.
+        """
+        # type: (object) -> DefinitionItem
+
+        node = self.roots[address.version]
+        value = int(address)
+        found = node[2] # type: DefinitionItem
+
+        for shift in range(self.bits_by_version[address.version] - 1, -1, -1):
+            node = node[(value >> shift) & 1]
+            if not node:
+                break
+            line = node[2] # type: DefinitionItem
+            if line and ((not found) or line.config_line < found.config_line):
+                found = line
+
+        if self.from_any and ((not found) or self.from_any.config_line < found.config_line):
+            found = self.from_any
+
+        return found
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SlidingWindow(BaseLimiter):
+    """ A per-server, approximate, rate limiter that counts requests in a window sliding over the last minute, hour or day
+    instead of in calendar periods. For each definition line, it keeps counters of the current and previous fixed windows,
+    with the latter weighted by how much of it still overlaps the sliding one. Time is kept in integer seconds, addresses
+    are matched through a NetworkTree and locks are striped by definition line.
+    """
+    __slots__ = 'tree', 'counters', 'locks', 'address_cache'
+
+    # How many locks to stripe definition lines over
+    lock_stripes = 16
+
+    # Matched addresses are cached up to this many of them
+    max_address_cache = 10000
+
+    def __init__(self, cluster_id):
+        # type: (int)
+        super(SlidingWindow, self).__init__(cluster_id)
+        self.tree = None          # type: NetworkTree
+        self.counters = {}        # type: dict
+        self.address_cache = {}   # type: dict
+        self.locks = [RLock() for _ in range(self.lock_stripes)]
+
+# ################################################################################################################################
+
+    def cleanup(self, _unit_seconds=Const.unit_seconds):
+        """ Deletes counters of definition lines that have not been used in their current or previous windows.
+        """
+        now = int(time())
+
+        for line, state in list(self.counters.items()): # type: DefinitionItem, list
+            if state[0] < now // _unit_seconds[line.unit] - 1:
+                self.counters.pop(line, None)
+
+# ################################################################################################################################
+
+    def _get_rate_config_by_from(self, orig_from):
+        # type: (str) -> DefinitionItem
+
+        found = self.address_cache.get(orig_from)
+
+        if not found:
+
+            if not self.tree:
+                self.tree = NetworkTree(self.definition)
+
+            found = self.tree.get(ip_address(orig_from))
+
+            # We did not match any line from configuration
+            if not found:
+                raise AddressNotAllowed('Address not allowed `{}`'.format(orig_from))
+
+            if len(self.address_cache) >= self.max_address_cache:
+                self.address_cache.clear()
+            self.address_cache[orig_from] = found
+
+        return found
+
+# ################################################################################################################################
+
+    def check_limit(self, cid, orig_from, _rate_any=Const.rate_any, _unit_seconds=Const.unit_seconds, _time=time):
+        # type: (str, str)
+
+        if self.has_from_any:
+            line = self.definition[0] # type: DefinitionItem
+        else:
+            line = self._get_rate_config_by_from(orig_from)
+
+        rate = line.rate
+        unit_seconds = _unit_seconds[line.unit]
+        now = int(_time())
+        window = now // unit_seconds
+
+        with self.locks[line.config_line % self.lock_stripes]:
+
+            self.invocation_no += 1
+
+            # Each state is a list of [window, current requests, previous requests, last cid, last from, last time]
+            state = self.counters.get(line)
+
+            if not state:
+                state = self.counters[line] = [window, 0, 0, None, None, None]
+
+            # We are in a new window so the current one becomes the previous one, unless there were no requests in the latter
+            elif state[0] != window:
+                state[2] = state[1] if state[0] == window - 1 else 0
+                state[1] = 0
+                state[0] = window
+
+            # Unless we are allowed to have any rate ..
+            if rate != _rate_any:
+
+                # .. we may have reached the limit already.
+                elapsed = now - window * unit_seconds
+                if state[2] * (unit_seconds - elapsed) // unit_seconds + state[1] >= rate:
+                    self._raise_rate_limit_exceeded(rate, line.unit, orig_from, line.from_, {
+                        'last_cid': state[3],
+                        'last_from': state[4],
+                        'last_request_time_utc': datetime.utcfromtimestamp(state[5]).isoformat() if state[5] else None,
+                    }, cid, line.object_id, line.object_name, line.object_type)
+
+            state[1] += 1
+            state[3] = cid
+            state[4] = orig_from
+            state[5] = now
+
+        # Above, we checked our own rate limit but it is still possible that we have a parent
+        # that also wants to check it.
+        if self.has_parent:
+            self.api.check_limit(cid, self.parent_type, self.parent_name, orig_from)
+
+        # Clean up old entries periodically
+        if self.invocation_no % 1000 == 0:
+            self.cleanup()
+
+# ################################################################################################################################
+# ################################################################################################################################
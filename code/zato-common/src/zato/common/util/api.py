@@ -178,6 +178,11 @@ wait_until_port_taken = wait_until_port_taken
 
 class ModuleCtx:
     PID_To_Port_Pattern = 'zato-ipc-port-{cluster_name}-{server_name}-{pid}.txt'
+    PID_To_Socket_Pattern = 'zato-ipc-{cluster_name}-{server_name}-{pid}.sock'
+    PID_To_Socket_Hashed_Pattern = 'zato-ipc-{hash}-{pid}.sock'
+
+    # Paths to Unix sockets cannot be longer than this
+    Socket_Path_Max_Len = 100
 
 # ################################################################################################################################
 
@@ -2065,6 +2070,33 @@ def save_ipc_pid_port(cluster_name:'str', server_name:'str', pid:'int', port:'in
 
 # ################################################################################################################################
 
+def get_ipc_pid_socket_path(cluster_name:'str', server_name:'str', pid:'int') -> 'str':
+
+    # This is where the file name itself ..
+    file_name = ModuleCtx.PID_To_Socket_Pattern.format(
+        cluster_name=cluster_name,
+        server_name=server_name,
+        pid=pid,
+    )
+
+    # .. make sure the name is safe to use in the file-system ..
+    file_name = fs_safe_name(file_name)
+
+    # .. now, we can combine it with a temporary directory ..
+    tmp_dir = gettempdir()
+    full_path = os.path.join(tmp_dir, file_name)
+
+    # .. unless that would be too long for a Unix socket, in which case we use a hash of the names instead ..
+    if len(full_path) > ModuleCtx.Socket_Path_Max_Len:
+        names_hash = sha256('{}/{}'.format(cluster_name, server_name).encode('utf8')).hexdigest()[:16]
+        file_name = ModuleCtx.PID_To_Socket_Hashed_Pattern.format(hash=names_hash, pid=pid)
+        full_path = os.path.join(tmp_dir, file_name)
+
+    # .. and return the result to our caller.
+    return full_path
+
+# ################################################################################################################################
+
 def load_ipc_pid_port(cluster_name:'str', server_name:'str', pid:'int') -> 'int':
 
     # Get a path to load the port from ..
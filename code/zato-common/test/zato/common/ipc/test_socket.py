@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+from socket import AF_UNIX, SOCK_STREAM, socket
+from tempfile import mkdtemp
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.common.ipc.api import IPCAPI
+from zato.common.ipc.socket_ import FrameType, IPCSocketClient, IPCSocketServer, IPCTimeout, ModuleCtx as SocketModuleCtx
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from bunch import Bunch
+    from zato.common.typing_ import tuple_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Username = 'test.username'
+    Password = 'test.password'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class IPCSocketTestCase(TestCase):
+
+    def _callback(self, msg:'Bunch') -> 'dict':
+        self.requests.append(msg)
+        data = msg['data']
+
+        if data.get('sleep'):
+            sleep(data['sleep'])
+
+        if data.get('error'):
+            raise Exception(data['error'])
+
+        return {'service': msg['service'], 'echo': data}
+
+    def _get_server(self) -> 'IPCSocketServer':
+
+        self.requests = []
+
+        path = os.path.join(mkdtemp(prefix='zato-test-ipc-'), 'ipc.sock')
+        server = IPCSocketServer(path, ModuleCtx.Username, ModuleCtx.Password, self._callback)
+        server.start()
+
+        self.addCleanup(server.stop)
+        return server
+
+    def _get_client(self, server:'IPCSocketServer', password:'str'=ModuleCtx.Password) -> 'IPCSocketClient':
+        client = IPCSocketClient(server.path, ModuleCtx.Username, password)
+        self.addCleanup(client.close)
+        return client
+
+# ################################################################################################################################
+
+    def test_invoke(self):
+
+        server = self._get_server()
+        client = self._get_client(server)
+
+        response = client.invoke('my.service', {'hello': 'world'})
+
+        self.assertEqual(response['status'], 'ok')
+        self.assertDictEqual(response['response'], {'service': 'my.service', 'echo': {'hello': 'world'}})
+
+        # Credentials are sent only once per connection, not with each request
+        self.assertNotIn('password', self.requests[0])
+
+        response = client.invoke('my.service', {'error': 'My error'})
+        self.assertEqual(response['status'], 'error')
+
+        # The connection is still usable after an error in the service
+        first_sock = client.sock
+        _ = client.invoke('my.service', {})
+        self.assertIs(client.sock, first_sock)
+
+# ################################################################################################################################
+
+    def test_concurrent_requests_are_multiplexed(self):
+
+        server = self._get_server()
+        client = self._get_client(server)
+
+        # The slowest request is sent first yet it does not hold up the other ones
+        greenlets = [spawn(client.invoke, 'my.service', {'idx': idx, 'sleep': 0.2 if idx == 0 else 0}) for idx in range(50)]
+        _ = joinall(greenlets[1:], timeout=0.1)
+
+        self.assertFalse(greenlets[0].ready())
+        self.assertTrue(all(greenlet.ready() for greenlet in greenlets[1:]))
+
+        _ = joinall(greenlets)
+        responses = [greenlet.value['response']['echo']['idx'] for greenlet in greenlets]
+        self.assertListEqual(responses, list(range(50)))
+
+# ################################################################################################################################
+
+    def test_invalid_credentials(self):
+
+        server = self._get_server()
+        client = self._get_client(server, 'invalid.password')
+
+        with self.assertRaises(Exception) as cm:
+            _ = client.invoke('my.service', {})
+
+        self.assertIn('rejected', str(cm.exception))
+        self.assertListEqual(self.requests, [])
+
+# ################################################################################################################################
+
+    def test_timeout_and_reconnect(self):
+
+        server = self._get_server()
+        client = self._get_client(server)
+
+        # gevent's own Timeout would not be caught by callers that expect an Exception
+        with self.assertRaises(IPCTimeout):
+            _ = client.invoke('my.service', {'sleep': 0.5}, timeout=0.05)
+
+        # The connection is kept after a timeout ..
+        first_sock = client.sock
+        self.assertIsNotNone(first_sock)
+        self.assertDictEqual(client.pending, {})
+
+        # .. and a new one is established if the previous one was closed.
+        client.close()
+        response = client.invoke('my.service', {'hello': 'world'})
+        self.assertEqual(response['status'], 'ok')
+        self.assertIsNot(client.sock, first_sock)
+
+# ################################################################################################################################
+
+    def test_auth_frame_size_is_limited(self):
+
+        server = self._get_server()
+
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(server.path)
+        self.addCleanup(sock.close)
+
+        # A frame that is too long for credentials is rejected before its payload is read ..
+        header = SocketModuleCtx.Header.pack(SocketModuleCtx.Max_Auth_Frame_Size + 1, 0, FrameType.Auth)
+        sock.sendall(header)
+
+        # .. and the connection is closed without a response.
+        self.assertEqual(sock.recv(1), b'')
+        self.assertListEqual(self.requests, [])
+
+# ################################################################################################################################
+
+    def _get_api(self, server:'IPCSocketServer') -> 'tuple_[IPCAPI, tuple_[str, str, int]]':
+
+        api = IPCAPI()
+        api.set_password(ModuleCtx.Password)
+
+        key = ('test.cluster', 'test.server', 123)
+        api.socket_clients[key] = self._get_client(server)
+
+        return api, key
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid_falls_back_to_http(self):
+
+        server = self._get_server()
+        api, key = self._get_api(server)
+
+        # The process is no longer listening on its socket ..
+        server.stop()
+
+        with patch('zato.common.ipc.api.load_ipc_pid_port', return_value=12345), \
+             patch('zato.common.ipc.api.IPCClient') as ipc_client:
+
+            ipc_client.return_value.invoke.return_value = {'status': 'ok', 'response': 'from.http'}
+            response = api.invoke_by_pid('my.service', {}, *key)
+
+        # .. which is why it was invoked over HTTP instead ..
+        self.assertEqual(response['response'], 'from.http')
+        self.assertEqual(ipc_client.call_args[0][1], 12345)
+
+        # .. and its socket will be checked again the next time.
+        self.assertNotIn(key, api.socket_clients)
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid_timeout_is_not_retried(self):
+
+        server = self._get_server()
+        api, key = self._get_api(server)
+        client = api.socket_clients[key]
+
+        with patch('zato.common.ipc.api.IPCClient') as ipc_client:
+            with self.assertRaises(IPCTimeout):
+                _ = api.invoke_by_pid('my.service', {'sleep': 0.5}, *key, timeout=0.05)
+
+        # The service may still be running, so it must not be invoked again over HTTP ..
+        ipc_client.assert_not_called()
+
+        # .. but the connection is dropped all the same.
+        self.assertNotIn(key, api.socket_clients)
+        self.assertIsNone(client.sock)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from unittest import main, TestCase
+
+# Zato
+from zato.common.ext.dataclasses import dataclass
+from zato.common.marshal_.api import ElementIsNotAList, ElementMissing, MarshalAPI, Model
+from zato.common.test.marshall_ import CreatePhoneListRequest, LineParent, Phone
+from zato.common.typing_ import cast_, list_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.server.service import Service
+    Service = Service
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+@dataclass(init=False, repr=False)
+class Order(Model):
+    order_id: int
+    item_list: list_[LineParent]
+
+@dataclass(init=False, repr=False)
+class Batch(Model):
+    batch_id: int
+    data_list: list
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModelPlanTestCase(TestCase):
+
+    def test_plans_are_shared_and_reused(self):
+
+        plan = MarshalAPI().get_model_plan(CreatePhoneListRequest)
+
+        # Other instances of the API use the same plan ..
+        self.assertIs(MarshalAPI().get_model_plan(CreatePhoneListRequest), plan)
+
+        # .. fields are always visited in the same order ..
+        self.assertListEqual([elem.name for elem in plan.fields], sorted(elem.name for elem in plan.fields))
+
+        # .. and lists of models point to plans of their elements.
+        phone_list, = [elem for elem in plan.fields if elem.name == 'phone_list']
+        self.assertTrue(phone_list.contains_model)
+        self.assertIs(phone_list.plan, MarshalAPI().get_model_plan(Phone))
+
+# ################################################################################################################################
+
+    def test_nested_model_in_list_element_path(self):
+
+        api = MarshalAPI()
+        service = cast_('Service', None)
+
+        data = {
+            'order_id': 123,
+            'item_list': [
+                {'name': 'item.0', 'details': {'name': 'details.0'}},
+                {'name': 'item.1', 'details': {}},
+            ]
+        }
+
+        with self.assertRaises(ElementMissing) as cm:
+            _ = api.from_dict(service, data, Order)
+
+        self.assertEqual(cm.exception.reason, 'Element missing: /item_list[1]/details/name')
+
+# ################################################################################################################################
+
+    def test_extra_is_used_for_top_level_elements_only(self):
+
+        api = MarshalAPI()
+        service = cast_('Service', None)
+
+        data = {'name': 'parent', 'details': {'name': 'details'}}
+        instance = api.from_dict(service, data, LineParent, extra={'name': 'extra'}) # type: LineParent
+
+        self.assertEqual(instance.name, 'extra')
+        self.assertEqual(instance.details.name, 'details')
+
+# ################################################################################################################################
+
+    def test_required_list_of_models_is_not_a_list(self):
+
+        api = MarshalAPI()
+        service = cast_('Service', None)
+
+        for value in (None, ''):
+            with self.assertRaises(ElementIsNotAList) as cm:
+                _ = api.from_dict(service, {'order_id': 1, 'item_list': value}, Order)
+            self.assertEqual(cm.exception.reason, 'Element is not a list: /item_list')
+
+# ################################################################################################################################
+
+    def test_untyped_list(self):
+
+        api = MarshalAPI()
+        service = cast_('Service', None)
+
+        # Extra overrides what the dict has ..
+        data = {'batch_id': 1, 'data_list': [1, 2]}
+        instance = api.from_dict(service, data, Batch, extra={'data_list': [3]}) # type: Batch
+        self.assertListEqual(instance.data_list, [3])
+
+        # .. and the value is taken as it is, without checking if it really is a list.
+        data = {'batch_id': 1, 'data_list': 'abc'}
+        instance = api.from_dict(service, data, Batch) # type: Batch
+        self.assertEqual(instance.data_list, 'abc')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
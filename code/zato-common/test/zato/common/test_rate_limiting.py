@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from ipaddress import ip_address
+from random import randrange, seed
+from unittest import TestCase
+
+# netaddr
+from netaddr import IPAddress
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Zato
+from zato.common.odb.model import RateLimitState
+from zato.common.rate_limiting import DefinitionParser, RateLimiting
+from zato.common.rate_limiting.common import AddressNotAllowed, Const, RateLimitReached
+from zato.common.rate_limiting.limiter import Exact, NetworkTree, SlidingWindow
+
+# ################################################################################################################################
+
+definition = """
+10.1.2.0/24 = 5/m
+10.0.0.0/8 = 10/m
+10.1.0.0/16 = 20/m
+192.168.1.1/32 = 30/h
+::1/128 = 40/d
+2001:db8::/32 = 50/m
+"""
+
+object_dict = {
+    'id': 1,
+    'type_': 'http_soap',
+    'name': 'my.channel',
+    'is_active': True,
+    'parent_type': None,
+    'parent_name': None,
+}
+
+# ################################################################################################################################
+
+class NetworkTreeTestCase(TestCase):
+
+    def _get_linear(self, lines, address):
+        for line in lines:
+            if line.from_ == Const.from_any or IPAddress(address) in line.from_:
+                return line
+
+    def _check_addresses(self, lines, addresses):
+        tree = NetworkTree(lines)
+        for address in addresses:
+            self.assertIs(tree.get(ip_address(address)), self._get_linear(lines, address), address)
+
+# ################################################################################################################################
+
+    def test_first_line_wins(self):
+        lines = DefinitionParser().parse(definition, 1, 'http_soap', 'my.channel')
+        self._check_addresses(lines, [
+            '10.1.2.3', '10.1.3.4', '10.2.3.4', '11.1.2.3', '192.168.1.1', '192.168.1.2', '::1', '::2', '2001:db8::1',
+            '2001:db9::1', '0.0.0.0', '255.255.255.255'])
+
+# ################################################################################################################################
+
+    def test_from_any(self):
+        lines = DefinitionParser().parse(definition + '\n* = 60/m\n', 1, 'http_soap', 'my.channel')
+        self._check_addresses(lines, ['10.1.2.3', '11.1.2.3', '::2'])
+
+        lines = DefinitionParser().parse('10.0.0.0/8 = 1/m\n* = 2/m\n10.1.0.0/16 = 3/m', 1, 'http_soap', 'my.channel')
+        self._check_addresses(lines, ['10.1.2.3', '11.1.2.3'])
+
+# ################################################################################################################################
+
+    def test_random_networks(self):
+
+        seed(1)
+
+        networks = []
+        for _ in range(300):
+            prefixlen = randrange(0, 33)
+            address = randrange(0, 2 ** 32)
+            networks.append('{}/{} = 1/m'.format(ip_address(address), prefixlen))
+
+        lines = DefinitionParser().parse('\n'.join(networks), 1, 'http_soap', 'my.channel')
+        self._check_addresses(lines, [str(ip_address(randrange(0, 2 ** 32))) for _ in range(2000)])
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SlidingWindowTestCase(TestCase):
+
+    def _get_api(self, definition):
+        api = RateLimiting()
+        api.engine = Const.Engine.sliding_window
+        api.create(object_dict, definition, False)
+        return api
+
+# ################################################################################################################################
+
+    def test_engine(self):
+        api = self._get_api(definition)
+        self.assertIsInstance(api.get_config('http_soap', 'my.channel'), SlidingWindow)
+
+# ################################################################################################################################
+
+    def test_limit_reached(self):
+
+        api = self._get_api(definition)
+
+        for _ in range(5):
+            api.check_limit('cid', 'http_soap', 'my.channel', '10.1.2.3')
+
+        with self.assertRaises(RateLimitReached):
+            api.check_limit('cid', 'http_soap', 'my.channel', '10.1.2.4')
+
+        # Another line has its own counter
+        api.check_limit('cid', 'http_soap', 'my.channel', '10.1.3.4')
+
+        with self.assertRaises(AddressNotAllowed):
+            api.check_limit('cid', 'http_soap', 'my.channel', '11.1.2.3')
+
+# ################################################################################################################################
+
+    def test_rate_any(self):
+        api = self._get_api('* = *')
+        for _ in range(100):
+            api.check_limit('cid', 'http_soap', 'my.channel', '10.1.2.3')
+
+# ################################################################################################################################
+
+    def test_window_slides(self):
+
+        api = self._get_api('* = 10/m')
+        limiter = api.get_config('http_soap', 'my.channel') # type: SlidingWindow
+
+        now = 6000 # Exactly at the start of a minute
+
+        def check(now):
+            limiter.check_limit('cid', '10.1.2.3', _time=lambda: now)
+
+        for _ in range(10):
+            check(now + 30)
+
+        with self.assertRaises(RateLimitReached):
+            check(now + 59)
+
+        # In the middle of the next minute, half of the previous one's requests still count ..
+        for _ in range(5):
+            check(now + 90)
+
+        with self.assertRaises(RateLimitReached):
+            check(now + 90)
+
+        # .. and two minutes later, none of them do.
+        for _ in range(10):
+            check(now + 180)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ExactTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        RateLimitState.__table__.create(engine)
+        self.session_func = sessionmaker(bind=engine)
+
+    def _get_api(self, definition, block_size):
+        api = RateLimiting()
+        api.cluster_id = 1
+        api.sql_session_func = self.session_func
+        api.exact_block_size = block_size
+        api.create(object_dict, definition, True)
+        return api
+
+    def _get_admitted(self, servers, max_requests):
+        """ Sends requests to each server in turn and returns how many were admitted by each of them.
+        """
+        admitted = [0] * len(servers)
+
+        for idx in range(max_requests):
+            server_idx = idx % len(servers)
+            try:
+                servers[server_idx].check_limit('cid', 'http_soap', 'my.channel', '10.1.2.3')
+            except RateLimitReached:
+                pass
+            else:
+                admitted[server_idx] += 1
+
+        return admitted
+
+    def _get_requests_in_odb(self):
+        session = self.session_func()
+        try:
+            return [item.requests for item in session.query(RateLimitState).all()]
+        finally:
+            session.close()
+
+# ################################################################################################################################
+
+    def test_block_size_one(self):
+
+        servers = [self._get_api(definition, 1), self._get_api(definition, 1)]
+        self.assertIsInstance(servers[0].get_config('http_soap', 'my.channel'), Exact)
+
+        admitted = self._get_admitted(servers, 50)
+        self.assertListEqual(admitted, [3, 2])
+        self.assertListEqual(self._get_requests_in_odb(), [5])
+
+# ################################################################################################################################
+
+    def test_blocks_never_exceed_limit(self):
+
+        servers = [self._get_api('* = 10/m', 3), self._get_api('* = 10/m', 3)]
+
+        admitted = self._get_admitted(servers, 50)
+
+        # Both servers reserve 3 requests twice, after which only 4 are left in the ODB,
+        # so the first server gets 3 and the second one gets the last one.
+        self.assertListEqual(admitted, [6, 4])
+        self.assertListEqual(self._get_requests_in_odb(), [10])
+
+# ################################################################################################################################
+
+    def test_unused_blocks(self):
+
+        servers = [self._get_api('* = 10/m', 4), self._get_api('* = 10/m', 4)]
+
+        # The first server reserves 4 requests but uses only 1 of them ..
+        self._get_admitted(servers[:1], 1)
+
+        # .. so the other one can reserve only 6 of them.
+        admitted = self._get_admitted(servers[1:], 50)
+        self.assertListEqual(admitted, [6])
+
+# ################################################################################################################################
+# ################################################################################################################################
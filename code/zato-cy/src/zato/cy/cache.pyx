@@ -13,6 +13,7 @@ from datetime import datetime
 from decimal import Decimal
 from email.utils import formatdate as stdlib_format_date
 from hashlib import sha256
+from heapq import heappop, heappush
 from json import dumps as json_dumps, JSONEncoder
 from logging import getLogger
 from sys import getsizeof
@@ -25,10 +26,9 @@ from arrow import Arrow
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
     PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
-from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
-from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
-from cpython.sequence cimport PySequence_ITEM
+from cpython.dict cimport PyDict_Size
 from libc.stdint cimport uint64_t
+from libc.stdlib cimport calloc, free
 #from posix.time cimport timeval, timezone, gettimeofday
 
 # gevent
@@ -37,6 +37,9 @@ from gevent.lock import RLock
 # regex
 from regex import compile as re_compile
 
+# sortedcontainers
+from sortedcontainers import SortedList
+
 # Python 2/3 compatibility
 from builtins import bytes
 from six import binary_type, integer_types, string_types, text_type
@@ -111,6 +114,17 @@ cdef class Entry:
         # This entry's position in index
         public long position
 
+        # Neighbours in the recency list - prev is more recently used, next is less recently used
+        Entry _prev
+        Entry _next
+
+        # This entry's recency stamp, the higher it is, the more recently the entry was used
+        long _stamp
+
+        # Whether the entry is in the expiry heap and with what expiration time
+        bint _in_expiry_heap
+        double _heap_expires_at
+
         # Hashed in SHA256
         public str hash
 
@@ -199,6 +213,12 @@ cdef class Entry:
 cdef class Cache:
     """ An LRU cache that optionally rejects entries bigger than N bytes. Entries can have a TTL assigned - periodic processes
     will clean up entries older than allowed.
+
+    Recency of entries is kept in a doubly-linked list that goes through the entries themselves, the most recently used one
+    is at its head. Each use of an entry gives it a new, ever increasing, stamp and a Fenwick tree over the stamps
+    lets one compute the entry's position in the list in O(log n), without walking the list. Stamps are renumbered
+    once all the ones available have been used up. Entries with an expiry time are additionally kept in a min-heap
+    so that deleting the expired ones does not need to check all the keys.
     """
     cdef:
         public long max_size
@@ -207,7 +227,13 @@ cdef class Cache:
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
         public dict _data
-        public list _index
+        Entry _head
+        Entry _tail
+        long *_stamps
+        long _stamps_size
+        long _next_stamp
+        uint64_t _expiry_seq
+        public list _expiry_heap
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
@@ -217,10 +243,19 @@ cdef class Cache:
         public object _lock
         public object default_get # A singleton indicating that no default value was given for self.get
         public dict _regex_cache
+        public bint has_key_index     # Whether string keys are additionally kept sorted for prefix and suffix look-ups
+        public object _key_index      # String keys, sorted
+        public object _key_index_rev  # String keys, each one reversed, sorted
 
     def __cinit__(self):
         self._data = {}
-        self._index = []
+        self._head = None
+        self._tail = None
+        self._stamps = NULL
+        self._stamps_size = 0
+        self._next_stamp = 1
+        self._expiry_seq = 0
+        self._expiry_heap = []
         self.hits_per_position = {}
         self._expired_on_op = []
         self.hits = 0
@@ -228,24 +263,33 @@ cdef class Cache:
         self.set_ops = 0
         self.get_ops = 0
         self._regex_cache = {}
+        self.has_key_index = False
+        self._key_index = None
+        self._key_index_rev = None
+
+    def __dealloc__(self):
+        free(self._stamps)
 
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None,
+        has_key_index=False):
         self._lock = lock or RLock()
         self.default_get = object()
         with self._lock:
-            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
+            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, has_key_index)
 
-    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set):
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, has_key_index=False):
         self.max_size = max_size or CACHE.DEFAULT_SIZE
         self.max_item_size = max_item_size or CACHE.MAX_ITEM_SIZE
         self.has_max_item_size = self.max_item_size > 0
         self.extend_expiry_on_get = extend_expiry_on_get
         self.extend_expiry_on_set = extend_expiry_on_set
         self.hits_per_position.update(dict((key, 0) for key in xrange(self.max_size)))
+        self._set_key_index(has_key_index)
 
     def update_config(self, config):
         with self._lock:
-            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set)
+            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('has_key_index', False))
 
 # ################################################################################################################################
 
@@ -274,7 +318,7 @@ cdef class Cache:
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return PyDict_Size(self._data)
 
 # ################################################################################################################################
 
@@ -290,9 +334,19 @@ cdef class Cache:
 
 # ################################################################################################################################
 
+    cdef list _keys_by_position(self):
+        cdef list out = []
+        cdef Entry entry = self._head
+
+        while entry is not None:
+            out.append(entry.key)
+            entry = entry._next
+
+        return out
+
     cpdef list keys_by_position(self):
         with self._lock:
-            return list(self._index)
+            return self._keys_by_position()
 
 # ################################################################################################################################
 
@@ -322,10 +376,11 @@ cdef class Cache:
 
     def get_slice(self, start, stop, step):
         with self._lock:
-            for key in self._index[start:stop:step]:
-                entry = self._data[key]
+            keys = self._keys_by_position()
+            for position in range(len(keys))[start:stop:step]:
+                entry = self._data[keys[position]]
                 as_dict = entry.to_dict()
-                as_dict['position'] = self._get_index(key)
+                as_dict['position'] = position
                 yield as_dict
 
 # ################################################################################################################################
@@ -336,7 +391,13 @@ cdef class Cache:
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
         with self._lock:
             self._data.clear()
-            self._index[:] = []
+            if self.has_key_index:
+                self._key_index.clear()
+                self._key_index_rev.clear()
+            self._head = None
+            self._tail = None
+            self._next_stamp = self._stamps_size + 1 # Stamps will be renumbered on next use
+            self._expiry_heap[:] = []
             self.hits_per_position.clear()
             self._expired_on_op[:] = []
             self.hits = 0
@@ -354,10 +415,12 @@ cdef class Cache:
             return
         else:
             # We run under self.lock so at this point we know that the key was valid
-            # and _remove_from_index_by_idx is safe to call.
+            # and _unlink is safe to call.
             out = entry.value
             del self._data[key]
-            self._remove_from_index_by_idx(self._get_index(key))
+            self._unlink(entry)
+            if self.has_key_index:
+                self._key_index_remove(key)
 
             return out
 
@@ -369,6 +432,119 @@ cdef class Cache:
 
     __del__ = delete
 
+# ################################################################################################################################
+
+    cdef _set_key_index(self, bint has_key_index):
+        """ Builds or drops the sorted indexes of keys used by *_by_prefix and *_by_suffix methods.
+        Must be called with self._lock held.
+        """
+        if has_key_index:
+            if not self.has_key_index:
+                self._rebuild_key_index()
+        else:
+            self._key_index = None
+            self._key_index_rev = None
+
+        self.has_key_index = has_key_index
+
+# ################################################################################################################################
+
+    cdef _rebuild_key_index(self):
+        """ Builds the key indexes from scratch, which sorts each one only once. Must be called with self._lock held.
+        """
+        cdef list keys = [key for key in self._data if isinstance(key, str_types)]
+        self._key_index = SortedList(keys)
+        self._key_index_rev = SortedList([key[::-1] for key in keys])
+
+# ################################################################################################################################
+
+    cdef _delete_many(self, list keys):
+        """ Deletes all the input keys. If they are a sizable part of the key index, the index is filtered once afterwards
+        rather than updated key by key - it stays sorted so this is linear. Must be called with self._lock held.
+        """
+        cdef bint rebuild = self.has_key_index and len(keys) * 8 > len(self._key_index)
+        cdef set deleted
+        cdef set deleted_rev
+
+        if rebuild:
+            self.has_key_index = False
+
+        for key in keys:
+            self._delete(key)
+
+        if rebuild:
+            deleted = set(keys)
+            deleted_rev = {key[::-1] for key in keys}
+            self._key_index = SortedList([key for key in self._key_index if key not in deleted])
+            self._key_index_rev = SortedList([key for key in self._key_index_rev if key not in deleted_rev])
+            self.has_key_index = True
+
+# ################################################################################################################################
+
+    cdef inline _key_index_add(self, object key):
+        if isinstance(key, str_types):
+            self._key_index.add(key)
+            self._key_index_rev.add(key[::-1])
+
+# ################################################################################################################################
+
+    cdef inline _key_index_remove(self, object key):
+        if isinstance(key, str_types):
+            self._key_index.remove(key)
+            self._key_index_rev.remove(key[::-1])
+
+# ################################################################################################################################
+
+    cdef list _keys_by_prefix(self, object data, int limit):
+        """ Returns string keys starting with the input prefix. With a key index, they are found in O(log n + k),
+        otherwise, all the keys are checked, but no more than limit of them. Must be called with self._lock held.
+        """
+        cdef list out = []
+
+        if self.has_key_index:
+            for key in self._key_index.irange(data):
+                if not key.startswith(data):
+                    break
+                out.append(key)
+                if len(out) == limit:
+                    break
+        else:
+            for idx, key in enumerate(self._data.iterkeys(), 1):
+                if isinstance(key, str_types):
+                    if key.startswith(data):
+                        out.append(key)
+                if idx == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _keys_by_suffix(self, object data, int limit):
+        """ Returns string keys ending with the input suffix, in the same way that self._keys_by_prefix does,
+        except that the key index consulted is the one of reversed keys.
+        """
+        cdef list out = []
+        cdef object rev_data
+
+        if self.has_key_index:
+            rev_data = data[::-1]
+            for rev_key in self._key_index_rev.irange(rev_data):
+                if not rev_key.startswith(rev_data):
+                    break
+                out.append(rev_key[::-1])
+                if len(out) == limit:
+                    break
+        else:
+            for idx, key in enumerate(self._data.iterkeys(), 1):
+                if isinstance(key, str_types):
+                    if key.endswith(data):
+                        out.append(key)
+                if idx == limit:
+                    break
+
+        return out
+
 # ################################################################################################################################
 
     cpdef dict delete_by_prefix(self, object data, bint return_found, int limit):
@@ -382,20 +558,11 @@ cdef class Cache:
         cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            to_delete = self._keys_by_prefix(data, limit)
+            if return_found:
+                for key in to_delete:
+                    out[key] = <Entry>self._data[key].value
+            self._delete_many(to_delete)
 
         return out
 
@@ -412,20 +579,11 @@ cdef class Cache:
         cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            to_delete = self._keys_by_suffix(data, limit)
+            if return_found:
+                for key in to_delete:
+                    out[key] = <Entry>self._data[key].value
+            self._delete_many(to_delete)
 
         return out
 
@@ -601,18 +759,109 @@ cdef class Cache:
 
 # ################################################################################################################################
 
-    cdef inline long _get_index(self, object key):
-        """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
+    cdef inline void _stamps_add(self, long stamp, long delta):
+        """ Adds delta to the Fenwick tree of recency stamps.
+        """
+        while stamp <= self._stamps_size:
+            self._stamps[stamp] += delta
+            stamp += stamp & -stamp
+
+    cdef inline long _stamps_sum(self, long stamp):
+        """ Returns how many entries have a recency stamp lower than or equal to the one given on input.
+        """
+        cdef long out = 0
+
+        while stamp > 0:
+            out += self._stamps[stamp]
+            stamp -= stamp & -stamp
+
+        return out
+
+# ################################################################################################################################
+
+    cdef _renumber_stamps(self):
+        """ Assigns consecutive recency stamps to all entries, starting from the least recently used one,
+        and rebuilds the Fenwick tree. There is room left for at least as many new stamps as there are entries,
+        which means that renumbering is amortised O(1) per operation.
+        """
+        cdef Entry entry
+        cdef long stamp = 0
+        cdef long idx
+        cdef long parent
+        cdef long size = max(2 * PyDict_Size(self._data) + 2, 1024)
+        cdef long *stamps = <long *>calloc(size + 1, sizeof(long))
+
+        if stamps == NULL:
+            raise MemoryError()
+
+        free(self._stamps)
+        self._stamps = stamps
+        self._stamps_size = size
+
+        entry = self._tail
+        while entry is not None:
+            stamp += 1
+            entry._stamp = stamp
+            self._stamps[stamp] = 1
+            entry = entry._prev
+
+        # Build the Fenwick tree in place
+        for idx in range(1, size + 1):
+            parent = idx + (idx & -idx)
+            if parent <= size:
+                self._stamps[parent] += self._stamps[idx]
+
+        self._next_stamp = stamp + 1
+
+# ################################################################################################################################
+
+    cdef inline _link_head(self, Entry entry):
+        """ Adds an entry at the head of the recency list, i.e. at position 0. Must be called with self._lock held.
         """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
+        if self._next_stamp > self._stamps_size:
+            self._renumber_stamps()
 
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
-                return index_idx
-            index_idx += 1
+        entry._stamp = self._next_stamp
+        self._next_stamp += 1
+        self._stamps_add(entry._stamp, 1)
+
+        entry._prev = None
+        entry._next = self._head
+
+        if self._head is not None:
+            self._head._prev = entry
+        else:
+            self._tail = entry
+
+        self._head = entry
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, Entry entry):
+        """ Removes an entry from the recency list. Must be called with self._lock held.
+        """
+        self._stamps_add(entry._stamp, -1)
+
+        if entry._prev is not None:
+            entry._prev._next = entry._next
+        else:
+            self._head = entry._next
+
+        if entry._next is not None:
+            entry._next._prev = entry._prev
+        else:
+            self._tail = entry._prev
+
+        entry._prev = None
+        entry._next = None
+
+# ################################################################################################################################
+
+    cdef inline long _get_position(self, Entry entry):
+        """ Returns the position an entry currently holds in the recency list, 0 is the most recently used one.
+        Must be called only with self._lock held.
+        """
+        return PyDict_Size(self._data) - self._stamps_sum(entry._stamp)
 
 # ################################################################################################################################
 
@@ -621,18 +870,19 @@ cdef class Cache:
         """
         with self._lock:
             if PyDict_Contains(self._data, key):
-                return self._get_index(key)
+                return self._get_position(<Entry>PyDict_GetItem(self._data, key))
 
 # ################################################################################################################################
 
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+    cdef inline _push_expiry(self, Entry entry):
+        """ Adds an entry to the expiry heap unless it is already there with an earlier expiration time. Entries are not
+        moved in the heap when their expiration time is extended - this is checked when they reach the top of the heap instead.
         """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
-
-        return index_key
+        if (not entry._in_expiry_heap) or entry.expires_at < entry._heap_expires_at:
+            self._expiry_seq += 1
+            heappush(self._expiry_heap, (entry.expires_at, self._expiry_seq, entry))
+            entry._in_expiry_heap = True
+            entry._heap_expires_at = entry.expires_at
 
 # ################################################################################################################################
 
@@ -651,12 +901,10 @@ cdef class Cache:
 
         cdef object out = None
         cdef Entry entry
+        cdef Entry evicted
         cdef double _now
         cdef double _orig_now = 0.0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
-        cdef long hits_per_position
+        cdef Py_ssize_t cache_size = PyDict_Size(self._data)
         cdef long len_value
 
         # If multiple processes synchronize contents of their caches, the one that originally added the keys
@@ -688,6 +936,7 @@ cdef class Cache:
                 if expiry:
                     entry.expiry = expiry
                     entry.expires_at = _now + expiry
+                    self._push_expiry(entry)
             else:
                 # Mark as deleted an entry that has already expired
                 if _now >= entry.expires_at:
@@ -717,7 +966,11 @@ cdef class Cache:
 
             # Make sure there is room for the new key
             if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+                evicted = self._tail
+                self._unlink(evicted)
+                PyDict_DelItem(self._data, evicted.key)
+                if self.has_key_index:
+                    self._key_index_remove(evicted.key)
 
             # Actually insert entry
             entry = Entry()
@@ -733,7 +986,13 @@ cdef class Cache:
             entry.set_metadata()
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._link_head(entry)
+
+            if self.has_key_index:
+                self._key_index_add(key)
+
+            if entry.expires_at:
+                self._push_expiry(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
@@ -762,27 +1021,20 @@ cdef class Cache:
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
+            for key in self._keys_by_prefix(data, limit):
 
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -803,29 +1055,20 @@ cdef class Cache:
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                if key.endswith(data):
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
+            for key in self._keys_by_suffix(data, limit):
 
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -1068,9 +1311,7 @@ cdef class Cache:
         """
         cdef object _item
         cdef Entry entry
-        cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
+        cdef long index_idx
         cdef double _now = self._get_timestamp()
 
         try:
@@ -1099,7 +1340,7 @@ cdef class Cache:
             self.hits += 1
 
             # Current position of that key in index
-            index_idx = self._get_index(key)
+            index_idx = self._get_position(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
@@ -1107,11 +1348,10 @@ cdef class Cache:
             hits_per_position += 1
             PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
 
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
-
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
+            # Move the entry to the head position, unless it is already there
+            if entry is not self._head:
+                self._unlink(entry)
+                self._link_head(entry)
 
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
@@ -1150,13 +1390,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._keys_by_prefix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1170,13 +1405,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._keys_by_suffix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1325,41 +1555,31 @@ cdef class Cache:
 
 # ################################################################################################################################
 
-    cdef bint expire_by_prefix(self, object data, double expiry, int limit):
+    cpdef bint expire_by_prefix(self, object data, double expiry, int limit):
         """ Sets expiration for all keys matching a given prefix. Non-string-like keys are ignored.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._keys_by_prefix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
 # ################################################################################################################################
 
-    cdef bint expire_by_suffix(self, object data, double expiry, int limit):
+    cpdef bint expire_by_suffix(self, object data, double expiry, int limit):
         """ Sets expiration for all keys matching a given suffix. Non-string-like keys are ignored.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._keys_by_suffix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1507,6 +1727,7 @@ cdef class Cache:
                 if expires_at > entry.expires_at:
                     entry.expiry = expiry
                     entry.expires_at = expires_at
+                    self._push_expiry(entry)
 
 # ################################################################################################################################
 
@@ -1516,20 +1737,36 @@ cdef class Cache:
         cdef list deleted
         cdef double _now = self._get_timestamp()
         cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef Entry entry
 
         with self._lock:
 
             deleted = self._expired_on_op[:]
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
-                    self._delete(key)
-                    deleted.append(key)
+            # Only entries at the top of the heap may have expired. An entry whose expiration time was extended
+            # since it was added to the heap goes back to it with its current expiration time. Entries that were
+            # deleted or replaced in the meantime are ignored.
+            while self._expiry_heap and _now > self._expiry_heap[0][0]:
+                expires_at, _, entry = heappop(self._expiry_heap)
+
+                # This is an older copy of an entry that was pushed again with an earlier expiration time
+                if (not entry._in_expiry_heap) or expires_at != entry._heap_expires_at:
+                    continue
+
+                entry._in_expiry_heap = False
+
+                if self._data.get(entry.key) is not entry:
+                    continue
+
+                if not entry.expires_at:
+                    continue
+
+                if entry.expires_at > expires_at:
+                    self._push_expiry(entry)
+                    continue
+
+                self._delete(entry.key)
+                deleted.append(entry.key)
 
             # Collect keys deleted by .get operations
             self._expired_on_op[:] = []
@@ -33,6 +33,7 @@ logger = getLogger('zato')
 # ################################################################################################################################
 
 DATA_FORMAT_DICT:str = DATA_FORMAT.DICT
+stream_data_formats:tuple = (DATA_FORMAT.JSON, DATA_FORMAT.CSV)
 _not_given:object = object()
 
 # ################################################################################################################################
@@ -53,6 +54,9 @@ class SimpleIOPayload:
     user_attrs_dict = cy.declare(dict, visibility='public') # type: dict
     user_attrs_list = cy.declare(list, visibility='public') # type: list
 
+    # Rows that a service produces one by one, to be serialised and sent as they are produced
+    user_attrs_stream = cy.declare(cy.object, visibility='public') # type: object
+
     # This is used by Zato internal services only
     zato_meta = cy.declare(cy.object, visibility='public') # type: object
 
@@ -66,6 +70,7 @@ class SimpleIOPayload:
         self.data_format = data_format
         self.user_attrs_dict = {}
         self.user_attrs_list = []
+        self.user_attrs_stream = None
         self.zato_meta = None
 
 # ################################################################################################################################
@@ -106,7 +111,7 @@ class SimpleIOPayload:
 
     @cy.returns(bool)
     def has_data(self):
-        return bool(self.user_attrs_dict or self.user_attrs_list)
+        return bool(self.user_attrs_dict or self.user_attrs_list or self.user_attrs_stream is not None)
 
 # ################################################################################################################################
 
@@ -196,6 +201,15 @@ class SimpleIOPayload:
             else:
                 self.user_attrs_dict.update(self._extract_payload_attrs(value))
 
+# ################################################################################################################################
+
+    def set_stream(self, rows:object):
+        """ Sets an iterable of rows, e.g. a generator, that will be serialised and sent to the client chunk by chunk,
+        rather than all at once, which lets services return more rows than they could keep in RAM.
+        """
+        self.user_attrs_stream = rows
+        self.output_repeated = True
+
 # ################################################################################################################################
 
     @cy.ccall
@@ -206,6 +220,19 @@ class SimpleIOPayload:
             if force_dict_serialisation:
                 serialize = True
 
+        # Streamed rows are serialised only as they are read, if the data format allows for it ..
+        if self.user_attrs_stream is not None:
+            if not serialize:
+                return self.user_attrs_stream
+            elif self.data_format in stream_data_formats:
+                return self.sio.get_output_stream(self.user_attrs_stream, self.data_format)
+
+            # .. and if it does not, they need to be read in full.
+            else:
+                for item in self.user_attrs_stream:
+                    self.user_attrs_list.append(self._extract_payload_attrs(item))
+                self.user_attrs_stream = None
+
         # If data format is DICT, we force serialisation to that format
         # unless overridden on input.
         value = self.user_attrs_list if self.output_repeated else self.user_attrs_dict
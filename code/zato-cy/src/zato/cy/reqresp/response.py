@@ -25,7 +25,7 @@ from lxml.objectify import ObjectifiedElement
 from sqlalchemy.util import KeyedTuple
 
 # Zato
-from zato.common.api import DATA_FORMAT, simple_types, ZATO_OK
+from zato.common.api import DATA_FORMAT, simple_types, stream_types, ZATO_OK
 from zato.common.marshal_.api import Model
 from zato.cy.reqresp.payload import SimpleIOPayload
 
@@ -46,7 +46,7 @@ logger = getLogger('zato')
 
 # ################################################################################################################################
 
-direct_payload:tuple = simple_types + (EtreeElement, ObjectifiedElement)
+direct_payload:tuple = simple_types + stream_types + (EtreeElement, ObjectifiedElement)
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -122,7 +122,8 @@ class Response:
 
     def _set_payload(self, value, _json=DATA_FORMAT.JSON):
         """ Strings, lists and tuples are assigned as-is. Dicts as well if SIO is not used. However, if SIO is used
-        the dicts are matched and transformed according to the SIO definition.
+        the dicts are matched and transformed according to the SIO definition. File-like objects and generators
+        are assigned as-is too and they are streamed to HTTP clients.
         """
         # 1)
         # This covers dict and subclasses, e.g. Bunch
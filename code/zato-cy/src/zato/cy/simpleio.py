@@ -63,6 +63,9 @@ _builtin_float = float
 _builtin_int = int
 _list_like = (list, tuple)
 
+# How many rows at a time are serialised into a single chunk of streamed output
+stream_chunk_rows:int = 1000
+
 # Default value added for backward-compatibility with SimpleIO definitions created before the rewrite in Cython.
 backward_compat_default_value = ''
 
@@ -1992,7 +1995,7 @@ class CySimpleIO:
 
 # ################################################################################################################################
 
-    def _yield_data_dicts(self, data:object, data_format:str):
+    def _yield_data_dicts(self, data:object, data_format:str, is_stream:cy.bint=False): # noqa: E252
 
         required_elems:dict = self.definition._output_required.elems_by_name
         optional_elems:dict = self.definition._output_optional.elems_by_name
@@ -2001,7 +2004,8 @@ class CySimpleIO:
         yield list(required_elems.keys())
         yield list(optional_elems.keys())
 
-        input_data:list = data if isinstance(data, (list, tuple)) else [data]
+        # Streams are iterated over as they are, without reading them into a list first
+        input_data:object = data if (is_stream or isinstance(data, (list, tuple))) else [data]
 
         # 1st item = is_required
         # 2nd item = elems dict
@@ -2093,6 +2097,101 @@ class CySimpleIO:
 
         return out
 
+# ################################################################################################################################
+
+    def _yield_output_csv_stream(self, data:object, chunk_rows:cy.int):
+
+        gen = self._yield_data_dicts(data, DATA_FORMAT_CSV, True)
+
+        # First, get the field names
+        required_field_names:list = next(gen)
+        optional_field_names:list = next(gen)
+
+        buff:StringIO = StringIO()
+        writer:DictWriter = DictWriter(
+            buff, required_field_names + optional_field_names, **self.definition._csv_config.writer_config)
+
+        if self.definition._csv_config.should_write_header:
+            writer.writeheader()
+
+        num_rows:cy.int = 0
+
+        for data_dict in gen:
+            writer.writerow(data_dict)
+            num_rows += 1
+
+            # Each chunk is returned as soon as it is complete so the buffer never holds more than one
+            if num_rows == chunk_rows:
+                yield buff.getvalue()
+                _ = buff.seek(0)
+                _ = buff.truncate()
+                num_rows = 0
+
+        out:str = buff.getvalue()
+        buff.close()
+
+        if out:
+            yield out
+
+# ################################################################################################################################
+
+    def _yield_output_json_stream(self, data:object, chunk_rows:cy.int):
+
+        encode = self.server_config.json_encoder.encode
+
+        # Rows are converted the same way as in non-streamed JSON output, i.e. to dicts that are then encoded
+        gen = self._yield_data_dicts(data, DATA_FORMAT_DICT, True)
+
+        # Ignore field names, not needed in JSON
+        next(gen)
+        next(gen)
+
+        # The output is a JSON list, possibly wrapped in a top-level element
+        if self.definition._has_response_elem:
+            prefix:str = '{%s:[' % encode(self.definition._response_elem)
+            suffix:str = ']}'
+        else:
+            prefix = '['
+            suffix = ']'
+
+        chunk:list = [prefix]
+        num_rows:cy.int = 0
+        separator:str = ''
+
+        for data_dict in gen:
+            chunk.append(separator)
+            chunk.append(encode(data_dict))
+            separator = ','
+            num_rows += 1
+
+            if num_rows == chunk_rows:
+                yield ''.join(chunk)
+                chunk = []
+                num_rows = 0
+
+        chunk.append(suffix)
+        yield ''.join(chunk)
+
+# ################################################################################################################################
+
+    def get_output_stream(self, data:object, data_format:object, chunk_rows:cy.int=stream_chunk_rows): # noqa: E252
+        """ Returns a generator of chunks of output, each with up to chunk_rows rows serialised to JSON or CSV,
+        for services that produce their rows one by one rather than returning them all at once. Each row goes through
+        the same SimpleIO elements as non-streamed output does, only when the previous chunk has been consumed.
+        """
+        # No reason to continue if no SimpleIO output is declared
+        if not (self.definition.has_output_required or self.definition.has_output_optional):
+            return ''
+
+        if data_format == DATA_FORMAT_JSON:
+            return self._yield_output_json_stream(data, chunk_rows)
+
+        elif data_format == DATA_FORMAT_CSV:
+            return self._yield_output_csv_stream(data, chunk_rows)
+
+        else:
+            raise ValueError('Output data format `{}` cannot be streamed'.format(data_format))
+
 # ################################################################################################################################
 
     @cy.returns(object)
@@ -39,6 +39,25 @@ unused_marker = 'unused'
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# ################################################################################################################################
+
+# What a match target's HTTP Accept header is when any value is allowed, i.e. */* before it was turned into a pattern
+_accept_any = '{}HTTP_SEP{}'.format(http_any_internal, http_any_internal)
+
+# Pieces of match targets that the routing index understands - everything else is matched through regular expressions
+_index_method_re = re_compile(r'^[A-Z]+$')
+_index_method_group_re = re_compile(r'^\(([A-Z]+\|)*[A-Z]+\)$')
+_index_literal_re = re_compile(r'^[\w\-~ ,;=@!%&<>#]*$', stdlib_re.UNICODE)
+_index_param_re = re_compile(r'^\{(\w+)\}$', stdlib_re.UNICODE)
+
+# The same characters that Matcher accepts in path parameters, without and with slashes
+_index_segment_value_re = re_compile(r'^[\w \$.\-:|=~^]+$', stdlib_re.UNICODE)
+
+# Node kinds in the routing index
+_route_kind_static = 'static'
+_route_kind_segment = 'segment'
+_route_kind_path = 'path'
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -132,11 +151,111 @@ cdef class Matcher:
 # ################################################################################################################################
 # ################################################################################################################################
 
-cdef class CyURLData:
+cdef class RouteEntry:
+    """ A single HTTP channel as it is known to the routing index. The channel's item is turned into a Bunch once,
+    when the channel is indexed, and the same Bunch is returned to all the requests that match the channel.
+    It must not be modified by callers.
+    """
+    cdef:
+        public dict item
+        public object item_bunch
+        public tuple priority
+        public list group_names
+        public list methods
+        public list parts
+        public object accept
+        public bint is_internal
+
+    def __init__(self, dict item, tuple priority, list methods, object accept, list parts):
+        self.item = item
+        self.item_bunch = bunchify(item)
+        self.priority = priority
+        self.methods = methods
+        self.accept = accept
+        self.parts = parts
+        self.group_names = [value for (kind, value) in parts if kind != _route_kind_static]
+        self.is_internal = item['match_target_compiled'].is_internal
+
+    def __str__(self):
+        return '<{} at {} {}>'.format(self.__class__.__name__, hex(id(self)), self.item.get('match_target'))
+
+    __repr__ = __str__
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+cdef class RouteNode:
+    """ A node in the routing index - each node corresponds to one segment of a URL path. Static segments are looked up
+    by their exact value whereas path parameters are kept in two dedicated children, one for parameters that are confined
+    to a single segment and one for those that may span several segments because their channels match slashes too.
+    """
+    cdef:
+        public dict static_children
+        public RouteNode segment_child
+        public RouteNode path_child
+        public list entries
+
+    def __init__(self):
+        self.static_children = {}
+        self.segment_child = None
+        self.path_child = None
+        self.entries = []
+
+# ################################################################################################################################
+
+    cdef RouteNode get_child(self, unicode kind, unicode value, bint needs_create):
 
+        cdef RouteNode child
+
+        if kind == _route_kind_static:
+            child = self.static_children.get(value)
+            if child is None and needs_create:
+                child = self.static_children[value] = RouteNode()
+
+        elif kind == _route_kind_segment:
+            child = self.segment_child
+            if child is None and needs_create:
+                child = self.segment_child = RouteNode()
+
+        else:
+            child = self.path_child
+            if child is None and needs_create:
+                child = self.path_child = RouteNode()
+
+        return child
+
+# ################################################################################################################################
+
+    cdef bint is_empty(self):
+        return not (self.entries or self.static_children or self.segment_child is not None or self.path_child is not None)
+
+# ################################################################################################################################
+
+    cdef remove_child(self, unicode kind, unicode value):
+        if kind == _route_kind_static:
+            del self.static_children[value]
+        elif kind == _route_kind_segment:
+            self.segment_child = None
+        else:
+            self.path_child = None
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+cdef class CyURLData:
+    """ Matches URL paths of incoming requests against HTTP channels. Channels whose match targets consist of static
+    segments and of whole-segment path parameters are kept in a per-HTTP method routing index, i.e. a trie of URL path
+    segments, whereas all the other ones are matched one by one with their regular expressions, as previously.
+    Either way, if more than one channel matches, the one that is first in the sorted channel_data list wins.
+    """
     cdef:
         public list channel_data
         public dict url_path_cache
+        public dict url_target_cache
+        public dict route_roots
+        public list route_fallback
+        dict _route_entries
+        object _route_seq
         bint has_trace1
 
     def __init__(self, channel_data=None):
@@ -144,29 +263,246 @@ cdef class CyURLData:
         self.url_path_cache = {}
         self.url_target_cache = {}
         self.has_trace1 = logger.isEnabledFor(TRACE1)
+        self.rebuild_index()
 
 # ################################################################################################################################
 
     cpdef _remove_from_cache(self, unicode match_target):
 
-        targets_to_remove = []
-        cached_targets = self.url_path_cache.keys()
+        cdef list matchers = []
+        cdef list targets_to_remove = []
 
-        for target in cached_targets:
-            for item in self.channel_data:
-                matcher = item['match_target_compiled']
-                if matcher.pattern == match_target:
-                    if matcher.match(target) is not None:
-                        targets_to_remove.append(target)
+        for item in self.channel_data:
+            matcher = item['match_target_compiled']
+            if matcher.pattern == match_target:
+                matchers.append(matcher)
+
+        if not matchers:
+            return
+
+        for target in self.url_path_cache:
+            for matcher in matchers:
+                if matcher.match(target) is not None:
+                    targets_to_remove.append(target)
+                    break
 
         for target in targets_to_remove:
             del self.url_path_cache[target]
 
+# ################################################################################################################################
+
+    cpdef rebuild_index(self):
+        """ Builds the routing index from scratch, out of all the channels currently in channel_data.
+        """
+        self.route_roots = {}
+        self.route_fallback = []
+        self._route_entries = {}
+        self._route_seq = 0
+
+        for item in (self.channel_data or []):
+            self.index_channel(item)
+
+# ################################################################################################################################
+
+    cdef tuple _get_index_parts(self, unicode match_target):
+        """ Returns HTTP methods, an HTTP Accept header and a list of path segments for a match target
+        that can be kept in the routing index, or None if the target needs to be matched with its regular expression.
+        """
+        cdef list methods
+        cdef list parts = []
+        cdef object accept
+
+        target_elems = match_target.split(target_separator, 3)
+        if len(target_elems) != 4:
+            return None
+
+        soap_action, method, http_accept, url_path = target_elems
+
+        # SOAP actions are never matched by path, only by the full pattern
+        if soap_action:
+            return None
+
+        # A specific HTTP method ..
+        if _index_method_re.match(method):
+            methods = [method]
+
+        # .. or a group of them that are all allowed ..
+        elif _index_method_group_re.match(method):
+            methods = method[1:-1].split('|')
+
+        # .. or possibly a pattern that we do not index.
+        else:
+            return None
+
+        if http_accept == _accept_any:
+            accept = None
+        elif _index_literal_re.match(http_accept):
+            accept = http_accept
+        else:
+            return None
+
+        for segment in url_path.split('/'):
+            param_match = _index_param_re.match(segment)
+            if param_match:
+                parts.append([None, param_match.group(1)])
+            elif _index_literal_re.match(segment):
+                parts.append([_route_kind_static, segment])
+            else:
+                return None
+
+        return methods, accept, parts
+
+# ################################################################################################################################
+
+    cpdef index_channel(self, dict item):
+        """ Adds a new channel to the routing index.
+        """
+        cdef RouteEntry entry
+        cdef RouteNode node
+        cdef unicode param_kind
+        cdef tuple index_parts
+
+        self._route_seq += 1
+        priority = (bool(item.get('is_internal')), item.get('name') or '', self._route_seq)
+
+        index_parts = self._get_index_parts(item['match_target'])
+
+        # This target cannot be indexed so it will be matched through its regular expression
+        if index_parts is None:
+            self.route_fallback.append((priority, item, bunchify(item)))
+            self.route_fallback.sort(key=itemgetter(0))
+            self._route_entries[id(item)] = None
+            return
+
+        methods, accept, parts = index_parts
+
+        # Path parameters may span several segments if a channel matches slashes too
+        param_kind = _route_kind_path if item.get('match_slash') else _route_kind_segment
+        for part in parts:
+            if part[0] is None:
+                part[0] = param_kind
+
+        parts = [tuple(part) for part in parts]
+        entry = RouteEntry(item, priority, methods, accept, parts)
+
+        for method in methods:
+            node = self.route_roots.get(method)
+            if node is None:
+                node = self.route_roots[method] = RouteNode()
+
+            for kind, value in parts:
+                node = node.get_child(kind, value, True)
+
+            node.entries.append(entry)
+
+        self._route_entries[id(item)] = entry
+
+# ################################################################################################################################
+
+    cdef bint _unindex_entry(self, RouteNode node, list parts, Py_ssize_t idx, RouteEntry entry):
+        """ Removes an entry from the subtree that starts in a given node, along with all the nodes
+        that are empty afterwards. Returns True if the node itself is empty.
+        """
+        cdef RouteNode child
+
+        if idx == len(parts):
+            if entry in node.entries:
+                node.entries.remove(entry)
+        else:
+            kind, value = parts[idx]
+            child = node.get_child(kind, value, False)
+            if child is not None:
+                if self._unindex_entry(child, parts, idx + 1, entry):
+                    node.remove_child(kind, value)
+
+        return node.is_empty()
+
+# ################################################################################################################################
+
+    cpdef unindex_channel(self, dict item):
+        """ Removes a channel from the routing index.
+        """
+        cdef RouteEntry entry
+
+        try:
+            entry = self._route_entries.pop(id(item))
+        except KeyError:
+            return
+
+        # The target was not in the index
+        if entry is None:
+            for idx, fallback in enumerate(self.route_fallback):
+                if fallback[1] is item:
+                    del self.route_fallback[idx]
+                    break
+            return
+
+        for method in entry.methods:
+            node = self.route_roots.get(method)
+            if node is not None:
+                if self._unindex_entry(node, entry.parts, 0, entry):
+                    del self.route_roots[method]
+
+# ################################################################################################################################
+
+    cdef _find_route(self, RouteNode node, list segments, Py_ssize_t idx, list captures, unicode http_accept,
+        bint needs_user, list best):
+        """ Walks the routing index depth-first, looking for the channel with the highest priority
+        that matches the remaining segments of a URL path. The result is stored in the 'best' list.
+        Parameters spanning multiple segments are greedy, as they are in Matcher's regular expressions,
+        hence the longest values are tried first.
+        """
+        cdef RouteEntry entry
+        cdef RouteNode child
+        cdef Py_ssize_t len_segments = len(segments)
+        cdef Py_ssize_t end
+        cdef unicode segment
+
+        if idx == len_segments:
+            for entry in node.entries:
+                if needs_user and entry.is_internal:
+                    continue
+                if entry.accept is not None and entry.accept != http_accept:
+                    continue
+                if (not best) or entry.priority < best[0]:
+                    best[:] = [entry.priority, entry, list(captures)]
+            return
+
+        segment = segments[idx]
+
+        child = node.static_children.get(segment)
+        if child is not None:
+            self._find_route(child, segments, idx + 1, captures, http_accept, needs_user, best)
+
+        child = node.segment_child
+        if child is not None:
+            if _index_segment_value_re.match(segment):
+                captures.append(segment)
+                self._find_route(child, segments, idx + 1, captures, http_accept, needs_user, best)
+                captures.pop()
+
+        child = node.path_child
+        if child is not None:
+
+            # Find how far the parameter can reach - empty segments are allowed
+            # inside of its value as long as the value as a whole is not empty.
+            end = idx
+            while end < len_segments:
+                if segments[end] and not _index_segment_value_re.match(segments[end]):
+                    break
+                end += 1
+
+            while end > idx:
+                if end - idx > 1 or segments[idx]:
+                    captures.append('/'.join(segments[idx:end]))
+                    self._find_route(child, segments, end, captures, http_accept, needs_user, best)
+                    captures.pop()
+                end -= 1
+
 # ################################################################################################################################
 
     cpdef tuple match(self, unicode url_path, unicode http_method, unicode http_accept,
-        unicode sep=target_separator, _bunchify=bunchify, _log_trace1=logger.log,
-        _trace1=TRACE1):
+        unicode sep=target_separator, _log_trace1=logger.log, _trace1=TRACE1):
         """ Attemps to match the combination of SOAPt Action and URL path against
         the list of HTTP channel targets.
         """
@@ -174,6 +510,10 @@ cdef class CyURLData:
         cdef Matcher matcher
         cdef dict item
         cdef object item_bunch
+        cdef RouteEntry entry
+        cdef RouteNode root
+        cdef list best = []
+        cdef bint is_static
 
         cdef unicode target = ''
         target += '' # This used to be a SOAP action, now it is always an empty string
@@ -196,7 +536,17 @@ cdef class CyURLData:
         except KeyError:
             needs_user = not url_path.startswith('/zato')
 
-            for item in self.channel_data:
+            # Look up the index first ..
+            root = self.route_roots.get(http_method)
+            if root is not None:
+                self._find_route(root, url_path.split('/'), 0, [], http_accept, needs_user, best)
+
+            # .. and now check the targets that are not indexed, but only those that would be sorted before
+            # what we possibly already have from the index. They are already sorted by priority.
+            for priority, item, item_bunch in self.route_fallback:
+
+                if best and priority > best[0]:
+                    break
 
                 matcher = item['match_target_compiled']
                 if needs_user and matcher.is_internal:
@@ -208,14 +558,26 @@ cdef class CyURLData:
                     if self.has_trace1:
                         _log_trace1(_trace1, 'Matched target:`%s` with:`%r`', target, item)
 
-                    item_bunch = _bunchify(item)
-
                     # Cache that target but only if it's a static URL without dynamic variables
                     if (not has_target_in_cache) and matcher.is_static:
                         self.url_path_cache[target] = item_bunch
 
                     return match, item_bunch
 
+            if best:
+                entry = best[1]
+
+                if self.has_trace1:
+                    _log_trace1(_trace1, 'Matched target:`%s` with:`%r`', target, entry.item)
+
+                is_static = not entry.group_names
+
+                # Cache that target but only if it's a static URL without dynamic variables
+                if (not has_target_in_cache) and is_static:
+                    self.url_path_cache[target] = entry.item_bunch
+
+                return dict(zip(entry.group_names, best[2])), entry.item_bunch
+
             return None, None
 
 # ################################################################################################################################
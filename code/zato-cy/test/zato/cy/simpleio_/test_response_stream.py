@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from unittest import main
+
+# Zato
+from zato.common.api import DATA_FORMAT, stream_types
+from zato.common.json_internal import loads as json_loads
+from zato.common.test import BaseSIOTestCase
+from zato.server.service import Service
+
+# Zato - Cython
+from zato.cy.reqresp.payload import SimpleIOPayload
+from zato.cy.reqresp.response import Response
+from zato.simpleio import CySimpleIO, Int, SerialisationError
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class StreamResponse(BaseSIOTestCase):
+
+    def _get_service_class(self, response_elem=None):
+
+        class MyService(Service):
+            class SimpleIO:
+                output = 'aaa', Int('bbb'), '-ccc'
+                csv_delimiter = ';'
+
+        if response_elem:
+            MyService.SimpleIO.response_elem = response_elem
+
+        CySimpleIO.attach_sio(None, self.get_server_config(), MyService)
+
+        return MyService
+
+# ################################################################################################################################
+
+    def _get_rows(self, num_rows, produced):
+        for idx in range(num_rows):
+            produced.append(idx)
+            yield {'aaa': 'aaa-{}'.format(idx), 'bbb': str(idx), 'zzz': 'not-in-output'}
+
+# ################################################################################################################################
+
+    def test_response_json(self):
+
+        MyService = self._get_service_class()
+
+        produced = []
+        chunks = MyService._sio.get_output_stream(self._get_rows(5, produced), DATA_FORMAT.JSON, 2)
+
+        # Nothing is produced until the first chunk is needed ..
+        self.assertListEqual(produced, [])
+
+        # .. and then, only as many rows as a chunk needs.
+        _ = next(chunks)
+        self.assertListEqual(produced, [0, 1])
+
+        rest = list(chunks)
+        self.assertEqual(len(rest), 2)
+        self.assertListEqual(produced, [0, 1, 2, 3, 4])
+
+        data = MyService._sio.get_output_stream(self._get_rows(5, []), DATA_FORMAT.JSON, 2)
+        json_data = json_loads(''.join(data))
+
+        self.assertEqual(len(json_data), 5)
+        self.assertDictEqual(json_data[0], {'aaa': 'aaa-0', 'bbb': 0})
+        self.assertDictEqual(json_data[4], {'aaa': 'aaa-4', 'bbb': 4})
+
+# ################################################################################################################################
+
+    def test_response_json_with_response_elem(self):
+
+        MyService = self._get_service_class('my_response_elem')
+
+        data = MyService._sio.get_output_stream(self._get_rows(3, []), DATA_FORMAT.JSON)
+        json_data = json_loads(''.join(data))
+
+        self.assertListEqual(list(json_data), ['my_response_elem'])
+        self.assertEqual(len(json_data['my_response_elem']), 3)
+
+# ################################################################################################################################
+
+    def test_response_json_empty(self):
+
+        MyService = self._get_service_class()
+
+        data = MyService._sio.get_output_stream(iter([]), DATA_FORMAT.JSON)
+        self.assertEqual(''.join(data), '[]')
+
+# ################################################################################################################################
+
+    def test_response_csv(self):
+
+        MyService = self._get_service_class()
+
+        chunks = list(MyService._sio.get_output_stream(self._get_rows(5, []), DATA_FORMAT.CSV, 2))
+        self.assertEqual(len(chunks), 3)
+
+        lines = ''.join(chunks).splitlines()
+
+        self.assertListEqual(lines, [
+            'aaa;bbb;ccc',
+            'aaa-0;0;',
+            'aaa-1;1;',
+            'aaa-2;2;',
+            'aaa-3;3;',
+            'aaa-4;4;',
+        ])
+
+# ################################################################################################################################
+
+    def test_response_invalid_input(self):
+
+        MyService = self._get_service_class()
+
+        chunks = MyService._sio.get_output_stream(iter([{'aaa': 'aaa', 'bbb': 'not-an-int'}]), DATA_FORMAT.JSON)
+
+        with self.assertRaises(SerialisationError):
+            _ = list(chunks)
+
+        with self.assertRaises(ValueError):
+            _ = MyService._sio.get_output_stream(iter([]), 'invalid')
+
+# ################################################################################################################################
+
+    def test_payload_set_stream(self):
+
+        MyService = self._get_service_class()
+        sio = MyService._sio
+
+        # JSON is streamed ..
+        payload = SimpleIOPayload(sio, sio.definition.all_output_elem_names, 'cid', DATA_FORMAT.JSON)
+        payload.set_stream(self._get_rows(3, []))
+
+        self.assertTrue(payload.has_data())
+
+        value = payload.getvalue()
+        self.assertIsInstance(value, stream_types)
+        self.assertEqual(len(json_loads(''.join(value))), 3)
+
+        # .. whereas dicts are not.
+        payload = SimpleIOPayload(sio, sio.definition.all_output_elem_names, 'cid', DATA_FORMAT.DICT)
+        payload.set_stream(self._get_rows(3, []))
+
+        value = payload.getvalue()
+        self.assertListEqual(value, [
+            {'aaa': 'aaa-0', 'bbb': 0},
+            {'aaa': 'aaa-1', 'bbb': 1},
+            {'aaa': 'aaa-2', 'bbb': 2},
+        ])
+
+# ################################################################################################################################
+
+    def test_response_keeps_stream(self):
+
+        MyService = self._get_service_class()
+
+        response = Response()
+        response.init('cid', MyService._sio, DATA_FORMAT.JSON)
+        response.payload.set_stream(self._get_rows(3, []))
+
+        # This is what HTTP channels do with SimpleIO responses, which means that they will send the output chunk by chunk
+        response.payload = response.payload.getvalue()
+        self.assertIsInstance(response.payload, stream_types)
+
+        self.assertEqual(len(json_loads(''.join(response.payload))), 3)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -474,6 +474,132 @@ class CacheTestCace(TestCase):
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_positions_after_many_operations(self):
+
+        # This is more than the initial number of recency stamps so they will be renumbered a few times
+        max_size = 700
+        iters = 5000
+
+        c = Cache(max_size)
+        expected = []
+
+        for idx in range(iters):
+
+            # Add a new key or read an older one ..
+            if (idx % 3) or (not expected):
+                key = 'key{}'.format(idx)
+                c.set(key, idx, 0.0, None)
+                if len(expected) == max_size:
+                    expected.pop()
+            else:
+                key = expected[idx % len(expected)]
+                c.get(key, None, False)
+                expected.remove(key)
+
+            # .. either way, the key is now the most recently used one.
+            expected.insert(0, key)
+
+        self.assertListEqual(c.keys_by_position(), expected)
+
+        for position, key in enumerate(expected):
+            self.assertEqual(c.index(key), position)
+
+        for position, item in enumerate(c.get_slice(10, 20, 2)):
+            self.assertEqual(item['key'], expected[10 + position * 2])
+            self.assertEqual(item['position'], 10 + position * 2)
+
+# ################################################################################################################################
+
+    def test_delete_expired_heap(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+        key3, expected3 = 'key3', 'value3'
+        key4, expected4 = 'key4', 'value4'
+
+        c = Cache()
+        c.set(key1, expected1, 0.01, None) # This one expires ..
+        c.set(key2, expected2, 0.01, None) # .. this one has its expiry extended ..
+        c.set(key3, expected3, 0.0, None)  # .. this one never expires ..
+        c.set(key4, expected4, 10.0, None) # .. and this one is replaced with a shorter expiry time.
+
+        c.delete(key4)
+        c.set(key4, expected4, 0.01, None)
+
+        c.set_expiration_data(key2, 1000.0, c.get_timestamp() + 1000.0)
+        sleep(0.02)
+
+        deleted = c.delete_expired()
+
+        self.assertEqual(sorted(deleted), [key1, key4])
+        self.assertEqual(sorted(c.keys()), [key2, key3])
+        self.assertListEqual(c.keys_by_position(), [key3, key2])
+
+# ################################################################################################################################
+
+    def _fill_key_index_caches(self):
+
+        with_index = Cache(has_key_index=True)
+        no_index = Cache()
+
+        for c in (with_index, no_index):
+            for idx in range(100):
+                c.set('customer:{}:name'.format(idx), idx, 0.0, None)
+                c.set('customer:{}:address'.format(idx), idx, 0.0, None)
+                c.set('order:{}:name'.format(idx), idx, 0.0, None)
+            c.set(123, 'not-a-string', 0.0, None)
+
+        return with_index, no_index
+
+# ################################################################################################################################
+
+    def test_key_index_get(self):
+
+        with_index, no_index = self._fill_key_index_caches()
+
+        for data in ('customer:1', 'customer:12:', 'order:', 'zzz', ''):
+            self.assertDictEqual(with_index.get_by_prefix(data, False, 0), no_index.get_by_prefix(data, False, 0))
+
+        for data in (':name', '9:address', 'zzz'):
+            self.assertDictEqual(with_index.get_by_suffix(data, False, 0), no_index.get_by_suffix(data, False, 0))
+
+        self.assertEqual(len(with_index.get_by_prefix('customer:', False, 10)), 10)
+        self.assertEqual(len(with_index.get_by_suffix(':name', False, 10)), 10)
+
+# ################################################################################################################################
+
+    def test_key_index_set_delete_expire(self):
+
+        with_index, no_index = self._fill_key_index_caches()
+
+        for c in (with_index, no_index):
+            c.set_by_prefix('order:1', 'new-value', 0.0, False, None, False, 0)
+            c.delete_by_suffix(':address', False, 0)
+            c.expire_by_prefix('customer:5', 0.01, 0)
+
+        sleep(0.02)
+
+        for c in (with_index, no_index):
+            c.delete_expired()
+
+        self.assertListEqual(sorted(with_index.keys(), key=str), sorted(no_index.keys(), key=str))
+        self.assertDictEqual(with_index.get_by_prefix('order:1', False, 0), no_index.get_by_prefix('order:1', False, 0))
+        self.assertDictEqual(with_index.get_by_prefix('customer:', False, 0), no_index.get_by_prefix('customer:', False, 0))
+
+        # The key index reflects what is left in the cache
+        expected = sorted(key for key in with_index.keys() if isinstance(key, str))
+        self.assertListEqual(list(with_index._key_index), expected)
+        self.assertListEqual(sorted(key[::-1] for key in with_index._key_index_rev), expected)
+
+        # Keys evicted are removed from the index too
+        small = Cache(2, has_key_index=True)
+        small.set('key1', 1, 0.0, None)
+        small.set('key2', 2, 0.0, None)
+        small.set('key3', 3, 0.0, None)
+        self.assertListEqual(list(small._key_index), ['key2', 'key3'])
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
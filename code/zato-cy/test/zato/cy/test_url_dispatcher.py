@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from operator import itemgetter
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.common.util.url_dispatcher import get_match_target
+from zato.url_dispatcher import CyURLData, Matcher
+
+# ################################################################################################################################
+
+http_methods_allowed_re = '(DELETE|GET|PATCH|POST|PUT)'
+accept_any = 'haanyHTTP_SEPhaany'
+
+# ################################################################################################################################
+
+def get_channel(name, url_path, method='', http_accept='', match_slash=True, is_internal=False):
+
+    item = {
+        'name': name,
+        'url_path': url_path,
+        'method': method,
+        'http_accept': http_accept,
+        'soap_action': '',
+        'match_slash': match_slash,
+        'is_internal': is_internal,
+    }
+
+    item['match_target'] = get_match_target(item, http_methods_allowed_re=http_methods_allowed_re)
+    item['match_target_compiled'] = Matcher(item['match_target'], match_slash)
+
+    return item
+
+# ################################################################################################################################
+
+def linear_match(channel_data, url_path, http_method, http_accept=accept_any):
+    """ Matches a URL path the way it was done before the routing index was added.
+    """
+    target = ':::{}:::{}:::{}'.format(http_method, http_accept, url_path)
+    needs_user = not url_path.startswith('/zato')
+
+    for item in sorted(channel_data, key=lambda item: (bool(item['is_internal']), item['name'])):
+        matcher = item['match_target_compiled']
+        if needs_user and matcher.is_internal:
+            continue
+        match = matcher.match(target)
+        if match is not None:
+            return match, item['name']
+
+    return None, None
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class URLDispatcherTestCase(TestCase):
+
+    def get_channel_data(self):
+        return [
+            get_channel('a.static', '/api/customer/list'),
+            get_channel('b.param', '/api/customer/{customer_id}'),
+            get_channel('c.param.get', '/api/customer/{customer_id}/order/{order_id}', method='GET'),
+            get_channel('d.param.post', '/api/customer/{customer_id}/order/{order_id}', method='POST'),
+            get_channel('e.no.slash', '/api/file/{name}', match_slash=False),
+            get_channel('f.slash', '/api/path/{name}/info'),
+            get_channel('g.accept', '/api/accept/{name}', http_accept='application/json'),
+            get_channel('h.regex', '/api/v1.0/item/{item_id}'),
+            get_channel('i.internal', '/zato/api/invoke/{service}', is_internal=True),
+            get_channel('j.trailing', '/api/trailing/{name}/'),
+        ]
+
+# ################################################################################################################################
+
+    def assert_same(self, url_data, channel_data, url_path, http_method, http_accept=accept_any):
+        # type: (CyURLData, list, str, str, str) -> None
+
+        expected_match, expected_name = linear_match(channel_data, url_path, http_method, http_accept)
+        match, channel_item = url_data.match(url_path, http_method, http_accept)
+
+        self.assertEqual(match, expected_match, url_path)
+        self.assertEqual(channel_item['name'] if channel_item else None, expected_name, url_path)
+
+# ################################################################################################################################
+
+    def test_match_same_as_regex(self):
+
+        channel_data = self.get_channel_data()
+        url_data = CyURLData(channel_data)
+
+        # Only the channel with a regular expression in its path is not in the index
+        self.assertListEqual([item['name'] for (_, item, _) in url_data.route_fallback], ['h.regex'])
+
+        for http_method in ('GET', 'POST', 'DELETE'):
+            for url_path in (
+                '/api/customer/list',
+                '/api/customer/123',
+                '/api/customer/123/',
+                '/api/customer/123/order/456',
+                '/api/customer/1/2/3',
+                '/api/file/abc',
+                '/api/file/abc/def',
+                '/api/path/a/info',
+                '/api/path/a/b/c/info',
+                '/api/path/a//b/info',
+                '/api/path//info',
+                '/api/accept/abc',
+                '/api/v1.0/item/123',
+                '/api/v1x0/item/123',
+                '/api/trailing/abc/',
+                '/api/trailing/abc',
+                '/zato/api/invoke/zato.ping',
+                '/api/customer/a b',
+                '/api/customer/a@b',
+                '/',
+                '',
+                '/not/found',
+            ):
+                self.assert_same(url_data, channel_data, url_path, http_method)
+                self.assert_same(url_data, channel_data, url_path, http_method, 'applicationHTTP_SEPjson')
+
+# ################################################################################################################################
+
+    def test_match_returns_prebuilt_bunch(self):
+
+        url_data = CyURLData(self.get_channel_data())
+
+        _, channel_item1 = url_data.match('/api/customer/123', 'GET', accept_any)
+        _, channel_item2 = url_data.match('/api/customer/456', 'GET', accept_any)
+
+        self.assertIs(channel_item1, channel_item2)
+        self.assertEqual(channel_item1.name, 'b.param')
+
+# ################################################################################################################################
+
+    def test_priority_follows_channel_name(self):
+
+        channel_data = [
+            get_channel('zzz', '/api/{a}/{b}'),
+            get_channel('aaa', '/api/{a}'),
+        ]
+        url_data = CyURLData(channel_data)
+
+        match, channel_item = url_data.match('/api/1/2', 'GET', accept_any)
+
+        self.assertEqual(channel_item['name'], 'aaa')
+        self.assertDictEqual(match, {'a': '1/2'})
+
+# ################################################################################################################################
+
+    def test_index_unindex_channel(self):
+
+        channel_data = self.get_channel_data()
+        url_data = CyURLData(channel_data)
+
+        # Add a new channel that takes precedence ..
+        new_item = get_channel('0.new', '/api/customer/{customer_id}/details')
+        channel_data.append(new_item)
+        url_data.index_channel(new_item)
+
+        match, channel_item = url_data.match('/api/customer/123/details', 'GET', accept_any)
+        self.assertEqual(channel_item['name'], '0.new')
+        self.assertDictEqual(match, {'customer_id': '123'})
+
+        # .. remove it and confirm the previous channel matches again ..
+        channel_data.remove(new_item)
+        url_data.unindex_channel(new_item)
+
+        match, channel_item = url_data.match('/api/customer/123/details', 'GET', accept_any)
+        self.assertEqual(channel_item['name'], 'b.param')
+        self.assertDictEqual(match, {'customer_id': '123/details'})
+
+        # .. remove all the channels, which should leave the index empty.
+        for item in sorted(channel_data, key=itemgetter('name')):
+            url_data.unindex_channel(item)
+
+        self.assertDictEqual(url_data.route_roots, {})
+        self.assertListEqual(url_data.route_fallback, [])
+
+        match, channel_item = url_data.match('/api/customer/123', 'GET', accept_any)
+        self.assertIsNone(match)
+        self.assertIsNone(channel_item)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = unittest_main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from collections import deque
+from logging import Formatter, getLogger, INFO
+from traceback import format_exc
+
+# gevent
+from gevent import spawn
+from gevent.event import Event
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from datetime import datetime, timedelta
+    from logging import Handler, Logger
+    from gevent import Greenlet
+    from zato.common.typing_ import any_, anydict, list_, tuple_
+    accesslogrecord = tuple_[str, str, timedelta, str, datetime, datetime, str, str, str, str, any_, str]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # Used to format each entry if the access logger has no handlers of its own
+    Default_Format = '%(remote_ip)s %(cid_resp_time)s "%(channel_name)s" [%(req_timestamp)s] ' \
+        '"%(method)s %(path)s %(http_version)s" %(status_code)s %(response_size)s "-" "%(user_agent)s"'
+
+    Date_Time_Format = '%d/%b/%Y:%H:%M:%S %z'
+
+    # Used in place of fields that a format needs but which access log entries do not have
+    Missing_Field = '-'
+
+    # Responses with these status codes are logged no matter what the sample rate is
+    Always_Log_Status = ('4', '5')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Overflow:
+    """ What to do when entries are produced faster than they can be written and the buffer is full.
+    """
+    Drop_Oldest = 'drop_oldest'
+    Drop_Newest = 'drop_newest'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Default:
+    buffer_size = 100_000
+    batch_size = 1000
+    flush_interval = 1
+    overflow = Overflow.Drop_Oldest
+    sample_rate = 1.0
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Fields(dict):
+    """ Access log fields that a handler's format is applied to.
+    """
+    def __missing__(self, key:'str') -> 'str':
+        return ModuleCtx.Missing_Field
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AccessLogWriter:
+    """ Writes the HTTP access log in background. Requests only append tuples of raw fields to a buffer which a greenlet
+    formats and writes in batches, each batch in a single log record, i.e. with a single write to each log file.
+    """
+    def __init__(
+        self,
+        access_logger,  # type: Logger
+        buffer_size=Default.buffer_size,       # type: int
+        batch_size=Default.batch_size,         # type: int
+        flush_interval=Default.flush_interval, # type: float
+        overflow=Default.overflow,             # type: str
+        sample_rate=Default.sample_rate,       # type: float
+    ) -> 'None':
+
+        if overflow not in (Overflow.Drop_Oldest, Overflow.Drop_Newest):
+            raise ValueError('Invalid access log overflow policy `{}`'.format(overflow))
+
+        self.access_logger = access_logger
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+
+        # Once the buffer is full, appending to it drops its oldest entries, which is what Overflow.Drop_Oldest needs
+        self.buffer = deque(maxlen=buffer_size) # type: deque[accesslogrecord]
+
+        # How many entries were not written because of overflows and how many were skipped by the sampler
+        self.num_dropped = 0
+        self.num_dropped_reported = 0
+        self.num_skipped = 0
+
+        # Each request adds the sample rate to it and the request is logged each time it reaches one
+        self.sample_credit = 0.0
+
+        # Handlers of the access logger along with the formats that they had originally
+        self.handlers = [] # type: list_[tuple_[Handler, str]]
+
+        self.batch_ready = Event()
+        self.keep_running = True
+        self.writer = None # type: Greenlet | None
+
+# ################################################################################################################################
+
+    @staticmethod
+    def from_config(access_logger:'Logger', config:'anydict') -> 'AccessLogWriter':
+        """ Returns a new writer configured through the [logging] section of server.conf.
+        """
+        # A sample rate of 0 is valid, which is why only a missing one means that the default should be used
+        sample_rate = config.get('http_access_log_sample_rate')
+        sample_rate = Default.sample_rate if sample_rate is None else float(sample_rate)
+
+        return AccessLogWriter(
+            access_logger,
+            int(config.get('http_access_log_buffer_size') or Default.buffer_size),
+            int(config.get('http_access_log_batch_size') or Default.batch_size),
+            float(config.get('http_access_log_flush_interval') or Default.flush_interval),
+            config.get('http_access_log_overflow') or Default.overflow,
+            sample_rate,
+        )
+
+# ################################################################################################################################
+
+    def start(self) -> 'None':
+
+        # Each handler is given entire batches from now on, which is why its formatter must leave them as they are ..
+        for handler in self.access_logger.handlers:
+            handler_format = getattr(handler.formatter, '_fmt', None) or ModuleCtx.Default_Format
+            self.handlers.append((handler, handler_format))
+            handler.setFormatter(Formatter('%(message)s'))
+
+        # .. and our greenlet formats individual entries.
+        self.writer = spawn(self._run)
+
+# ################################################################################################################################
+
+    def stop(self) -> 'None':
+        self.keep_running = False
+        self.batch_ready.set()
+        self.flush()
+
+# ################################################################################################################################
+
+    def push(self, record:'accesslogrecord') -> 'None':
+        """ Enqueues an entry to be written. Called for each HTTP request, which is why it does as little as possible.
+        """
+        # Unless all entries are logged, skip the ones that are not sampled, but always log errors
+        if self.sample_rate < 1.0 and record[9][:1] not in ModuleCtx.Always_Log_Status:
+            self.sample_credit += self.sample_rate
+            if self.sample_credit < 1.0:
+                self.num_skipped += 1
+                return
+            self.sample_credit -= 1.0
+
+        if len(self.buffer) == self.buffer_size:
+            self.num_dropped += 1
+            if self.overflow == Overflow.Drop_Newest:
+                return
+
+        self.buffer.append(record)
+
+        if len(self.buffer) >= self.batch_size:
+            self.batch_ready.set()
+
+# ################################################################################################################################
+
+    def _run(self) -> 'None':
+
+        while self.keep_running:
+            _ = self.batch_ready.wait(self.flush_interval)
+            self.batch_ready.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Could not write HTTP access log, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def _get_fields(self, records:'list_[accesslogrecord]') -> 'list_[_Fields]':
+        """ Turns raw entries into fields that log formats can be applied to.
+        """
+        out = [] # type: list_[_Fields]
+
+        # Entries from the same second share their timestamps, which is why we format each of them only once
+        last_utc = last_utc_formatted = last_local = last_local_formatted = None
+
+        for remote_ip, cid, resp_time, channel_name, req_ts_utc, req_ts_local, method, path, http_version, \
+            status, response_size, user_agent in records:
+
+            utc = req_ts_utc.replace(microsecond=0)
+            if utc != last_utc:
+                last_utc = utc
+                last_utc_formatted = req_ts_utc.strftime(ModuleCtx.Date_Time_Format)
+
+            local = req_ts_local.replace(microsecond=0)
+            if local != last_local:
+                last_local = local
+                last_local_formatted = req_ts_local.strftime(ModuleCtx.Date_Time_Format)
+
+            out.append(_Fields(
+                remote_ip=remote_ip,
+                cid_resp_time='%s/%s' % (cid, resp_time.total_seconds()),
+                channel_name=channel_name,
+                req_timestamp_utc=last_utc_formatted,
+                req_timestamp=last_local_formatted,
+                method=method,
+                path=path,
+                http_version=http_version,
+                status_code=status.split()[0],
+                response_size=response_size,
+                user_agent=user_agent,
+            ))
+
+        return out
+
+# ################################################################################################################################
+
+    def _write(self, fields:'list_[_Fields]') -> 'None':
+
+        # If there are any handlers, each of them may use its own format ..
+        if self.handlers:
+            for handler, handler_format in self.handlers:
+                msg = '\n'.join(handler_format % elem for elem in fields)
+                record = self.access_logger.makeRecord(self.access_logger.name, INFO, __file__, 0, msg, None, None)
+                _ = handler.handle(record)
+
+        # .. otherwise, it is up to the parent loggers to write the batch.
+        else:
+            msg = '\n'.join(ModuleCtx.Default_Format % elem for elem in fields)
+            record = self.access_logger.makeRecord(self.access_logger.name, INFO, __file__, 0, msg, None, None)
+            self.access_logger.handle(record)
+
+# ################################################################################################################################
+
+    def flush(self) -> 'None':
+        """ Writes all the buffered entries.
+        """
+        buffer = self.buffer
+        popleft = buffer.popleft
+
+        while buffer:
+            records = [popleft() for _ in range(min(self.batch_size, len(buffer)))]
+            self._write(self._get_fields(records))
+
+        if self.num_dropped != self.num_dropped_reported:
+            logger.warning('HTTP access log buffer full, dropped %d entries in total (%s)',
+                self.num_dropped, self.overflow)
+            self.num_dropped_reported = self.num_dropped
+
+# ################################################################################################################################
+# ################################################################################################################################
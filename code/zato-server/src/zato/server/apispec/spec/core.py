@@ -96,6 +96,12 @@ class Generator:
 
         for details in self.service_store_services.values():
 
+            # Services are filtered before their classes are accessed, because accessing the class of a service
+            # restored from a snapshot imports it if it has not been imported yet. Inactive services cannot be invoked
+            # so they are not documented either.
+            if not details.get('is_active', True):
+                continue
+
             _should_include = self._should_handle(details['name'], self.include)
             _should_exclude = self._should_handle(details['name'], self.exclude)
 
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from collections import deque
+from itertools import count
+from logging import getLogger
+from pickle import dumps, HIGHEST_PROTOCOL, loads
+from time import monotonic, time_ns
+from traceback import format_exc
+
+# gevent
+from gevent import getcurrent, spawn
+from gevent.event import Event
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, anydict, callable_, dict_, strlist, stranydict, strnone
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Spill_Suffix = '.task'
+    Spill_Temp_Suffix = '.tmp'
+
+    # Greenlets that currently run tasks of any pool
+    Task_Greenlets = set()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Overflow:
+    """ What a pool does with new tasks once its queue is full.
+    """
+    Reject = 'reject' # Raise an exception to the caller
+    Block = 'block'   # Make the caller wait until there is room in the queue, unless the caller is a task itself
+    Spill = 'spill'   # Write tasks to disk and read them back when there is room in the queue
+    Spawn = 'spawn'   # Run tasks immediately, in addition to the ones already running, without waiting in the queue
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Default:
+    pool_name = 'default'
+    max_concurrency = 1000
+    queue_size = 10_000
+    overflow = Overflow.Block
+    block_timeout = 30
+
+    # The default pool is used by all the Service.invoke_async calls that do not have a pool of their own,
+    # so it never makes its callers wait.
+    default_pool_overflow = Overflow.Spawn
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AsyncPoolFull(Exception):
+    """ Raised when a pool cannot accept a task.
+    """
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Task:
+    """ A task waiting in a queue for its turn to run.
+    """
+    __slots__ = ('func', 'args', 'enqueued_at')
+
+    def __init__(self, func:'callable_', args:'any_', enqueued_at:'float') -> 'None':
+        self.func = func
+        self.args = args
+        self.enqueued_at = enqueued_at
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AsyncPool:
+    """ Runs at most max_concurrency tasks at a time, each in a greenlet of its own. Tasks that cannot run immediately
+    wait in a queue of up to queue_size elements and what happens when that queue is full depends on the overflow policy.
+    """
+    def __init__(
+        self,
+        name,        # type: str
+        resume_func, # type: callable_ | None
+        max_concurrency=Default.max_concurrency, # type: int
+        queue_size=Default.queue_size,           # type: int
+        overflow=Default.overflow,               # type: str
+        block_timeout=Default.block_timeout,     # type: float
+        spill_dir=None,                          # type: strnone
+    ) -> 'None':
+
+        if overflow not in (Overflow.Reject, Overflow.Block, Overflow.Spill, Overflow.Spawn):
+            raise ValueError('Invalid overflow policy `{}` in async pool `{}`'.format(overflow, name))
+
+        if overflow == Overflow.Spill and not (spill_dir and resume_func):
+            raise ValueError('Async pool `{}` needs a directory and a function to resume tasks to spill them'.format(name))
+
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        # Tasks read back from disk are run by this function because the objects they were submitted with are gone
+        self.resume_func = resume_func
+
+        self.queue = deque() # type: deque[_Task]
+        self.num_running = 0
+
+        # Set each time a task leaves the queue, which wakes up callers that wait for room in it
+        self.has_room = Event()
+
+        # Paths to spilled tasks, oldest first
+        self.spill_dir = spill_dir
+        self.spilled = deque() # type: deque[str]
+        self.spill_idx = count()
+
+        # Metrics
+        self.num_submitted = 0
+        self.num_completed = 0
+        self.num_failed = 0
+        self.num_rejected = 0
+        self.num_blocked = 0
+        self.num_spilled = 0
+        self.num_spawned = 0
+        self.queue_max_depth = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.num_waited = 0
+
+        if self.spill_dir:
+            self._load_spilled()
+
+# ################################################################################################################################
+
+    def _load_spilled(self) -> 'None':
+        """ Finds tasks spilled by a previous process and schedules them to run once there is room for them.
+        """
+        os.makedirs(self.spill_dir, exist_ok=True) # type: ignore
+
+        for name in sorted(os.listdir(self.spill_dir)): # type: ignore
+            path = os.path.join(self.spill_dir, name) # type: ignore
+            if name.endswith(ModuleCtx.Spill_Suffix):
+                self.spilled.append(path)
+            elif name.endswith(ModuleCtx.Spill_Temp_Suffix):
+                os.remove(path)
+
+        if self.spilled:
+            logger.info('Async pool `%s` found %d spilled task(s) in %s', self.name, len(self.spilled), self.spill_dir)
+            self._refill()
+
+# ################################################################################################################################
+
+    def submit(self, func:'callable_', *args:'any_') -> 'None':
+        """ Runs func(*args) in background, as soon as the pool lets it.
+        """
+        self.num_submitted += 1
+
+        # If we can run the task immediately, do it ..
+        if self.num_running < self.max_concurrency and not self.queue and not self.spilled:
+            self._start(func, args, 0.0)
+            return
+
+        # .. otherwise, it needs to wait, but first, there must be room for it, and if anything is spilled already,
+        # .. new tasks need to be spilled too, to keep them in order ..
+        if len(self.queue) >= self.queue_size or (self.spilled and self.overflow == Overflow.Spill):
+
+            if self.overflow == Overflow.Reject:
+                self.num_rejected += 1
+                raise AsyncPoolFull('Async pool `{}` is full ({} running, {} queued)'.format(
+                    self.name, self.num_running, len(self.queue)))
+
+            elif self.overflow == Overflow.Spill:
+                self._spill(args)
+                return
+
+            elif self.overflow == Overflow.Spawn:
+                self.num_spawned += 1
+                self._start(func, args, 0.0)
+                return
+
+            else:
+                self._wait_for_room()
+
+        # .. and now that there is, the task can wait for its turn ..
+        self.queue.append(_Task(func, args, monotonic()))
+        self.queue_max_depth = max(self.queue_max_depth, len(self.queue))
+
+        # .. unless we waited for room in the queue and, in the meantime, all the running tasks completed.
+        if self.num_running < self.max_concurrency:
+            self._start_queued()
+
+# ################################################################################################################################
+
+    def _wait_for_room(self) -> 'None':
+
+        # A task that waited for room in a queue would keep its own pool's slot, possibly until the very room it waits for
+        # could only be made by itself, which is why tasks are rejected rather than made to wait.
+        if getcurrent() in ModuleCtx.Task_Greenlets:
+            self.num_rejected += 1
+            raise AsyncPoolFull('Async pool `{}` is full and a task cannot wait for room in it ({} running, {} queued)'.format(
+                self.name, self.num_running, len(self.queue)))
+
+        self.num_blocked += 1
+        deadline = monotonic() + self.block_timeout
+
+        while len(self.queue) >= self.queue_size:
+            remaining = deadline - monotonic()
+
+            if remaining <= 0:
+                self.num_rejected += 1
+                raise AsyncPoolFull('Async pool `{}` is still full after {}s'.format(self.name, self.block_timeout))
+
+            self.has_room.clear()
+            _ = self.has_room.wait(remaining)
+
+# ################################################################################################################################
+
+    def _spill(self, args:'any_') -> 'None':
+        """ Writes a task to disk, to be read back once there is room for it in the queue.
+        """
+        # Names sort in the same order that the tasks were spilled in
+        name = '{:020d}-{:010d}'.format(time_ns(), next(self.spill_idx))
+        path = os.path.join(self.spill_dir, name + ModuleCtx.Spill_Suffix) # type: ignore
+        temp_path = path + ModuleCtx.Spill_Temp_Suffix
+
+        try:
+            data = dumps(args, protocol=HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.num_rejected += 1
+            raise AsyncPoolFull('Async pool `{}` is full and the task could not be spilled, e:`{}`'.format(self.name, e))
+
+        with open(temp_path, 'wb') as f:
+            _ = f.write(data)
+
+        os.replace(temp_path, path)
+
+        self.spilled.append(path)
+        self.num_spilled += 1
+
+# ################################################################################################################################
+
+    def _refill(self) -> 'None':
+        """ Moves spilled tasks back to the queue, as many of them as there is room for.
+        """
+        while self.spilled and len(self.queue) < self.queue_size:
+            path = self.spilled.popleft()
+
+            try:
+                with open(path, 'rb') as f:
+                    args = loads(f.read())
+                os.remove(path)
+            except Exception:
+                logger.warning('Could not read spilled task from `%s` in async pool `%s`, e:`%s`', path, self.name, format_exc())
+                continue
+
+            # Spilled tasks do not count towards wait time because they are not in the queue yet
+            self.queue.append(_Task(self.resume_func, args, monotonic())) # type: ignore
+
+        # Possibly, there is room to run some of them immediately
+        self._start_queued()
+
+# ################################################################################################################################
+
+    def _start(self, func:'callable_', args:'any_', wait_time:'float') -> 'None':
+
+        self.num_running += 1
+
+        if wait_time:
+            self.num_waited += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+        _ = spawn(self._run, func, args)
+
+# ################################################################################################################################
+
+    def _start_queued(self) -> 'None':
+
+        while self.queue and self.num_running < self.max_concurrency:
+            task = self.queue.popleft()
+            self._start(task.func, task.args, monotonic() - task.enqueued_at)
+            self.has_room.set()
+
+# ################################################################################################################################
+
+    def _run(self, func:'callable_', args:'any_') -> 'None':
+
+        current = getcurrent()
+        ModuleCtx.Task_Greenlets.add(current)
+
+        try:
+            func(*args)
+        except Exception:
+            self.num_failed += 1
+            logger.warning('Exception in async pool `%s`, e:`%s`', self.name, format_exc())
+        else:
+            self.num_completed += 1
+        finally:
+            ModuleCtx.Task_Greenlets.discard(current)
+            self.num_running -= 1
+
+            # There is room for one more task so let the queue know about it and refill it if it is not full anymore
+            self._start_queued()
+            if self.spilled:
+                self._refill()
+
+# ################################################################################################################################
+
+    def get_stats(self) -> 'stranydict':
+        return {
+            'name': self.name,
+            'max_concurrency': self.max_concurrency,
+            'queue_size': self.queue_size,
+            'overflow': self.overflow,
+            'running': self.num_running,
+            'queue_depth': len(self.queue),
+            'queue_max_depth': self.queue_max_depth,
+            'spilled_pending': len(self.spilled),
+            'submitted': self.num_submitted,
+            'completed': self.num_completed,
+            'failed': self.num_failed,
+            'rejected': self.num_rejected,
+            'blocked': self.num_blocked,
+            'spilled': self.num_spilled,
+            'spawned': self.num_spawned,
+            'wait_time_avg': self.wait_time_total / self.num_waited if self.num_waited else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AsyncExecutor:
+    """ A per-server collection of named async pools, each used by the services and channels configured for it,
+    or explicitly by name. Everything else goes to the default pool.
+    """
+    def __init__(self) -> 'None':
+        self.pools = {} # type: dict_[str, AsyncPool]
+        self.pool_by_service = {} # type: dict_[str, AsyncPool]
+        self.pool_by_channel = {} # type: dict_[str, AsyncPool]
+
+        self.add_pool(AsyncPool(Default.pool_name, None, overflow=Default.default_pool_overflow))
+
+# ################################################################################################################################
+
+    @staticmethod
+    def from_config(config:'anydict', spill_dir:'str', resume_func:'callable_') -> 'AsyncExecutor':
+        """ Returns a new executor with pools from the [async_pools] section of server.conf, each in a subsection of its own.
+        """
+        executor = AsyncExecutor()
+
+        for name, pool_config in config.items():
+
+            default_overflow = Default.default_pool_overflow if name == Default.pool_name else Default.overflow
+
+            pool = AsyncPool(
+                name,
+                resume_func,
+                int(pool_config.get('max_concurrency') or Default.max_concurrency),
+                int(pool_config.get('queue_size') or Default.queue_size),
+                pool_config.get('overflow') or default_overflow,
+                float(pool_config.get('block_timeout') or Default.block_timeout),
+                os.path.join(spill_dir, name),
+            )
+
+            executor.add_pool(pool, _as_list(pool_config.get('services')), _as_list(pool_config.get('channels')))
+
+        return executor
+
+# ################################################################################################################################
+
+    def add_pool(self, pool:'AsyncPool', services:'strlist'=(), channels:'strlist'=()) -> 'None': # type: ignore
+        self.pools[pool.name] = pool
+
+        for name in services:
+            self.pool_by_service[name] = pool
+
+        for name in channels:
+            self.pool_by_channel[name] = pool
+
+# ################################################################################################################################
+
+    def get_pool(self, pool_name:'str', service_name:'str', channel:'str') -> 'AsyncPool':
+        """ Returns a pool by its name or, if not given, the one configured for a service or a channel, in that order.
+        """
+        if pool_name:
+            try:
+                return self.pools[pool_name]
+            except KeyError:
+                raise ValueError('No such async pool `{}`'.format(pool_name))
+
+        return self.pool_by_service.get(service_name) or \
+            self.pool_by_channel.get(channel) or \
+            self.pools[Default.pool_name]
+
+# ################################################################################################################################
+
+    def submit(self, pool_name:'str', service_name:'str', channel:'str', func:'callable_', *args:'any_') -> 'None':
+        self.get_pool(pool_name, service_name, channel).submit(func, *args)
+
+# ################################################################################################################################
+
+    def get_stats(self) -> 'stranydict':
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def _as_list(value:'any_') -> 'strlist':
+    if not value:
+        return []
+    elif isinstance(value, (list, tuple)):
+        return [elem for elem in value if elem]
+    else:
+        return [value]
+
+# ################################################################################################################################
+# ################################################################################################################################
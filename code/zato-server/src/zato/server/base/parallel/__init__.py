@@ -15,11 +15,11 @@ from pathlib import Path
 from platform import system as platform_system
 from random import seed as random_seed
 from tempfile import mkstemp
-from traceback import format_exc
+from traceback import format_exc, format_exception
 from uuid import uuid4
 
 # gevent
-from gevent import sleep
+from gevent import joinall, sleep, spawn
 from gevent.lock import RLock
 
 # Needed for Cassandra
@@ -33,7 +33,7 @@ from paste.util.converters import asbool
 from zato.broker import BrokerMessageReceiver
 from zato.broker.client import BrokerClient
 from zato.bunch import Bunch
-from zato.common.api import DATA_FORMAT, default_internal_modules, HotDeploy, IPC, KVDB as CommonKVDB, RATE_LIMIT, \
+from zato.common.api import CHANNEL, DATA_FORMAT, default_internal_modules, HotDeploy, IPC, KVDB as CommonKVDB, RATE_LIMIT, \
     SERVER_STARTUP, SEC_DEF_TYPE, SERVER_UP_STATUS, ZatoKVDB as CommonZatoKVDB, ZATO_ODB_POOL_NAME
 from zato.common.audit import audit_pii
 from zato.common.audit_log import AuditLog
@@ -52,8 +52,8 @@ from zato.common.pubsub import SkipDelivery
 from zato.common.rate_limiting import RateLimiting
 from zato.common.typing_ import cast_, intnone, optional
 from zato.common.util.api import absolutize, get_config_from_file, get_kvdb_config_for_log, get_user_config_name, \
-    fs_safe_name, hot_deploy, invoke_startup_services as _invoke_startup_services, new_cid, register_diag_handlers, \
-    save_ipc_pid_port, spawn_greenlet, StaticConfig
+    fs_safe_name, get_ipc_pid_socket_path, hot_deploy, invoke_startup_services as _invoke_startup_services, new_cid, \
+    register_diag_handlers, save_ipc_pid_port, spawn_greenlet, StaticConfig
 from zato.common.util.file_transfer import path_string_list_to_list
 from zato.common.util.json_ import BasicParser
 from zato.common.util.platform_ import is_posix
@@ -61,7 +61,10 @@ from zato.common.util.posix_ipc_ import ConnectorConfigIPC, ServerStartupIPC
 from zato.common.util.time_ import TimeUtil
 from zato.common.util.tcp import wait_until_port_taken
 from zato.distlock import LockManager
+from zato.server.access_log import AccessLogWriter
+from zato.server.async_executor import AsyncExecutor
 from zato.server.base.worker import WorkerStore
+from zato.server.config_snapshot import ConfigSnapshotStore, ModuleCtx as ConfigSnapshotCtx
 from zato.server.config import ConfigStore
 from zato.server.connection.stats import ServiceStatsClient
 from zato.server.connection.server.rpc.api import ConfigCtx as _ServerRPC_ConfigCtx, ServerRPC
@@ -75,6 +78,9 @@ from zato.server.base.parallel.subprocess_.ftp import FTPIPC
 from zato.server.base.parallel.subprocess_.ibm_mq import IBMMQIPC
 from zato.server.base.parallel.subprocess_.zato_events import ZatoEventsIPC
 from zato.server.base.parallel.subprocess_.outconn_sftp import SFTPIPC
+from zato.server.jwt_cache import JWTTokenCache
+from zato.server.pattern.retry_scheduler import get_callback_request as get_invoke_retry_callback_request, \
+     ModuleCtx as RetrySchedulerCtx, RetryScheduler
 from zato.server.sso import SSOTool
 
 # ################################################################################################################################
@@ -86,12 +92,13 @@ if 0:
     from zato.common.crypto.api import ServerCryptoManager
     from zato.common.odb.api import ODBManager
     from zato.common.odb.model import Cluster as ClusterModel
-    from zato.common.typing_ import any_, anydict, anylist, anyset, callable_, strbytes, strlist, strnone
+    from zato.common.typing_ import any_, anydict, anylist, anyset, callable_, stranydict, strbytes, strlist, strnone
     from zato.server.commands import CommandResult
     from zato.server.connection.cache import Cache, CacheAPI
     from zato.server.connection.connector.subprocess_.ipc import SubprocessIPC
     from zato.server.ext.zunicorn.arbiter import Arbiter
     from zato.server.ext.zunicorn.workers.ggevent import GeventWorker
+    from zato.server.service import AsyncCtx, Service
     from zato.server.service.store import ServiceStore
     from zato.simpleio import SIOServerConfig
     from zato.server.startup_callable import StartupCallableTool
@@ -215,6 +222,7 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.has_fg = False
         self.default_internal_pubsub_endpoint_id = 0
         self.jwt_secret = b''
+        self.jwt_token_cache = JWTTokenCache()
         self._hash_secret_method = ''
         self._hash_secret_rounds = -1
         self._hash_secret_salt_size = -1
@@ -283,6 +291,10 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
 
         self.access_logger = logging.getLogger('zato_access_log')
         self.access_logger_log = self.access_logger._log
+        self.access_log_writer = AccessLogWriter(self.access_logger)
+        self.async_executor = AsyncExecutor()
+        self.retry_scheduler = cast_('RetryScheduler', None)
+        self.config_snapshot_store = cast_('ConfigSnapshotStore', None)
         self.needs_access_log = self.access_logger.isEnabledFor(INFO)
         self.needs_all_access_log = True
         self.access_log_ignore = set()
@@ -804,6 +816,20 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.work_dir = self.fs_server_config.main.get('work_dir') or self.fs_server_config.hot_deploy.get('work_dir')
         self.work_dir = os.path.normpath(os.path.join(self.repo_location, self.work_dir))
 
+        # Services invoked in background run in bounded pools whose tasks may be spilled to disk, separately for each process
+        async_spill_dir = os.path.join(self.work_dir, 'async', str(self.process_idx))
+        self.async_executor = AsyncExecutor.from_config(
+            self.fs_server_config.get('async_pools') or {}, async_spill_dir, self.resume_async_invocation)
+
+        # Pending retries of the invoke-retry pattern are kept on disk, separately for each process
+        retry_journal_dir = os.path.join(self.work_dir, RetrySchedulerCtx.Dir_Name, str(self.process_idx))
+        self.retry_scheduler = RetryScheduler.from_config(
+            self.fs_server_config.get('invoke_retry') or {}, retry_journal_dir,
+            self.run_invoke_retry_attempt, self.notify_invoke_retry_callback)
+
+        # Configuration read from ODB is shared by all the processes of this server through a snapshot
+        self.config_snapshot_store = ConfigSnapshotStore(os.path.join(self.work_dir, ConfigSnapshotCtx.Dir_Name))
+
         # Make sure the directories for events exists
         events_dir_v1 = os.path.join(self.work_dir, 'events', 'v1')
 
@@ -940,6 +966,10 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.rate_limiting.global_lock_func = self.zato_lock_manager
         self.rate_limiting.sql_session_func = self.odb.session
 
+        # Added after 3.2 was released, hence optional
+        self.rate_limiting.engine = self.fs_server_config.misc.get('rate_limiting_engine') or self.rate_limiting.engine
+        self.rate_limiting.exact_block_size = int(self.fs_server_config.misc.get('rate_limiting_exact_block_size') or 1)
+
         # Set up rate limiting for ConfigDict-based objects, which includes everything except for:
         # * services  - configured in ServiceStore
         # * SSO       - configured in the next call
@@ -1059,6 +1089,9 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         # Per-process IPC tasks
         self.init_ipc()
 
+        # Retries left behind by a previous process can run now that all the services are deployed
+        self.retry_scheduler.start()
+
         if is_posix:
             connector_config_ipc = cast_('ConnectorConfigIPC', self.connector_config_ipc)
 
@@ -1112,9 +1145,18 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
             callback_func=self.on_ipc_invoke_callback,
         )
 
-        # .. we can now store the information about what IPC port to use with this PID.
+        # .. we can now store the information about what IPC port to use with this PID ..
         save_ipc_pid_port(self.cluster_name, self.name, self.pid, bind_port)
 
+        # .. and, if possible, we also listen on a Unix socket, which other processes will prefer over HTTP.
+        if self.has_posix_ipc:
+            self.ipc_api.start_socket_server(
+                get_ipc_pid_socket_path(self.cluster_name, self.name, self.pid),
+                username=IPC.Credentials.Username,
+                password=ipc_password,
+                callback_func=self.on_ipc_invoke_callback,
+            )
+
 # ################################################################################################################################
 
     def _stop_after_timeout(self):
@@ -1372,10 +1414,10 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
 
 # ################################################################################################################################
 
-    def set_in_cache(self, cache_type:'str', cache_name:'str', key:'str', value:'any_') -> 'any_':
-        """ Sets a value in cache for input parameters.
+    def set_in_cache(self, cache_type:'str', cache_name:'str', key:'str', value:'any_', expiry:'float'=0.0) -> 'any_':
+        """ Sets a value in cache for input parameters, optionally expiring after that many seconds.
         """
-        return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value)
+        return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value, expiry)
 
 # ################################################################################################################################
 
@@ -1396,20 +1438,32 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
             # Underlying IPC needs strings on input instead of None
             request = request or ''
 
+            # All the processes are invoked in parallel ..
+            greenlets = {}
             for pid in pids:
+                greenlets[pid] = spawn(self.invoke_by_pid, service, request, pid, timeout=timeout, *args, **kwargs)
+
+            # .. and all of them need to reply within the same deadline.
+            _ = joinall(greenlets.values(), timeout=timeout)
+
+            for pid, greenlet in greenlets.items():
                 response = {
                     'is_ok': False,
                     'pid_data': None,
                     'error_info': None
                 }
-                try:
-                    pid_data = self.invoke_by_pid(service, request, pid, timeout=timeout, *args, **kwargs)
-                    response['pid_data'] = pid_data
-                except Exception:
-                    e = format_exc()
-                    response['error_info'] = e
-                finally:
-                    out[pid] = response
+
+                if greenlet.successful():
+                    response['pid_data'] = greenlet.value
+
+                elif greenlet.ready():
+                    response['error_info'] = ''.join(format_exception(*greenlet.exc_info))
+
+                else:
+                    greenlet.kill(block=False)
+                    response['error_info'] = 'PID {} did not reply within {}s'.format(pid, timeout)
+
+                out[pid] = response
         except Exception:
             logger.warning('PID invocation error `%s`', format_exc())
         finally:
@@ -1463,6 +1517,16 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
     def publish(self, *args:'any_', **kwargs:'any_') -> 'any_':
         return self.worker_store.pubsub.publish(*args, **kwargs)
 
+# ################################################################################################################################
+
+    def on_broker_msg(self, msg:'anydict') -> 'None':
+
+        # Configuration changes make the config snapshot stale, which must be known before any new process reads it
+        if self.config_snapshot_store:
+            self.config_snapshot_store.on_broker_msg(msg.get('action'))
+
+        super().on_broker_msg(msg)
+
 # ################################################################################################################################
 
     def invoke_async(self, service:'str', request:'any_', callback:'callable_', *args:'any_', **kwargs:'any_') -> 'any_':
@@ -1470,6 +1534,47 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         """
         return self.worker_store.invoke(service, request, is_async=True, callback=callback, *args, **kwargs)
 
+# ################################################################################################################################
+
+    def resume_async_invocation(self, ctx:'AsyncCtx', channel:'str') -> 'None':
+        """ Runs a background invocation that an async pool spilled to disk, possibly before this process started,
+        which is why a new instance of the service that made the invocation is needed.
+        """
+        service, _ = self.service_store.new_instance_by_name(ctx.calling_service)
+        service.update(service, channel, self, broker_client=self.broker_client, _ignored=None,
+            cid=ctx.cid, payload=ctx.data, raw_request=ctx.data, environ=ctx.environ)
+
+        service._invoke_async(ctx, channel)
+
+# ################################################################################################################################
+
+    def _new_invoke_retry_service(self, entry:'stranydict') -> 'Service':
+        """ Returns a new instance of the service that made an invocation through the invoke-retry pattern.
+        """
+        service, _ = self.service_store.new_instance_by_name(entry['source'])
+        service.update(service, CHANNEL.INVOKE_ASYNC, self, broker_client=self.broker_client, _ignored=None,
+            cid=entry['orig_cid'], payload=None, raw_request=None)
+
+        return service
+
+# ################################################################################################################################
+
+    def run_invoke_retry_attempt(self, entry:'stranydict') -> 'any_':
+        """ Runs a single attempt of a background retry on behalf of the service that requested it.
+        """
+        service = self._new_invoke_retry_service(entry)
+        return service.invoke(entry['target'], *entry['args'], **entry['kwargs'])
+
+# ################################################################################################################################
+
+    def notify_invoke_retry_callback(self, entry:'stranydict', is_ok:'bool', response:'any_') -> 'None':
+        """ Lets the callback service of a background retry know that the retry completed.
+        """
+        service = self._new_invoke_retry_service(entry)
+        request = get_invoke_retry_callback_request(entry, is_ok, response, datetime.utcnow().isoformat())
+
+        _ = service.invoke_async(entry['callback'], request)
+
 # ################################################################################################################################
 
     def publish_pickup(self, topic_name:'str', request:'any_', *args:'any_', **kwargs:'any_') -> 'None':
@@ -1717,6 +1822,16 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
             # Close SQL pools
             self.sql_pool_store.cleanup_on_stop()
 
+            # Write whatever is still in the HTTP access log's buffer
+            self.access_log_writer.stop()
+
+            # Pending retries stay on disk for the next process to resume
+            if self.retry_scheduler:
+                self.retry_scheduler.stop()
+
+            # Stop accepting IPC connections
+            self.ipc_api.stop_socket_server()
+
             # Close all POSIX IPC structures
             if self.has_posix_ipc:
                 self.server_startup_ipc.close()
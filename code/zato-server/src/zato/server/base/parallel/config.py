@@ -20,7 +20,9 @@ from zato.common.const import SECRETS
 from zato.common.util.api import asbool
 from zato.common.util.sql import elems_with_opaque
 from zato.common.util.url_dispatcher import get_match_target
+from zato.server.access_log import AccessLogWriter
 from zato.server.config import ConfigDict
+from zato.server.config_snapshot import ModuleCtx as ConfigSnapshotCtx
 from zato.url_dispatcher import Matcher
 
 # ################################################################################################################################
@@ -29,8 +31,10 @@ from zato.url_dispatcher import Matcher
 if 0:
     from zato.common.model.wsx import WSXConnectorConfig
     from zato.common.odb.model import Server as ServerModel
-    from zato.common.typing_ import anydict, anydictnone, anyset
+    from zato.common.typing_ import anydict, anydictnone, anyset, strtuple
+    from zato.distlock import Lock
     from zato.server.base.parallel import ParallelServer
+    from zato.server.config_snapshot import ConfigSource
     WSXConnectorConfig = WSXConnectorConfig
 
 # ################################################################################################################################
@@ -62,6 +66,39 @@ class ConfigLoader:
         server:'ServerModel'
     ) -> 'None':
 
+        # All the workers of a server build their configuration from the same ODB queries, which is why only one of them
+        # runs the queries and the rest read their results from a snapshot that it saves ..
+        odb = self.config_snapshot_store.get_source(self.odb, self.deployment_key, self.encrypt, self._get_config_snapshot_lock)
+
+        # .. while holding a lock that the other ones wait for, which needs to be released even if the queries fail.
+        try:
+            self._set_up_config_from_source(server, odb)
+        finally:
+            odb.release()
+
+        # HTTP access log should optionally ignore certain requests
+        access_log_ignore = self.fs_server_config.get('logging', {}).get('http_access_log_ignore')
+        if access_log_ignore:
+            access_log_ignore = access_log_ignore if isinstance(access_log_ignore, list) else [access_log_ignore]
+            self.needs_all_access_log = False
+            self.access_log_ignore.update(access_log_ignore)
+
+        # HTTP access log is written in background, in batches
+        if self.needs_access_log:
+            self.access_log_writer = AccessLogWriter.from_config(self.access_logger, self.fs_server_config.get('logging', {}))
+            self.access_log_writer.start()
+
+        # Assign config to worker
+        self.worker_store.worker_config = self.config
+
+# ################################################################################################################################
+
+    def _set_up_config_from_source(
+        self:'ParallelServer',  # type: ignore
+        server:'ServerModel',
+        odb:'ConfigSource'
+    ) -> 'None':
+
         # Which components are enabled
         self.component_enabled.stats = asbool(self.fs_server_config.component_enabled.stats)
         self.component_enabled.slow_response = asbool(self.fs_server_config.component_enabled.slow_response)
@@ -70,10 +107,10 @@ class ConfigLoader:
         # Cassandra - start
         #
 
-        query = self.odb.get_cassandra_conn_list(server.cluster.id, True)
+        query = odb.get_cassandra_conn_list(server.cluster.id, True)
         self.config.cassandra_conn = ConfigDict.from_query('cassandra_conn', query, decrypt_func=self.decrypt)
 
-        query = self.odb.get_cassandra_query_list(server.cluster.id, True)
+        query = odb.get_cassandra_query_list(server.cluster.id, True)
         self.config.cassandra_query = ConfigDict.from_query('cassandra_query', query, decrypt_func=self.decrypt)
 
         #
@@ -84,10 +121,10 @@ class ConfigLoader:
         # Search - start
         #
 
-        query = self.odb.get_search_es_list(server.cluster.id, True)
+        query = odb.get_search_es_list(server.cluster.id, True)
         self.config.search_es = ConfigDict.from_query('search_es', query, decrypt_func=self.decrypt)
 
-        query = self.odb.get_search_solr_list(server.cluster.id, True)
+        query = odb.get_search_solr_list(server.cluster.id, True)
         self.config.search_solr = ConfigDict.from_query('search_solr', query, decrypt_func=self.decrypt)
 
         #
@@ -98,7 +135,7 @@ class ConfigLoader:
         # SMS - start
         #
 
-        query = self.odb.get_sms_twilio_list(server.cluster.id, True)
+        query = odb.get_sms_twilio_list(server.cluster.id, True)
         self.config.sms_twilio = ConfigDict.from_query('sms_twilio', query, decrypt_func=self.decrypt)
 
         #
@@ -111,7 +148,7 @@ class ConfigLoader:
 
         # AWS S3
 
-        query = self.odb.get_cloud_aws_s3_list(server.cluster.id, True)
+        query = odb.get_cloud_aws_s3_list(server.cluster.id, True)
         self.config.cloud_aws_s3 = ConfigDict.from_query('cloud_aws_s3', query, decrypt_func=self.decrypt)
 
         #
@@ -121,7 +158,7 @@ class ConfigLoader:
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
         # Services
-        query = self.odb.get_service_list(server.cluster.id, True)
+        query = odb.get_service_list(server.cluster.id, True)
         self.config.service = ConfigDict.from_query('service_list', query, decrypt_func=self.decrypt)
 
         #
@@ -129,11 +166,11 @@ class ConfigLoader:
         #
 
         # AMQP
-        query = self.odb.get_definition_amqp_list(server.cluster.id, True)
+        query = odb.get_definition_amqp_list(server.cluster.id, True)
         self.config.definition_amqp = ConfigDict.from_query('definition_amqp', query, decrypt_func=self.decrypt)
 
         # IBM MQ
-        query = self.odb.get_definition_wmq_list(server.cluster.id, True)
+        query = odb.get_definition_wmq_list(server.cluster.id, True)
         self.config.definition_wmq = ConfigDict.from_query('definition_wmq', query, decrypt_func=self.decrypt)
 
         #
@@ -145,11 +182,11 @@ class ConfigLoader:
         #
 
         # AMQP
-        query = self.odb.get_channel_amqp_list(server.cluster.id, True)
+        query = odb.get_channel_amqp_list(server.cluster.id, True)
         self.config.channel_amqp = ConfigDict.from_query('channel_amqp', query, decrypt_func=self.decrypt)
 
         # IBM MQ
-        query = self.odb.get_channel_wmq_list(server.cluster.id, True)
+        query = odb.get_channel_wmq_list(server.cluster.id, True)
         self.config.channel_wmq = ConfigDict.from_query('channel_wmq', query, decrypt_func=self.decrypt)
 
         #
@@ -161,58 +198,58 @@ class ConfigLoader:
         #
 
         # AMQP
-        query = self.odb.get_out_amqp_list(server.cluster.id, True)
+        query = odb.get_out_amqp_list(server.cluster.id, True)
         self.config.out_amqp = ConfigDict.from_query('out_amqp', query, decrypt_func=self.decrypt)
 
         # Caches
-        query = self.odb.get_cache_builtin_list(server.cluster.id, True)
+        query = odb.get_cache_builtin_list(server.cluster.id, True)
         self.config.cache_builtin = ConfigDict.from_query('cache_builtin', query, decrypt_func=self.decrypt)
 
-        query = self.odb.get_cache_memcached_list(server.cluster.id, True)
+        query = odb.get_cache_memcached_list(server.cluster.id, True)
         self.config.cache_memcached = ConfigDict.from_query('cache_memcached', query, decrypt_func=self.decrypt)
 
         # FTP
-        query = self.odb.get_out_ftp_list(server.cluster.id, True)
+        query = odb.get_out_ftp_list(server.cluster.id, True)
         self.config.out_ftp = ConfigDict.from_query('out_ftp', query, decrypt_func=self.decrypt)
 
         # IBM MQ
-        query = self.odb.get_out_wmq_list(server.cluster.id, True)
+        query = odb.get_out_wmq_list(server.cluster.id, True)
         self.config.out_wmq = ConfigDict.from_query('out_wmq', query, decrypt_func=self.decrypt)
 
         # Odoo
-        query = self.odb.get_out_odoo_list(server.cluster.id, True)
+        query = odb.get_out_odoo_list(server.cluster.id, True)
         self.config.out_odoo = ConfigDict.from_query('out_odoo', query, decrypt_func=self.decrypt)
 
         # SAP RFC
-        query = self.odb.get_out_sap_list(server.cluster.id, True)
+        query = odb.get_out_sap_list(server.cluster.id, True)
         self.config.out_sap = ConfigDict.from_query('out_sap', query, decrypt_func=self.decrypt)
 
         # REST
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'plain_http', True)
+        query = odb.get_http_soap_list(server.cluster.id, 'outgoing', 'plain_http', True)
         self.config.out_plain_http = ConfigDict.from_query('out_plain_http', query, decrypt_func=self.decrypt)
 
         # SFTP
-        query = self.odb.get_out_sftp_list(server.cluster.id, True)
+        query = odb.get_out_sftp_list(server.cluster.id, True)
         self.config.out_sftp = ConfigDict.from_query('out_sftp', query, decrypt_func=self.decrypt, drop_opaque=True)
 
         # SOAP
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'soap', True)
+        query = odb.get_http_soap_list(server.cluster.id, 'outgoing', 'soap', True)
         self.config.out_soap = ConfigDict.from_query('out_soap', query, decrypt_func=self.decrypt)
 
         # SQL
-        query = self.odb.get_out_sql_list(server.cluster.id, True)
+        query = odb.get_out_sql_list(server.cluster.id, True)
         self.config.out_sql = ConfigDict.from_query('out_sql', query, decrypt_func=self.decrypt)
 
         # ZMQ channels
-        query = self.odb.get_channel_zmq_list(server.cluster.id, True)
+        query = odb.get_channel_zmq_list(server.cluster.id, True)
         self.config.channel_zmq = ConfigDict.from_query('channel_zmq', query, decrypt_func=self.decrypt)
 
         # ZMQ outgoing
-        query = self.odb.get_out_zmq_list(server.cluster.id, True)
+        query = odb.get_out_zmq_list(server.cluster.id, True)
         self.config.out_zmq = ConfigDict.from_query('out_zmq', query, decrypt_func=self.decrypt)
 
         # WebSocket channels
-        query = self.odb.get_channel_web_socket_list(server.cluster.id, True)
+        query = odb.get_channel_web_socket_list(server.cluster.id, True)
         self.config.channel_web_socket = ConfigDict.from_query('channel_web_socket', query, decrypt_func=self.decrypt)
 
         #
@@ -228,7 +265,7 @@ class ConfigLoader:
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
         # Connections
-        query = self.odb.get_generic_connection_list(server.cluster.id, True)
+        query = odb.get_generic_connection_list(server.cluster.id, True)
         self.config.generic_connection = ConfigDict.from_query('generic_connection', query, decrypt_func=self.decrypt)
 
         #
@@ -242,7 +279,7 @@ class ConfigLoader:
         #
 
         # SQL
-        query = self.odb.get_notif_sql_list(server.cluster.id, True)
+        query = odb.get_notif_sql_list(server.cluster.id, True)
         self.config.notif_sql = ConfigDict.from_query('notif_sql', query, decrypt_func=self.decrypt)
 
         #
@@ -256,59 +293,59 @@ class ConfigLoader:
         #
 
         # API keys
-        query = self.odb.get_apikey_security_list(server.cluster.id, True)
+        query = odb.get_apikey_security_list(server.cluster.id, True)
         self.config.apikey = ConfigDict.from_query('apikey', query, decrypt_func=self.decrypt)
 
         # AWS
-        query = self.odb.get_aws_security_list(server.cluster.id, True)
+        query = odb.get_aws_security_list(server.cluster.id, True)
         self.config.aws = ConfigDict.from_query('aws', query, decrypt_func=self.decrypt)
 
         # HTTP Basic Auth
-        query = self.odb.get_basic_auth_list(server.cluster.id, None, True)
+        query = odb.get_basic_auth_list(server.cluster.id, None, True)
         self.config.basic_auth = ConfigDict.from_query('basic_auth', query, decrypt_func=self.decrypt)
 
         # JWT
-        query = self.odb.get_jwt_list(server.cluster.id, None, True)
+        query = odb.get_jwt_list(server.cluster.id, None, True)
         self.config.jwt = ConfigDict.from_query('jwt', query, decrypt_func=self.decrypt)
 
         # NTLM
-        query = self.odb.get_ntlm_list(server.cluster.id, True)
+        query = odb.get_ntlm_list(server.cluster.id, True)
         self.config.ntlm = ConfigDict.from_query('ntlm', query, decrypt_func=self.decrypt)
 
         # OAuth
-        query = self.odb.get_oauth_list(server.cluster.id, True)
+        query = odb.get_oauth_list(server.cluster.id, True)
         self.config.oauth = ConfigDict.from_query('oauth', query, decrypt_func=self.decrypt)
 
         # RBAC - permissions
-        query = self.odb.get_rbac_permission_list(server.cluster.id, True)
+        query = odb.get_rbac_permission_list(server.cluster.id, True)
         self.config.rbac_permission = ConfigDict.from_query('rbac_permission', query, decrypt_func=self.decrypt)
 
         # RBAC - roles
-        query = self.odb.get_rbac_role_list(server.cluster.id, True)
+        query = odb.get_rbac_role_list(server.cluster.id, True)
         self.config.rbac_role = ConfigDict.from_query('rbac_role', query, decrypt_func=self.decrypt)
 
         # RBAC - client roles
-        query = self.odb.get_rbac_client_role_list(server.cluster.id, True)
+        query = odb.get_rbac_client_role_list(server.cluster.id, True)
         self.config.rbac_client_role = ConfigDict.from_query('rbac_client_role', query, decrypt_func=self.decrypt)
 
         # RBAC - role permission
-        query = self.odb.get_rbac_role_permission_list(server.cluster.id, True)
+        query = odb.get_rbac_role_permission_list(server.cluster.id, True)
         self.config.rbac_role_permission = ConfigDict.from_query('rbac_role_permission', query, decrypt_func=self.decrypt)
 
         # TLS CA certs
-        query = self.odb.get_tls_ca_cert_list(server.cluster.id, True)
+        query = odb.get_tls_ca_cert_list(server.cluster.id, True)
         self.config.tls_ca_cert = ConfigDict.from_query('tls_ca_cert', query, decrypt_func=self.decrypt)
 
         # TLS channel security
-        query = self.odb.get_tls_channel_sec_list(server.cluster.id, True)
+        query = odb.get_tls_channel_sec_list(server.cluster.id, True)
         self.config.tls_channel_sec = ConfigDict.from_query('tls_channel_sec', query, decrypt_func=self.decrypt)
 
         # TLS key/cert pairs
-        query = self.odb.get_tls_key_cert_list(server.cluster.id, True)
+        query = odb.get_tls_key_cert_list(server.cluster.id, True)
         self.config.tls_key_cert = ConfigDict.from_query('tls_key_cert', query, decrypt_func=self.decrypt)
 
         # Vault connections
-        query = self.odb.get_vault_connection_list(server.cluster.id, True)
+        query = odb.get_vault_connection_list(server.cluster.id, True)
         self.config.vault_conn_sec = ConfigDict.from_query('vault_conn_sec', query, decrypt_func=self.decrypt)
 
         # Encrypt all secrets
@@ -323,7 +360,7 @@ class ConfigLoader:
         # All the HTTP/SOAP channels.
         http_soap = []
 
-        for item in elems_with_opaque(self.odb.get_http_soap_list(server.cluster.id, 'channel')):
+        for item in elems_with_opaque(odb.get_http_soap_list(server.cluster.id, 'channel')):
 
             hs_item = {}
             for key in item.keys():
@@ -337,7 +374,7 @@ class ConfigLoader:
         self.config.http_soap = http_soap
 
         # JSON Pointer
-        query = self.odb.get_json_pointer_list(server.cluster.id, True)
+        query = odb.get_json_pointer_list(server.cluster.id, True)
         self.config.json_pointer = ConfigDict.from_query('json_pointer', query, decrypt_func=self.decrypt)
 
         # SimpleIO
@@ -360,34 +397,27 @@ class ConfigLoader:
         self.config.pubsub = Bunch()
 
         # Pub/sub - endpoints
-        query = self.odb.get_pubsub_endpoint_list(server.cluster.id, True)
+        query = odb.get_pubsub_endpoint_list(server.cluster.id, True)
         self.config.pubsub_endpoint = ConfigDict.from_query('pubsub_endpoint', query, decrypt_func=self.decrypt)
 
         # Pub/sub - topics
-        query = self.odb.get_pubsub_topic_list(server.cluster.id, True)
+        query = odb.get_pubsub_topic_list(server.cluster.id, True)
         self.config.pubsub_topic = ConfigDict.from_query('pubsub_topic', query, decrypt_func=self.decrypt)
 
         # Pub/sub - subscriptions
-        query = self.odb.get_pubsub_subscription_list(server.cluster.id, True)
+        query = odb.get_pubsub_subscription_list(server.cluster.id, True)
         self.config.pubsub_subscription = ConfigDict.from_query('pubsub_subscription', query, decrypt_func=self.decrypt)
 
         # E-mail - SMTP
-        query = self.odb.get_email_smtp_list(server.cluster.id, True)
+        query = odb.get_email_smtp_list(server.cluster.id, True)
         self.config.email_smtp = ConfigDict.from_query('email_smtp', query, decrypt_func=self.decrypt)
 
         # E-mail - IMAP
-        query = self.odb.get_email_imap_list(server.cluster.id, True)
+        query = odb.get_email_imap_list(server.cluster.id, True)
         self.config.email_imap = ConfigDict.from_query('email_imap', query, decrypt_func=self.decrypt)
 
-        # HTTP access log should optionally ignore certain requests
-        access_log_ignore = self.fs_server_config.get('logging', {}).get('http_access_log_ignore')
-        if access_log_ignore:
-            access_log_ignore = access_log_ignore if isinstance(access_log_ignore, list) else [access_log_ignore]
-            self.needs_all_access_log = False
-            self.access_log_ignore.update(access_log_ignore)
-
-        # Assign config to worker
-        self.worker_store.worker_config = self.config
+        # Let other workers use our query results, if we are the one that ran them
+        odb.save()
 
 # ################################################################################################################################
 
@@ -585,6 +615,10 @@ class ConfigLoader:
             'apikey', 'aws', 'basic_auth', 'jwt', 'ntlm', 'oauth', 'tls_key_cert', 'vault_conn_sec'
         )
 
+        # Usually, all the secrets are encrypted already, in which case ODB does not need to be accessed at all
+        if not self._needs_encrypt_secrets(sec_config_dict_types):
+            return
+
         # Global lock to make sure only one server attempts to do it at a time
         with self.zato_lock_manager('zato_encrypt_secrets'):
 
@@ -617,6 +651,39 @@ class ConfigLoader:
                 # Commit to SQL now that all updates are made
                 session.commit()
 
+# ################################################################################################################################
+
+    def _needs_encrypt_secrets(
+        self: 'ParallelServer', # type: ignore
+        sec_config_dict_types   # type: strtuple
+    ) -> 'bool':
+        """ Returns True if any security definition has secrets that are not encrypted in ODB yet.
+        """
+        for sec_config_dict_type in sec_config_dict_types:
+            for config in getattr(self.config, sec_config_dict_type).values():
+                config = config['config']
+                if config.get('_encryption_needed') and not config['_encrypted_in_odb']:
+                    return True
+
+        # If we are here, it means that there is nothing to encrypt but the flags still need to be cleaned up
+        for sec_config_dict_type in sec_config_dict_types:
+            for config in getattr(self.config, sec_config_dict_type).values():
+                config = config['config']
+                config.pop('_encryption_needed', None)
+                config.pop('_encrypted_in_odb', None)
+
+        return False
+
+# ################################################################################################################################
+
+    def _get_config_snapshot_lock(
+        self: 'ParallelServer' # type: ignore
+    ) -> 'Lock':
+        """ Returns a lock that makes sure only one worker of this server creates its config snapshot.
+        """
+        lock_name = '{}{}'.format(ConfigSnapshotCtx.Lock_Prefix, self.name)
+        return self.zato_lock_manager(lock_name, ttl=self.deployment_lock_expires, block=self.deployment_lock_timeout)
+
 # ################################################################################################################################
 
     def _after_init_non_accepted(self, server:'ParallelServer') -> 'None':
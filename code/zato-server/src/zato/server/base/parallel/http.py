@@ -8,7 +8,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 from datetime import datetime
-from logging import getLogger, INFO
+from logging import getLogger
 from traceback import format_exc
 
 # pytz
@@ -18,15 +18,16 @@ from pytz import UTC
 from tzlocal import get_localzone
 
 # Zato
-from zato.common.api import NO_REMOTE_ADDRESS
+from zato.common.api import NO_REMOTE_ADDRESS, stream_types
 from zato.common.util.api import new_cid
+from zato.server.connection.http_soap.stream import iter_response
 
 # ################################################################################################################################
 # ################################################################################################################################
 
 if 0:
     from pytz.tzinfo import BaseTzInfo
-    from zato.common.typing_ import any_, callable_, list_, stranydict
+    from zato.common.typing_ import any_, callable_, stranydict
     from zato.server.base.parallel import ParallelServer
 
 # ################################################################################################################################
@@ -37,11 +38,6 @@ logger = getLogger(__name__)
 # ################################################################################################################################
 # ################################################################################################################################
 
-ACCESS_LOG_DT_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
-
-# ################################################################################################################################
-# ################################################################################################################################
-
 class HTTPHandler:
     """ Handles incoming HTTP requests.
     """
@@ -52,12 +48,11 @@ class HTTPHandler:
         _new_cid=new_cid, # type: callable_
         _local_zone=get_localzone(), # type: BaseTzInfo
         _utcnow=datetime.utcnow, # type: callable_
-        _INFO=INFO, # type: int
         _UTC=UTC,   # type: any_
-        _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT, # type: str
         _no_remote_address=NO_REMOTE_ADDRESS,       # type: str
+        _stream_types=stream_types, # type: any_
         **kwargs:'any_'
-    ) -> 'list_[bytes]':
+    ) -> 'any_':
         """ Handles incoming HTTP requests.
         """
         cid = kwargs.get('cid', _new_cid())
@@ -99,8 +94,18 @@ class HTTPHandler:
 
         start_response(wsgi_environ['zato.http.response.status'], wsgi_environ['zato.http.response.headers'].items())
 
-        if isinstance(payload, str):
-            payload = payload.encode('utf-8')
+        # Streams are not concatenated into a single object, each of their chunks is sent as soon as it is available ..
+        if isinstance(payload, _stream_types):
+            response_size = wsgi_environ['zato.http.response.headers'].get('Content-Length', '-')
+            response = iter_response(payload, wsgi_environ.get('wsgi.file_wrapper'))
+
+        # .. whereas everything else is returned in one piece.
+        else:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+
+            response_size = len(payload)
+            response = [payload]
 
         if self.needs_access_log:
 
@@ -108,26 +113,23 @@ class HTTPHandler:
             # is not in a list of paths to ignore.
             if self.needs_all_access_log or wsgi_environ['PATH_INFO'] not in self.access_log_ignore:
 
-                self.access_logger_log(
-                    _INFO,
-                    '',
-                    None, # type: ignore
-                    None,
-                    {
-                        'remote_ip': remote_addr,
-                        'cid_resp_time': '%s/%s' % (cid, (_utcnow() - request_ts_utc).total_seconds()),
-                        'channel_name': channel_name,
-                        'req_timestamp_utc': request_ts_utc.strftime(_ACCESS_LOG_DT_FORMAT),
-                        'req_timestamp': request_ts_local.strftime(_ACCESS_LOG_DT_FORMAT),
-                        'method': wsgi_environ['REQUEST_METHOD'],
-                        'path': wsgi_environ['PATH_INFO'],
-                        'http_version': wsgi_environ['SERVER_PROTOCOL'],
-                        'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                        'response_size': len(payload),
-                        'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
-                })
-
-        return [payload]
+                # Only raw fields are collected here, they will be formatted and written in background
+                self.access_log_writer.push((
+                    remote_addr,
+                    cid,
+                    _utcnow() - request_ts_utc,
+                    channel_name,
+                    request_ts_utc,
+                    request_ts_local,
+                    wsgi_environ['REQUEST_METHOD'],
+                    wsgi_environ['PATH_INFO'],
+                    wsgi_environ['SERVER_PROTOCOL'],
+                    wsgi_environ['zato.http.response.status'],
+                    response_size,
+                    wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
+                ))
+
+        return response
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -1514,12 +1514,16 @@ class WorkerStore(_WorkerStoreBase):
                 self._visit_wrapper_edit, keys=('username', 'name'))
         self.server.set_up_object_rate_limiting(RATE_LIMIT.OBJECT_TYPE.SEC_DEF, msg.name, 'jwt')
 
+        # Tokens will be validated against ODB again, with the new configuration in place
+        self.server.jwt_token_cache.clear()
+
     def on_broker_msg_SECURITY_JWT_DELETE(self, msg:'Bunch', *args:'any_') -> 'None':
         """ Deletes a JWT security definition.
         """
         self._update_auth(msg, code_to_name[msg.action], SEC_DEF_TYPE.JWT,
                 self._visit_wrapper_delete)
         self.server.delete_object_rate_limiting(RATE_LIMIT.OBJECT_TYPE.SEC_DEF, msg.name)
+        self.server.jwt_token_cache.clear()
 
     def on_broker_msg_SECURITY_JWT_CHANGE_PASSWORD(self, msg:'Bunch', *args:'any_') -> 'None':
         """ Changes password of a JWT security definition.
@@ -1527,6 +1531,11 @@ class WorkerStore(_WorkerStoreBase):
         self._update_auth(msg, code_to_name[msg.action], SEC_DEF_TYPE.JWT,
                 self._visit_wrapper_change_password)
 
+    def on_broker_msg_SECURITY_JWT_TOKEN_DELETE(self, msg:'Bunch', *args:'any_') -> 'None':
+        """ Deletes a JWT token from RAM after a user logged out of it on this or another server.
+        """
+        self.server.jwt_token_cache.delete(msg.token_key)
+
 # ################################################################################################################################
 
     def get_channel_file_transfer_config(self, name:'str') -> 'stranydict':
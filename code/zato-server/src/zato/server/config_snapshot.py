@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import re
+from logging import getLogger
+from mmap import ACCESS_READ, mmap
+from pickle import dumps, HIGHEST_PROTOCOL, loads
+from struct import Struct
+from traceback import format_exc
+
+# Zato
+from zato.common.broker_message import code_to_name
+from zato.common.const import SECRETS
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.odb.api import ODBManager
+    from zato.common.typing_ import any_, anydict, anylist, callable_, strlist, strnone
+    from zato.distlock import Lock
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # Stored in the server's work directory
+    Dir_Name = 'config-snapshot'
+    File_Name = 'config.dat'
+    Changes_File_Name = 'changes'
+    Temp_Suffix = '.tmp'
+
+    # Only one worker of a server at a time creates its snapshot
+    Lock_Prefix = 'zato-config-snapshot-'
+
+    # Magic bytes, change counter and the length of the deployment key that follows
+    Magic = b'ZCS1'
+    Header = Struct('>4sQH')
+
+    # Broker messages that change the configuration in ODB, except for the ones that only change what is in caches
+    Config_Change_Action = re.compile(r'_(CREATE|EDIT|DELETE|CREATE_EDIT|CHANGE_PASSWORD|CREATE_SERVICE)$')
+    Config_Change_Ignore_Prefix = 'CACHE_BUILTIN_STATE_CHANGED'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+config_change_actions = frozenset(
+    code for code, name in code_to_name.items()
+        if ModuleCtx.Config_Change_Action.search(name) and not name.startswith(ModuleCtx.Config_Change_Ignore_Prefix))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SnapshotRow(dict):
+    """ A row from ODB, as kept in a snapshot. Its columns can be accessed as attributes, the same as in SQL rows.
+    """
+    __slots__ = ('row_name',)
+
+    def __getattr__(self, name:'str') -> 'any_':
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get_name(self) -> 'strnone':
+        return self.row_name
+
+    def _asdict(self) -> 'anydict':
+        return dict(self)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ConfigSnapshotStore:
+    """ Keeps a snapshot of results of ODB queries that a server's configuration is built from. The snapshot is shared
+    by all the workers of the server and it is valid for as long as the server's deployment and configuration do not change.
+    """
+    def __init__(self, base_dir:'str') -> 'None':
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, ModuleCtx.File_Name)
+        self.changes_path = os.path.join(base_dir, ModuleCtx.Changes_File_Name)
+
+# ################################################################################################################################
+
+    def get_change_counter(self) -> 'int':
+        """ Returns how many configuration changes have been made so far. Each change appends a byte to a file,
+        which is atomic, so the size of that file is the counter.
+        """
+        try:
+            return os.stat(self.changes_path).st_size
+        except FileNotFoundError:
+            return 0
+
+# ################################################################################################################################
+
+    def on_broker_msg(self, action:'str') -> 'None':
+        """ Invalidates the snapshot if a broker message changes configuration.
+        """
+        if action in config_change_actions:
+            os.makedirs(self.base_dir, exist_ok=True)
+            fd = os.open(self.changes_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                _ = os.write(fd, b'.')
+            finally:
+                os.close(fd)
+
+# ################################################################################################################################
+
+    def load(self, deployment_key:'str') -> 'anydict | None':
+        """ Returns queries and their results from the snapshot or None if there is no valid snapshot.
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, 'rb') as f:
+                with mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+
+                    # The header is enough to tell if the snapshot can be used, without reading the rest of it ..
+                    magic, change_counter, len_deployment_key = ModuleCtx.Header.unpack_from(data)
+                    offset = ModuleCtx.Header.size
+
+                    if magic != ModuleCtx.Magic:
+                        logger.info('Ignoring config snapshot in an unknown format `%s`', self.path)
+                        return None
+
+                    snapshot_deployment_key = data[offset:offset + len_deployment_key].decode('utf8')
+                    offset += len_deployment_key
+
+                    if snapshot_deployment_key != deployment_key:
+                        logger.info('Ignoring config snapshot created during a different deployment `%s`', self.path)
+                        return None
+
+                    if change_counter != self.get_change_counter():
+                        logger.info('Ignoring config snapshot created before configuration changed `%s`', self.path)
+                        return None
+
+                    # .. and only now do we need to load its contents.
+                    with memoryview(data) as view:
+                        return loads(view[offset:])
+
+        except Exception:
+            logger.info('Ignoring config snapshot that could not be read `%s`, e:`%s`', self.path, format_exc())
+            return None
+
+# ################################################################################################################################
+
+    def save(self, deployment_key:'str', change_counter:'int', queries:'anydict') -> 'None':
+        """ Writes out a snapshot in a way that readers will never see a partially written one.
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+
+        deployment_key_bytes = deployment_key.encode('utf8')
+        header = ModuleCtx.Header.pack(ModuleCtx.Magic, change_counter, len(deployment_key_bytes))
+
+        temp_path = self.path + ModuleCtx.Temp_Suffix
+
+        with open(temp_path, 'wb') as f:
+            _ = f.write(header)
+            _ = f.write(deployment_key_bytes)
+            _ = f.write(dumps(queries, protocol=HIGHEST_PROTOCOL))
+
+        os.replace(temp_path, self.path)
+
+# ################################################################################################################################
+
+    def get_source(
+        self,
+        odb,            # type: ODBManager
+        deployment_key, # type: str
+        encrypt_func,   # type: callable_
+        lock_func=None  # type: callable_ | None
+    ) -> 'ConfigSource':
+        """ Returns an object to run configuration queries through. If there is a valid snapshot, the results will be
+        read from it, otherwise, they will be read from ODB and saved in a new snapshot for other workers to use.
+        """
+        # Most of the time, there will be a snapshot that we can use immediately ..
+        queries = self.load(deployment_key)
+        if queries is not None:
+            return ConfigSource(self, odb, deployment_key, encrypt_func, queries)
+
+        # .. if there is not, only one worker at a time should create it ..
+        lock = lock_func() if lock_func else None
+        if lock:
+            _ = lock.acquire()
+
+        # .. so it is possible that another worker has just created it ..
+        queries = self.load(deployment_key)
+        if queries is not None:
+            if lock:
+                lock.release()
+            return ConfigSource(self, odb, deployment_key, encrypt_func, queries)
+
+        # .. and if it has not, we are the one to do it.
+        return ConfigSource(self, odb, deployment_key, encrypt_func, None, lock)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ConfigSource:
+    """ Runs configuration queries in ODB and records their results, or reads the results from a snapshot.
+    Either way, it returns them in a format that ConfigDict.from_query accepts.
+    """
+    def __init__(
+        self,
+        store,          # type: ConfigSnapshotStore
+        odb,            # type: ODBManager
+        deployment_key, # type: str
+        encrypt_func,   # type: callable_
+        queries,        # type: anydict | None
+        lock=None,      # type: Lock | None
+    ) -> 'None':
+        self.store = store
+        self.odb = odb
+        self.deployment_key = deployment_key
+        self.encrypt_func = encrypt_func
+        self.lock = lock
+
+        # If there are no queries on input, we need to record them
+        self.is_snapshot = queries is not None
+        self.queries = queries if queries is not None else {}
+
+        # Read now, rather than when the snapshot is saved, in case the configuration changes while we query ODB
+        self.change_counter = store.get_change_counter()
+
+# ################################################################################################################################
+
+    def __getattr__(self, name:'str') -> 'callable_':
+
+        def run_query(*args:'any_') -> 'any_':
+            if self.is_snapshot:
+                return self._get_from_snapshot(name, args)
+            else:
+                return self._get_from_odb(name, args)
+
+        return run_query
+
+# ################################################################################################################################
+
+    def _get_from_snapshot(self, name:'str', args:'any_') -> 'any_':
+
+        try:
+            column_names, rows = self.queries[(name,) + args]
+        except KeyError:
+
+            # This query was not in use when the snapshot was created
+            logger.info('Config query not found in snapshot `%s` %s', name, args)
+            return getattr(self.odb, name)(*args)
+
+        if column_names is None:
+            return rows
+        else:
+            return rows, dict.fromkeys(column_names)
+
+# ################################################################################################################################
+
+    def _get_from_odb(self, name:'str', args:'any_') -> 'any_':
+
+        result = getattr(self.odb, name)(*args)
+
+        # Some queries return columns along with the rows ..
+        if isinstance(result, tuple):
+            rows, columns = result
+            column_names = list(columns.keys()) # type: strlist | None
+
+        # .. and some return the rows only.
+        else:
+            rows = result
+            column_names = None
+
+        self.queries[(name,) + args] = (column_names, [self._get_snapshot_row(row, column_names) for row in rows])
+
+        return result
+
+# ################################################################################################################################
+
+    def _get_snapshot_row(self, row:'any_', column_names:'strlist | None') -> 'SnapshotRow':
+
+        if hasattr(row, '_asdict'):
+            out = SnapshotRow(row._asdict())
+        elif isinstance(row, dict):
+            out = SnapshotRow(row)
+        else:
+            out = SnapshotRow((name, getattr(row, name)) for name in column_names or ())
+
+        if hasattr(row, 'name'):
+            out.row_name = row.name
+        elif hasattr(row, 'get_name'):
+            out.row_name = row.get_name()
+        else:
+            out.row_name = None
+
+        # Secrets are kept in the snapshot encrypted, the same as in ODB, even if the latter still has some
+        # that are not, e.g. after a migration from an older version, so that each worker decrypts them on its own.
+        for key in SECRETS.PARAMS:
+            value = out.get(key)
+            if value and isinstance(value, (str, bytes)):
+                value = value.decode('utf8') if isinstance(value, bytes) else value
+                if not value.startswith((SECRETS.PREFIX, '$')):
+                    out[key] = self.encrypt_func(value)
+
+        return out
+
+# ################################################################################################################################
+
+    def save(self) -> 'None':
+        """ Saves the results of all the queries run so far for other workers to use, unless they came from a snapshot.
+        """
+        if self.is_snapshot:
+            return
+
+        try:
+            self.store.save(self.deployment_key, self.change_counter, self.queries)
+        except Exception:
+            logger.warning('Could not save config snapshot to `%s`, e:`%s`', self.store.path, format_exc())
+        finally:
+            self.release()
+
+# ################################################################################################################################
+
+    def release(self) -> 'None':
+        """ Lets other workers create the snapshot, e.g. if we could not run all the queries. Can be called more than once.
+        """
+        lock, self.lock = self.lock, None
+        if lock:
+            lock.release()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -9,12 +9,16 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-from base64 import b64encode
+from base64 import b64decode, b64encode
 from logging import getLogger
+from time import time
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
 from gevent.lock import RLock
 
 # python-memcached
@@ -31,8 +35,7 @@ from zato.common.util.api import parse_extra_into_dict
 
 # Python 2/3 compatibility
 from zato.common.ext.future.utils import iteritems, itervalues
-from zato.common.py23_.past.builtins import basestring
-from zato.common.py23_ import pickle_dumps
+from zato.common.py23_ import pickle_dumps, pickle_loads
 
 # ################################################################################################################################
 
@@ -69,10 +72,20 @@ for builtin_op in builtin_ops:
 
 # ################################################################################################################################
 
-default_get = ZATO_NOT_GIVEN # A singleton to indicate that no default for Cache.get was given on input
+# Operations on a single key - the last one of each group for a given key is all that needs to be synchronized
+_key_op_group = {
+    CACHE.STATE_CHANGED.SET: 'value',
+    CACHE.STATE_CHANGED.DELETE: 'value',
+    CACHE.STATE_CHANGED.EXPIRE: 'expiry',
+}
+
+# Maps operations to methods of Cache objects that apply them in other workers
+_sync_func_name = dict((getattr(CACHE.STATE_CHANGED, builtin_op), 'sync_after_{}'.format(builtin_op.lower()))
+    for builtin_op in builtin_ops)
 
-_no_key = 'zato-no-key'
-_no_value = 'zato-no-value'
+# ################################################################################################################################
+
+default_get = ZATO_NOT_GIVEN # A singleton to indicate that no default for Cache.get was given on input
 
 # ################################################################################################################################
 
@@ -85,7 +98,7 @@ class Cache:
         self.after_state_changed_callback = self.config.after_state_changed_callback
         self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
         self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
-            self.config.extend_expiry_on_set)
+            self.config.extend_expiry_on_set, has_key_index=asbool(self.config.get('has_key_index', False)))
         spawn(self._delete_expired)
 
 # ################################################################################################################################
@@ -181,7 +194,7 @@ class Cache:
         meta_ref = {'key':key, 'value':value, 'expiry':expiry} if self.needs_sync else None
         value = self.impl.set(key, value, expiry, details, meta_ref)
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self.after_state_changed_callback(_OP, self.config.name, meta_ref)
 
         return value
 
@@ -197,7 +210,7 @@ class Cache:
         out = self.impl.set_by_prefix(key, value, expiry, False, meta_ref, return_found, limit)
 
         if meta_ref['_any_found'] and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -219,7 +232,7 @@ class Cache:
         out = self.impl.set_by_suffix(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -241,7 +254,7 @@ class Cache:
         out = self.impl.set_by_regex(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -263,7 +276,7 @@ class Cache:
         out = self.impl.set_contains(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -285,7 +298,7 @@ class Cache:
         out = self.impl.set_not_contains(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -307,7 +320,7 @@ class Cache:
         out = self.impl.set_contains_all(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -329,7 +342,7 @@ class Cache:
         out = self.impl.set_contains_any(key, value, expiry, False, meta_ref, return_found, limit)
 
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'value':value,
                 'expiry':expiry,
@@ -351,7 +364,7 @@ class Cache:
                 raise
         else:
             if self.needs_sync:
-                spawn(self.after_state_changed_callback, _OP, self.config.name, {'key':key})
+                self.after_state_changed_callback(_OP, self.config.name, {'key':key})
 
             return value
 
@@ -363,7 +376,7 @@ class Cache:
         """
         out = self.impl.delete_by_prefix(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -378,7 +391,7 @@ class Cache:
         """
         out = self.impl.delete_by_suffix(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -393,7 +406,7 @@ class Cache:
         """
         out = self.impl.delete_by_regex(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -408,7 +421,7 @@ class Cache:
         """
         out = self.impl.delete_contains(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -423,7 +436,7 @@ class Cache:
         """
         out = self.impl.delete_not_contains(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -438,7 +451,7 @@ class Cache:
         """
         out = self.impl.delete_contains_all(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -453,7 +466,7 @@ class Cache:
         """
         out = self.impl.delete_contains_any(key, return_found, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'limit':limit
             })
@@ -469,7 +482,7 @@ class Cache:
         found_key = self.impl.expire(key, expiry, meta_ref)
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
+            self.after_state_changed_callback(_OP, self.config.name, meta_ref)
 
         return found_key
 
@@ -478,9 +491,9 @@ class Cache:
     def expire_by_prefix(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_BY_PREFIX):
         """ Sets expiry in seconds (or a fraction of) for all keys matching the input prefix.
         """
-        out = self.impl.expire_by_prefix(key, expiry)
+        out = self.impl.expire_by_prefix(key, expiry, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -493,9 +506,9 @@ class Cache:
     def expire_by_suffix(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_BY_SUFFIX):
         """ Sets expiry in seconds (or a fraction of) for all keys matching the input suffix.
         """
-        out = self.impl.expire_by_suffix(key, expiry)
+        out = self.impl.expire_by_suffix(key, expiry, limit)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -510,7 +523,7 @@ class Cache:
         """
         out = self.impl.expire_by_regex(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -525,7 +538,7 @@ class Cache:
         """
         out = self.impl.expire_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -540,7 +553,7 @@ class Cache:
         """
         out = self.impl.expire_not_contains(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -555,7 +568,7 @@ class Cache:
         """
         out = self.impl.expire_contains_all(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -570,7 +583,7 @@ class Cache:
         """
         out = self.impl.expire_contains_any(key, expiry)
         if out and self.needs_sync:
-            spawn(self.after_state_changed_callback, _OP, self.config.name, {
+            self.after_state_changed_callback(_OP, self.config.name, {
                 'key':key,
                 'expiry':expiry,
                 'limit':limit
@@ -628,7 +641,7 @@ class Cache:
         self.impl.clear()
 
         if self.needs_sync:
-            spawn(self.after_state_changed_callback, _CLEAR, self.config.name, {})
+            self.after_state_changed_callback(_CLEAR, self.config.name, {})
 
 # ################################################################################################################################
 
@@ -807,6 +820,176 @@ class Cache:
 
 # ################################################################################################################################
 
+class SyncQueue:
+    """ Collects state changes of a single built-in cache and publishes them to other workers in batches. A batch is published
+    once it has batch_size operations or once its oldest operation has waited for batch_interval seconds, whichever comes first.
+    If the same key is set or deleted more than once in a batch, only the last operation is kept, and likewise for expiry.
+    """
+    def __init__(self, cache_name, publish, batch_size, batch_interval, _CLEAR=CACHE.STATE_CHANGED.CLEAR):
+        self.cache_name = cache_name
+        self.publish = publish
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lock = RLock()
+        self._CLEAR = _CLEAR
+
+        # Operations to publish, in the order they are to be applied in. Keys are pairs of (group, key) for operations
+        # on a single key and consecutive integers for all the others, which can never be coalesced.
+        self.pending = {}
+        self.pending_since = None
+        self.flush_timer = None
+        self.seq = 0
+
+        # Outgoing metrics ..
+        self.ops_total = 0
+        self.ops_coalesced = 0
+        self.ops_sent = 0
+        self.ops_skipped = 0
+        self.batches_sent = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        # .. and incoming ones.
+        self.batches_received = 0
+        self.ops_received = 0
+        self.last_receive_lag = 0.0
+
+# ################################################################################################################################
+
+    def put(self, op, data, _key_op_group=_key_op_group):
+        """ Adds a new operation to the batch, replacing any earlier one on the same key that it overrides.
+        """
+        with self.lock:
+
+            self.ops_total += 1
+
+            # Everything before a .clear operation is irrelevant to other workers ..
+            if op == self._CLEAR:
+                self.ops_coalesced += len(self.pending)
+                self.pending.clear()
+                pending_key = op
+
+            else:
+                group = _key_op_group.get(op)
+
+                # .. operations on a single key replace earlier ones in the same group, moving to the end of the batch ..
+                if group:
+                    pending_key = (group, data['key'])
+                    if self.pending.pop(pending_key, None):
+                        self.ops_coalesced += 1
+
+                # .. and everything else is always published.
+                else:
+                    self.seq += 1
+                    pending_key = self.seq
+
+            self.pending[pending_key] = (op, data)
+
+            if self.pending_since is None:
+                self.pending_since = time()
+                self.flush_timer = spawn_later(self.batch_interval, self._on_flush_timer)
+
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+# ################################################################################################################################
+
+    def _on_flush_timer(self):
+        with self.lock:
+            self.flush_timer = None
+            self.flush()
+
+# ################################################################################################################################
+
+    def flush(self):
+        """ Publishes all the pending operations as a single batch.
+        """
+        with self.lock:
+
+            if not self.pending:
+                return
+
+            if self.flush_timer:
+                self.flush_timer.kill(block=False)
+                self.flush_timer = None
+
+            ops = list(self.pending.values())
+            created_at = self.pending_since
+
+            self.pending = {}
+            self.pending_since = None
+
+        # Each operation is pickled on its own so that a value that cannot be pickled drops only its own operation
+        pickled = []
+
+        for op in ops:
+            try:
+                pickled.append(pickle_dumps(op))
+            except Exception:
+                self.ops_skipped += 1
+                logger.warning('Skipping an operation on cache `%s` that could not be pickled, e:`%s`',
+                    self.cache_name, format_exc())
+
+        if not pickled:
+            return
+
+        with self.lock:
+
+            batch_size = len(pickled)
+            lag = time() - created_at
+
+            self.ops_sent += batch_size
+            self.batches_sent += 1
+            self.last_batch_size = batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+        try:
+            self.publish({
+                'cache_name': self.cache_name,
+                'created_at': created_at,
+                'ops': b64encode(pickle_dumps(pickled)).decode('ascii'),
+            })
+        except Exception:
+            logger.warning('Could not publish a batch of %d operation(s) from cache `%s`, e:`%s`',
+                batch_size, self.cache_name, format_exc())
+
+# ################################################################################################################################
+
+    def on_batch_received(self, batch_size, created_at):
+        self.batches_received += 1
+        self.ops_received += batch_size
+        self.last_receive_lag = time() - created_at
+
+# ################################################################################################################################
+
+    def get_stats(self):
+        """ Returns metrics of this queue - lag is in seconds, from the time the oldest operation in a batch
+        was added to the time the batch was published or, for received batches, applied.
+        """
+        with self.lock:
+            return {
+                'ops_total': self.ops_total,
+                'ops_coalesced': self.ops_coalesced,
+                'ops_sent': self.ops_sent,
+                'ops_skipped': self.ops_skipped,
+                'ops_pending': len(self.pending),
+                'batches_sent': self.batches_sent,
+                'last_batch_size': self.last_batch_size,
+                'max_batch_size': self.max_batch_size,
+                'avg_batch_size': (self.ops_sent / self.batches_sent) if self.batches_sent else 0.0,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag,
+                'batches_received': self.batches_received,
+                'ops_received': self.ops_received,
+                'last_receive_lag': self.last_receive_lag,
+            }
+
+# ################################################################################################################################
+
 class _NotConfiguredAPI:
     def set(self, *args, **kwargs):
         raise Exception('Default cache is not configured')
@@ -829,44 +1012,68 @@ class CacheAPI:
         self.builtin = self.caches[CACHE.TYPE.BUILTIN]
         self.memcached = self.caches[CACHE.TYPE.MEMCACHED]
 
+        # Cache name -> SyncQueue for each built-in cache that had its state changed
+        self.sync_queues = {}
+
     def _maybe_set_default(self, config, cache):
         if config.is_default:
             self.default = cache
 
 # ################################################################################################################################
 
-    def after_state_changed(self, op, cache_name, data, _broker_msg=builtin_op_to_broker_msg, _pickle_dumps=pickle_dumps):
+    def after_state_changed(self, op, cache_name, data):
         """ Callback method invoked by each cache if it requires synchronization with other worker processes.
         """
         try:
+            self._get_sync_queue(cache_name).put(op, data)
+        except Exception:
+            logger.warning('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
+                op, cache_name, data, format_exc())
 
-            data['action'] = _broker_msg[op]
-            data['cache_name'] = cache_name
-            data['source_worker_id'] = self.server.worker_id
+# ################################################################################################################################
 
-            key = data.get('key', _no_key)
-            value = data.get('value', _no_value)
+    def _get_sync_queue(self, cache_name):
+        """ Returns a SyncQueue for the input cache, creating it first if it does not exist yet.
+        """
+        sync_queue = self.sync_queues.get(cache_name)
 
-            if isinstance(key, basestring):
-                data['is_key_pickled'] = False
-            else:
-                data['is_key_pickled'] = True
-                data['key'] = _pickle_dumps(key)
+        if not sync_queue:
+            with self.lock:
+                sync_queue = self.sync_queues.get(cache_name)
+                if not sync_queue:
+                    config = self.server.fs_server_config.get('cache') or {}
+                    sync_queue = SyncQueue(
+                        cache_name,
+                        self._publish_sync_batch,
+                        int(config.get('sync_batch_size', CACHE.DEFAULT.SYNC_BATCH_SIZE)),
+                        float(config.get('sync_batch_interval', CACHE.DEFAULT.SYNC_BATCH_INTERVAL)),
+                    )
+                    self.sync_queues[cache_name] = sync_queue
 
-            if value:
-                if isinstance(value, basestring):
-                    data['is_value_pickled'] = False
-                else:
-                    data['is_value_pickled'] = True
-                    value = _pickle_dumps(value)
-                    data['value'] = b64encode(value)
-            else:
-                data['is_value_pickled'] = False
+        return sync_queue
 
-            self.server.broker_client.publish(data)
-        except Exception:
-            logger.warning('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
-                op, cache_name, data, format_exc())
+# ################################################################################################################################
+
+    def _flush_sync_queue(self, cache_name):
+        """ Publishes any pending changes to the input cache and drops its SyncQueue. Must be called with self.lock held.
+        """
+        sync_queue = self.sync_queues.pop(cache_name, None)
+        if sync_queue:
+            sync_queue.flush()
+
+# ################################################################################################################################
+
+    def _publish_sync_batch(self, msg, _action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        msg['action'] = _action
+        msg['source_worker_id'] = self.server.worker_id
+        self.server.broker_client.publish(msg)
+
+# ################################################################################################################################
+
+    def get_sync_stats(self, name):
+        """ Returns synchronization metrics of a given built-in cache, e.g. its replication lag and batch sizes.
+        """
+        return self._get_sync_queue(name).get_stats()
 
 # ################################################################################################################################
 
@@ -928,6 +1135,7 @@ class CacheAPI:
         """ A low-level method for updating configuration of a given cache. Must be called with self.lock held.
         """
         if config.cache_type == CACHE.TYPE.BUILTIN:
+            self._flush_sync_queue(config.old_name)
             cache = self.caches[config.cache_type].pop(config.old_name)
             cache.update_config(config)
             self._add_cache(config, cache)
@@ -954,6 +1162,7 @@ class CacheAPI:
 
         if cache_type == CACHE.TYPE.BUILTIN:
             self._clear(cache_type, name)
+            self._flush_sync_queue(name)
         else:
             cache.disconnect_all()
 
@@ -1130,4 +1339,28 @@ class CacheAPI:
         """
         self.caches[cache_type][data.cache_name].sync_after_clear()
 
+# ################################################################################################################################
+
+    def sync_after_batch(self, cache_type, data, _CLEAR=CACHE.STATE_CHANGED.CLEAR, _sync_func_name=_sync_func_name):
+        """ Synchronizes the state of this worker's cache after a batch of operations in another worker process.
+        """
+        cache = self.caches[cache_type][data.cache_name]
+        ops = pickle_loads(b64decode(data.ops))
+
+        for idx, op in enumerate(ops):
+
+            # An operation that cannot be applied, e.g. a key that already expired in this worker,
+            # must not stop the rest of the batch from being applied.
+            try:
+                op, op_data = pickle_loads(op)
+                if op == _CLEAR:
+                    cache.sync_after_clear()
+                else:
+                    getattr(cache, _sync_func_name[op])(Bunch(op_data))
+            except Exception:
+                logger.warning('Could not apply operation #%s from a batch to cache `%s`, e:`%s`',
+                    idx, data.cache_name, format_exc())
+
+        self._get_sync_queue(data.cache_name).on_batch_received(len(ops), data.created_at)
+
 # ################################################################################################################################
@@ -12,7 +12,7 @@ from logging import getLogger
 from traceback import format_exc
 
 # Zato
-from zato.common.events.common import Action
+from zato.common.events.common import Action, BatchCodec
 from zato.common.util.json_ import JSONParser
 from zato.common.util.tcp import ZatoStreamServer
 from zato.server.connection.connector.subprocess_.base import BaseConnectionContainer
@@ -66,6 +66,7 @@ class EventsConnectionContainer(BaseConnectionContainer):
         self._action_map = {
             Action.Ping: self._on_event_ping,
             Action.Push: self._on_event_push,
+            Action.PushBatch: self._on_event_push_batch,
             Action.GetTable: self._on_event_get_table,
         }
 
@@ -111,6 +112,17 @@ class EventsConnectionContainer(BaseConnectionContainer):
         # .. now, we can push it to the database.
         self.events_db.access_state(_opcode, data)
 
+# ################################################################################################################################
+
+    def _on_event_push_batch(self, data, ignored_address_str, _opcode=OpCode.PushBatch):
+        # type: (bytes, str, str) -> None
+
+        # We received a binary batch of events ..
+        data = BatchCodec.decode(data)
+
+        # .. which are pushed to the database all at once.
+        self.events_db.access_state(_opcode, data, len(data))
+
 # ################################################################################################################################
 
     def _on_event_get_table(self, ignored_address_str, _opcode=OpCode.Tabulate):
@@ -159,6 +171,11 @@ class EventsConnectionContainer(BaseConnectionContainer):
                 # .. otherwise, handle the action ..
                 data = line[2:]
 
+                # .. batches are binary so their line contains only the length of the payload that follows,
+                # .. which is in turn followed by a newline, like all the other actions.
+                if action == Action.PushBatch:
+                    data = socket_file.read(int(data) + 1)[:-1]
+
                 try:
                     response = func(data, address_str) # type: str
                 except Exception as e:
@@ -9,6 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 import os
 from datetime import datetime, timedelta
+from shutil import rmtree
 from typing import Optional as optional
 
 # Humanize
@@ -37,24 +38,49 @@ utcnow = datetime.utcnow
 # ################################################################################################################################
 # ################################################################################################################################
 
+class ModuleCtx:
+
+    # Raw events are kept here, in per-partition subdirectories ..
+    Events_Dir = 'events'
+
+    # .. and their summaries per Stats.DefaultAggrTimeFreq bucket are kept here, also per partition.
+    Summary_Dir = 'summary'
+
+    # Each partition holds events from one day
+    Partition_Format = '%Y-%m-%d'
+    Partition_Delta = timedelta(days=1)
+
+    # The name of a file that all the files of a partition are compacted into once the partition is closed
+    Compacted_Name = 'compacted'
+
+    File_Suffix = '.parquet'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class OpCode:
-    Push     = 'EventsDBPush'
-    Tabulate = 'EventsDBTabulate'
+    Push      = 'EventsDBPush'
+    PushBatch = 'EventsDBPushBatch'
+    Tabulate  = 'EventsDBTabulate'
 
     class Internal:
-        SaveData    = 'InternalSaveData'
-        SyncState   = 'InternalSyncState'
-        GetFromRAM  = 'InternalGetFromRAM'
-        ReadParqet  = 'InternalReadParqet'
-        CreateNewDF = 'InternalCreateNewDF'
-        CombineData = 'InternalCombineData'
-
-_op_int_save_data     = OpCode.Internal.SaveData
-_op_int_sync_state    = OpCode.Internal.SyncState
-_op_int_get_from_ram  = OpCode.Internal.GetFromRAM
-_op_int_read_parqet   = OpCode.Internal.ReadParqet
-_op_int_create_new_df = OpCode.Internal.CreateNewDF
-_op_int_combine_data  = OpCode.Internal.CombineData
+        SaveData      = 'InternalSaveData'
+        SyncState     = 'InternalSyncState'
+        GetFromRAM    = 'InternalGetFromRAM'
+        ReadParqet    = 'InternalReadParqet'
+        CreateNewDF   = 'InternalCreateNewDF'
+        CombineData   = 'InternalCombineData'
+        Compact       = 'InternalCompact'
+        DropPartition = 'InternalDropPartition'
+
+_op_int_save_data      = OpCode.Internal.SaveData
+_op_int_sync_state     = OpCode.Internal.SyncState
+_op_int_get_from_ram   = OpCode.Internal.GetFromRAM
+_op_int_read_parqet    = OpCode.Internal.ReadParqet
+_op_int_create_new_df  = OpCode.Internal.CreateNewDF
+_op_int_combine_data   = OpCode.Internal.CombineData
+_op_int_compact        = OpCode.Internal.Compact
+_op_int_drop_partition = OpCode.Internal.DropPartition
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -174,7 +200,11 @@ class Event:
 # ################################################################################################################################
 
 class EventsDatabase(InRAMStore):
-
+    """ Keeps events in RAM and periodically appends them to persistent storage, partitioned by day. Each sync writes
+    new files only, with raw events and their summaries per Stats.DefaultAggrTimeFreq bucket, and retention drops
+    whole partitions, which means that the cost of a sync depends on how many new events there are rather than
+    on how many of them have been retained so far.
+    """
     def __init__(self, logger, fs_data_path, sync_threshold, sync_interval, max_retention=Stats.MaxRetention):
         super().__init__(sync_threshold, sync_interval)
 
@@ -196,14 +226,37 @@ class EventsDatabase(InRAMStore):
         # Aggregated response times are kept here
         self.fs_response_time_path = os.path.join(self.fs_data_path, 'response-time')
 
+        # Partitions of raw events are kept here ..
+        self.fs_events_path = os.path.join(self.fs_data_path, ModuleCtx.Events_Dir)
+
+        # .. and partitions of their summaries are kept here.
+        self.fs_summary_path = os.path.join(self.fs_data_path, ModuleCtx.Summary_Dir)
+
         # In-RAM database of events, saved to disk periodically in background
         self.in_ram_store = [] # type: list[Event]
 
         # Fow how long to keep statistics in persistent storage
         self.max_retention = max_retention # type: int
 
+        # Maps names of partitions to totals per object_id, built out of each partition's summaries
+        self.partition_totals = {} # type: dict[str, DataFrame]
+
+        # Totals of the oldest retained partition, some of whose events may have expired already, along with the partition's name
+        # and the first Stats.DefaultAggrTimeFreq bucket that they were built out of
+        self.boundary_totals = None # type: tuple | None
+
+        # Partitions that new files were added to, which will be compacted once they are closed
+        self.partitions_to_compact = set() # type: set[str]
+
+        # Each file saved gets a unique name, with a sequence number in it
+        self.file_seq = 0
+
+        # Whether the summaries already in persistent storage have been read
+        self.is_storage_loaded = False
+
         # Configure our opcodes
         self.opcode_to_func[OpCode.Push] = self.push
+        self.opcode_to_func[OpCode.PushBatch] = self.push_batch
         self.opcode_to_func[OpCode.Tabulate] = self.get_table
 
         # Reusable Panda groupers
@@ -218,13 +271,34 @@ class EventsDatabase(InRAMStore):
             'item_total_usage':  pd.NamedAgg(column='total_time_ms', aggfunc=np.count_nonzero),
         }
 
+        # Summaries have these columns instead - unlike a mean, each of them can be merged across buckets ..
+        # .. note that these are built-in functions only, which pandas does not need to call for each group separately.
+        self.summary_agg_by = {
+            'item_max':  pd.NamedAgg(column='total_time_ms', aggfunc='max'),
+            'item_min':  pd.NamedAgg(column='total_time_ms', aggfunc='min'),
+            'item_total_time':  pd.NamedAgg(column='total_time_ms', aggfunc='sum'),
+            'item_total_usage':  pd.NamedAgg(column='is_non_zero', aggfunc='sum'),
+            'item_count':  pd.NamedAgg(column='total_time_ms', aggfunc='count'),
+        }
+
+        # .. and this is how they are merged.
+        self.summary_merge_by = {
+            'item_max': 'max',
+            'item_min': 'min',
+            'item_total_time': 'sum',
+            'item_total_usage': 'sum',
+            'item_count': 'sum',
+        }
+
         # Configure our telemetry opcodes
-        self.telemetry[_op_int_save_data]     = 0
-        self.telemetry[_op_int_sync_state]    = 0
-        self.telemetry[_op_int_get_from_ram]  = 0
-        self.telemetry[_op_int_read_parqet]   = 0
-        self.telemetry[_op_int_create_new_df] = 0
-        self.telemetry[_op_int_combine_data]  = 0
+        self.telemetry[_op_int_save_data]      = 0
+        self.telemetry[_op_int_sync_state]     = 0
+        self.telemetry[_op_int_get_from_ram]   = 0
+        self.telemetry[_op_int_read_parqet]    = 0
+        self.telemetry[_op_int_create_new_df]  = 0
+        self.telemetry[_op_int_combine_data]   = 0
+        self.telemetry[_op_int_compact]        = 0
+        self.telemetry[_op_int_drop_partition] = 0
 
         # Configure Panda objects
         self.set_up_group_by()
@@ -270,24 +344,152 @@ class EventsDatabase(InRAMStore):
         # type: (dict) -> None
         self.in_ram_store.append(data)
 
+# ################################################################################################################################
+
+    def push_batch(self, data):
+        # type: (list) -> None
+        self.in_ram_store.extend(data)
+
+# ################################################################################################################################
+
+    def get_partition_dirs(self, partition):
+        # type: (str) -> tuple
+        return os.path.join(self.fs_events_path, partition), os.path.join(self.fs_summary_path, partition)
+
+# ################################################################################################################################
+
+    def list_partitions(self):
+        """ Returns names of all the partitions in persistent storage, from the oldest to the newest one.
+        """
+        # type: () -> list
+
+        partitions = set()
+
+        for path in (self.fs_events_path, self.fs_summary_path):
+            if os.path.isdir(path):
+                partitions.update(os.listdir(path))
+
+        return sorted(partitions)
+
+# ################################################################################################################################
+
+    def list_files(self, path):
+        # type: (str) -> list
+
+        if not os.path.isdir(path):
+            return []
+
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(ModuleCtx.File_Suffix))
+
+# ################################################################################################################################
+
+    def get_new_file_name(self):
+        # type: () -> str
+
+        self.file_seq += 1
+        return '{}-{}{}'.format(utcnow().strftime('%Y%m%dT%H%M%S%f'), self.file_seq, ModuleCtx.File_Suffix)
+
+# ################################################################################################################################
+
+    def read_files(self, file_list):
+        """ Reads Parquet files and returns their contents as a single DataFrame.
+        """
+        # type: (list) -> DataFrame
+
+        # Pandas
+        import pandas as pd
+
+        data = [pd.read_parquet(path) for path in file_list]
+        return pd.concat(data, ignore_index=True)
+
+# ################################################################################################################################
+
+    def load_storage(self):
+        """ Reads the summaries of all the partitions that are already in persistent storage. This is done only once,
+        after which the summaries are kept up to date in RAM while new events are being saved.
+        """
+        # type: () -> None
+
+        if self.is_storage_loaded:
+            return
+
+        # Data from before partitioning was introduced is in a single file that we need to partition first ..
+        self.migrate_single_file()
+
+        # .. and now, we can build totals out of each partition's summaries.
+        for partition in self.list_partitions():
+
+            events_dir, summary_dir = self.get_partition_dirs(partition)
+            summary_file_list = self.list_files(summary_dir)
+
+            if summary_file_list:
+                summary = self.read_files(summary_file_list)
+                self.partition_totals[partition] = self.get_totals(summary)
+                self.telemetry[_op_int_read_parqet] += 1
+
+            # Partitions with more than one file can be still compacted
+            if len(summary_file_list) > 1 or len(self.list_files(events_dir)) > 1:
+                self.partitions_to_compact.add(partition)
+
+        self.is_storage_loaded = True
+
+# ################################################################################################################################
+
+    def migrate_single_file(self):
+        """ Partitions data that was kept in a single file, as it was before partitioning was introduced.
+        """
+        # type: () -> None
+
+        # Pandas
+        import pandas as pd
+
+        # The old file is renamed first to make room for the directory that partitions are kept in ..
+        legacy_path = self.fs_data_path + '.legacy'
+
+        if os.path.isfile(self.fs_data_path):
+            os.rename(self.fs_data_path, legacy_path)
+
+        # .. and it is deleted only after it has been partitioned, which means that, if we are interrupted,
+        # .. the migration will be carried out again the next time around.
+        if os.path.exists(legacy_path):
+
+            self.logger.info('Partitioning DF data from %s', legacy_path)
+
+            data = pd.read_parquet(legacy_path) # type: pd.DataFrame
+
+            if len(data):
+                self.save_data(self.trim(self.parse_timestamps(data)))
+
+            os.remove(legacy_path)
+
 # ################################################################################################################################
 
     def load_data_from_storage(self):
-        """ Reads existing data from persistent storage and returns it as a DataFrame.
+        """ Reads existing events from all the partitions in persistent storage and returns them as a DataFrame.
         """
 
         # Pandas
         import pandas as pd
 
+        # Collect all the files with events that we have ..
+        file_list = []
+
+        for partition in self.list_partitions():
+            events_dir, _ = self.get_partition_dirs(partition)
+            file_list.extend(self.list_files(events_dir))
+
         # Let's check if we already have anything in storage ..
-        if os.path.exists(self.fs_data_path):
+        if file_list:
 
             #  Let the users know what we are doing ..
-            self.logger.info('Loading DF data from %s', self.fs_data_path)
+            self.logger.info('Loading DF data from %s', self.fs_events_path)
 
             # .. load existing data from storage ..
             start = utcnow()
-            existing = pd.read_parquet(self.fs_data_path) # type: pd.DataFrame
+            existing = self.read_files(file_list)
+
+            # .. partitions are dropped as a whole so they may still contain individual events that are too old ..
+            existing = self.trim(existing)
 
             # .. log the time it took to load the data ..
             self.logger.info('DF data read in %s; len_existing=%s', utcnow() - start, int_to_comma(len(existing)))
@@ -333,7 +535,22 @@ class EventsDatabase(InRAMStore):
 
 # ################################################################################################################################
 
-    def aggregate(self, data, time_freq=Stats.DefaultAggrTimeFreq):
+    def parse_timestamps(self, data):
+        """ Returns data with timestamps parsed, skipping events whose timestamps cannot be parsed.
+        """
+        # type: (DataFrame) -> DataFrame
+
+        # Pandas
+        import pandas as pd
+
+        timestamp = pd.to_datetime(data['timestamp'], errors='coerce')
+        data = data.assign(timestamp=timestamp)
+
+        return data[timestamp.notna()]
+
+# ################################################################################################################################
+
+    def aggregate(self, data, time_freq=Stats.DefaultAggrTimeFreq, agg_by=None):
 
         # Pandas
         import pandas as pd
@@ -351,10 +568,149 @@ class EventsDatabase(InRAMStore):
 
         aggregated = data.\
             groupby(group_by).\
-            agg(**self.agg_by)
+            agg(**(agg_by or self.agg_by))
 
         return aggregated
 
+# ################################################################################################################################
+
+    def summarise(self, data):
+        """ Returns a summary of events per Stats.DefaultAggrTimeFreq bucket and object_id.
+        """
+        # type: (DataFrame) -> DataFrame
+
+        # This is what np.count_nonzero would return for each group, but computed for all of them at once
+        data = data.assign(is_non_zero=data['total_time_ms'] != 0)
+
+        summary = self.aggregate(data, agg_by=self.summary_agg_by)
+        summary = summary.reset_index()
+
+        # Buckets without any events are not stored
+        return summary[(summary['item_count'] > 0) | (summary['item_total_usage'] > 0)]
+
+# ################################################################################################################################
+
+    def get_totals(self, summary):
+        """ Merges all the buckets of a summary into totals per object_id.
+        """
+        # type: (DataFrame) -> DataFrame
+        return summary.groupby(Stats.TabulateAggr).agg(self.summary_merge_by)
+
+# ################################################################################################################################
+
+    def merge_totals(self, totals_list):
+        """ Merges totals per object_id from multiple sources, e.g. partitions.
+        """
+        # type: (list) -> DataFrame
+
+        # Pandas
+        import pandas as pd
+
+        if len(totals_list) == 1:
+            return totals_list[0]
+
+        combined = pd.concat(totals_list)
+        return combined.groupby(level=0).agg(self.summary_merge_by)
+
+# ################################################################################################################################
+
+    def update_totals(self, partition, summary):
+        """ Adds a summary of new events to the totals of the partition they belong to.
+        """
+        # type: (str, DataFrame) -> None
+
+        totals = self.get_totals(summary)
+        existing = self.partition_totals.get(partition)
+
+        if existing is not None:
+            totals = self.merge_totals([existing, totals])
+
+        self.partition_totals[partition] = totals
+        self.discard_boundary_totals(partition)
+
+# ################################################################################################################################
+
+    def discard_boundary_totals(self, partition):
+        """ Makes sure that totals of a partition will not be returned from cache, e.g. because it has new events.
+        """
+        # type: (str) -> None
+
+        if self.boundary_totals and self.boundary_totals[0] == partition:
+            self.boundary_totals = None
+
+# ################################################################################################################################
+
+    def get_boundary_totals(self, partition, first_bucket):
+        """ Returns totals of a partition built out of its summary buckets starting from first_bucket,
+        or None if there are no such buckets. The totals are cached until the first bucket changes.
+        """
+        # type: (str, object) -> DataFrame
+
+        if self.boundary_totals:
+            cached_partition, cached_first_bucket, totals = self.boundary_totals
+            if cached_partition == partition and cached_first_bucket == first_bucket:
+                return totals
+
+        _, summary_dir = self.get_partition_dirs(partition)
+        summary_file_list = self.list_files(summary_dir)
+
+        totals = None
+
+        if summary_file_list:
+            summary = self.read_files(summary_file_list)
+            summary = summary[summary['timestamp'] >= first_bucket]
+            self.telemetry[_op_int_read_parqet] += 1
+
+            if len(summary):
+                totals = self.get_totals(summary)
+
+        self.boundary_totals = (partition, first_bucket, totals)
+        return totals
+
+# ################################################################################################################################
+
+    def get_retained_totals(self, _utcnow=utcnow):
+        """ Returns totals of all the partitions without the events that are older than the retention threshold.
+        Partitions are dropped only once all of their events expire, which is why the oldest retained one may still
+        have some that did. Its totals are built out of the summary buckets that have not expired yet,
+        which means that, like the summaries themselves, they are accurate to one Stats.DefaultAggrTimeFreq bucket.
+        """
+        # type: (callable) -> list
+
+        # Pandas
+        import pandas as pd
+
+        max_retained = _utcnow() - timedelta(milliseconds=self.max_retention)
+
+        # The bucket that the retention threshold falls in is the first one that still has events retained
+        first_bucket = pd.Timestamp(max_retained).floor(Stats.DefaultAggrTimeFreq)
+
+        out = []
+
+        for partition, totals in self.partition_totals.items():
+
+            try:
+                partition_start = datetime.strptime(partition, ModuleCtx.Partition_Format)
+            except ValueError:
+                out.append(totals)
+                continue
+
+            # All the events of this partition are retained ..
+            if partition_start >= first_bucket:
+                out.append(totals)
+
+            # .. none of them are, but the partition has not been dropped yet ..
+            elif partition_start + ModuleCtx.Partition_Delta <= max_retained:
+                continue
+
+            # .. or only some of them are.
+            else:
+                totals = self.get_boundary_totals(partition, first_bucket)
+                if totals is not None:
+                    out.append(totals)
+
+        return out
+
 # ################################################################################################################################
 
     def combine_data(self, existing, current):
@@ -384,14 +740,16 @@ class EventsDatabase(InRAMStore):
 
     def trim(self, data, utcnow=utcnow, timedelta=timedelta):
 
+        # Pandas
+        import pandas as pd
+
         if len(data):
 
             # Check how many of the past events to leave, i.e. events older than this will be discarded
             max_retained = utcnow() - timedelta(milliseconds=self.max_retention)
-            max_retained = max_retained.isoformat()
 
             # .. construct a new dataframe, containing only the events that are younger than max_retained ..
-            data = data[data['timestamp'] > max_retained]
+            data = data[pd.to_datetime(data['timestamp']) > max_retained]
 
         # .. and return it to our caller.
         return data
@@ -399,14 +757,39 @@ class EventsDatabase(InRAMStore):
 # ################################################################################################################################
 
     def save_data(self, data):
+        """ Appends events to persistent storage. Each partition that the events belong to receives a new file with
+        the events and another one with their summary. No existing files are ever modified here.
+        """
         # type: (DataFrame) -> None
 
         # Let the user know what we are doing ..
         self.logger.info('Saving DF to %s', self.fs_data_path)
 
-        # .. save the DF to persistent storage ..
+        # .. save the DF to persistent storage, one partition at a time ..
         start = utcnow()
-        data.to_parquet(self.fs_data_path)
+        partition_names = data['timestamp'].dt.strftime(ModuleCtx.Partition_Format)
+
+        for partition, events in data.groupby(partition_names):
+
+            events_dir, summary_dir = self.get_partition_dirs(partition)
+
+            os.makedirs(events_dir, exist_ok=True)
+            os.makedirs(summary_dir, exist_ok=True)
+
+            # .. summarise the events ..
+            summary = self.summarise(events)
+
+            # .. both files have the same name to make it easier to find events that a summary was built out of ..
+            file_name = self.get_new_file_name()
+
+            events.to_parquet(os.path.join(events_dir, file_name), index=False)
+            summary.to_parquet(os.path.join(summary_dir, file_name), index=False)
+
+            # .. update the totals that tabulating reads ..
+            self.update_totals(partition, summary)
+
+            # .. and make sure that the partition will be compacted once it is closed.
+            self.partitions_to_compact.add(partition)
 
         # .. log the time it took to save to storage ..
         self.logger.info('DF saved in %s', utcnow() - start)
@@ -414,6 +797,100 @@ class EventsDatabase(InRAMStore):
         # .. update counters ..
         self.telemetry[_op_int_save_data] += 1
 
+# ################################################################################################################################
+
+    def compact_files(self, path, merge_func=None):
+        """ Replaces all the files in a directory with a single one.
+        """
+        # type: (str, callable) -> None
+
+        file_list = self.list_files(path)
+
+        # Nothing to do if there is only one file
+        if len(file_list) < 2:
+            return
+
+        data = self.read_files(file_list)
+
+        if merge_func:
+            data = merge_func(data)
+
+        compacted_path = os.path.join(path, ModuleCtx.Compacted_Name + ModuleCtx.File_Suffix)
+
+        # The compacted file is written under a temporary name first, which is not read until it is complete ..
+        temp_path = compacted_path + '.tmp'
+        data.to_parquet(temp_path, index=False)
+        os.replace(temp_path, compacted_path)
+
+        # .. and it is only now that the files it replaces can be deleted.
+        for file_path in file_list:
+            if file_path != compacted_path:
+                os.remove(file_path)
+
+# ################################################################################################################################
+
+    def merge_summaries(self, summary):
+        """ Merges rows of a summary that concern the same bucket and object_id.
+        """
+        # type: (DataFrame) -> DataFrame
+        return summary.groupby(['timestamp', Stats.TabulateAggr], as_index=False).agg(self.summary_merge_by)
+
+# ################################################################################################################################
+
+    def compact_closed_partitions(self, _utcnow=utcnow):
+        """ Compacts each partition that no new events are expected for anymore into one file with events
+        and one with their summary.
+        """
+        # type: (callable) -> None
+
+        current_partition = _utcnow().strftime(ModuleCtx.Partition_Format)
+
+        for partition in sorted(self.partitions_to_compact):
+
+            # Partition names sort in chronological order
+            if partition < current_partition:
+
+                self.logger.info('Compacting DF partition %s', partition)
+
+                events_dir, summary_dir = self.get_partition_dirs(partition)
+                self.compact_files(events_dir)
+                self.compact_files(summary_dir, self.merge_summaries)
+
+                self.partitions_to_compact.remove(partition)
+                self.telemetry[_op_int_compact] += 1
+
+# ################################################################################################################################
+
+    def drop_expired_partitions(self, _utcnow=utcnow):
+        """ Deletes partitions whose all events are older than the retention threshold.
+        """
+        # type: (callable) -> None
+
+        max_retained = _utcnow() - timedelta(milliseconds=self.max_retention)
+
+        for partition in self.list_partitions():
+
+            try:
+                partition_start = datetime.strptime(partition, ModuleCtx.Partition_Format)
+            except ValueError:
+                self.logger.info('Ignoring unrecognised DF partition %s', partition)
+                continue
+
+            # We can stop at the first partition that is still retained because all the subsequent ones are newer
+            if partition_start + ModuleCtx.Partition_Delta > max_retained:
+                break
+
+            self.logger.info('Dropping DF partition %s', partition)
+
+            for path in self.get_partition_dirs(partition):
+                rmtree(path, ignore_errors=True)
+
+            _ = self.partition_totals.pop(partition, None)
+            self.partitions_to_compact.discard(partition)
+            self.discard_boundary_totals(partition)
+
+            self.telemetry[_op_int_drop_partition] += 1
+
 # ################################################################################################################################
 
     def _sync_state(self, _utcnow=utcnow):
@@ -426,20 +903,20 @@ class EventsDatabase(InRAMStore):
         self.logger.info('*********************** DataFrame (DF) Sync storage ***************************** ')
         self.logger.info('********************************************************************************* ')
 
-        # Get the existing data from storage
-        existing = self.load_data_from_storage()
+        # Make sure we know what is already in storage
+        self.load_storage()
 
-        # Get data that is currently in RAM
-        current = self.get_data_from_ram()
+        # Append data that is currently in RAM to storage
+        if self.in_ram_store:
+            current = self.get_data_from_ram()
+            current = self.parse_timestamps(current)
+            self.save_data(current)
 
-        # Combine data from storage and RAM
-        combined = self.combine_data(existing, current)
+        # Compact partitions that will not change anymore
+        self.compact_closed_partitions()
 
-        # Trim the data to the retention threshold
-        trimmed = self.trim(combined)
-
-        # Save the combined result to storage
-        self.save_data(trimmed)
+        # Drop partitions that are past the retention threshold
+        self.drop_expired_partitions()
 
         # Clear our current dataset
         self.in_ram_store[:] = []
@@ -458,23 +935,42 @@ class EventsDatabase(InRAMStore):
 
 # ################################################################################################################################
 
-    def get_table(self):
+    def get_table(self, _utcnow=utcnow):
 
-        # Prepare configuration ..
-        group_by = self.group_by[Stats.TabulateAggr]
+        # Pandas
+        import pandas as pd
 
         with self.update_lock:
 
-            # .. make sure we have access to the latest data ..
-            self._sync_state()
+            # .. make sure we know what is already in storage ..
+            self.load_storage()
 
-            # .. read our input data from persistent storage ..
-            data = self.load_data_from_storage()
+            # .. we have totals of each partition in storage, without the events that have already expired ..
+            totals_list = self.get_retained_totals(_utcnow)
 
-        # .. tabulate all the statistics found ..
-        tabulated = data.\
-            groupby(group_by).\
-            agg(**self.agg_by)
+            # .. and we need to add events that have not been synced yet ..
+            if self.in_ram_store:
+                current = self.get_data_from_ram()
+                current = self.parse_timestamps(current)
+                if len(current):
+                    totals_list.append(self.get_totals(self.summarise(current)))
+
+        # .. there may be no statistics at all yet ..
+        if not totals_list:
+            return pd.DataFrame()
+
+        # .. merge all the totals found ..
+        totals = self.merge_totals(totals_list)
+        self.telemetry[_op_int_combine_data] += 1
+
+        # .. tabulate them, computing the mean out of the total time and usage ..
+        tabulated = pd.DataFrame({
+            'item_max': totals['item_max'],
+            'item_min': totals['item_min'],
+            'item_mean': totals['item_total_time'] / totals['item_count'],
+            'item_total_time': totals['item_total_time'],
+            'item_total_usage': totals['item_total_usage'],
+        })
 
         # .. convert rows to columns which is what our callers expect ..
         tabulated = tabulated.transpose()
@@ -13,35 +13,42 @@ from gzip import GzipFile
 from hashlib import sha256
 from http.client import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
 from io import StringIO
+from time import time
 from traceback import format_exc
 
+# gevent
+from gevent import spawn
+from gevent.event import AsyncResult
+
 # regex
 from regex import compile as regex_compile
 
 # Zato
 from zato.common.api import CHANNEL, CONTENT_TYPE, DATA_FORMAT, HL7, HTTP_SOAP, MISC, RATE_LIMIT, SEC_DEF_TYPE, SIMPLE_IO, \
-    SSO, TRACE1, URL_PARAMS_PRIORITY, ZATO_NONE
+    SSO, stream_types, TRACE1, URL_PARAMS_PRIORITY, ZATO_NONE
 from zato.common.audit_log import DataReceived, DataSent
 from zato.common.const import ServiceConst
 from zato.common.exception import HTTP_RESPONSES
 from zato.common.hl7 import HL7Exception
-from zato.common.json_internal import dumps, loads
+from zato.common.json_internal import dumps
 from zato.common.json_schema import DictError as JSONSchemaDictError, ValidationException as JSONSchemaValidationException
 from zato.common.marshal_.api import Model, ModelValidationError
 from zato.common.rate_limiting.common import AddressNotAllowed, BaseException as RateLimitingException, RateLimitReached
 from zato.common.typing_ import cast_
+from zato.common.util.api import new_cid
 from zato.common.util.exception import pretty_format_exception
 from zato.common.util.http import get_form_data as util_get_form_data, QueryDict
 from zato.cy.reqresp.payload import SimpleIOPayload as CySimpleIOPayload
 from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, MethodNotAllowed, NotFound, \
      TooManyRequests, Unauthorized
+from zato.server.connection.http_soap.stream import gzip_response, ModuleCtx as StreamCtx, new_request_body, RequestBody
 from zato.server.service.internal import AdminService
 
 # ################################################################################################################################
 
 if 0:
     from zato.broker.client import BrokerClient
-    from zato.common.typing_ import any_, anydict, anytuple, callable_, dictnone, stranydict, strlist, strstrdict
+    from zato.common.typing_ import any_, anydict, anytuple, callable_, dict_, dictnone, stranydict, strlist, strstrdict
     from zato.server.service import Service
     from zato.server.base.parallel import ParallelServer
     from zato.server.base.worker import WorkerStore
@@ -156,16 +163,37 @@ def get_client_error_wrapper(transport:'str', data_format:'str') -> 'callable_':
 # ################################################################################################################################
 
 class _CachedResponse:
-    """ A wrapper for responses served from caches.
+    """ A response kept in a channel's cache. It is returned to callers as is, without any copying or parsing,
+    which is why its payload is already serialized and why it must never be modified once it is in a cache.
     """
-    __slots__ = ('payload', 'content_type', 'headers', 'status_code')
+    __slots__ = ('payload', 'content_type', 'headers', 'status_code', 'soft_expires_at')
 
-    def __init__(self, payload:'any_', content_type:'str', headers:'stranydict', status_code:'int') -> 'None':
+    def __init__(
+        self,
+        payload:'any_',
+        content_type:'str',
+        headers:'stranydict',
+        status_code:'int',
+        soft_expires_at:'float'=0.0,
+    ) -> 'None':
         self.payload = payload
         self.content_type = content_type
         self.headers = headers
         self.status_code = status_code
 
+        # After that time, the response is stale and needs to be refreshed, unless it is zero
+        self.soft_expires_at = soft_expires_at
+
+    def is_stale(self) -> 'bool':
+        return bool(self.soft_expires_at) and self.soft_expires_at <= time()
+
+    # Needed because Memcached pickles objects using a protocol that does not support __slots__ on its own
+    def __getstate__(self) -> 'anytuple':
+        return self.payload, self.content_type, self.headers, self.status_code, self.soft_expires_at
+
+    def __setstate__(self, state:'anytuple') -> 'None':
+        self.payload, self.content_type, self.headers, self.status_code, self.soft_expires_at = state
+
 # ################################################################################################################################
 
 class _HashCtx:
@@ -254,8 +282,11 @@ class RequestDispatcher:
         # This is needed in parallel.py's on_wsgi_request
         wsgi_environ['zato.channel_item'] = channel_item
 
-        # Read the raw data
-        payload = wsgi_environ['wsgi.input'].read()
+        # Read the raw data, unless the channel streams it to its service, in which case it will be read only if needed
+        if channel_item and channel_item.get('is_streaming'):
+            payload = new_request_body(wsgi_environ, channel_item)
+        else:
+            payload = wsgi_environ['wsgi.input'].read()
 
         # Store for later use prior to any kind of parsing
         wsgi_environ['zato.http.raw_request'] = payload
@@ -305,7 +336,7 @@ class RequestDispatcher:
                     data_event = DataReceived()
                     data_event.type_ = ModuleCtx.Channel
                     data_event.object_id = channel_item['id']
-                    data_event.data = payload
+                    data_event.data = StreamCtx.Audit_Log_Data if isinstance(payload, RequestBody) else payload
                     data_event.timestamp = req_timestamp
                     data_event.msg_id = cid
 
@@ -347,12 +378,22 @@ class RequestDispatcher:
                 wsgi_environ['zato.http.response.headers'].update(response.headers)
                 wsgi_environ['zato.http.response.status'] = status_response[response.status_code]
 
-                if channel_item['content_encoding'] == 'gzip':
+                # The response may have been served from a cache, in which case it must not be modified
+                payload = response.payload
+
+                # Streams are returned to the client chunk by chunk, as they are read
+                is_stream = isinstance(payload, stream_types)
+
+                if channel_item['content_encoding'] == 'gzip' and is_stream:
+                    payload = gzip_response(payload)
+                    wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
+
+                elif channel_item['content_encoding'] == 'gzip':
 
                     s = StringIO()
                     with GzipFile(fileobj=s, mode='w') as f: # type: ignore
-                        f.write(response.payload)
-                    response.payload = s.getvalue()
+                        f.write(payload)
+                    payload = s.getvalue()
                     s.close()
 
                     wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
@@ -364,7 +405,7 @@ class RequestDispatcher:
                     data_event = DataSent()
                     data_event.type_ = ModuleCtx.Channel
                     data_event.object_id = channel_item['id']
-                    data_event.data = response.payload
+                    data_event.data = StreamCtx.Audit_Log_Data if is_stream else payload
                     data_event.timestamp = _utcnow()
                     data_event.msg_id = 'zrp{}'.format(cid) # This is a response to this CID
                     data_event.in_reply_to = cid
@@ -373,14 +414,12 @@ class RequestDispatcher:
                     self.server.audit_log.store_data_sent(data_event)
 
                 # Finally, return payload to the client, potentially deserializing it from CySimpleIO first.
-                if isinstance(response.payload, CySimpleIOPayload):
-                    payload = response.payload.getvalue()
+                if isinstance(payload, CySimpleIOPayload):
+                    payload = payload.getvalue()
                     if isinstance(payload, dict):
                         if 'response' in payload:
                             payload = payload['response']
                             payload = dumps(payload)
-                else:
-                    payload = response.payload
 
                 return payload
 
@@ -532,6 +571,9 @@ class RequestHandler:
     def __init__(self, server:'ParallelServer') -> 'None':
         self.server = server
 
+        # Cache key -> A result that greenlets waiting for the service to produce a response for that key receive
+        self._cache_in_flight = {} # type: dict_[str, AsyncResult]
+
 # ################################################################################################################################
 
     def _set_response_data(self, service:'Service', **kwargs:'any_'):
@@ -583,8 +625,11 @@ class RequestHandler:
             post = post_data
         else:
             # We cannot parse incoming data if we know for sure that an explicit
-            # data format was set for channel.
-            post = self._get_flattened(raw_request) if not channel_item.data_format else {}
+            # data format was set for channel or if the data is streamed to the service.
+            if channel_item.data_format or isinstance(raw_request, RequestBody):
+                post = {}
+            else:
+                post = self._get_flattened(raw_request)
 
         if channel_item.url_params_pri == URL_PARAMS_PRIORITY.QS_OVER_PATH:
             if _qs:
@@ -627,6 +672,8 @@ class RequestHandler:
         if service.get_request_hash:
             hash_value = service.get_request_hash(_HashCtx(raw_request, channel_item, channel_params, wsgi_environ))
         else:
+            if isinstance(raw_request, RequestBody):
+                raw_request = raw_request.getvalue() # type: ignore
             query_string = str(sorted(channel_params.items()))
             data = '%s%s%s%s' % (wsgi_environ['REQUEST_METHOD'], wsgi_environ['PATH_INFO'], query_string, raw_request)
             hash_value = sha256(data.encode('utf8')).hexdigest()
@@ -635,28 +682,37 @@ class RequestHandler:
         # No matter if hash value is default or from service, always prefix it with channel's type and ID
         cache_key = 'http-channel-%s-%s' % (channel_item['id'], hash_value)
 
-        # We have the key so now we can check if there is any matching response already stored in cache
+        # We have the key so now we can check if there is any matching response already stored in cache ..
         response = self.server.get_from_cache(channel_item['cache_type'], channel_item['cache_name'], cache_key)
 
-        # If there is any response, we can now load into a format that our callers expect
-        if response:
-            response = loads(response)
-            response = _CachedResponse(response['payload'], response['content_type'], response['headers'],
-                response['status_code'])
+        # .. which is already in a format that our callers expect, unless it was stored in a different one
+        # .. by a previous version, in which case we treat it as though it did not exist.
+        if not isinstance(response, _CachedResponse):
+            response = None
 
         return cache_key, response
 
 # ################################################################################################################################
 
-    def set_response_in_cache(self, channel_item:'any_', key:'str', response:'any_'):
+    def set_response_in_cache(self, channel_item:'any_', key:'str', response:'any_') -> '_CachedResponse':
         """ Caches responses from this channel's invocation for as long as the cache is configured to keep it.
         """
-        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, dumps({
-            'payload': response.payload,
-            'content_type': response.content_type,
-            'headers': response.headers,
-            'status_code': response.status_code,
-        }))
+        # Serialize the payload upfront so that it can be returned as is each time it is read from the cache
+        payload = response.payload
+        if isinstance(payload, str):
+            payload = payload.encode('utf8')
+
+        # If the channel has a soft expiry, the response will be refreshed once that much time has passed
+        soft_expiry = channel_item.get('cache_soft_expiry') or 0
+        soft_expires_at = time() + soft_expiry if soft_expiry else 0.0
+
+        cached = _CachedResponse(payload, response.content_type, dict(response.headers), response.status_code,
+            soft_expires_at)
+
+        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, cached,
+            channel_item.get('cache_expiry') or 0.0)
+
+        return cached
 
 # ################################################################################################################################
 
@@ -685,14 +741,33 @@ class RequestHandler:
         else:
             channel_params = {}
 
-        # This is needed for type checking to make sure the name is bound
-        cache_key = ''
+        # Everything that is needed to invoke the service
+        invoke_args = (service, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config,
+            post_data, channel_params)
 
-        # If caching is configured for this channel, we need to first check if there is no response already
+        # If caching is configured for this channel, the response may be already available ..
         if channel_item['cache_type']:
-            cache_key, response = self.get_response_from_cache(service, raw_request, channel_item, channel_params, wsgi_environ)
-            if response:
-                return response
+            return self._handle_cached(*invoke_args)
+
+        # .. otherwise, we invoke the service directly.
+        else:
+            return self._invoke_service(*invoke_args)
+
+# ################################################################################################################################
+
+    def _invoke_service(
+        self,
+        service:'Service',
+        cid:'str',
+        url_match:'any_',
+        channel_item:'any_',
+        wsgi_environ:'stranydict',
+        raw_request:'str',
+        worker_store:'WorkerStore',
+        simple_io_config:'stranydict',
+        post_data:'dictnone',
+        channel_params:'stranydict',
+    ) -> 'any_':
 
         # Add any path params matched to WSGI environment so it can be easily accessible later on
         wsgi_environ['zato.http.path_params'] = url_match
@@ -701,8 +776,7 @@ class RequestHandler:
         if channel_item['data_format'] == ModuleCtx.SIO_FORM_DATA:
             wsgi_environ['zato.request.payload'] = post_data
 
-        # No cache for this channel or no cached response, invoke the service then.
-        response = service.update_handle(self._set_response_data, service, raw_request,
+        return service.update_handle(self._set_response_data, service, raw_request,
             CHANNEL.HTTP_SOAP, channel_item.data_format, channel_item.transport, self.server,
             cast_('BrokerClient', worker_store.broker_client),
             worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
@@ -710,14 +784,92 @@ class RequestHandler:
             merge_channel_params=channel_item.merge_url_params_req,
             params_priority=channel_item.params_pri)
 
-        # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
-        if channel_item['cache_type']:
-            self.set_response_in_cache(channel_item, cache_key, response)
+# ################################################################################################################################
+
+    def _handle_cached(self, service:'Service', *invoke_args:'any_') -> 'any_':
+        """ Returns a response to a request to a channel with a cache. For each cache key, only one greenlet at a time
+        invokes the service while all the other ones wait for the response it produces. If the channel has a soft expiry,
+        stale responses are refreshed by one greenlet too and, if the channel allows it, they are still returned
+        to everyone else until the refresh completes.
+        """
+        _, _, channel_item, wsgi_environ, raw_request, _, _, _, channel_params = invoke_args
+
+        cache_key, cached = self.get_response_from_cache(service, raw_request, channel_item, channel_params, wsgi_environ)
+
+        if cached:
 
-        # Having used the cache or not, we can return the response now
-        response
-        response
-        return response
+            # A response that is not stale can be returned immediately ..
+            if not cached.is_stale():
+                return cached
+
+            # .. a stale one as well, if the channel lets us do it, but it will be also refreshed in background ..
+            if channel_item.get('cache_stale_while_revalidate'):
+
+                if cache_key not in self._cache_in_flight:
+                    _ = spawn(self._refresh_cached, cache_key, service, *invoke_args)
+
+                return cached
+
+        # .. otherwise, we need a response from the service, but if someone is already waiting for it, we wait too ..
+        in_flight = self._cache_in_flight.get(cache_key)
+        if in_flight:
+            cached = in_flight.get()
+
+            # .. unless no response was produced, e.g. because of an exception in the service,
+            # .. in which case we need to invoke it ourselves ..
+            if cached:
+                return cached
+            else:
+                return self._invoke_service(service, *invoke_args)
+
+        # .. and if no one is, it is our greenlet that invokes the service.
+        return self._invoke_and_cache(cache_key, service, *invoke_args)
+
+# ################################################################################################################################
+
+    def _invoke_and_cache(self, cache_key:'str', service:'Service', *invoke_args:'any_') -> 'any_':
+        """ Invokes a service and caches its response, letting everyone waiting for that response know about it.
+        """
+        channel_item = invoke_args[2]
+
+        in_flight = self._cache_in_flight[cache_key] = AsyncResult()
+        cached = None
+
+        try:
+            response = self._invoke_service(service, *invoke_args)
+
+            # Streams can be read only once so they cannot be cached and everyone waiting will invoke the service
+            if not isinstance(response.payload, stream_types):
+                cached = self.set_response_in_cache(channel_item, cache_key, response)
+
+            return response
+
+        finally:
+            # This is None if the service raised an exception or returned a stream
+            in_flight.set(cached)
+            _ = self._cache_in_flight.pop(cache_key, None)
+
+# ################################################################################################################################
+
+    def _refresh_cached(self, cache_key:'str', service:'Service', *invoke_args:'any_') -> 'None':
+        """ Refreshes a stale response in background. Runs in a greenlet of its own, with a copy of the WSGI environment
+        of the request that found the response to be stale, because that request has already been responded to.
+        """
+        cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config, post_data, \
+            channel_params = invoke_args
+
+        # Someone may have started to refresh it in the meantime
+        if cache_key in self._cache_in_flight:
+            return
+
+        wsgi_environ = dict(wsgi_environ)
+        wsgi_environ['zato.http.response.headers'] = {}
+
+        try:
+            _ = self._invoke_and_cache(cache_key, service, new_cid(), url_match, channel_item, wsgi_environ, raw_request,
+                worker_store, simple_io_config, post_data, channel_params)
+        except Exception:
+            logger.warning('Could not refresh a cached response, cid:`%s`, key:`%s`, e:`%s`', cid, cache_key, format_exc())
 
 # ################################################################################################################################
 
@@ -755,6 +907,11 @@ class RequestHandler:
             if not isinstance(response.payload, str):
                 if isinstance(response.payload, dict) and data_format in ModuleCtx.Dict_Like:
                     response.payload = dumps(response.payload)
+
+                # Streams are returned as they are
+                elif isinstance(response.payload, stream_types):
+                    return
+
                 else:
                     if response.payload:
                         if isinstance(response.payload, Model):
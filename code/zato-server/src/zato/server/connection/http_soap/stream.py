@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from functools import partial
+from tempfile import SpooledTemporaryFile
+from zlib import compressobj, DEFLATED, MAX_WBITS
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, callable_, intnone, iterator_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # How many bytes at a time to read from requests and to send in responses
+    Chunk_Size = 64 * 1024
+
+    # Request bodies bigger than that are spooled to temporary files rather than kept in RAM
+    Spool_Threshold = 1024 * 1024
+
+    # Makes zlib produce gzip headers and trailers
+    Gzip_WBits = 16 + MAX_WBITS
+
+    # What audit log stores instead of streamed messages, which are never read in full because of it
+    Audit_Log_Data = '(stream)'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RequestBody:
+    """ A body of a request to a streaming HTTP channel. Services can read it chunk by chunk, like a file or an iterator,
+    in which case it is never kept in full in RAM. If it is needed as a whole, e.g. because a service accesses
+    self.request.payload, it is first spooled, in RAM up to a threshold and then in a temporary file.
+    """
+    def __init__(
+        self,
+        wsgi_input,      # type: any_
+        content_length,  # type: intnone
+        spool_threshold=ModuleCtx.Spool_Threshold # type: int
+    ) -> 'None':
+
+        self.wsgi_input = wsgi_input
+        self.spool_threshold = spool_threshold
+
+        # How many bytes are still to be read from input, None if there is no Content-Length
+        self.remaining = content_length
+
+        # Set once the body is spooled
+        self.spool = None # type: SpooledTemporaryFile | None
+
+        # If any part of input was given to the service directly, it cannot be spooled anymore
+        self.has_read_input = False
+
+# ################################################################################################################################
+
+    def _read_input(self, size:'int') -> 'bytes':
+
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+            if size <= 0:
+                return b''
+
+        data = self.wsgi_input.read(size)
+
+        if self.remaining is not None:
+            self.remaining -= len(data)
+
+        return data
+
+# ################################################################################################################################
+
+    def read(self, size:'int'=-1) -> 'bytes':
+        """ Reads up to size bytes of the body or all of the remaining ones if size is negative.
+        """
+        if self.spool:
+            return self.spool.read(size)
+
+        self.has_read_input = True
+
+        if size < 0:
+            return b''.join(iter(partial(self._read_input, ModuleCtx.Chunk_Size), b''))
+        else:
+            return self._read_input(size)
+
+# ################################################################################################################################
+
+    def __iter__(self) -> 'iterator_[bytes]':
+        return iter(partial(self.read, ModuleCtx.Chunk_Size), b'')
+
+# ################################################################################################################################
+
+    def spool_body(self) -> 'SpooledTemporaryFile':
+        """ Reads the whole body into a spool, unless it has been already done, and returns that spool.
+        """
+        if not self.spool:
+
+            if self.has_read_input:
+                raise ValueError('Request body cannot be spooled after it has been read as a stream')
+
+            spool = SpooledTemporaryFile(max_size=self.spool_threshold)
+
+            for chunk in iter(partial(self._read_input, ModuleCtx.Chunk_Size), b''):
+                _ = spool.write(chunk)
+
+            _ = spool.seek(0)
+            self.spool = spool
+
+        return self.spool
+
+# ################################################################################################################################
+
+    def getvalue(self) -> 'bytes':
+        """ Returns the whole body, spooling it first if needed.
+        """
+        spool = self.spool_body()
+        position = spool.tell()
+
+        _ = spool.seek(0)
+        data = spool.read()
+        _ = spool.seek(position)
+
+        return data
+
+# ################################################################################################################################
+
+    def close(self) -> 'None':
+        if self.spool:
+            self.spool.close()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def new_request_body(wsgi_environ:'any_', channel_item:'any_') -> 'RequestBody':
+    """ Returns a new body of a request to a streaming channel, based on that channel's configuration.
+    """
+    content_length = wsgi_environ.get('CONTENT_LENGTH')
+    content_length = int(content_length) if content_length else None
+
+    spool_threshold = channel_item.get('stream_spool_threshold') or ModuleCtx.Spool_Threshold
+
+    return RequestBody(wsgi_environ['wsgi.input'], content_length, spool_threshold)
+
+# ################################################################################################################################
+
+def iter_response(payload:'any_', file_wrapper:'callable_ | None'=None) -> 'any_':
+    """ Turns a stream payload into an iterable of bytes that can be returned to a WSGI server. File-like objects
+    are wrapped in the server's own wrapper, if there is one, which lets it use sendfile.
+    """
+    if hasattr(payload, 'read'):
+        if file_wrapper:
+            return file_wrapper(payload, ModuleCtx.Chunk_Size)
+        else:
+            return iter(partial(payload.read, ModuleCtx.Chunk_Size), b'')
+
+    return (elem.encode('utf8') if isinstance(elem, str) else elem for elem in payload)
+
+# ################################################################################################################################
+
+def gzip_response(payload:'any_') -> 'iterator_[bytes]':
+    """ Compresses a stream payload chunk by chunk.
+    """
+    compressor = compressobj(9, DEFLATED, ModuleCtx.Gzip_WBits)
+
+    for chunk in iter_response(payload):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -300,7 +300,7 @@ class URLData(CyURLData, OAuthDataStore):
                 return False
 
         token = authorization.split('Bearer ', 1)[1]
-        result = JWT(self.odb, self.worker.server.decrypt, self.jwt_secret).validate(
+        result = JWT(self.odb, self.worker.server.decrypt, self.jwt_secret, self.worker.server.jwt_token_cache).validate(
             sec_def.username, token.encode('utf8'))
 
         if not result.valid:
@@ -607,7 +607,7 @@ class URLData(CyURLData, OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
-            self.channel_data.pop(match_idx)
+            self.unindex_channel(self.channel_data.pop(match_idx))
 
 # ################################################################################################################################
 
@@ -1055,7 +1055,8 @@ class URLData(CyURLData, OAuthDataStore):
         for name in('connection', 'content_type', 'data_format', 'host', 'id', 'has_rbac', 'impl_name', 'is_active',
             'is_internal', 'merge_url_params_req', 'method', 'name', 'params_pri', 'ping_method', 'pool_size', 'service_id',
             'service_name', 'soap_action', 'soap_version', 'transport', 'url_params_pri', 'url_path', 'sec_use_rbac',
-            'cache_type', 'cache_id', 'cache_name', 'cache_expiry', 'content_encoding', 'match_slash', 'hl7_version',
+            'cache_type', 'cache_id', 'cache_name', 'cache_expiry', 'cache_soft_expiry', 'cache_stale_while_revalidate',
+            'is_streaming', 'stream_spool_threshold', 'content_encoding', 'match_slash', 'hl7_version',
             'json_path', 'should_parse_on_input', 'should_validate', 'should_return_errors', 'data_encoding',
             'is_audit_log_sent_active', 'is_audit_log_received_active', 'max_len_messages_sent', 'max_len_messages_received',
             'max_bytes_per_message_sent', 'max_bytes_per_message_received'):
@@ -1127,6 +1128,7 @@ class URLData(CyURLData, OAuthDataStore):
         match_target = get_match_target(msg, http_methods_allowed_re=self.worker.server.http_methods_allowed_re)
         channel_item = self._channel_item_from_msg(msg, match_target, old_data)
         self.channel_data.append(channel_item)
+        self.index_channel(channel_item)
         self.url_sec[match_target] = self._sec_info_from_msg(msg)
 
         self._remove_from_cache(match_target)
@@ -1165,6 +1167,7 @@ class URLData(CyURLData, OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             old_data = self.channel_data.pop(match_idx)
+            self.unindex_channel(old_data)
         else:
             old_data = {}
 
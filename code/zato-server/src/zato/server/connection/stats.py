@@ -7,14 +7,19 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from collections import deque
+from itertools import islice
 from logging import getLogger
+from traceback import format_exc
 
 # gevent
+from gevent import spawn
+from gevent.event import Event
 from gevent.lock import RLock
 
 # Zato
 from zato.common.events.client import Client as EventsClient
-from zato.common.events.common import EventInfo, PushCtx
+from zato.common.events.common import Default as EventsDefault, EventInfo, PushCtx
 from zato.common.util.api import new_cid
 
 # ################################################################################################################################
@@ -33,15 +38,47 @@ object_type_service = EventInfo.ObjectType.service
 # ################################################################################################################################
 
 class ServiceStatsClient:
-    def __init__(self, impl_class=None):
-        # type: (object) -> None
+    """ Sends events about service invocations to the events database. Services only append events to a bounded
+    backlog and a background flusher greenlet sends them to the database in batches.
+    """
+    def __init__(
+        self,
+        impl_class=None, # type: object
+        batch_size=EventsDefault.push_batch_size,         # type: int
+        flush_interval=EventsDefault.push_flush_interval, # type: float
+        buffer_size=EventsDefault.push_buffer_size,       # type: int
+    ):
+        # type: (...) -> None
         self.host = '<ServiceStatsClient-host>'
         self.port = -1
         self.impl = None # type: EventsClient
         self.impl_class = impl_class or EventsClient
-        self.backlog = []
         self.lock = RLock()
 
+        # Events waiting to be sent, appended to by services and consumed by the flusher ..
+        self.backlog = deque() # type: deque[PushCtx]
+
+        # .. which sends them in batches of up to that many events ..
+        self.batch_size = batch_size
+
+        # .. once in that many seconds, unless a full batch is ready earlier ..
+        self.flush_interval = flush_interval
+
+        # .. the backlog can grow up to that many events ..
+        self.buffer_size = buffer_size
+
+        # .. and events that do not fit in it are dropped and counted here ..
+        self.num_dropped = 0
+
+        # .. whereas this is how many dropped events the flusher already reported in logs.
+        self.num_dropped_reported = 0
+
+        # Set by services when there are enough events for a full batch
+        self.batch_ready = Event()
+
+        # A greenlet sending events from the backlog
+        self.flusher = None
+
 # ################################################################################################################################
 
     def init(self, host, port):
@@ -53,6 +90,9 @@ class ServiceStatsClient:
             self.impl = self.impl_class(self.host, self.port)
             self.impl.connect()
 
+            if not self.flusher:
+                self.flusher = spawn(self._run_flusher)
+
 # ################################################################################################################################
 
     def run(self):
@@ -60,36 +100,69 @@ class ServiceStatsClient:
 
 # ################################################################################################################################
 
-    def _push_backlog(self):
-        """ Pushes an event to the backend, assuming that we have access to the backend already.
+    def _run_flusher(self):
+        """ Runs in background, sending the backlog each time a full batch is ready or once in self.flush_interval seconds.
         """
-        # type: (str, str, str, int, str) -> None
+        while True:
+
+            _ = self.batch_ready.wait(self.flush_interval)
+            self.batch_ready.clear()
 
-        # Make sure we are connected to the backend ..
-        if self.impl:
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Could not flush stats backlog, e:`%s`', format_exc())
 
-            # .. ensure no updates to the backlog while we run ..
-            with self.lock:
+# ################################################################################################################################
+
+    def flush(self):
+        """ Sends all the events from the backlog to the backend, in batches, assuming that we have access to the backend.
+        """
+        # type: () -> None
 
-                # .. get all enqueued events ..
-                for item in self.backlog[:]: # type: PushCtx
+        # Report events that could not be enqueued since the last time we were here ..
+        num_dropped = self.num_dropped
 
-                    # .. push each to the backend ..
-                    self.impl.push(item)
+        if num_dropped != self.num_dropped_reported:
+            logger.warning('Dropped %s stats event(s) because the backlog was full (max. %s); total dropped: %s',
+                num_dropped - self.num_dropped_reported, self.buffer_size, num_dropped)
+            self.num_dropped_reported = num_dropped
 
-                    # .. and remove it from the queue ..
-                    self.backlog.remove(item)
+        # .. make sure we are connected to the backend ..
+        if not self.impl:
+            return
+
+        # Local aliases
+        backlog = self.backlog
+        popleft = backlog.popleft
+
+        # .. ensure that nothing else uses the connection while we run ..
+        with self.lock:
+
+            # .. and send all the enqueued events. Events are removed from the backlog only after they have been sent,
+            # which is safe because it is only us who remove them, so that a batch that could not be sent will be retried.
+            while backlog:
+                batch = list(islice(backlog, self.batch_size))
+                self.impl.push_batch(batch)
+
+                for _ in range(len(batch)):
+                    _ = popleft()
 
 # ################################################################################################################################
 
     def push(self, cid, timestamp, service_name, is_request, total_time_ms=0, id=None):
-        """ Accepts information about the service, enqueues it as a push context and tries to empty the backlog.
-        The reason we first need the backlog is that we may not be connected to the backend yet
-        when this method executes. That is we need a staging area, a backlog, first.
+        """ Accepts information about the service and enqueues it as a push context for the flusher to send.
+        The backlog is also needed because we may not be connected to the backend yet when this method executes.
+        Nothing here blocks because this is called on the path of each service invocation.
         """
         # type: (str, str, str, int, str) -> None
 
-        # Fill out the details of a context object ..
+        # If the backlog is full, the event is dropped - we only count it here and the flusher will log it ..
+        if len(self.backlog) >= self.buffer_size:
+            self.num_dropped += 1
+            return
+
+        # .. otherwise, fill out the details of a context object ..
         ctx = PushCtx()
         ctx.id = id or new_cid()
         ctx.cid = cid
@@ -99,12 +172,12 @@ class ServiceStatsClient:
         ctx.object_id = service_name
         ctx.total_time_ms = total_time_ms
 
-        # .. push the event to the backlog queue, using a lock to ensure the backlog is not modified in between ..
-        with self.lock:
-            self.backlog.append(ctx)
+        # .. enqueue it ..
+        self.backlog.append(ctx)
 
-        # .. and try to send it to the backend now.
-        self._push_backlog()
+        # .. and let the flusher know if it can already send a full batch.
+        if len(self.backlog) >= self.batch_size:
+            self.batch_ready.set()
 
 # ################################################################################################################################
 
@@ -116,6 +189,9 @@ class ServiceStatsClient:
 
     def sync_state(self):
 
+        # Make sure that the database has all the events that we have received so far
+        self.flush()
+
         with self.lock:
             self.impl.sync_state()
 
@@ -39,11 +39,13 @@ from bunch import Bunch, bunchify
 
 # gevent
 from gevent import sleep, socket, spawn
+from gevent.event import AsyncResult, Event
 from gevent.lock import RLock
 from gevent.pywsgi import WSGIServer as _Gevent_WSGIServer
 
 # ws4py
 from ws4py.exc import HandshakeError
+from ws4py.messaging import TextMessage
 from ws4py.websocket import WebSocket as _WebSocket
 from ws4py.server.geventserver import GEventWebSocketPool, WebSocketWSGIHandler
 from ws4py.server.wsgiutils import WebSocketWSGIApplication
@@ -71,7 +73,8 @@ if 0:
     from gevent._socketcommon import SocketMixin
     from zato.common.audit_log import DataEvent
     from zato.common.model.wsx import WSXConnectorConfig
-    from zato.common.typing_ import any_, anydict, anylist, boolnone, callable_, callnone, intnone, optional, stranydict, strset
+    from zato.common.typing_ import any_, anydict, anylist, boolnone, callable_, callnone, dict_, intnone, list_, optional, \
+        stranydict, strset
     from zato.server.base.parallel import ParallelServer
 
     DataEvent = DataEvent
@@ -138,6 +141,7 @@ class close_code:
     runtime_invoke_client = 3701
     runtime_background_ping = 3702
     unhandled_error = 3703
+    too_many_frames_pending = 3704
     runtime_error = 4003
     connection_error = 4003
     default_closed = 4004
@@ -164,6 +168,9 @@ _audit_msg_type = WEB_SOCKET.AUDIT_KEY
 # ################################################################################################################################
 
 log_msg_max_size = 8192
+
+# A client with that many frames waiting to be written to it does not keep up with what is sent to it
+frames_pending_max = 10_000
 _interact_update_interval = WEB_SOCKET.DEFAULT.INTERACT_UPDATE_INTERVAL
 
 # ################################################################################################################################
@@ -311,6 +318,7 @@ class WebSocket(_WebSocket):
         ping_interval = ping_interval or WEB_SOCKET.DEFAULT.PING_INTERVAL
 
         self.has_session_opened = False
+        self.session_opened_event = Event()
         self._token = None
         self.update_lock = RLock()
         self.ext_client_id = None
@@ -408,8 +416,12 @@ class WebSocket(_WebSocket):
         for name in _wsgi_drop_keys:
             _ = self.initial_http_wsgi_environ.pop(name, None)
 
-        # Responses to previously sent requests - keyed by request IDs
-        self.responses_received = {}
+        # Requests sent to the client that are still waiting for their responses - keyed by request IDs
+        self.responses_pending = {} # type: dict_[str, AsyncResult]
+
+        # Frames built once for many clients, e.g. in broadcasts, waiting to be written to this one's socket
+        self.frames_pending = [] # type: list_[bytes]
+        self.is_sending_frames = False
 
         _local_address = self.sock.getsockname() # type: ignore
         self._local_address = '{}:{}'.format(_local_address[0], _local_address[1])
@@ -756,6 +768,7 @@ class WebSocket(_WebSocket):
                 self.token = 'zwsxt.{}'.format(self_token)
 
                 self.has_session_opened = True
+                self.session_opened_event.set()
                 self.ext_client_id = request.ext_client_id
                 self.ext_client_name = request.ext_client_name
 
@@ -1123,30 +1136,6 @@ class WebSocket(_WebSocket):
                 logger.warning(_msg, _meta)
                 logger_zato.warning(_msg, _meta)
 
-# ################################################################################################################################
-
-    def _wait_for_event(
-        self,
-        wait_time:'int',
-        condition_callable:'callable_',
-        _delta:'callable_'=timedelta,
-        _sleep:'callable_'=sleep,
-        *args:'any_',
-        **kwargs:'any_'
-    ) -> 'any_':
-
-        now = _now()
-        until = now + _delta(seconds=wait_time)
-
-        while now < until:
-
-            response = condition_callable(*args, **kwargs)
-            if response:
-                return response
-            else:
-                _sleep(0.01)
-                now = _now()
-
 # ################################################################################################################################
 
     def _handle_client_response(
@@ -1170,17 +1159,33 @@ class WebSocket(_WebSocket):
                 request['msg'] = msg
                 hook(**request)
 
-        # Regular synchronous response, simply enqueue it and someone else will take care of it
+        # Regular synchronous response, simply hand it over to whoever is waiting for it
         else:
-            self.responses_received[msg.in_reply_to] = msg
+            self._set_client_response(msg.in_reply_to, msg)
+
+# ################################################################################################################################
 
-    def _has_client_response(self, request_id:'str') -> 'any_':
-        return self.responses_received.get(request_id)
+    def _set_client_response(self, request_id:'str', response:'any_') -> 'None':
+        """ Wakes up the greenlet waiting for a response to the request of the given ID. Responses that no one waits for,
+        e.g. because they arrived after a timeout or to requests that did not need them, are ignored.
+        """
+        result = self.responses_pending.pop(request_id, None)
+        if result is not None:
+            result.set(response)
+        elif logger_has_debug:
+            logger.debug('Ignoring response to `%s` without a pending request (%s)', request_id, self.peer_conn_info_pretty)
+
+# ################################################################################################################################
 
-    def _wait_for_client_response(self, request_id:'str', wait_time:'int'=5) -> 'any_':
-        """ Wait until a response from client arrives and return it or return None if there is no response up to wait_time.
+    def _cancel_client_responses(self) -> 'None':
+        """ Wakes up all the greenlets still waiting for responses from the client, e.g. because it has just disconnected,
+        and each of them receives None, the same as if its request timed out.
         """
-        return self._wait_for_event(wait_time, self._has_client_response, request_id=request_id)
+        responses_pending = self.responses_pending
+        self.responses_pending = {}
+
+        for result in responses_pending.values():
+            result.set(None)
 
 # ################################################################################################################################
 
@@ -1306,6 +1311,67 @@ class WebSocket(_WebSocket):
         # Call the super-class that will actually send the message.
         super().send(data)
 
+# ################################################################################################################################
+
+    def send_frame(self, frame:'bytes', data:'any_', cid:'str') -> 'None':
+        """ Sends a frame that has already been built, possibly for many clients at once. Frames are written in background
+        and the ones that are queued up while a previous write is still in progress are written together.
+        """
+        if self.is_audit_log_sent_active:
+            self._store_audit_log_data(DataSent, data, cid)
+
+        # There is no point in sending anything to a client that is being disconnected ..
+        if self._disconnect_requested:
+            return
+
+        # .. including one that is too slow to read what it is sent, which is why its frames are dropped
+        # .. and it is disconnected in background, so as not to make our caller, e.g. a broadcast, wait for it.
+        if len(self.frames_pending) >= frames_pending_max:
+            self.frames_pending = []
+            self._disconnect_requested = True
+
+            msg = 'Disconnecting a client with %s frames pending, conn:`%s`'
+            logger.info(msg, frames_pending_max, self.peer_conn_info_pretty)
+            logger_zato.info(msg, frames_pending_max, self.peer_conn_info_pretty)
+
+            _ = spawn(self.disconnect_client, cid, close_code.too_many_frames_pending, 'Too many frames pending')
+            return
+
+        self.frames_pending.append(frame)
+
+        if not self.is_sending_frames:
+            self.is_sending_frames = True
+            _ = spawn(self._send_pending_frames)
+
+# ################################################################################################################################
+
+    def _send_pending_frames(self) -> 'None':
+
+        try:
+            while self.frames_pending:
+
+                frames = self.frames_pending
+                self.frames_pending = []
+
+                self._write(frames[0] if len(frames) == 1 else b''.join(frames))
+
+        except RuntimeError as e:
+            self.frames_pending = []
+
+            if str(e) == _cannot_send:
+                msg = 'Cannot send frames (socket terminated #3), conn:`%s`'
+                logger.info(msg, self.peer_conn_info_pretty)
+                logger_zato.info(msg, self.peer_conn_info_pretty)
+
+            self.disconnect_client(code=close_code.runtime_invoke_client, reason='Client invocation runtime error')
+
+        except Exception:
+            self.frames_pending = []
+            logger.warning('Could not send frames to `%s`, e:`%s`', self.peer_conn_info_pretty, format_exc())
+
+        finally:
+            self.is_sending_frames = False
+
 # ################################################################################################################################
 
     def _store_audit_log_data(
@@ -1363,7 +1429,7 @@ class WebSocket(_WebSocket):
         is closed.
         """
         try:
-            if self._wait_for_event(self.config.new_token_wait_time, lambda: self.has_session_opened):
+            if self.session_opened_event.wait(self.config.new_token_wait_time):
                 return
 
             # We get here if self.has_session_opened has not been set to True by self.create_session_by
@@ -1424,34 +1490,49 @@ class WebSocket(_WebSocket):
             logger.info('Sending message `%s` from `%s` to `%s` `%s` `%s` `%s`', self._shorten_data(serialized),
                 self.python_id, self.pub_client_id, self.ext_client_id, self.ext_client_name, self.peer_conn_info_pretty)
 
+        # We will wait for a response but only if it is not a pub/sub message, these are always asynchronous
+        # and that channel's WSX hook will process the response, if any arrives. Note that we need to start to wait
+        # before the request is sent, otherwise, a response could arrive before we know that someone needs it.
+        if wait_for_response and _Class is not InvokeClientPubSubRequest:
+            msg_id = msg.id
+            result = self.responses_pending[msg_id] = AsyncResult()
+        else:
+            msg_id = None
+            result = None
+
         try:
-            if use_send:
-                self.send(serialized, cid, msg.in_reply_to)
-            else:
-                # Do not send whitespace so as not to the exceed the 125 bytes length limit
-                # that each ping message has to be contained within.
-                serialized = serialized.replace(' ', '').replace('\n', '')
-                self.ping(serialized)
 
-        except RuntimeError as e:
-            if str(e) == _cannot_send:
-                msg = 'Cannot send message (socket terminated #2), cid:`%s`, msg:`%s` conn:`%s`'
-                data_msg = self._shorten_data(msg)
-                logger.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
-                logger_zato.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
-
-            self.disconnect_client(cid, close_code.runtime_invoke_client, 'Client invocation runtime error')
-            raise RuntimeInvocationError(cid, 'WSX client disconnected cid:`{}, peer:`{}`'.format(cid, self.peer_conn_info_pretty))
-
-        # Wait for response but only if it is not a pub/sub message,
-        # these are always asynchronous and that channel's WSX hook
-        # will process the response, if any arrives.
-        if _Class is not InvokeClientPubSubRequest:
-            if wait_for_response:
-                response = self._wait_for_client_response(msg.id, timeout)
+            try:
+                if use_send:
+                    self.send(serialized, cid, msg.in_reply_to)
+                else:
+                    # Do not send whitespace so as not to the exceed the 125 bytes length limit
+                    # that each ping message has to be contained within.
+                    serialized = serialized.replace(' ', '').replace('\n', '')
+                    self.ping(serialized)
+
+            except RuntimeError as e:
+                if str(e) == _cannot_send:
+                    msg = 'Cannot send message (socket terminated #2), cid:`%s`, msg:`%s` conn:`%s`'
+                    data_msg = self._shorten_data(msg)
+                    logger.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
+                    logger_zato.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
+
+                self.disconnect_client(cid, close_code.runtime_invoke_client, 'Client invocation runtime error')
+                raise RuntimeInvocationError(
+                    cid, 'WSX client disconnected cid:`{}, peer:`{}`'.format(cid, self.peer_conn_info_pretty))
+
+            # The response will be None if it does not arrive in time or if the client disconnects in the meantime ..
+            if result is not None:
+                response = result.wait(timeout)
                 if response:
                     return response if isinstance(response, bool) else response.data # It will be bool in pong responses
 
+        # .. and, whether there was a response or not, even if our own greenlet was killed, the request is no longer pending.
+        finally:
+            if msg_id is not None:
+                _ = self.responses_pending.pop(msg_id, None)
+
 # ################################################################################################################################
 
     def _close_connection(self, verb:'str', *_ignored_args:'any_', **_ignored_kwargs:'any_') -> 'None':
@@ -1462,6 +1543,9 @@ class WebSocket(_WebSocket):
         self.unregister_auth_client()
         self.container.clients.pop(self.pub_client_id, None)
 
+        # No responses will arrive from now on, so there is no point in waiting for them
+        self._cancel_client_responses()
+
         # Unregister the client from audit log
         if self.is_audit_log_sent_active or self.is_audit_log_received_active:
             self.parallel_server.audit_log.delete_container(_audit_msg_type, self.pub_client_id)
@@ -1507,7 +1591,7 @@ class WebSocket(_WebSocket):
         # we cannot use in_reply_to because pong messages are 1:1 copies of ping ones.
         data = self._json_parser.parse(msg.data) # type: any_
         msg_id = data['meta']['id']
-        self.responses_received[msg_id] = True
+        self._set_client_response(msg_id, True)
 
         # Since we received a pong response, it means that the peer is connected,
         # in which case we update its pub/sub metadata.
@@ -1653,6 +1737,9 @@ class WebSocketContainer(WebSocketWSGIApplication):
 
     def invoke_client_by_attrs(self, cid:'str', attrs:'stranydict', request:'any_', timeout:'int') -> 'any_':
 
+        # Clients to invoke
+        clients = []
+
         # Iterate over all the currently connected WebSockets ..
         for client in self.clients.values():
 
@@ -1680,15 +1767,52 @@ class WebSocketContainer(WebSocketWSGIApplication):
                 # .. if we are here, it means that this client can be invoked ..
                 should_invoke = True
 
-            # .. do invoke it now in background ..
+            # .. if it does, we will invoke it ..
             if should_invoke:
-                _ = spawn(client.invoke_client, cid, request, wait_for_response=False)
+                clients.append(client)
+
+        # .. along with all the other matching clients, in background.
+        self._fan_out(cid, request, clients)
 
 # ################################################################################################################################
 
     def broadcast(self, cid:'str', request:'any_') -> 'None':
-        for client in self.clients.values():
-            _ = spawn(client.invoke_client, cid, request, wait_for_response=False)
+        self._fan_out(cid, request, list(self.clients.values()))
+
+# ################################################################################################################################
+
+    def _fan_out(self, cid:'str', request:'any_', clients:'anylist') -> 'None':
+        """ Invokes all the clients given on input with the same request, without waiting for their responses.
+        The request is the same for each of them, which is why it is serialised and framed only once.
+        """
+        # Clients are added to the container before they are fully initialised, in which case they cannot be invoked yet
+        clients = [client for client in clients if getattr(client, '_initialized', False)]
+
+        if not clients:
+            return
+
+        # If input request is a string, try to decode it from JSON, but leave as-is in case
+        # of an error or if it is not a string.
+        if isinstance(request, str):
+            try:
+                request = stdlib_loads(request)
+            except ValueError:
+                pass
+
+        # All the clients use the same JSON library because it is configured for the whole server
+        client = cast_('WebSocket', clients[0])
+
+        msg = InvokeClientRequest(cid, request, None)
+        serialized = msg.serialize(client._json_dump_func)
+
+        # Messages from servers to clients are never masked, so each client can be sent the same bytes
+        frame = TextMessage(serialized).single(mask=False)
+
+        logger.info('Sending message `%s` from `%s` to %d client(s)', client._shorten_data(serialized),
+            self.config.name, len(clients))
+
+        for client in clients:
+            client.send_frame(frame, serialized, cid)
 
 # ################################################################################################################################
 
@@ -13,6 +13,7 @@ import uuid
 from contextlib import closing
 from datetime import datetime
 from logging import getLogger
+from time import monotonic
 
 # Bunch
 from bunch import bunchify, Bunch
@@ -25,7 +26,7 @@ import jwt
 
 # Zato
 from zato.common.odb.model import JWT as JWTModel
-from zato.server.jwt_cache import JWTCache
+from zato.server.jwt_cache import JWTCache, JWTTokenCache
 
 # ################################################################################################################################
 
@@ -51,11 +52,14 @@ class JWT:
 
 # ################################################################################################################################
 
-    def __init__(self, odb, decrypt_func, secret):
+    def __init__(self, odb, decrypt_func, secret, token_cache=None):
         self.odb = odb
         self.cache = JWTCache(odb)
         self.decrypt_func = decrypt_func
 
+        # An optional, in-RAM, cache of tokens that were already validated by this server process
+        self.token_cache = token_cache # type: JWTTokenCache
+
         self.secret = secret
         self.fernet = Fernet(self.secret)
 
@@ -121,15 +125,40 @@ class JWT:
             4. decode
             5. renew the cache expiration asynchronously (do not wait for the update confirmation).
             5. return "valid" + the token contents
+
+        If there is an in-RAM token cache, it is checked first and the token's data is taken from it, in which case
+        the expiration is renewed in ODB only periodically.
         """
+        if self.token_cache:
+            now = monotonic()
+            key = self.token_cache.get_key(token)
+            item = self.token_cache.get(key, now)
+
+            if item:
+                if item.token_data.username == expected_username:
+
+                    # Renew the token expiration, in ODB too if it is time to do it
+                    if self.token_cache.renew(item, now):
+                        self.cache.put(token, token, item.ttl, is_async=True)
+
+                    return Bunch(valid=True, token=item.token_data, raw_token=token)
+
+                else:
+                    return Bunch(valid=False, message='Unexpected user for token found')
+
         if self.cache.get(token):
             decrypted = self.fernet.decrypt(token)
-            token_data = bunchify(jwt.decode(decrypted, self.secret))
+            token_data = bunchify(jwt.decode(decrypted, self.secret, algorithms=[self.ALGORITHM]))
 
             if token_data.username == expected_username:
 
                 # Renew the token expiration
                 self.cache.put(token, token, token_data.ttl, is_async=True)
+
+                # Next time, the token will be found in RAM
+                if self.token_cache:
+                    self.token_cache.set(key, token_data, token_data.ttl, now) # type: ignore
+
                 return Bunch(valid=True, token=token_data, raw_token=token)
 
             else:
@@ -141,8 +170,11 @@ class JWT:
 # ################################################################################################################################
 
     def delete(self, token):
-        """ Deletes a token in ODB.
+        """ Deletes a token in ODB, and in RAM if there is a token cache.
         """
         self.cache.delete(token)
 
+        if self.token_cache:
+            self.token_cache.delete(self.token_cache.get_key(token))
+
 # ################################################################################################################################
@@ -11,10 +11,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import datetime
 from contextlib import closing
+from hashlib import sha256
 from logging import getLogger
+from time import monotonic
 
 # gevent
 import gevent
+from gevent.lock import RLock
 
 # Zato
 from zato.common.odb.model import KVData
@@ -117,3 +120,105 @@ class JWTCache:
                 session.commit()
 
 # ################################################################################################################################
+
+class _CachedToken:
+    """ A token that was already validated, along with its decoded data.
+    """
+    __slots__ = 'token_data', 'ttl', 'expires_at', 'odb_renewed_at'
+
+    def __init__(self, token_data, ttl, now):
+        self.token_data = token_data
+        self.ttl = ttl
+        self.expires_at = now + ttl
+        self.odb_renewed_at = now
+
+# ################################################################################################################################
+
+class JWTTokenCache:
+    """ Tokens that were validated by this server process, kept in RAM so that validating them again requires no ODB access.
+    Each token is known by a hash of its contents and, just like in ODB, its expiration time is extended each time
+    it is used. ODB is let know about the extensions in the background, no more often than every renew_ratio * TTL seconds,
+    so that other servers that do not have the token in RAM can still find it there.
+    """
+    def __init__(self, renew_ratio=0.5, sweep_interval=60):
+        # type: (float, float) -> None
+        self.renew_ratio = renew_ratio
+        self.sweep_interval = sweep_interval
+        self.lock = RLock()
+
+        # Token hash -> Cached token
+        self.tokens = {}
+
+        # When expired tokens that were not accessed again should be deleted next time
+        self.next_sweep = monotonic() + self.sweep_interval
+
+# ################################################################################################################################
+
+    @staticmethod
+    def get_key(token):
+        """ Returns a key under which the token is stored, which is safe to be sent to other servers.
+        """
+        if isinstance(token, unicode):
+            token = token.encode('utf8')
+        return sha256(token).hexdigest()
+
+# ################################################################################################################################
+
+    def get(self, key, now=None):
+        """ Returns a cached token by its key if it exists and did not expire yet.
+        """
+        item = self.tokens.get(key)
+        if item:
+            if item.expires_at > (now or monotonic()):
+                return item
+            else:
+                _ = self.tokens.pop(key, None)
+
+# ################################################################################################################################
+
+    def set(self, key, token_data, ttl, now=None):
+        """ Stores a token that was just validated.
+        """
+        now = now or monotonic()
+
+        with self.lock:
+            self.tokens[key] = _CachedToken(token_data, ttl, now)
+
+            if now >= self.next_sweep:
+                self._delete_expired(now)
+
+# ################################################################################################################################
+
+    def renew(self, item, now=None):
+        """ Extends the expiration time of a cached token and returns True if the same should be done in ODB now.
+        """
+        now = now or monotonic()
+        item.expires_at = now + item.ttl
+
+        if now - item.odb_renewed_at >= item.ttl * self.renew_ratio:
+            item.odb_renewed_at = now
+            return True
+        else:
+            return False
+
+# ################################################################################################################################
+
+    def delete(self, key):
+        _ = self.tokens.pop(key, None)
+
+# ################################################################################################################################
+
+    def clear(self):
+        self.tokens.clear()
+
+# ################################################################################################################################
+
+    def _delete_expired(self, now):
+
+        with self.lock:
+            for key in [key for key, item in self.tokens.items() if item.expires_at <= now]:
+                del self.tokens[key]
+
+            self.next_sweep = now + self.sweep_interval
+
+# ################################################################################################################################
@@ -16,8 +16,8 @@ from gevent import sleep
 
 # Zato
 from zato.common.exception import ZatoException
-from zato.common.json_internal import dumps
 from zato.common.util.api import new_cid
+from zato.server.pattern.retry_scheduler import Default as RetryDefault, get_retry_delay
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -92,6 +92,13 @@ class InvokeRetry:
         retry_seconds = kwargs.get('seconds')
         retry_minutes = kwargs.get('minutes')
 
+        # How the delay between attempts grows, each of which is optional
+        backoff_config = {
+            'backoff_factor': kwargs.get('backoff'),
+            'max_seconds': kwargs.get('max_seconds'),
+            'jitter': kwargs.get('jitter'),
+        }
+
         if async_fallback:
             items = ('callback', 'repeats')
             for item in items:
@@ -121,18 +128,19 @@ class InvokeRetry:
                 raise ValueError(msg)
 
         # Get rid of arguments our superclass doesn't understand
-        for item in('async_fallback', 'callback', 'context', 'repeats', 'seconds', 'minutes'):
+        for item in('async_fallback', 'callback', 'context', 'repeats', 'seconds', 'minutes', 'backoff', 'max_seconds', 'jitter'):
             kwargs.pop(item, True)
 
         # Note that internally we use seconds only.
-        return async_fallback, callback, callback_context, retry_repeats, retry_seconds or retry_minutes * 60, kwargs
+        return async_fallback, callback, callback_context, retry_repeats, retry_seconds or retry_minutes * 60, \
+            backoff_config, kwargs
 
 # ################################################################################################################################
 
     def _invoke_async_retry(self, target, retry_repeats, retry_seconds, orig_cid, call_cid, callback,
-        callback_context, args, kwargs, _utcnow=utcnow):
+        callback_context, backoff_config, args, kwargs, delay=0.0, _utcnow=utcnow):
 
-        # Request to invoke the background service with ..
+        # A retry for the server's scheduler, which keeps it on disk until it completes ..
         retry_request = {
             'source':self.invoking_service.name,
             'target': target,
@@ -144,25 +152,43 @@ class InvokeRetry:
             'callback_context': callback_context,
             'args': args,
             'kwargs': kwargs,
-            'req_ts_utc': _utcnow()
+            'req_ts_utc': _utcnow().isoformat()
         }
+        retry_request.update(backoff_config)
+
+        # .. and runs it in background, calling the callback when it does.
+        self.invoking_service.server.retry_scheduler.schedule(retry_request, delay)
 
-        return self.invoking_service.invoke_async('zato.pattern.invoke-retry.invoke-retry', dumps(retry_request), cid=call_cid)
+        return call_cid
 
 # ################################################################################################################################
 
     def invoke_async(self, target, *args, **kwargs):
-        async_fallback, callback, callback_context, retry_repeats, retry_seconds, kwargs = self._get_retry_settings(
-            target, **kwargs)
+        async_fallback, callback, callback_context, retry_repeats, retry_seconds, backoff_config, kwargs = \
+            self._get_retry_settings(target, **kwargs)
+
+        kwargs['cid'] = kwargs.get('cid', new_cid())
+
         return self._invoke_async_retry(
             target, retry_repeats, retry_seconds, self.invoking_service.cid, kwargs['cid'], callback,
-            callback_context, args, kwargs)
+            callback_context, backoff_config, args, kwargs)
+
+# ################################################################################################################################
+
+    def _get_retry_delay(self, attempt, retry_seconds, backoff_config):
+        return get_retry_delay(
+            attempt,
+            retry_seconds,
+            backoff_config['backoff_factor'] or RetryDefault.backoff_factor,
+            backoff_config['max_seconds'] or RetryDefault.max_seconds,
+            RetryDefault.jitter if backoff_config['jitter'] is None else backoff_config['jitter'],
+        )
 
 # ################################################################################################################################
 
     def invoke(self, target, *args, **kwargs):
-        async_fallback, callback, callback_context, retry_repeats, retry_seconds, kwargs = self._get_retry_settings(
-            target, **kwargs)
+        async_fallback, callback, callback_context, retry_repeats, retry_seconds, backoff_config, kwargs = \
+            self._get_retry_settings(target, **kwargs)
 
         # Let's invoke the service and find out if it works, maybe we don't need
         # to retry anything.
@@ -179,31 +205,38 @@ class InvokeRetry:
             # to block or prefers if we retry in background.
             if async_fallback:
 
-                # .. invoke the background service and return CID to the caller.
+                # .. schedule the first retry after a delay, as the target has just failed, and return CID to the caller.
                 return self._invoke_async_retry(
                     target, retry_repeats, retry_seconds, self.invoking_service.cid, kwargs['cid'], callback,
-                    callback_context, args, kwargs)
+                    callback_context, backoff_config, args, kwargs,
+                    self._get_retry_delay(1, retry_seconds, backoff_config))
 
             # We are to block while repeating
             else:
-                # Repeat the given number of times sleeping for as many seconds as we are told
+                # Repeat the given number of times, sleeping for longer and longer each time
                 remaining = retry_repeats
                 result = None
+                is_ok = False
 
                 while remaining > 1:
+                    sleep(self._get_retry_delay(retry_repeats - remaining + 1, retry_seconds, backoff_config))
                     try:
                         result = self.invoking_service.invoke(target, *args, **kwargs)
                     except Exception as e:
                         msg = retry_failed_msg(
                             (retry_repeats-remaining)+1, retry_repeats, target, retry_seconds, self.invoking_service.cid, e)
                         logger.info(msg)
-                        sleep(retry_seconds)
                         remaining -= 1
+                    else:
+                        is_ok = True
+                        break
 
                 # OK, give up now, there's nothing more we can do
-                if not result:
+                if not is_ok:
                     msg = retry_limit_reached_msg(retry_repeats, target, retry_seconds, self.invoking_service.cid)
                     raise ZatoException(self.invoking_service.cid, msg)
+
+                return result
         else:
             # All good, simply return the response
             return result
@@ -0,0 +1,649 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from heapq import heapify, heappop, heappush
+from itertools import count
+from logging import getLogger
+from pickle import dumps, HIGHEST_PROTOCOL, loads
+from random import random
+from struct import Struct
+from sys import intern
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent import spawn
+from gevent.event import Event
+
+# Zato
+from zato.server.async_executor import AsyncPool, AsyncPoolFull, Overflow
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from gevent import Greenlet
+    from zato.common.typing_ import any_, anydict, anylist, callable_, dict_, list_, stranydict, tuple_
+
+    # Due time, retry ID, offset in the journal and the target service
+    queue_item = tuple_[float, int, int, str]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # Stored in the server's work directory, separately for each process
+    Dir_Name = 'invoke-retry'
+    Journal_Name = 'retry.journal'
+    Temp_Suffix = '.tmp'
+
+    # Record type, retry ID, due time and the length of the pickled retry that follows
+    Record = Struct('>BQdI')
+    Record_Add = 1
+    Record_Done = 2
+
+    # The journal is compacted once it has at least that many records that are no longer needed
+    # and more of them than of the ones that are.
+    Compact_Min_Dead = 10_000
+
+    Pool_Name = 'invoke-retry'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Default:
+    max_concurrency = 100
+    backoff_factor = 2.0
+    max_seconds = 3600
+    jitter = 0.5
+    breaker_failures = 5
+    breaker_reset_seconds = 30
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_retry_delay(
+    attempt,        # type: int
+    retry_seconds,  # type: float
+    backoff_factor, # type: float
+    max_seconds,    # type: float
+    jitter,         # type: float
+    _random=random  # type: callable_
+) -> 'float':
+    """ Returns how many seconds to wait before the next attempt, given how many attempts have been made so far.
+    The delay grows exponentially, up to max_seconds, and a random part of it, up to the jitter fraction, is subtracted
+    so that callers that failed at the same time do not all retry at the same time too.
+    """
+    delay = min(max_seconds, retry_seconds * backoff_factor ** max(attempt - 1, 0))
+    return delay * (1 - jitter * _random())
+
+# ################################################################################################################################
+
+def get_callback_request(entry:'stranydict', is_ok:'bool', response:'any_', resp_ts_utc:'str') -> 'stranydict':
+    """ Returns a request to the callback service of a retry that has just completed.
+    """
+    return {
+        'ok': is_ok,
+        'orig_cid': entry['orig_cid'],
+        'call_cid': entry['call_cid'],
+        'source': entry['source'],
+        'target': entry['target'],
+        'retry_seconds': entry['retry_seconds'],
+        'retry_repeats': entry['retry_repeats'],
+        'attempts': entry['attempt'],
+        'context': entry['callback_context'],
+        'req_ts_utc': entry['req_ts_utc'],
+        'resp_ts_utc': resp_ts_utc,
+        'response': response
+    }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class CircuitBreaker:
+    """ Stops invocations of a target service after a number of consecutive failures. Once reset_seconds pass,
+    a single trial invocation is let through and, depending on its outcome, the breaker closes or opens again.
+    """
+    __slots__ = ('failure_threshold', 'reset_seconds', 'num_failures', 'opened_until', 'is_trial_running')
+
+    def __init__(self, failure_threshold:'int', reset_seconds:'float') -> 'None':
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.num_failures = 0
+        self.opened_until = 0.0
+        self.is_trial_running = False
+
+# ################################################################################################################################
+
+    @property
+    def is_open(self) -> 'bool':
+        return self.opened_until > 0
+
+# ################################################################################################################################
+
+    def can_attempt(self, now:'float') -> 'bool':
+
+        # The breaker is closed ..
+        if not self.opened_until:
+            return True
+
+        # .. it is open ..
+        if now < self.opened_until:
+            return False
+
+        # .. or it is half-open, in which case only one invocation at a time may find out if the target works again.
+        if self.is_trial_running:
+            return False
+
+        self.is_trial_running = True
+        return True
+
+# ################################################################################################################################
+
+    def get_retry_at(self, now:'float') -> 'float':
+        """ Returns when an invocation that could not be attempted now should be tried again. Such invocations are spread
+        over reset_seconds so that they do not all reach the target at once when the breaker closes.
+        """
+        return max(now, self.opened_until) + self.reset_seconds * random()
+
+# ################################################################################################################################
+
+    def on_success(self) -> 'None':
+        self.num_failures = 0
+        self.opened_until = 0.0
+        self.is_trial_running = False
+
+# ################################################################################################################################
+
+    def on_failure(self, now:'float') -> 'None':
+        self.num_failures += 1
+        self.is_trial_running = False
+
+        if self.num_failures >= self.failure_threshold:
+            self.opened_until = now + self.reset_seconds
+
+# ################################################################################################################################
+
+    def on_attempt_ended(self) -> 'None':
+        """ Lets another trial invocation run, including when an attempt ended without an outcome, e.g. because its retry
+        could not be read, which would otherwise keep the breaker half-open forever.
+        """
+        self.is_trial_running = False
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RetryJournal:
+    """ An append-only file with pending retries. Each retry is added to it along with the time it is due at
+    and, each time it is rescheduled, a new version of it is added. Once it completes, a record saying so is added.
+    Only positions of retries in the file are kept in RAM, which is why their number does not affect memory use.
+    """
+    def __init__(self, path:'str') -> 'None':
+        self.path = path
+        self.fd = -1
+        self.size = 0
+
+# ################################################################################################################################
+
+    def open(self) -> 'anylist':
+        """ Opens the journal, compacting what a previous process may have left in it, and returns all the pending retries.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Retry ID -> due time, offset and length of the latest version of each retry that has not completed
+        live = {} # type: dict_[int, tuple_[float, int, int]]
+
+        if os.path.exists(self.path):
+            file_size = os.path.getsize(self.path)
+
+            with open(self.path, 'rb') as f:
+                offset = 0
+                while True:
+                    header = f.read(ModuleCtx.Record.size)
+
+                    # A partial record means that a process stopped while writing it
+                    if len(header) < ModuleCtx.Record.size:
+                        break
+
+                    record_type, retry_id, due, length = ModuleCtx.Record.unpack(header)
+                    end = offset + ModuleCtx.Record.size + length
+
+                    if end > file_size:
+                        break
+
+                    if record_type == ModuleCtx.Record_Add:
+                        live[retry_id] = (due, offset, length)
+                        _ = f.seek(length, os.SEEK_CUR)
+
+                    elif record_type == ModuleCtx.Record_Done:
+                        _ = live.pop(retry_id, None)
+
+                    else:
+                        logger.warning('Unrecognised record type `%s` at offset %d in `%s`', record_type, offset, self.path)
+                        break
+
+                    offset = end
+
+        # Rewrite the retries that are still pending to a new file, in the order of their due times
+        queue = sorted((due, retry_id, offset, length) for retry_id, (due, offset, length) in live.items())
+        return self._rewrite(queue)
+
+# ################################################################################################################################
+
+    def _rewrite(self, queue:'anylist') -> 'anylist':
+        """ Writes retries from the current journal to a new one and switches to it. Returns what each retry's offset
+        in the new one is. Each element of the queue on input is a tuple of due time, retry ID, offset and length,
+        where length may be None if it is not known yet.
+        """
+        temp_path = self.path + ModuleCtx.Temp_Suffix
+        out = []
+        new_offset = 0
+
+        old_fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600)
+
+        try:
+            with open(temp_path, 'wb') as f:
+                for due, retry_id, offset, length in queue:
+
+                    if length is None:
+                        length = ModuleCtx.Record.unpack(os.pread(old_fd, ModuleCtx.Record.size, offset))[-1]
+
+                    data = os.pread(old_fd, length, offset + ModuleCtx.Record.size)
+
+                    _ = f.write(ModuleCtx.Record.pack(ModuleCtx.Record_Add, retry_id, due, length))
+                    _ = f.write(data)
+
+                    out.append((due, retry_id, new_offset))
+                    new_offset += ModuleCtx.Record.size + length
+        finally:
+            os.close(old_fd)
+
+        os.replace(temp_path, self.path)
+
+        # Switch to the new file
+        if self.fd != -1:
+            os.close(self.fd)
+
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        self.size = new_offset
+
+        return out
+
+# ################################################################################################################################
+
+    def compact(self, queue:'anylist') -> 'anylist':
+        """ Keeps in the journal only the retries from the queue on input, each a tuple of due time, retry ID and offset,
+        and returns them with their offsets in the compacted journal.
+        """
+        return self._rewrite([(due, retry_id, offset, None) for due, retry_id, offset in queue])
+
+# ################################################################################################################################
+
+    def add(self, retry_id:'int', due:'float', entry:'stranydict') -> 'int':
+        """ Adds a new version of a retry and returns its offset.
+        """
+        data = dumps(entry, protocol=HIGHEST_PROTOCOL)
+        offset = self.size
+
+        _ = os.write(self.fd, ModuleCtx.Record.pack(ModuleCtx.Record_Add, retry_id, due, len(data)) + data)
+        self.size += ModuleCtx.Record.size + len(data)
+
+        return offset
+
+# ################################################################################################################################
+
+    def done(self, retry_id:'int') -> 'None':
+        _ = os.write(self.fd, ModuleCtx.Record.pack(ModuleCtx.Record_Done, retry_id, 0.0, 0))
+        self.size += ModuleCtx.Record.size
+
+# ################################################################################################################################
+
+    def read(self, offset:'int') -> 'stranydict':
+        length = ModuleCtx.Record.unpack(os.pread(self.fd, ModuleCtx.Record.size, offset))[-1]
+        return loads(os.pread(self.fd, length, offset + ModuleCtx.Record.size))
+
+# ################################################################################################################################
+
+    def close(self) -> 'None':
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RetryScheduler:
+    """ Runs retries of invocations made through the invoke-retry pattern. Pending retries are kept in a journal on disk,
+    which lets them survive restarts, and in RAM there is only a priority queue of their due times. A single greenlet
+    waits for the next one to become due and at most max_concurrency of them run at a time. Each target service has
+    its own circuit breaker, which defers retries while the target keeps failing rather than letting them all fail.
+    """
+    def __init__(
+        self,
+        journal_dir,   # type: str
+        attempt_func,  # type: callable_
+        callback_func, # type: callable_
+        max_concurrency=Default.max_concurrency,             # type: int
+        backoff_factor=Default.backoff_factor,               # type: float
+        max_seconds=Default.max_seconds,                     # type: float
+        jitter=Default.jitter,                               # type: float
+        breaker_failures=Default.breaker_failures,           # type: int
+        breaker_reset_seconds=Default.breaker_reset_seconds, # type: float
+    ) -> 'None':
+
+        # Invoked with a retry on input to run a single attempt and, once the retry completes, to notify its callback
+        self.attempt_func = attempt_func
+        self.callback_func = callback_func
+
+        self.backoff_factor = backoff_factor
+        self.max_seconds = max_seconds
+        self.jitter = jitter
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+
+        self.journal = RetryJournal(os.path.join(journal_dir, ModuleCtx.Journal_Name))
+        self.pool = AsyncPool(ModuleCtx.Pool_Name, None, max_concurrency, max_concurrency, Overflow.Block)
+
+        # Retries waiting to become due, ordered by their due times ..
+        self.queue = [] # type: list_[queue_item]
+
+        # .. and the ones that are being attempted right now.
+        self.in_flight = {} # type: dict_[int, queue_item]
+
+        self.breakers = {} # type: dict_[str, CircuitBreaker]
+        self.retry_id = count(1)
+
+        # Set each time a retry is added, which may be due earlier than the ones that the scheduler is waiting for
+        self.has_new = Event()
+
+        self.keep_running = False
+        self.greenlet = None # type: Greenlet | None
+
+        # Journal records that are no longer needed, i.e. the ones of completed retries and old versions of pending ones
+        self.num_dead = 0
+
+        # Metrics
+        self.num_scheduled = 0
+        self.num_attempts = 0
+        self.num_deferred = 0
+        self.num_succeeded = 0
+        self.num_failed = 0
+
+        # Retries can be scheduled before the scheduler starts, e.g. by startup services, which is why the journal
+        # needs to be open already.
+        self._load()
+
+# ################################################################################################################################
+
+    @staticmethod
+    def from_config(
+        config,       # type: anydict
+        journal_dir,  # type: str
+        attempt_func, # type: callable_
+        callback_func # type: callable_
+    ) -> 'RetryScheduler':
+        """ Returns a new scheduler configured through the [invoke_retry] section of server.conf.
+        """
+        return RetryScheduler(
+            journal_dir,
+            attempt_func,
+            callback_func,
+            int(config.get('max_concurrency') or Default.max_concurrency),
+            float(config.get('backoff_factor') or Default.backoff_factor),
+            float(config.get('max_seconds') or Default.max_seconds),
+            float(Default.jitter if config.get('jitter') is None else config['jitter']),
+            int(config.get('breaker_failures') or Default.breaker_failures),
+            float(config.get('breaker_reset_seconds') or Default.breaker_reset_seconds),
+        )
+
+# ################################################################################################################################
+
+    def _load(self) -> 'None':
+        """ Opens the journal and loads retries that a previous process left behind.
+        """
+        queue = self.journal.open()
+        self.queue[:] = [(due, retry_id, offset, self._get_target(offset)) for due, retry_id, offset in queue]
+        heapify(self.queue)
+
+        if self.queue:
+            logger.info('Found %d pending retr%s in `%s`', len(self.queue), 'y' if len(self.queue) == 1 else 'ies',
+                self.journal.path)
+            self.retry_id = count(max(retry_id for _, retry_id, _, _ in self.queue) + 1)
+
+# ################################################################################################################################
+
+    def start(self) -> 'None':
+        """ Starts to run pending retries, including the ones scheduled before this method was called.
+        """
+        # The journal is closed if the scheduler was stopped before
+        if self.journal.fd == -1:
+            self._load()
+
+        self.keep_running = True
+        self.greenlet = spawn(self._run)
+
+# ################################################################################################################################
+
+    def stop(self) -> 'None':
+        """ Stops the scheduler. Pending retries remain in the journal, to be resumed by the next process.
+        """
+        self.keep_running = False
+        self.has_new.set()
+
+        if self.greenlet:
+            self.greenlet.kill(block=False)
+
+        self.journal.close()
+
+# ################################################################################################################################
+
+    def _get_target(self, offset:'int') -> 'str':
+        # Many retries are of the same targets, which is why each name is kept in RAM only once
+        return intern(self.journal.read(offset)['target'])
+
+# ################################################################################################################################
+
+    def schedule(self, entry:'stranydict', delay:'float'=0.0) -> 'None':
+        """ Adds a new retry to run in delay seconds. The entry on input is what InvokeRetry builds for each invocation.
+        """
+        entry.setdefault('attempt', 0)
+
+        retry_id = next(self.retry_id)
+        due = time() + delay
+        offset = self.journal.add(retry_id, due, entry)
+
+        heappush(self.queue, (due, retry_id, offset, intern(entry['target'])))
+        self.num_scheduled += 1
+        self.has_new.set()
+
+# ################################################################################################################################
+
+    def get_breaker(self, target:'str') -> 'CircuitBreaker':
+        breaker = self.breakers.get(target)
+        if not breaker:
+            breaker = self.breakers[target] = CircuitBreaker(self.breaker_failures, self.breaker_reset_seconds)
+        return breaker
+
+# ################################################################################################################################
+
+    def _run(self) -> 'None':
+
+        while self.keep_running:
+
+            # Anything added from now on will wake us up ..
+            self.has_new.clear()
+
+            # .. run everything that is due ..
+            now = time()
+            while self.queue and self.queue[0][0] <= now:
+                self._dispatch(heappop(self.queue), now)
+                now = time()
+
+            # .. and wait for whatever comes next.
+            timeout = self.queue[0][0] - time() if self.queue else None
+            _ = self.has_new.wait(timeout)
+
+# ################################################################################################################################
+
+    def _dispatch(self, item:'queue_item', now:'float') -> 'None':
+
+        due, retry_id, offset, target = item
+        breaker = self.get_breaker(target)
+
+        # If the target keeps failing, there is no point in trying it now, but this does not count as an attempt
+        if not breaker.can_attempt(now):
+            heappush(self.queue, (breaker.get_retry_at(now), retry_id, offset, target))
+            self.num_deferred += 1
+            return
+
+        self.in_flight[retry_id] = item
+
+        try:
+            self.pool.submit(self._attempt, retry_id)
+        except AsyncPoolFull:
+            _ = self.in_flight.pop(retry_id)
+            heappush(self.queue, (now + 1, retry_id, offset, target))
+
+# ################################################################################################################################
+
+    def _attempt(self, retry_id:'int') -> 'None':
+
+        _, _, offset, target = self.in_flight[retry_id]
+        breaker = self.get_breaker(target)
+
+        try:
+            self._attempt_entry(retry_id, offset, target, breaker)
+        finally:
+            breaker.on_attempt_ended()
+
+# ################################################################################################################################
+
+    def _attempt_entry(self, retry_id:'int', offset:'int', target:'str', breaker:'CircuitBreaker') -> 'None':
+
+        try:
+            entry = self.journal.read(offset)
+        except Exception:
+            logger.warning('Could not read retry #%d from `%s`, e:`%s`', retry_id, self.journal.path, format_exc())
+            self._complete(retry_id, None, False, None)
+            return
+
+        entry['attempt'] += 1
+        self.num_attempts += 1
+
+        try:
+            response = self.attempt_func(entry)
+        except Exception as e:
+            breaker.on_failure(time())
+            logger.info('(%d/%d) Retry failed for:`%s`, orig_cid:`%s`, %s:`%s`', entry['attempt'], entry['retry_repeats'],
+                target, entry['orig_cid'], e.__class__.__name__, e.args)
+
+            # Give up ..
+            if entry['attempt'] >= entry['retry_repeats']:
+                logger.warning('(%d/%d) Retry limit reached for:`%s`, orig_cid:`%s`', entry['attempt'],
+                    entry['retry_repeats'], target, entry['orig_cid'])
+                self._complete(retry_id, entry, False, None)
+
+            # .. or try again later.
+            else:
+                self._reschedule(retry_id, entry)
+
+        else:
+            breaker.on_success()
+            self._complete(retry_id, entry, True, response)
+
+# ################################################################################################################################
+
+    def _reschedule(self, retry_id:'int', entry:'stranydict') -> 'None':
+
+        delay = get_retry_delay(
+            entry['attempt'],
+            entry['retry_seconds'],
+            entry.get('backoff_factor') or self.backoff_factor,
+            entry.get('max_seconds') or self.max_seconds,
+            self.jitter if entry.get('jitter') is None else entry['jitter'],
+        )
+
+        due = time() + delay
+
+        # The new version of the retry replaces the previous one, which is not needed anymore
+        offset = self.journal.add(retry_id, due, entry)
+        self.num_dead += 1
+
+        _, _, _, target = self.in_flight.pop(retry_id)
+        heappush(self.queue, (due, retry_id, offset, target))
+        self.has_new.set()
+
+        self._compact_if_needed()
+
+# ################################################################################################################################
+
+    def _complete(self, retry_id:'int', entry:'stranydict | None', is_ok:'bool', response:'any_') -> 'None':
+
+        self.journal.done(retry_id)
+        self.num_dead += 2
+        _ = self.in_flight.pop(retry_id, None)
+
+        if is_ok:
+            self.num_succeeded += 1
+        else:
+            self.num_failed += 1
+
+        self._compact_if_needed()
+
+        if entry and entry.get('callback'):
+            try:
+                self.callback_func(entry, is_ok, response)
+            except Exception:
+                logger.warning('Could not invoke callback `%s` of retry #%d, e:`%s`', entry['callback'], retry_id, format_exc())
+
+# ################################################################################################################################
+
+    def _compact_if_needed(self) -> 'None':
+        """ Rewrites the journal to keep only the retries that are pending or being attempted, if it is worth it.
+        """
+        if not (self.num_dead > ModuleCtx.Compact_Min_Dead and self.num_dead > len(self.queue) + len(self.in_flight)):
+            return
+
+        in_flight = list(self.in_flight.values())
+        compacted = self.journal.compact([item[:3] for item in self.queue] + [item[:3] for item in in_flight])
+
+        # Offsets have changed but the order of the retries is the same as on input, so the queue is still a heap
+        num_queued = len(self.queue)
+
+        self.queue[:] = [
+            (due, retry_id, offset, item[3]) for (due, retry_id, offset), item in zip(compacted[:num_queued], self.queue)]
+
+        for (due, retry_id, offset), item in zip(compacted[num_queued:], in_flight):
+            self.in_flight[retry_id] = (due, retry_id, offset, item[3])
+
+        self.num_dead = 0
+
+# ################################################################################################################################
+
+    def get_stats(self) -> 'stranydict':
+        return {
+            'pending': len(self.queue),
+            'in_flight': len(self.in_flight),
+            'scheduled': self.num_scheduled,
+            'attempts': self.num_attempts,
+            'deferred': self.num_deferred,
+            'succeeded': self.num_succeeded,
+            'failed': self.num_failed,
+            'open_breakers': sorted(target for target, breaker in self.breakers.items() if breaker.is_open),
+        }
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -35,6 +35,7 @@ from zato.server.pubsub.core.hook import HookAPI
 from zato.server.pubsub.core.pubapi import PubAPI
 from zato.server.pubsub.core.sql import SQLAPI
 from zato.server.pubsub.core.topic import TopicAPI
+from zato.server.pubsub.delivery.scheduler import DeliveryScheduler
 from zato.server.pubsub.model import inttopicdict, strsubdict, strtopicdict, Subscription, SubKeyServer
 from zato.server.pubsub.publisher import Publisher
 from zato.server.pubsub.sync import InRAMSync
@@ -131,6 +132,10 @@ class PubSub:
         # A backlog of messages that have at least one subscription, i.e. this is what delivery servers use.
         self.sync_backlog = InRAMSync(self)
 
+        # Runs delivery tasks for all the sub_keys handled by this server - added after 3.2 was released, hence optional.
+        self.delivery_scheduler = DeliveryScheduler(
+            self.server.fs_server_config.pubsub.get('delivery_pool_size') or PUBSUB.DEFAULT.DELIVERY_POOL_SIZE)
+
         # How many messages have been published through this server, regardless of which topic they were for
         self.msg_pub_counter = 0
 
@@ -757,6 +762,10 @@ class PubSub:
             for sub in subscriptions_by_topic:
                 _ = self._delete_subscription_by_sub_key(sub.sub_key, ignore_missing=True)
 
+            # GD publications to the topic are no longer possible so their writer does not need to keep anything about it
+            if self.impl_publisher.gd_batch_writer:
+                self.impl_publisher.gd_batch_writer.on_topic_deleted(topic_id)
+
 # ################################################################################################################################
 
     def edit_topic(self, del_name:'str', config:'anydict') -> 'None':
@@ -10,6 +10,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 from bisect import bisect_left
+from itertools import chain
 from logging import getLogger
 from typing import Iterator as iterator
 
@@ -20,8 +21,8 @@ from sortedcontainers import SortedList as _SortedList
 # ################################################################################################################################
 
 if 0:
-    from zato.common.typing_ import any_
-    from zato.server.pubsub.delivery.message import Message
+    from zato.common.typing_ import any_, dict_, tuple_
+    from zato.server.pubsub.delivery.message import Message, msgnone
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -33,8 +34,26 @@ logger = getLogger('zato_pubsub.task')
 
 class SortedList(_SortedList):
     """ A custom subclass that knows how to remove pubsub messages from SortedList instances.
+    It also keeps an index of messages by their IDs and counts GD messages so that look-ups
+    and queue depth do not require for the whole list to be scanned.
     """
 
+    def __init__(self, iterable:'any_'=None, key:'any_'=None) -> 'None':
+
+        # Msg ID -> Message
+        self._by_msg_id = {} # type: dict_[str, Message]
+
+        # How many GD messages there are - all the other ones are non-GD
+        self.len_gd = 0
+
+        super().__init__(None, key)
+
+        # The parent class would not call our own .update
+        if iterable is not None:
+            self.update(iterable)
+
+# ################################################################################################################################
+
     def __iter__(self) -> 'iterator[Message]':
         return super().__iter__()
 
@@ -43,6 +62,115 @@ class SortedList(_SortedList):
     def __getitem__(self, idx:'any_') -> 'any_':
         return super().__getitem__(idx)
 
+# ################################################################################################################################
+
+    def __delitem__(self, idx:'any_') -> 'None':
+        super().__delitem__(idx)
+
+        # Deleting slices bypasses self._delete so we need to rebuild the index in such a case
+        if isinstance(idx, slice):
+            self._rebuild_index()
+
+# ################################################################################################################################
+
+    def _index_msg(self, msg:'Message') -> 'None':
+        self._by_msg_id[msg.pub_msg_id] = msg
+        if msg.has_gd:
+            self.len_gd += 1
+
+# ################################################################################################################################
+
+    def _rebuild_index(self) -> 'None':
+        self._by_msg_id.clear()
+        self.len_gd = 0
+
+        for msg in self:
+            self._index_msg(msg)
+
+# ################################################################################################################################
+
+    def add(self, msg:'Message') -> 'None':
+        super().add(msg)
+        self._index_msg(msg)
+
+# ################################################################################################################################
+
+    def update(self, iterable:'any_') -> 'None':
+        values = list(iterable)
+        super().update(values)
+
+        for msg in values:
+            self._index_msg(msg)
+
+# ################################################################################################################################
+
+    def clear(self) -> 'None':
+        super().clear()
+        self._by_msg_id.clear()
+        self.len_gd = 0
+
+# ################################################################################################################################
+
+    def _delete(self, pos:'int', idx:'int') -> 'None':
+        """ All the methods deleting individual elements end up here, which is why this is where the index is updated.
+        """
+        msg = self._lists[pos][idx] # type: Message
+
+        super()._delete(pos, idx)
+
+        # The same message may have been possibly added more than once, in which case
+        # the index points to the most recent copy and we leave it as it is.
+        if self._by_msg_id.get(msg.pub_msg_id) is msg:
+            del self._by_msg_id[msg.pub_msg_id]
+
+        if msg.has_gd:
+            self.len_gd -= 1
+
+# ################################################################################################################################
+
+    def get_pubsub_msg(self, msg_id:'str') -> 'msgnone':
+        """ Returns a message by its ID or None if there is no such message in the list.
+        """
+        return self._by_msg_id.get(msg_id)
+
+# ################################################################################################################################
+
+    def has_pubsub_msg(self, msg_id:'str') -> 'bool':
+        return msg_id in self._by_msg_id
+
+# ################################################################################################################################
+
+    def get_queue_depth(self) -> 'tuple_[int, int]':
+        """ Returns the number of GD and non-GD messages in the list.
+        """
+        return self.len_gd, len(self) - self.len_gd
+
+# ################################################################################################################################
+
+    def _find_pubsub_msg(self, msg:'Message') -> 'tuple_[int, int]':
+        """ Returns the position of a message's sublist and its index in that sublist.
+        """
+        pos = bisect_left(self._maxes, msg)
+
+        if pos == len(self._maxes):
+            raise ValueError('{0!r} not in list (1)'.format(msg))
+
+        # We start from where the message should be, which is enough unless there are many messages
+        # with the same sort key, in which case it may be in any other place in this sublist or in the next ones.
+        _list = self._lists[pos]
+        start = bisect_left(_list, msg)
+
+        for _list_idx in chain(range(start, len(_list)), range(0, start)):
+            if msg.pub_msg_id == _list[_list_idx].pub_msg_id:
+                return pos, _list_idx
+
+        for _pos in chain(range(pos + 1, len(self._lists)), range(0, pos)):
+            for _list_idx, _list_msg in enumerate(self._lists[_pos]):
+                if msg.pub_msg_id == _list_msg.pub_msg_id:
+                    return _pos, _list_idx
+
+        raise ValueError('{0!r} not in list (2)'.format(msg))
+
 # ################################################################################################################################
 
     def remove_pubsub_msg(self, msg:'Message') -> 'None':
@@ -51,18 +179,12 @@ class SortedList(_SortedList):
         """
 
         logger.info('In remove_pubsub_msg msg:`%s`, mxs:`%s`', msg.pub_msg_id, self._maxes)
-        pos = bisect_left(self._maxes, msg)
 
-        if pos == len(self._maxes):
-            raise ValueError('{0!r} not in list (1)'.format(msg))
+        # The input message may be a copy so we look up the one that we actually store
+        msg = self._by_msg_id.get(msg.pub_msg_id, msg)
 
-        for _list_idx, _list_msg in enumerate(self._lists[pos]):
-            if msg.pub_msg_id == _list_msg.pub_msg_id:
-                idx = _list_idx
-                self._delete(pos, idx)
-                break
-        else:
-            raise ValueError('{0!r} not in list (2)'.format(msg))
+        pos, idx = self._find_pubsub_msg(msg)
+        self._delete(pos, idx)
 
 # ################################################################################################################################
 # ################################################################################################################################
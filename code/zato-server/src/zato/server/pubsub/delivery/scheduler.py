@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from logging import getLogger
+from traceback import format_exc
+
+# gevent
+from gevent import spawn, spawn_later
+from gevent.queue import Queue
+
+# Zato
+from zato.common.api import PUBSUB
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from gevent import Greenlet
+    from zato.common.typing_ import list_
+    from zato.server.pubsub.delivery.task import DeliveryTask
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger('zato_pubsub.task')
+logger_zato = getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class DeliveryScheduler:
+    """ Runs delivery tasks of all the sub_keys that a server handles using a shared pool of greenlets.
+    A task is scheduled only when it is signalled that there are messages for it, each scheduled task runs one delivery
+    batch at a time and, if it still has messages to deliver, it is put at the end of the queue, so all sub_keys
+    are treated fairly. A task is never scheduled twice, which keeps deliveries for each sub_key in order.
+    """
+    def __init__(self, pool_size:'int'=PUBSUB.DEFAULT.DELIVERY_POOL_SIZE) -> 'None':
+        self.pool_size = pool_size
+        self.ready = Queue()
+        self.workers = [] # type: list_[Greenlet]
+
+        # How many delivery batches all the tasks ran so far
+        self.len_runs = 0
+
+# ################################################################################################################################
+
+    def _start_workers(self) -> 'None':
+        for _ in range(self.pool_size):
+            self.workers.append(spawn(self._run_worker))
+
+        logger.info('Started %d pub/sub delivery worker%s', self.pool_size, '' if self.pool_size == 1 else 's')
+
+# ################################################################################################################################
+
+    def _run_worker(self) -> 'None':
+        while True:
+            task = self.ready.get() # type: DeliveryTask
+            try:
+                self.len_runs += 1
+                task.run_scheduled()
+            except Exception:
+                e = format_exc()
+                logger.warning('Exception in delivery worker for sub_key:`%s`, e:`%s`', task.sub_key, e)
+                logger_zato.warning('Exception in delivery worker for sub_key:`%s`, e:`%s`', task.sub_key, e)
+
+# ################################################################################################################################
+
+    def schedule(self, task:'DeliveryTask') -> 'None':
+        """ Enqueues a task to be run by the first available worker.
+        """
+        # Workers are started lazily, so there are no idle greenlets on servers without any pub/sub subscriptions
+        if not self.workers:
+            self._start_workers()
+
+        self.ready.put(task)
+
+# ################################################################################################################################
+
+    def schedule_later(self, task:'DeliveryTask', delay:'float') -> 'None':
+        """ Lets a task know that it can be woken up again once the delay elapses, e.g. after a delivery error.
+        """
+        _ = spawn_later(delay, task.wake_after_delay)
+
+# ################################################################################################################################
+
+    def stop(self) -> 'None':
+        for worker in self.workers:
+            worker.kill(block=False)
+        self.workers[:] = []
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -15,7 +15,6 @@ from traceback import format_exc, format_exception
 from typing import Iterable as iterable_
 
 # gevent
-from gevent import sleep
 from gevent.lock import RLock
 from gevent.thread import getcurrent
 
@@ -37,6 +36,7 @@ if 0:
     from zato.server.pubsub import PubSub
     from zato.server.pubsub.delivery.message import GDMessage, Message
     from zato.server.pubsub.delivery._sorted_list import SortedList
+    from zato.server.pubsub.delivery.scheduler import DeliveryScheduler
     GDMessage = GDMessage
 
 # ################################################################################################################################
@@ -70,7 +70,8 @@ sqlmsgiter = iterable_['SQLRow']
 # ################################################################################################################################
 
 class DeliveryTask:
-    """ Runs a greenlet responsible for delivery of messages for a given sub_key.
+    """ Delivers messages for a given sub_key. The task is run by a shared scheduler each time it is woken up
+    because new messages were added to its delivery list.
     """
 
     wait_sock_err: 'float'
@@ -85,6 +86,7 @@ class DeliveryTask:
         sub_key,       # type: str
         delivery_lock, # type: RLock
         delivery_list, # type: SortedList
+        scheduler,     # type: DeliveryScheduler
         deliver_pubsub_msg,              # type: callable_
         confirm_pubsub_msg_delivered_cb, # type: callable_
         enqueue_initial_messages_func,   # type: callable_
@@ -102,6 +104,7 @@ class DeliveryTask:
         self.sub_key = sub_key
         self.delivery_lock = delivery_lock
         self.delivery_list = delivery_list
+        self.scheduler = scheduler
         self.deliver_pubsub_msg = deliver_pubsub_msg
         self.confirm_pubsub_msg_delivered_cb = confirm_pubsub_msg_delivered_cb
         self.sub_config = sub_config
@@ -130,6 +133,13 @@ class DeliveryTask:
         # This is a lock used for micro-operations such as changing or consulting the contents of self.delete_requested.
         self.interrupt_lock = RLock()
 
+        # Scheduling state - whether initial messages were already enqueued, whether we are in the scheduler's queue or running,
+        # whether we were woken up while running and whether we wait for a retry after an error.
+        self.is_started = False
+        self.is_scheduled = False
+        self.has_pending_wake = False
+        self.is_delayed = False
+
         # If self.wrap_in_list is True, messages will be always wrapped in a list,
         # even if there is only one message to send. Note that self.wrap_in_list will be False
         # only if both batch_size is 1 and wrap_one_msg_in_list is True.
@@ -144,7 +154,7 @@ class DeliveryTask:
         else:
             self.wrap_in_list = True
 
-        _ = spawn_greenlet(self.run) # noqa: F841
+        _ = spawn_greenlet(self._start) # noqa: F841
 
 # ################################################################################################################################
 
@@ -184,22 +194,20 @@ class DeliveryTask:
 
             # Build a list of actual messages to be deleted - we cannot use a msg_id list only
             # because the SortedList always expects actual message objects for comparison purposes.
-            # This will not be called too often so it is fine to iterate over self.delivery_list
-            # instead of employing look up dicts just in case a message would have to be deleted.
             to_delete = cast_('msglist', [])
-            for msg in self.delivery_list:
-                if msg.pub_msg_id in msg_list:
-                    # We can trim it since we know it won't appear again
-                    msg_list.remove(msg.pub_msg_id)
+            for msg_id in msg_list:
+                msg = self.delivery_list.get_pubsub_msg(msg_id)
+                if msg:
                     to_delete.append(msg)
 
             # We are a task that sends out notifications
             if self.sub_config['delivery_method'] == _notify:
 
-                logger.info('Marking message(s) to be deleted `%s` from `%s` (%s)', msg_list, self.sub_key, self.topic_name)
+                logger.info('Marking message(s) to be deleted `%s` from `%s` (%s)',
+                    [msg.pub_msg_id for msg in to_delete], self.sub_key, self.topic_name)
                 self.delete_requested.extend(to_delete)
 
-            # We do not send notifications and self.run never runs so we need to delete the messages here
+            # We do not send notifications and self.run_delivery is never scheduled so we need to delete the messages here
             else:
                 self._delete_messages(to_delete)
 
@@ -215,9 +223,15 @@ class DeliveryTask:
             len_out = len(out)
         else:
             out = []
-            for msg in self.delivery_list:
-                if msg.has_gd is has_gd:
-                    out.append(msg)
+
+            # There is no need to iterate the list if we know up front that there are no messages of the type requested
+            gd, non_gd = self.delivery_list.get_queue_depth()
+            len_expected = gd if has_gd else non_gd
+
+            if len_expected:
+                for msg in self.delivery_list:
+                    if msg.has_gd is has_gd:
+                        out.append(msg)
             len_out = len(out)
 
         logger.info('Returning %d message(s) for sub_key `%s` (gd:%s)', len_out, self.sub_key, has_gd)
@@ -260,10 +274,9 @@ class DeliveryTask:
     def get_message(self, msg_id:'str') -> 'Message':
         """ Returns a particular message enqueued by this delivery task.
         """
-        for msg in self.delivery_list:
-            if msg.pub_msg_id == msg_id:
-                return msg
-
+        msg = self.delivery_list.get_pubsub_msg(msg_id)
+        if msg:
+            return msg
         else:
             raise ValueError('No such message {}'.format(msg_id))
 
@@ -426,7 +439,7 @@ class DeliveryTask:
 
         except Exception as e:
 
-            # Do not attempt to deliver any other message in case of an error. Our parent will sleep for a small amount of
+            # Do not attempt to deliver any other message in case of an error. The task will wait for a small amount of
             # time and then re-run us, thanks to which the next time we run we will again iterate over all the messages
             # currently queued up, including the ones that we were not able to deliver in current iteration.
 
@@ -484,35 +497,48 @@ class DeliveryTask:
 
 # ################################################################################################################################
 
-    def _should_wake(self, _now:'callable_'=utcnow_as_ms) -> 'bool':
-        """ Returns True if the task should be woken up e.g. because its time has come already to process messages,
-        assumming there are any waiting for it.
+    def wake(self) -> 'None':
+        """ Signals that there may be messages to deliver, in which case the task is scheduled to run
+        unless it is already scheduled, it has not started yet or it waits for a retry after an error.
         """
-        # Return quickly if we already know that there are some messages to deliver or clear ..
-        if self.delivery_list:
-            return True
+        if not self.keep_running:
+            return
 
-        # .. otherwise, we will wait until self.delivery_interval lapsed.
+        if not self.is_started or self.is_delayed:
+            return
 
-        now = _now()
-        diff = round(now - self.last_iter_run, 2)
+        # Pull-style subscribers query us themselves
+        if self.sub_config['delivery_method'] not in _notify_methods:
+            return
 
-        if diff >= self.delivery_interval:
-            if self.delivery_list:
-                logger.info('Waking task:%s now:%s last:%s diff:%s interval:%s len-list:%d',
-                    self.sub_key, now, self.last_iter_run, diff, self.delivery_interval, len(self.delivery_list))
-                return True
+        # We are already in the scheduler's queue or running now, in which case we will run again once we are done.
+        if self.is_scheduled:
+            self.has_pending_wake = True
+            return
 
-        # The above conditions are not met so we explicitly return False
-        return False
+        self.is_scheduled = True
+        self.scheduler.schedule(self)
 
 # ################################################################################################################################
 
-    def run(self,
-        default_sleep_time=0.1,  # type: float
-        status_code=run_deliv_sc # type: any_
-    ) -> 'None':
-        """ Runs the delivery task's main loop.
+    def wake_after_delay(self) -> 'None':
+        """ Invoked by the scheduler once a delay, e.g. after a delivery error, elapses.
+        """
+        self.is_delayed = False
+        self.wake()
+
+# ################################################################################################################################
+
+    def _delay(self, delay:'float') -> 'None':
+        """ Makes the task ignore all the wake-ups until the delay elapses.
+        """
+        self.is_delayed = True
+        self.scheduler.schedule_later(self, delay)
+
+# ################################################################################################################################
+
+    def _start(self) -> 'None':
+        """ Prepares the task to run and lets the scheduler know about any messages that are already waiting for it.
         """
 
         # Fill out Python-level metadata first
@@ -525,118 +551,147 @@ class DeliveryTask:
         logger.info('Starting delivery task for sub_key:`%s` (%s, %s, %s)',
             self.sub_key, self.topic_name, self.sub_config['delivery_method'], self.py_object)
 
-        # First, make sure that the topic object already exists,
-        # e.g. it is possible that our task is already started
-        # even if other in-RAM structures are not populated yet,
-        # which is why we need to wait for this topic.
-        _ = self.pubsub.wait_for_topic(self.topic_name)
-
-        #
-        # Before starting anything, check if there are any messages already queued up in the database for this task.
-        # This may happen, for instance, if:
-        #
-        # * Our delivery_method is `pull`
-        # * Some messages get published to topic but the subscribers never gets them
-        # * Our server is restarted
-        # * The server is ultimately brought up and we need to find these messages that were previously
-        #   published but never delivered
-        #
-        # Since this is about messages taken from the database, by definition, all of them they must be GD ones.
-        #
-        self.enqueue_initial_messages_func(self.sub_key, self.topic_name, self.sub_config['endpoint_name'])
+        try:
+
+            # First, make sure that the topic object already exists,
+            # e.g. it is possible that our task is already started
+            # even if other in-RAM structures are not populated yet,
+            # which is why we need to wait for this topic.
+            _ = self.pubsub.wait_for_topic(self.topic_name)
+
+            #
+            # Before starting anything, check if there are any messages already queued up in the database for this task.
+            # This may happen, for instance, if:
+            #
+            # * Our delivery_method is `pull`
+            # * Some messages get published to topic but the subscribers never gets them
+            # * Our server is restarted
+            # * The server is ultimately brought up and we need to find these messages that were previously
+            #   published but never delivered
+            #
+            # Since this is about messages taken from the database, by definition, all of them they must be GD ones.
+            #
+            self.enqueue_initial_messages_func(self.sub_key, self.topic_name, self.sub_config['endpoint_name'])
+
+        except Exception as e:
+            error_msg = 'Exception in delivery task for sub_key:`%s`, e:`%s`'
+            e_formatted = format_exc()
+            logger.warning(error_msg, self.sub_key, e_formatted)
+            logger_zato.warning(error_msg, self.sub_key, e)
+
+        # From now on, we can be woken up by new messages ..
+        self.is_started = True
+
+        # .. and we want to deliver the ones that we may already have.
+        if self.delivery_list:
+            self.wake()
+
+# ################################################################################################################################
+
+    def run_scheduled(self,
+        status_code=run_deliv_sc # type: any_
+    ) -> 'None':
+        """ Invoked by the scheduler to deliver the next batch of messages.
+        """
+        # Any wake-up from now on will need to be handled in the next run
+        self.has_pending_wake = False
 
         try:
-            while self.keep_running:
+            self._run_scheduled(status_code)
+        finally:
+            self.is_scheduled = False
 
-                # Reusable.
-                delivery_method = self.sub_config['delivery_method']
+        # Run again if there are still messages left - the scheduler will put us at the end of its queue
+        # so other sub_keys are not starved.
+        if self.delivery_list or self.has_pending_wake:
+            self.wake()
 
-                # We are a task that does not notify endpoints, i.e. we are pull-style and our subscribers
-                # will query us themselves so in this case we can sleep for a while and repeat the loop -
-                # perhaps before the next iteration of the loop begins someone will change delivery_method
-                # to one that allows for notifications to be sent. If not, we will be simply looping forever,
-                # checking periodically below if the delivery method is still the same.
-                if delivery_method not in _notify_methods:
-                    sleep(5)
-                    continue
+# ################################################################################################################################
 
-                # Apparently, our delivery method has changed since the last time our self.sub_config
-                # was modified, so we can log this fact and store it for later use.
-                if delivery_method != self.previous_delivery_method:
+    def _run_scheduled(self, status_code:'any_') -> 'None':
 
-                    # First, log what happened ..
-                    self._log_delivery_method_changed(delivery_method)
+        if not self.keep_running:
+            return
 
-                    # .. now, the new value replaces the previous one - possibly to be replaced again and again in the future.
-                    self.previous_delivery_method = delivery_method
+        # Reusable.
+        delivery_method = self.sub_config['delivery_method']
 
-                # Is there any message that we can try to deliver?
-                if self._should_wake():
+        # We are a task that does not notify endpoints, i.e. we are pull-style and our subscribers
+        # will query us themselves, so there is nothing to do until our delivery method changes,
+        # at which point self.update_sub_config will wake us up.
+        if delivery_method not in _notify_methods:
+            return
 
-                    with self.delivery_lock:
+        # Apparently, our delivery method has changed since the last time our self.sub_config
+        # was modified, so we can log this fact and store it for later use.
+        if delivery_method != self.previous_delivery_method:
 
-                        # Update last run time to be able to wake up in time for the next delivery
-                        self.last_iter_run = utcnow_as_ms()
+            # First, log what happened ..
+            self._log_delivery_method_changed(delivery_method)
 
-                        # Get the list of all message IDs for which delivery was successful,
-                        # indicating whether all currently lined up messages have been
-                        # successfully delivered.
-                        result = self.run_delivery()
+            # .. now, the new value replaces the previous one - possibly to be replaced again and again in the future.
+            self.previous_delivery_method = delivery_method
 
-                        if not self.keep_running:
-                            msg = 'Skipping delivery loop after r:%s, kr:%d [lend:%d]'
-                            logger.info(msg, result, self.keep_running, self.len_delivered)
-                            continue
+        # Is there any message that we can try to deliver?
+        if not self.delivery_list:
+            return
 
-                        if result.is_ok:
-                            continue
+        with self.delivery_lock:
 
-                        # This was a runtime invocation error - for instance, a low-level WebSocket exception,
-                        # which is unrecoverable and we need to stop our task. When the client reconnects,
-                        # the delivery will pick up where we left.
-                        elif result.reason_code == ReasonCode.Error_Runtime_Invoke:
-                            self.stop()
+            # Update last run time for informational purposes
+            self.last_iter_run = utcnow_as_ms()
 
-                        # Sleep for a moment because we have just run out of all messages.
-                        elif result.reason_code == ReasonCode.No_Msg:
-                            sleep(default_sleep_time) # pyright: ignore[reportGeneralTypeIssues]
+            # This is what we need to know whether any message was delivered in this run.
+            len_delivered = self.len_delivered
 
-                        # Otherwise, sleep for a longer time because our endpoint must have returned an error.
-                        # After this sleep, self.run_delivery will again attempt to deliver all messages
-                        # we queued up. Note that we are the only delivery task for this sub_key  so when we sleep here
-                        # for a moment, we do not block other deliveries.
-                        else:
+            # Get the list of all message IDs for which delivery was successful,
+            # indicating whether all currently lined up messages have been
+            # successfully delivered.
+            result = self.run_delivery()
 
-                            # We caught an error or warning ..
-                            if not result.is_ok:
+        if not self.keep_running:
+            msg = 'Skipping delivery loop after r:%s, kr:%d [lend:%d]'
+            logger.info(msg, result, self.keep_running, self.len_delivered)
+            return
 
-                                # Reusable.
-                                len_exception_list = len(result.exception_list)
+        if result.is_ok:
 
-                                # Log all the exceptions received while trying to deliver the messages ..
-                                self._log_warnings_from_delivery_task(result, len_exception_list)
+            # A before-delivery hook may have decided to skip all the messages that we still have,
+            # in which case we try again after the delivery interval instead of spinning in place.
+            if self.len_delivered == len_delivered and self.delivery_list:
+                self._delay(self.delivery_interval)
 
-                                # .. sleep only if there are still some messages to be delivered,
-                                # .. as it is possible that our lists has been cleared out since the last time we run ..
-                                if self.delivery_list:
+        # This was a runtime invocation error - for instance, a low-level WebSocket exception,
+        # which is unrecoverable and we need to stop our task. When the client reconnects,
+        # the delivery will pick up where we left.
+        elif result.reason_code == ReasonCode.Error_Runtime_Invoke:
+            self.stop()
 
-                                    # .. sleep for a while but only if this was an error (not a warning).
-                                    if result.status_code == status_code.Error:
+        # There is nothing to do until new messages arrive.
+        elif result.reason_code == ReasonCode.No_Msg:
+            pass
 
-                                        # .. OK, we can sleep now.
-                                        self._sleep_on_delivery_error(result, len_exception_list)
+        # Otherwise, wait a longer time because our endpoint must have returned an error.
+        # Once the time elapses, self.run_delivery will again attempt to deliver all messages
+        # we queued up. Note that this is only a delay for this sub_key, the shared workers
+        # will keep on delivering messages for other sub_keys in the meantime.
+        else:
 
-                # There was no message to deliver in this turn ..
-                else:
+            # Reusable.
+            len_exception_list = len(result.exception_list)
 
-                    # .. thus, we can wait until one arrives.
-                    sleep(default_sleep_time) # pyright: ignore[reportGeneralTypeIssues]
+            # Log all the exceptions received while trying to deliver the messages ..
+            self._log_warnings_from_delivery_task(result, len_exception_list)
 
-        except Exception as e:
-            error_msg = 'Exception in delivery task for sub_key:`%s`, e:`%s`'
-            e_formatted = format_exc()
-            logger.warning(error_msg, self.sub_key, e_formatted)
-            logger_zato.warning(error_msg, self.sub_key, e)
+            # .. retry later only if there are still some messages to be delivered,
+            # .. as it is possible that our lists has been cleared out since the last time we run ..
+            if self.delivery_list:
+
+                # .. but only if this was an error (not a warning).
+                if result.status_code == status_code.Error:
+
+                    # .. OK, we can wait now.
+                    self._delay_on_delivery_error(result, len_exception_list)
 
 # ################################################################################################################################
 
@@ -665,7 +720,7 @@ class DeliveryTask:
 
 # ################################################################################################################################
 
-    def _sleep_on_delivery_error(self, result:'DeliveryResultCtx', len_exception_list:'int') -> 'None':
+    def _delay_on_delivery_error(self, result:'DeliveryResultCtx', len_exception_list:'int') -> 'None':
 
         if result.reason_code == ReasonCode.Error_IO:
             sleep_time = self.wait_sock_err
@@ -680,13 +735,13 @@ class DeliveryTask:
         else:
             exc_len_msg = exc_len_multi.format(len_exception_list)
 
-        sleep_msg = 'Sleeping for {}s after {} in iter #{}'.format(
+        sleep_msg = 'Retrying in {}s after {} in iter #{}'.format(
             sleep_time, exc_len_msg, result.delivery_iter)
 
         logger.warning(sleep_msg)
         logger_zato.warning(sleep_msg)
 
-        sleep(sleep_time) # pyright: ignore[reportGeneralTypeIssues]
+        self._delay(sleep_time)
 
 # ################################################################################################################################
 
@@ -722,21 +777,15 @@ class DeliveryTask:
     def update_sub_config(self) -> 'None':
         self._set_sub_config_attrs()
 
+        # Our delivery method may have changed from pull to notify
+        self.wake()
+
 # ################################################################################################################################
 
     def get_queue_depth(self) -> 'tuple_[int, int]':
         """ Returns the number of GD and non-GD messages in delivery list.
         """
-        gd = 0
-        non_gd = 0
-
-        for msg in self.delivery_list:
-            if msg.has_gd:
-                gd += 1
-            else:
-                non_gd += 1
-
-        return gd, non_gd
+        return self.delivery_list.get_queue_depth()
 
 # ################################################################################################################################
 
@@ -193,6 +193,7 @@ class PubSubTool:
                 sub_key = sub_key,
                 delivery_lock = delivery_lock,
                 delivery_list = delivery_list,
+                scheduler = self.pubsub.delivery_scheduler,
                 deliver_pubsub_msg = self.deliver_pubsub_msg,
                 confirm_pubsub_msg_delivered_cb = self.confirm_pubsub_msg_delivered,
                 enqueue_initial_messages_func = self.enqueue_initial_messages,
@@ -273,6 +274,9 @@ class PubSubTool:
             add = cast_('callable_', self.delivery_lists[sub_key].add)
             add(NonGDMessage(sub_key, self.server_name, self.server_pid, msg))
 
+        # Let the delivery task know that it has new messages
+        self._wake_delivery_task(sub_key)
+
 # ################################################################################################################################
 
     def add_non_gd_messages_by_sub_key(self, sub_key:'str', messages:'dictlist') -> 'None':
@@ -385,7 +389,13 @@ class PubSubTool:
         ignore_list = set() # type: intset
 
         for sub_key in sub_key_list:
-            for msg in self.delivery_lists[sub_key]:
+
+            # There is no need to look up anything if we know that there are no GD messages for this sub_key
+            delivery_list = self.delivery_lists[sub_key]
+            if not delivery_list.len_gd:
+                continue
+
+            for msg in delivery_list:
                 msg = cast(GDMessage, msg)
                 if msg.has_gd:
                     ignore_list.add(msg.endp_msg_queue_id)
@@ -430,6 +440,19 @@ class PubSubTool:
 
         logger.info('Pushing %d GD message{}to task:%s; msg_ids:%s'.format(' ' if count==1 else 's '), count, sub_key, msg_ids)
 
+        if count:
+            self._wake_delivery_task(sub_key)
+
+# ################################################################################################################################
+
+    def _wake_delivery_task(self, sub_key:'str') -> 'None':
+        """ Signals to the delivery task for input sub_key that there are new messages for it.
+        """
+        # The task will not exist if the subscription could not be found when the sub_key was added
+        task = self.delivery_tasks.get(sub_key)
+        if task:
+            task.wake()
+
 # ################################################################################################################################
 
     def _enqueue_gd_messages_by_sub_key(self, sub_key:'str', gd_msg_list:'sqlmsgiter') -> 'None':
@@ -20,7 +20,9 @@ except ImportError:
     from dateparser.parser import parse as parse_datetime_as_naive # type: ignore
 
 # gevent
-from gevent import spawn
+from gevent import spawn, spawn_later
+from gevent.event import AsyncResult
+from gevent.lock import RLock
 
 # typing-extensions
 from typing_extensions import TypeAlias
@@ -44,7 +46,9 @@ from zato.common.util.time_ import datetime_from_ms, datetime_to_ms, utcnow_as_m
 
 if 0:
     from zato.common.marshal_.api import MarshalAPI
-    from zato.common.typing_ import anylist, callable_, dictlist, strlist, tuple_
+    from gevent import Greenlet
+    from sqlalchemy.orm.session import Session as SASession
+    from zato.common.typing_ import anylist, callable_, dict_, dictlist, intdict, list_, strlist, tuple_
     from zato.server.base.parallel import ParallelServer
     from zato.server.pubsub import PubSub, Topic
     from zato.server.pubsub.model import sublist
@@ -187,6 +191,282 @@ class PubRequest(Model):
 # ################################################################################################################################
 # ################################################################################################################################
 
+class _GDBatch:
+    """ GD publications to a single topic that are waiting to be written to SQL together.
+    """
+    def __init__(self, write_lock:'RLock') -> 'None':
+
+        # The topic's write lock as of when the batch was created - if the topic has a different one when the batch
+        # is written, or none at all, it means that the topic was deleted in the meantime.
+        self.write_lock = write_lock
+
+        # Each publication along with the result that its publisher waits for
+        self.items = [] # type: list_[tuple_[PubCtx, AsyncResult]]
+
+        # How many messages there are in all the publications
+        self.len_msg = 0
+
+        # How many of the messages are not in any subscriber queue, i.e. they will count towards the topic's depth
+        self.len_depth = 0
+
+        # Whether the topic's depth should be read from SQL once the batch is written
+        self.needs_depth_check = False
+
+        # A greenlet that will write the batch unless it becomes full first
+        self.timer = None # type: Greenlet | None
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class GDBatchWriter:
+    """ Coalesces concurrent publications of GD messages to the same topic. All the publications collected
+    over batch_interval seconds, or until batch_size messages are available, are written to SQL in a single transaction,
+    after which each publisher is let known that its messages are durable. Depth of each topic is kept in RAM,
+    updated with each batch written and refreshed from SQL by the writer as often as the topic's depth_check_freq indicates.
+    """
+    def __init__(
+        self,
+        *,
+        server: 'ParallelServer',
+        new_session_func: 'callable_',
+        insert_gd_messages_func: 'callable_',
+        reject_publication_func: 'callable_',
+        batch_size: 'int',
+        batch_interval: 'float',
+    ) -> 'None':
+
+        self.server = server
+        self.new_session_func = new_session_func
+        self.insert_gd_messages_func = insert_gd_messages_func
+        self.reject_publication_func = reject_publication_func
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lock = RLock()
+
+        # Topic ID -> Publications not written yet
+        self.batches = {} # type: dict_[int, _GDBatch]
+
+        # Topic ID -> A lock held while a batch is being written, so each topic has at most one writer at a time
+        self.write_locks = {} # type: dict_[int, RLock]
+
+        # Topic ID -> Depth of the topic, i.e. messages not in any subscriber queue, as of the last batch written
+        self.depth = {} # type: intdict
+
+        # Topic ID -> How many messages that will count towards the topic's depth are in batches not written yet
+        self.pending_depth = {} # type: intdict
+
+        # How many batches and publications have been written so far
+        self.len_batches = 0
+        self.len_publications = 0
+
+# ################################################################################################################################
+
+    def _get_depth(self, ctx:'PubCtx') -> 'int':
+        """ Returns current depth of a topic, reading it from SQL if it is not known yet. This must not be called with
+        self.lock held, so that publications to other topics do not wait for the query.
+        """
+        depth = self.depth.get(ctx.topic.id)
+
+        if depth is None:
+            with closing(self.new_session_func()) as session:
+                depth = get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id)
+
+            # A batch may have been written in the meantime, in which case its depth is more recent than ours
+            depth = self.depth.setdefault(ctx.topic.id, depth)
+
+        return depth
+
+# ################################################################################################################################
+
+    def publish(self, ctx:'PubCtx') -> 'None':
+        """ Adds GD messages from a publication to the topic's batch and waits until the batch is written to SQL.
+        Raises an exception if the messages would exceed the topic's max depth or if they could not be written.
+        """
+        topic_id = ctx.topic.id
+        len_msg = len(ctx.gd_msg_list)
+
+        # Only messages that are not in any subscriber queue count towards the topic's depth
+        len_depth = len([msg for msg in ctx.gd_msg_list if not msg.get('is_in_sub_queue')])
+        result = AsyncResult()
+
+        # Make sure the depth is known before the lock is acquired ..
+        _ = self._get_depth(ctx)
+
+        with self.lock:
+
+            # .. check it against what was already written and what other publishers are about to write ..
+            depth = self.depth[topic_id] + self.pending_depth.get(topic_id, 0) + len_depth
+
+            # .. and reject the publication if max depth would be exceeded - note that this call raises an exception ..
+            if depth > ctx.topic.max_depth_gd:
+                self.reject_publication_func(ctx.cid, ctx.topic.name, True)
+
+            # .. this only updates the local ctx variable.
+            ctx.current_depth = depth
+
+            batch = self.batches.get(topic_id)
+            if not batch:
+                batch = self.batches[topic_id] = _GDBatch(self.write_locks.setdefault(topic_id, RLock()))
+
+            batch.items.append((ctx, result))
+            batch.len_msg += len_msg
+            batch.len_depth += len_depth
+            batch.needs_depth_check = batch.needs_depth_check or ctx.topic.needs_depth_check()
+
+            self.pending_depth[topic_id] = self.pending_depth.get(topic_id, 0) + len_depth
+
+            # The batch is full so it can be written immediately ..
+            if batch.len_msg >= self.batch_size:
+                del self.batches[topic_id]
+                if batch.timer:
+                    batch.timer.kill(block=False)
+                _ = spawn(self._write_batch, topic_id, batch)
+
+            # .. otherwise, it will be written once the interval elapses, unless it becomes full earlier.
+            elif not batch.timer:
+                batch.timer = spawn_later(self.batch_interval, self._on_interval, topic_id, batch)
+
+        # Wait until our messages are durable - this re-raises any exception that the writer may have caught.
+        result.get()
+
+# ################################################################################################################################
+
+    def on_topic_deleted(self, topic_id:'int') -> 'None':
+        """ Forgets everything about a topic that was deleted. Batches already collected for the topic are still written,
+        which lets their publishers know the outcome, but they no longer update anything that we keep about the topic.
+        """
+        with self.lock:
+            _ = self.write_locks.pop(topic_id, None)
+            _ = self.depth.pop(topic_id, None)
+            _ = self.pending_depth.pop(topic_id, None)
+
+# ################################################################################################################################
+
+    def _on_interval(self, topic_id:'int', batch:'_GDBatch') -> 'None':
+        with self.lock:
+
+            # The batch may have been written already because it became full
+            if self.batches.get(topic_id) is not batch:
+                return
+
+            del self.batches[topic_id]
+
+        self._write_batch(topic_id, batch)
+
+# ################################################################################################################################
+
+    def _insert_batch(self, session:'SASession', batch:'_GDBatch') -> 'None':
+        """ Inserts all the messages from a batch without committing them. Publications to the same subscribers
+        are inserted together, which usually means that the whole batch is inserted in one go.
+        """
+        # Sub keys -> Publications to them
+        by_sub_keys = {} # type: dict_[tuple_[str, ...], list_[PubCtx]]
+
+        for ctx, _ in batch.items:
+            sub_keys = tuple(sub.sub_key for sub in ctx.subscriptions_by_topic)
+            by_sub_keys.setdefault(sub_keys, []).append(ctx)
+
+        for ctx_list in by_sub_keys.values():
+
+            # The messages are modified during the insert, so we use copies in case the batch needs
+            # to be written again, one publication at a time, should this insert fail.
+            gd_msg_list = [dict(msg) for ctx in ctx_list for msg in ctx.gd_msg_list]
+
+            ctx = ctx_list[0]
+            now = max(elem.now for elem in ctx_list)
+
+            self.insert_gd_messages_func(session, now, ctx.cid, ctx.topic, gd_msg_list, ctx.subscriptions_by_topic)
+
+# ################################################################################################################################
+
+    def _write_batch(self, topic_id:'int', batch:'_GDBatch') -> 'None':
+        """ Writes a batch to SQL in one transaction and lets each publisher know that its messages are durable.
+        """
+        with batch.write_lock:
+
+            try:
+                with closing(self.new_session_func()) as session:
+
+                    try:
+                        self._insert_batch(session, batch)
+                        session.commit()
+
+                    except Exception:
+
+                        # A single publication may have made the whole batch fail, e.g. because it contained
+                        # a message ID that already exists, so we write each of them in its own transaction.
+                        session.rollback()
+
+                        logger_pubsub.info('Could not write a batch of %d GD publications to topic `%s`, retrying one by one,' + \
+                            ' e:`%s`', len(batch.items), batch.items[0][0].topic.name, format_exc())
+
+                        self._write_one_by_one(batch)
+
+                    else:
+                        for _, result in batch.items:
+                            self.server.incr_pub_counter()
+                            result.set()
+
+                    # Update the depth of the topic now that we know what was actually written,
+                    # unless the topic was deleted in the meantime, in which case there is no depth to update.
+                    if self._is_topic_current(topic_id, batch):
+                        self._update_depth(session, topic_id, batch)
+
+            except Exception as e:
+
+                # We are here if we could not even obtain an SQL session, in which case no publisher can succeed.
+                for _, result in batch.items:
+                    if not result.ready():
+                        result.set_exception(e)
+
+            finally:
+
+                # The messages are either in the topic's depth already or they were not written at all
+                with self.lock:
+                    if self._is_topic_current(topic_id, batch):
+                        self.pending_depth[topic_id] -= batch.len_depth
+
+        self.len_batches += 1
+        self.len_publications += len(batch.items)
+
+# ################################################################################################################################
+
+    def _is_topic_current(self, topic_id:'int', batch:'_GDBatch') -> 'bool':
+        return self.write_locks.get(topic_id) is batch.write_lock
+
+# ################################################################################################################################
+
+    def _write_one_by_one(self, batch:'_GDBatch') -> 'None':
+
+        for ctx, result in batch.items:
+            try:
+                with closing(self.new_session_func()) as session:
+                    self.insert_gd_messages_func(
+                        session, ctx.now, ctx.cid, ctx.topic, ctx.gd_msg_list, ctx.subscriptions_by_topic)
+                    session.commit()
+            except Exception as e:
+                result.set_exception(e)
+            else:
+                self.server.incr_pub_counter()
+                result.set()
+
+# ################################################################################################################################
+
+    def _update_depth(self, session:'SASession', topic_id:'int', batch:'_GDBatch') -> 'None':
+
+        # Read the actual depth from SQL if it is time to do it ..
+        if batch.needs_depth_check:
+            depth = get_gd_depth_topic(session, batch.items[0][0].cluster_id, topic_id)
+
+        # .. or add what we have just written, which is corrected with the next check if any publication failed.
+        else:
+            depth = self.depth.get(topic_id, 0) + batch.len_depth
+
+        self.depth[topic_id] = depth
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class Publisher:
     """ Actual implementation of message publishing exposed through other services to the outside world.
     """
@@ -211,6 +491,25 @@ class Publisher:
         self.service_invoke_func = service_invoke_func
         self.new_session_func = new_session_func
 
+        # Added after 3.2 was released, hence optional
+        config = self.server.fs_server_config.pubsub
+        gd_batch_size = int(config.get('gd_batch_size', PUBSUB.DEFAULT.GD_BATCH_SIZE))
+        gd_batch_interval = float(config.get('gd_batch_interval', PUBSUB.DEFAULT.GD_BATCH_INTERVAL))
+
+        # Writes GD messages to SQL in batches, unless batching is disabled, in which case each publication
+        # is written to SQL in its own transaction.
+        if gd_batch_size > 1:
+            self.gd_batch_writer = GDBatchWriter(
+                server = self.server,
+                new_session_func = self.new_session_func,
+                insert_gd_messages_func = self.insert_gd_messages,
+                reject_publication_func = self.reject_publication,
+                batch_size = gd_batch_size,
+                batch_interval = gd_batch_interval,
+            ) # type: GDBatchWriter | None
+        else:
+            self.gd_batch_writer = None
+
 # ################################################################################################################################
 
     def get_data_prefixes(self, data:'str') -> 'tuple_[str, str]':
@@ -610,55 +909,45 @@ class Publisher:
         # We don't always have GD messages on request so there is no point in running an SQL transaction otherwise.
         if has_gd_msg_list:
 
-            with closing(ctx.new_session_func()) as session:
-
-                # Test first if we should check the depth in this iteration.
-                if ctx.topic.needs_depth_check():
+            if has_logger_pubsub_debug:
+                logger_pubsub.debug(_inserting_gd_msg, ctx.topic.name, [elem['pub_msg_id'] for elem in ctx.gd_msg_list],
+                    ctx.endpoint_name, ctx.ext_client_id, ctx.cid)
 
-                    # Get current depth of this topic ..
-                    ctx.current_depth = get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id)
+            # The messages will be written along with other publications to the same topic ..
+            if self.gd_batch_writer:
 
-                    # .. and abort if max depth is already reached ..
-                    if ctx.current_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
+                # .. this returns only once our messages have been committed.
+                self.gd_batch_writer.publish(ctx)
 
-                        # .. note thath is call raises an exception.
-                        self.reject_publication(ctx.cid, ctx.topic.name, True)
+            else:
 
-                    else:
+                with closing(ctx.new_session_func()) as session:
 
-                        # This only updates the local ctx variable
-                        ctx.current_depth = ctx.current_depth + len_gd_msg_list
+                    # Test first if we should check the depth in this iteration.
+                    if ctx.topic.needs_depth_check():
 
-                pub_msg_list = [elem['pub_msg_id'] for elem in ctx.gd_msg_list]
+                        # Get current depth of this topic ..
+                        ctx.current_depth = get_gd_depth_topic(session, ctx.cluster_id, ctx.topic.id)
 
-                if has_logger_pubsub_debug:
-                    logger_pubsub.debug(_inserting_gd_msg, ctx.topic.name, pub_msg_list, ctx.endpoint_name,
-                        ctx.ext_client_id, ctx.cid)
+                        # .. and abort if max depth is already reached ..
+                        if ctx.current_depth + len_gd_msg_list > ctx.topic.max_depth_gd:
 
-                # This is the call that runs SQL INSERT statements with messages for topics and subscriber queues
-                _ = sql_publish_with_retry(
+                            # .. note thath is call raises an exception.
+                            self.reject_publication(ctx.cid, ctx.topic.name, True)
 
-                    now = ctx.now,
-                    cid = ctx.cid,
-                    topic_id = ctx.topic.id,
-                    topic_name = ctx.topic.name,
-                    cluster_id = ctx.cluster_id,
-                    pub_counter = self.server.get_pub_counter(),
+                        else:
 
-                    session = session,
-                    new_session_func = ctx.new_session_func,
-                    before_queue_insert_func = None,
+                            # This only updates the local ctx variable
+                            ctx.current_depth = ctx.current_depth + len_gd_msg_list
 
-                    gd_msg_list = ctx.gd_msg_list,
-                    subscriptions_by_topic = ctx.subscriptions_by_topic,
-                    should_collect_ctx = False
-                )
+                    # This is the call that runs SQL INSERT statements with messages for topics and subscriber queues
+                    self.insert_gd_messages(session, ctx.now, ctx.cid, ctx.topic, ctx.gd_msg_list, ctx.subscriptions_by_topic)
 
-                # Run an SQL commit for all queries above ..
-                session.commit()
+                    # Run an SQL commit for all queries above ..
+                    session.commit()
 
-                # .. increase the publication counter now that we have committed the messages ..
-                self.server.incr_pub_counter()
+                    # .. increase the publication counter now that we have committed the messages ..
+                    self.server.incr_pub_counter()
 
             # .. and set a flag to signal that there are some GD messages available
             ctx.pubsub.set_sync_has_msg(
@@ -738,6 +1027,37 @@ class Publisher:
         out = self._build_response(len_gd_msg_list, ctx)
         return out
 
+# ################################################################################################################################
+
+    def insert_gd_messages(
+        self,
+        session:'SASession',
+        now:'float',
+        cid:'str',
+        topic:'Topic',
+        gd_msg_list:'dictlist',
+        subscriptions_by_topic:'sublist'
+    ) -> 'None':
+        """ Runs SQL INSERT statements with messages for topics and subscriber queues, without committing them.
+        """
+        _ = sql_publish_with_retry(
+
+            now = now,
+            cid = cid,
+            topic_id = topic.id,
+            topic_name = topic.name,
+            cluster_id = self.server.cluster_id,
+            pub_counter = self.server.get_pub_counter(),
+
+            session = session,
+            new_session_func = self.new_session_func,
+            before_queue_insert_func = None,
+
+            gd_msg_list = gd_msg_list,
+            subscriptions_by_topic = subscriptions_by_topic,
+            should_collect_ctx = False
+        )
+
 # ################################################################################################################################
 
     def reject_publication(self, cid:'str', topic_name:'str', is_gd:'bool') -> 'None':
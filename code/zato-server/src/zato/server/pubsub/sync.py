@@ -10,6 +10,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 import logging
+from heapq import heapify, heappop, heappush
 from traceback import format_exc
 
 # gevent
@@ -19,7 +20,7 @@ from gevent.lock import RLock
 # Zato
 from zato.common.api import PUBSUB
 from zato.common.exception import BadRequest
-from zato.common.typing_ import any_, anydict, anylist, anyset, anytuple, callable_, dict_, dictlist, intsetdict, strlist, \
+from zato.common.typing_ import any_, anydict, anylist, anyset, anytuple, callable_, dict_, dictlist, intdictdict, strlist, \
      strdictdict, strset, strsetdict
 from zato.common.util.api import spawn_greenlet
 from zato.common.util.pubsub import make_short_msg_copy_from_dict
@@ -64,6 +65,10 @@ _update_attrs = (
 _default_expiration = PUBSUB.DEFAULT.EXPIRATION
 default_sk_server_table_columns = 6, 15, 8, 6, 17, 80
 
+# The expiry heap is rebuilt from live messages only if it has at least that many entries
+# and more than half of them point to messages that were already deleted or whose expiration was changed.
+_expiry_heap_compact_min = 1024
+
 # ################################################################################################################################
 
 def get_priority(
@@ -106,15 +111,20 @@ class InRAMSync:
     """ A backlog of messages kept in RAM for whom there are subscriptions - that is, they are known to have subscribers
     and will be ultimately delivered to them. Stores a list of sub_keys and all messages that a sub_key points to.
     It acts as a multi-key dict and keeps only a single copy of message for each sub_key.
+
+    Messages for each topic and sub_key are kept in dicts whose values are always None - they are used as insertion-ordered
+    sets, which means that deleting a message is O(1) and the messages are returned in the order they were published.
+    Expiration times are kept in a heap so the cleanup task visits expired messages only.
     """
 
     lock: 'RLock'
     pubsub: 'PubSub'
 
     msg_id_to_msg:     'strdictdict'
-    topic_id_msg_id:   'intsetdict'
-    sub_key_to_msg_id: 'strsetdict'
+    topic_id_msg_id:   'intdictdict'
+    sub_key_to_msg_id: 'strdictdict'
     msg_id_to_sub_key: 'strsetdict'
+    expiry_heap:       'anylist'
 
     def __init__(self, pubsub:'PubSub') -> 'None':
 
@@ -124,15 +134,19 @@ class InRAMSync:
         # Msg ID   -> Message data - What is the actual contents of each message
         self.msg_id_to_msg = {}
 
-        # Topic ID -> Msg ID set --- What messages are available for each topic (no matter sub_key)
+        # Topic ID -> Msg ID ordered set --- What messages are available for each topic (no matter sub_key)
         self.topic_id_msg_id = {}
 
-        # Sub key  -> Msg ID set --- What messages are available for a given subcriber
+        # Sub key  -> Msg ID ordered set --- What messages are available for a given subcriber
         self.sub_key_to_msg_id = {}
 
         # Msg ID   -> Sub key set  - What subscribers are interested in a given message
         self.msg_id_to_sub_key = {}
 
+        # A min-heap of (expiration_time, msg_id) tuples - entries of messages that were deleted
+        # or whose expiration time was updated are skipped when they are popped off the heap.
+        self.expiry_heap = []
+
         # Start in background a cleanup task that deletes all expired and removed messages
         _ = spawn_greenlet(self.run_cleanup_task)
 
@@ -153,9 +167,9 @@ class InRAMSync:
         with self.lock:
 
             # Local aliases
-            msg_ids = [msg['pub_msg_id'] for msg in messages]
+            msg_ids = dict.fromkeys(msg['pub_msg_id'] for msg in messages)
             len_messages = len(messages)
-            topic_messages = self.topic_id_msg_id.setdefault(topic_id, set())
+            topic_messages = self.topic_id_msg_id.setdefault(topic_id, {})
 
             # Try to append the messages for each of their subscribers ..
             for sub_key in sub_keys:
@@ -169,7 +183,7 @@ class InRAMSync:
                     continue
 
                 # .. otherwise, we make it known that the sub_key is interested in this message ..
-                sub_key_msg = self.sub_key_to_msg_id.setdefault(sub_key, set())
+                sub_key_msg = self.sub_key_to_msg_id.setdefault(sub_key, {})
                 sub_key_msg.update(msg_ids)
 
             # For each message given on input, store its actual contents ..
@@ -194,6 +208,9 @@ class InRAMSync:
                 msg_sub_key = self.msg_id_to_sub_key.setdefault(msg['pub_msg_id'], set())
                 msg_sub_key.update(sub_keys)
 
+                # .. make it known when the message expires ..
+                heappush(self.expiry_heap, (msg['expiration_time'], msg['pub_msg_id']))
+
             # .. and add a reference to it to the topic.
             topic_messages.update(msg_ids)
 
@@ -213,9 +230,15 @@ class InRAMSync:
                 logger_zato.warning(_warn, msg['msg_id'])
                 return False # No such message
             else:
+                expiration_time = _msg['expiration_time']
+
                 for attr in _update_attrs:
                     _msg[attr] = msg[attr]
 
+                # The previous entry in the expiry heap will be skipped by the cleanup task
+                if _msg['expiration_time'] != expiration_time:
+                    heappush(self.expiry_heap, (_msg['expiration_time'], _msg['pub_msg_id']))
+
                 # Ok, found and updated
                 return True
 
@@ -241,21 +264,20 @@ class InRAMSync:
             _has_topic_msg = False # Was the ID found for at least one topic
             _has_sk_msg = False     # Ditto but for sub_keys
 
-            for _topic_msg_set in self.topic_id_msg_id.values():
-                try:
-                    _ = _topic_msg_set.remove(msg_id)
-                except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
-                else:
+            # The message knows which topic it was published to ..
+            if found_to_msg:
+                _topic_msg_set = self.topic_id_msg_id.get(found_to_msg['topic_id'])
+                if _topic_msg_set and msg_id in _topic_msg_set:
+                    del _topic_msg_set[msg_id]
                     _has_topic_msg = True
 
-            for _sk_msg_set in self.sub_key_to_msg_id.values():
-                try:
-                    _ = _sk_msg_set.remove(msg_id)
-                except KeyError:
-                    pass # This is fine, msg_id did not belong to this topic
-                else:
-                    _has_sk_msg = True
+            # .. and the reverse mapping tells us which sub_keys may still point to it.
+            if found_to_sub_key:
+                for sub_key in found_to_sub_key:
+                    _sk_msg_set = self.sub_key_to_msg_id.get(sub_key)
+                    if _sk_msg_set and msg_id in _sk_msg_set:
+                        del _sk_msg_set[msg_id]
+                        _has_sk_msg = True
 
             if not found_to_sub_key:
                 logger.warning('Message not found (msg_id_to_sub_key) %s', msg_id)
@@ -285,7 +307,7 @@ class InRAMSync:
 
     def has_messages_by_sub_key(self, sub_key:'str') -> 'bool':
         with self.lock:
-            msg_id_set = self.sub_key_to_msg_id.get(sub_key) or set()
+            msg_id_set = self.sub_key_to_msg_id.get(sub_key) or {}
             return len(msg_id_set) > 0
 
 # ################################################################################################################################
@@ -296,10 +318,10 @@ class InRAMSync:
         with self.lock:
 
             # Not all servers will have messages for the topic, hence .get
-            messages = self.topic_id_msg_id.get(topic_id, set())
+            messages = self.topic_id_msg_id.get(topic_id, {})
 
             if messages:
-                messages = list(messages) # We need a copy so as not to change the input set during iteration later on
+                messages = list(messages) # We need a copy so as not to change the input dict during iteration later on
                 self._delete_messages(messages)
             else:
                 logger.info(
@@ -364,12 +386,17 @@ class InRAMSync:
             # .. first, direct mappings ..
             _ = self.msg_id_to_msg.pop(msg_id, None)
 
-            logger.info('Deleting msg from mapping dict `%s`, before:`%s`', msg_id, self.msg_id_to_msg)
+            logger.info('Deleting msg from mapping dict `%s`', msg_id)
 
             # .. now, remove the message from topic ..
-            self.topic_id_msg_id[topic_id].remove(msg_id)
+            _ = self.topic_id_msg_id[topic_id].pop(msg_id, None)
 
-            logger.info('Deleting msg from mapping topic `%s`, after:`%s`', msg_id, self.topic_id_msg_id)
+            # .. the sub_keys from input no longer point to this message ..
+            msg_sub_keys = self.msg_id_to_sub_key.get(msg_id)
+            if msg_sub_keys is not None:
+                msg_sub_keys.difference_update(sub_keys)
+                if not msg_sub_keys:
+                    del self.msg_id_to_sub_key[msg_id]
 
             # .. now, find the message for each sub_key ..
             for sub_key in sub_keys:
@@ -382,13 +409,10 @@ class InRAMSync:
                 # will not have this response for current sub_key.
                 if sub_key_to_msg_id:
 
-                    # .. delete the message itself - but we need to catch ValueError because
+                    # .. delete the message itself - it is not an error if it is not found because
                     # to_delete_msg is a list of all messages to be deleted and we do not know
                     # if this particular message belonged to this particular sub_key or not.
-                    try:
-                        sub_key_to_msg_id.remove(msg_id)
-                    except KeyError:
-                        pass # OK, message was not found for this sub_key
+                    _ = sub_key_to_msg_id.pop(msg_id, None)
 
                     # .. now delete the sub_key either because we are explicitly told to (e.g. during unsubscribe)
                     if delete_sub:# or (not sub_key_to_msg_id):
@@ -423,8 +447,8 @@ class InRAMSync:
             if not msg_id_list:
                 return []
 
-            # A list of messages to be returned - we actually need to build a whole list instead of using
-            # generators because the underlying container is an unsorted set and we need a sorted result on output.
+            # A list of messages to be returned - we build a whole list instead of using generators
+            # because the underlying container must not be changed by other greenlets while our caller iterates it.
             msg_list = [] # type: dictlist
 
             for msg_id in msg_id_list:
@@ -479,84 +503,107 @@ class InRAMSync:
                 for msg_id in msg_ids:
 
                     # Get all subscribers interested in this message ..
-                    current_subs = self.msg_id_to_sub_key[msg_id]
-                    current_subs.remove(sub_key)
+                    current_subs = self.msg_id_to_sub_key.get(msg_id)
+                    if current_subs is None:
+                        continue
+                    current_subs.discard(sub_key)
 
-                    # .. if the list is empty, it means that there no some subscribers left for that message,
+                    # .. if the set is empty, it means that there no some subscribers left for that message,
                     # in which case we may deleted references to this message from other look-up structures.
                     if not current_subs:
-                        del self.msg_id_to_msg[msg_id]
-                        topic_msg = self.topic_id_msg_id[topic_id]
-                        topic_msg.remove(msg_id)
+                        del self.msg_id_to_sub_key[msg_id]
+                        _ = self.msg_id_to_msg.pop(msg_id, None)
+                        topic_msg = self.topic_id_msg_id.get(topic_id)
+                        if topic_msg:
+                            _ = topic_msg.pop(msg_id, None)
 
         logger.info(pattern, sub_keys, topic_name)
         logger_zato.info(pattern, sub_keys, topic_name)
 
 # ################################################################################################################################
 
-    def run_cleanup_task(self, _utcnow:'callable_'=utcnow_as_ms, _sleep:'callable_'=sleep) -> 'None':
-        """ A background task waking up periodically to remove all expired and retrieved messages from backlog.
+    def _rebuild_expiry_heap(self) -> 'None':
+        """ Rebuilds the expiry heap out of messages that still exist - must be called with self.lock held.
+        """
+        self.expiry_heap = [(msg['expiration_time'], msg_id) for msg_id, msg in self.msg_id_to_msg.items()]
+        heapify(self.expiry_heap)
+
+# ################################################################################################################################
+
+    def _delete_expired_messages(self, now:'float') -> 'int':
+        """ Deletes all the messages that expired before now and returns how many there were - must be called with self.lock held.
         """
 
         # Forward declarations
-        msg_id:   'str'
-        sub_key:  'str'
-        topic_id: 'int'
+        msg_id:  'str'
+        sub_key: 'str'
 
-        while True:
-            try:
-                with self.lock:
+        # Local aliases
+        heap = self.expiry_heap
+        publishers = {} # type: dict_[int, Endpoint]
+        len_expired = 0
 
-                    # Local alias
-                    publishers = {} # type: dict_[int, Endpoint]
+        while heap and now >= heap[0][0]:
 
-                    # We keep them separate so as not to modify any objects during iteration.
-                    expired_msg = [] # type: anylist
+            expiration_time, msg_id = heappop(heap)
+            msg = self.msg_id_to_msg.get(msg_id)
 
-                    # Calling it once will suffice.
-                    now = _utcnow()
+            # The message was already deleted or its expiration time was updated, in which case there is another entry for it
+            if not msg or msg['expiration_time'] != expiration_time:
+                continue
 
-                    for _, msg in self.msg_id_to_msg.items():
+            # It's possible that there will be many expired messages all sent by the same publisher
+            # so there is no need to query self.pubsub for each message.
+            if msg['published_by_id'] not in publishers:
+                publishers[msg['published_by_id']] = self.pubsub.get_endpoint_by_id(msg['published_by_id'])
 
-                        if now >= msg['expiration_time']:
+            # We can be sure that it is always found
+            publisher = publishers[msg['published_by_id']] # type: Endpoint
 
-                            # It's possible that there will be many expired messages all sent by the same publisher
-                            # so there is no need to query self.pubsub for each message.
-                            if msg['published_by_id'] not in publishers:
-                                publishers[msg['published_by_id']] = self.pubsub.get_endpoint_by_id(msg['published_by_id'])
+            # Log the message to make sure the expiration event is always logged ..
+            logger_zato.info('Found an expired msg:`%s`, topic:`%s`, publisher:`%s`, pub_time:`%s`, exp:`%s`',
+                msg['pub_msg_id'], msg['topic_name'], publisher.name, msg['pub_time'], msg['expiration'])
 
-                            # We can be sure that it is always found
-                            publisher = publishers[msg['published_by_id']] # type: Endpoint
+            # .. get all sub_keys waiting for this message and delete the message from each one,
+            # but note that there may be possibly no subscribers at all if the message was published
+            # to a topic without any subscribers ..
+            for sub_key in self.msg_id_to_sub_key.pop(msg_id, ()):
+                sub_key_msg = self.sub_key_to_msg_id.get(sub_key)
+                if sub_key_msg:
+                    _ = sub_key_msg.pop(msg_id, None)
 
-                            # Log the message to make sure the expiration event is always logged ..
-                            logger_zato.info('Found an expired msg:`%s`, topic:`%s`, publisher:`%s`, pub_time:`%s`, exp:`%s`',
-                                msg['pub_msg_id'], msg['topic_name'], publisher.name, msg['pub_time'], msg['expiration'])
+            # .. remove all references to the message from topic ..
+            topic_msg = self.topic_id_msg_id.get(msg['topic_id'])
+            if topic_msg:
+                _ = topic_msg.pop(msg_id, None)
 
-                            # .. and append it to the list of messages to be deleted.
-                            expired_msg.append((msg['pub_msg_id'], msg['topic_id']))
+            # .. and finally, remove the message's contents.
+            del self.msg_id_to_msg[msg_id]
+            len_expired += 1
 
-                    # For logging what was done
-                    len_expired = len(expired_msg)
+        # Messages consumed before they expired leave their entries behind so, if there are too many of them,
+        # we rebuild the heap, which is still O(1) amortized per message because it happens this rarely.
+        if len(heap) > _expiry_heap_compact_min and len(heap) > 2 * len(self.msg_id_to_msg):
+            self._rebuild_expiry_heap()
 
-                    # Iterate over all the expired messages found and delete them from in-RAM structures
-                    for msg_id, topic_id in expired_msg:
+        return len_expired
 
-                        # Get all sub_keys waiting for these messages and delete the message from each one,
-                        # but note that there may be possibly no subscribers at all if the message was published
-                        # to a topic without any subscribers.
-                        for sub_key in self.msg_id_to_sub_key.pop(msg_id):
-                            self.sub_key_to_msg_id[sub_key].remove(msg_id)
+# ################################################################################################################################
 
-                        # Remove all references to the message from topic
-                        self.topic_id_msg_id[topic_id].remove(msg_id)
+    def run_cleanup_task(self, _utcnow:'callable_'=utcnow_as_ms, _sleep:'callable_'=sleep) -> 'None':
+        """ A background task waking up periodically to remove all expired and retrieved messages from backlog.
+        """
+        while True:
+            try:
+                with self.lock:
 
-                        # And finally, remove the message's contents
-                        del self.msg_id_to_msg[msg_id]
+                    # Calling it once will suffice.
+                    len_expired = self._delete_expired_messages(_utcnow())
+                    len_messages = len(self.msg_id_to_msg)
 
                 suffix = 's' if (len_expired==0 or len_expired > 1) else ''
-                len_messages = len(self.msg_id_to_msg)
-                if len_expired or len_messages:
-                    logger.info('In-RAM. Deleted %s pub/sub message%s. Left:%s' % (len_expired, suffix, self.msg_id_to_msg))
+                if len_expired:
+                    logger.info('In-RAM. Deleted %s pub/sub message%s. Left:%s' % (len_expired, suffix, len_messages))
 
                 # Sleep for a moment before checking again but don't do it with self.lock held.
                 _sleep(2)
@@ -595,7 +642,7 @@ class InRAMSync:
         """ Returns depth of a given in-RAM queue for the topic.
         """
         with self.lock:
-            return len(self.topic_id_msg_id.get(topic_id, set()))
+            return len(self.topic_id_msg_id.get(topic_id, {}))
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -42,6 +42,7 @@ from zato.server.commands import CommandsFacade
 from zato.server.connection.cache import CacheAPI
 from zato.server.connection.email import EMailAPI
 from zato.server.connection.facade import KeysightContainer, RESTFacade, SchedulerFacade
+from zato.server.connection.http_soap.stream import RequestBody
 from zato.server.connection.jms_wmq.outgoing import WMQFacade
 from zato.server.connection.search import SearchAPI
 from zato.server.connection.sms import SMSAPI
@@ -725,7 +726,8 @@ class Service:
         # Here's an edge case. If a SOAP request has a single child in Body and this child is an empty element
         # (though possibly with attributes), checking for 'not payload' alone won't suffice - this evaluates
         # to False so we'd be parsing the payload again superfluously.
-        if not isinstance(payload, ObjectifiedElement) and not payload:
+        # Streamed requests are not parsed here at all, only when a service accesses its payload, if ever.
+        if not isinstance(payload, ObjectifiedElement) and not payload and not isinstance(raw_request, RequestBody):
             payload = payload_from_request(server.json_parser, cid, raw_request, data_format, transport, channel_item)
 
         job_type = kwargs.get('job_type') or ''
@@ -767,7 +769,8 @@ class Service:
                 # Check if there is a JSON Schema validator attached to the service and if so,
                 # validate input before proceeding any further.
                 if service._json_schema_validator and service._json_schema_validator.is_initialized:
-                    validation_result = service._json_schema_validator.validate(cid, raw_request)
+                    schema_request = raw_request.getvalue() if isinstance(raw_request, RequestBody) else raw_request
+                    validation_result = service._json_schema_validator.validate(cid, schema_request)
                     if not validation_result:
                         error = validation_result.get_error()
 
@@ -1032,9 +1035,11 @@ class Service:
         cid='',        # type: str
         callback=None, # type: str | Service | None
         zato_ctx=None, # type: stranydict | None
-        environ=None   # type: stranydict | None
+        environ=None,  # type: stranydict | None
+        pool=''        # type: str
     ) -> 'str':
-        """ Invokes a service asynchronously by its name.
+        """ Invokes a service asynchronously by its name, in the async pool given on input or, if there is none,
+        in the pool configured for that service or channel, or in the default one.
         """
 
         zato_ctx = zato_ctx if zato_ctx is not None else {}
@@ -1087,7 +1092,7 @@ class Service:
         if callback:
             async_ctx.callback = list(callback) if isinstance(callback, (list, tuple)) else [callback]
 
-        spawn_greenlet(self._invoke_async, async_ctx, channel)
+        self.server.async_executor.submit(pool, name, channel, self._invoke_async, async_ctx, channel)
 
         return cid
 
@@ -1337,6 +1342,11 @@ class Service:
         channel_item = cast_('stranydict', channel_item)
         sec_def_info = wsgi_environ.get('zato.sec_def', {})
 
+        # A streamed request is parsed only if the service needs its payload
+        if isinstance(raw_request, RequestBody):
+            service.request.set_payload_loader(lambda: payload_from_request(
+                server.json_parser, cid, raw_request.getvalue(), data_format, transport, channel_item))
+
         if channel_type == _AMQP:
             service.request.amqp = AMQPRequestData(channel_item['amqp_msg'])
 
@@ -19,6 +19,7 @@ from zato.common.api import CACHE as _COMMON_CACHE
 from zato.common.broker_message import CACHE
 from zato.common.odb.model import CacheBuiltin
 from zato.common.odb.query import cache_builtin_list
+from zato.common.util.sql import parse_instance_opaque_attr
 from zato.server.service import Bool, Int
 from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.internal.cache import common_instance_hook
@@ -34,7 +35,8 @@ list_func = cache_builtin_list
 skip_create_integrity_error = True
 skip_if_exists = True
 skip_input_params = ['cache_id']
-output_optional_extra = ['current_size', 'cache_id']
+create_edit_input_optional_extra = [Bool('has_key_index')]
+output_optional_extra = ['current_size', 'cache_id', Bool('has_key_index')]
 
 # ################################################################################################################################
 
@@ -95,9 +97,13 @@ class Get(AdminService):
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
             Int('current_size'))
+        output_optional = (Bool('has_key_index'),)
 
     def handle(self):
-        response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
+        cache = self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id)
+
+        response = asdict(cache)
+        response.update(parse_instance_opaque_attr(cache))
         response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
 
         self.response.payload = response
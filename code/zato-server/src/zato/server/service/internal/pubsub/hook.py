@@ -59,6 +59,11 @@ class GetHookServiceList(AdminService):
 
         for impl_name, details in self.server.service_store.services.items():
 
+            # Inactive services cannot be hooks, and checking it first means that we do not import
+            # classes of services restored from a snapshot only to find out that they are inactive.
+            if not details['is_active']:
+                continue
+
             if is_class_pubsub_hook(details['service_class']):
                 service_id = self.server.service_store.impl_name_to_id[impl_name]
                 out.append({
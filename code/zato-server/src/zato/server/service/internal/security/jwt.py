@@ -276,10 +276,17 @@ class LogOut(Service):
             self.response.payload.result = 'No JWT found'
 
         try:
-            JWTBackend(self.odb, self.server.decrypt, self.server.jwt_secret).delete(token)
+            JWTBackend(self.odb, self.server.decrypt, self.server.jwt_secret, self.server.jwt_token_cache).delete(token)
         except Exception:
             self.logger.warning(format_exc())
             self.response.status_code = BAD_REQUEST
             self.response.payload.result = 'Token could not be deleted'
+        else:
+
+            # Let all the other servers know that they should not accept this token anymore
+            self.broker_client.publish({
+                'action': SECURITY.JWT_TOKEN_DELETE.value,
+                'token_key': self.server.jwt_token_cache.get_key(token),
+            })
 
 # ################################################################################################################################
@@ -23,6 +23,7 @@ from zato.common.marshal_.api import Model
 from zato.common.json_internal import loads
 from zato.common.util.api import make_repr
 from zato.common.util.http import get_form_data as util_get_form_data
+from zato.server.connection.http_soap.stream import RequestBody
 
 # Zato - Cython
 from zato.simpleio import ServiceInput
@@ -47,7 +48,7 @@ if 0:
     # Zato
     from zato.common.kvdb.api import KVDB as KVDBAPI
     from zato.common.odb.api import PoolStore
-    from zato.common.typing_ import any_, stranydict
+    from zato.common.typing_ import any_, callable_, stranydict
     from zato.hl7.mllp.server import ConnCtx as HL7ConnCtx
     from zato.server.config import ConfigDict, ConfigStore
     from zato.server.connection.email import EMailAPI
@@ -178,15 +179,16 @@ class Request:
     """
     raw_request: 'any_'
 
-    __slots__ = ('service', 'logger', 'payload', 'raw_request', 'input', 'cid', 'data_format', 'transport',
-        'encrypt_func', 'encrypt_secrets', 'bytes_to_str_encoding', '_wsgi_environ', 'channel_params',
+    __slots__ = ('service', 'logger', '_payload', '_payload_loader', 'raw_request', 'input', 'cid', 'data_format',
+        'transport', 'encrypt_func', 'encrypt_secrets', 'bytes_to_str_encoding', '_wsgi_environ', 'channel_params',
         'merge_channel_params', 'http', 'amqp', 'wmq', 'ibm_mq', 'hl7', 'enforce_string_encoding')
 
     def __init__(self, service, simple_io_config=None, data_format=None, transport=None):
         # type: (Service, object, str, str)
         self.service = service
         self.logger = service.logger # type: Logger
-        self.payload = ''
+        self._payload = ''
+        self._payload_loader = None # type: callable_ | None
         self.raw_request = ''
         self.input = None # type: any_
         self.cid = None # type: str
@@ -203,6 +205,32 @@ class Request:
         self.encrypt_secrets = True
         self.bytes_to_str_encoding = None # type: str
 
+# ################################################################################################################################
+
+    @property
+    def payload(self) -> 'any_':
+        """ The request's payload, which, if there is a payload loader, is loaded only when it is first accessed.
+        """
+        if self._payload_loader:
+            loader, self._payload_loader = self._payload_loader, None
+            self._payload = loader()
+
+        return self._payload
+
+    @payload.setter
+    def payload(self, value:'any_') -> 'None':
+        self._payload_loader = None
+        self._payload = value
+
+# ################################################################################################################################
+
+    def set_payload_loader(self, loader:'callable_') -> 'None':
+        """ Makes the payload be loaded by the callable given on input, but only if it is ever needed,
+        e.g. to parse a streamed request only if the service accesses self.request.payload.
+        """
+        self._payload = ''
+        self._payload_loader = loader
+
 # ################################################################################################################################
 
     def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func):
@@ -256,6 +284,10 @@ class Request:
         if isinstance(self.raw_request, dict):
             return bunchify(deepcopy(self.raw_request))
 
+        # A streamed request needs to be read in full first
+        if isinstance(self.raw_request, RequestBody):
+            return bunchify(loads(self.raw_request.getvalue()))
+
         # Must be a JSON input, raises exception when attempting to load it if it's not
         return bunchify(loads(self.raw_request))
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import sys
+from hashlib import sha256
+from importlib import import_module
+from importlib.util import find_spec
+from logging import getLogger
+from pickle import dumps, HIGHEST_PROTOCOL, loads
+from traceback import format_exc
+
+# Zato
+from zato.common.version import get_version
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.api import SourceCodeInfo
+    from zato.common.typing_ import any_, anydict, callable_, iterator_, list_, stranydict, strnone
+    from zato.server.service import Service
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+version = get_version()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # Stored in the server's config/repo directory
+    File_Name = 'internal-snapshot.dat'
+    Temp_Suffix = '.tmp'
+
+    # Must be increased each time the contents of a snapshot change
+    Format_Version = 1
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def find_module_file(mod_name:'str') -> 'strnone':
+    """ Returns the path to the source file of a module, without importing it if at all possible.
+    """
+    # The module may have been imported already ..
+    mod = sys.modules.get(mod_name)
+    if mod:
+        return getattr(mod, '__file__', None)
+
+    parts = mod_name.split('.')
+
+    # .. if not, we look it up in the directories of the closest package that has been imported ..
+    for idx in range(len(parts) - 1, 0, -1):
+        package = sys.modules.get('.'.join(parts[:idx]))
+        package_path = getattr(package, '__path__', None)
+
+        if package_path:
+            for dir_name in package_path:
+                path = os.path.join(dir_name, *parts[idx:])
+                for file_name in os.path.join(path, '__init__.py'), path + '.py':
+                    if os.path.isfile(file_name):
+                        return file_name
+            break
+
+    # .. and if that was not possible, we let Python find it, which may import its parent packages.
+    spec = find_spec(mod_name)
+    return spec.origin if spec else None
+
+# ################################################################################################################################
+
+def get_snapshot_key(mod_names:'iterator_[str]') -> 'str':
+    """ Returns a key that changes each time the Zato version or the source code of any of the modules on input does.
+    """
+    key = sha256('{}:{}'.format(ModuleCtx.Format_Version, version).encode('utf8'))
+
+    for mod_name in sorted(mod_names):
+        key.update(mod_name.encode('utf8'))
+
+        path = find_module_file(mod_name)
+        if path:
+            with open(path, 'rb') as f:
+                key.update(sha256(f.read()).digest())
+
+    return key.hexdigest()
+
+# ################################################################################################################################
+
+def load_service_class(entry:'stranydict') -> 'type[Service]':
+    """ Imports the module of a service from a snapshot and returns the service's class.
+    """
+    mod = import_module(entry['mod_name'])
+    return getattr(mod, entry['class_name'])
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyServiceInfo(dict):
+    """ Information about a service restored from a snapshot. The service's class is imported and set up
+    the first time that the service is invoked or that anything else needs the class.
+    """
+    def __init__(self, load_func:'callable_', entry:'stranydict', **kwargs:'any_') -> 'None':
+        super().__init__(**kwargs)
+        self.load_func = load_func
+        self.entry = entry
+
+    def __missing__(self, key:'str') -> 'any_':
+
+        if key != 'service_class':
+            raise KeyError(key)
+
+        class_ = self.load_func(self.entry)
+        self['service_class'] = class_
+
+        return class_
+
+    def __contains__(self, key:'any_') -> 'bool':
+        # The class is always there, even if it has not been imported yet ..
+        return key == 'service_class' or super().__contains__(key)
+
+    def get(self, key:'str', default:'any_'=None) -> 'any_':
+        # .. which is why it is imported if it is looked up in any way.
+        if key in self:
+            return self[key]
+        else:
+            return default
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ServiceSnapshot:
+    """ Metadata of internal services that the first worker of a server computes when it deploys them, so that other workers
+    can restore it instead of importing and setting up each of the services again.
+    """
+    def __init__(self, path:'str', key:'str', deployment_key:'str') -> 'None':
+        self.path = path
+        self.key = key
+        self.deployment_key = deployment_key
+        self.services = [] # type: list_[stranydict]
+
+# ################################################################################################################################
+
+    def add(
+        self,
+        class_,           # type: type[Service]
+        name,             # type: str
+        impl_name,        # type: str
+        service_id,       # type: int
+        is_active,        # type: bool
+        slow_threshold,   # type: int
+        deployment_info,  # type: anydict
+        source_code_info, # type: SourceCodeInfo
+        needs_eager_load, # type: bool
+    ) -> 'None':
+        self.services.append({
+            'name': name,
+            'impl_name': impl_name,
+            'mod_name': class_.__module__,
+            'class_name': class_.__name__,
+            'service_id': service_id,
+            'is_active': is_active,
+            'slow_threshold': slow_threshold,
+            'deployment_info': deployment_info,
+            'source_path': source_code_info.path,
+            'source_hash': source_code_info.hash,
+            'source_hash_method': source_code_info.hash_method,
+            'len_source': source_code_info.len_source,
+            'needs_eager_load': needs_eager_load,
+        })
+
+# ################################################################################################################################
+
+    def save(self) -> 'None':
+        """ Writes the snapshot out to disk in a way that readers will never see a partially written one.
+        """
+        data = dumps({
+            'key': self.key,
+            'deployment_key': self.deployment_key,
+            'services': self.services,
+        }, protocol=HIGHEST_PROTOCOL)
+
+        temp_path = self.path + ModuleCtx.Temp_Suffix
+
+        with open(temp_path, 'wb') as f:
+            _ = f.write(data)
+
+        os.replace(temp_path, self.path)
+
+# ################################################################################################################################
+
+    @staticmethod
+    def load(path:'str', key:'str', deployment_key:'str') -> 'ServiceSnapshot | None':
+        """ Returns a snapshot from the path given on input, or None if there is no such snapshot, if it cannot be read,
+        or if it was created for a different version of the source code or during a different deployment.
+        """
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                data = loads(f.read())
+        except Exception:
+            logger.info('Ignoring snapshot of internal services that could not be read `%s`, e:`%s`', path, format_exc())
+            return None
+
+        if data['key'] != key:
+            logger.info('Ignoring snapshot of internal services created for different sources `%s`', path)
+            return None
+
+        # Service IDs are valid only for the deployment that they were read in
+        if data['deployment_key'] != deployment_key:
+            logger.info('Ignoring snapshot of internal services created during a different deployment `%s`', path)
+            return None
+
+        snapshot = ServiceSnapshot(path, key, deployment_key)
+        snapshot.services[:] = data['services']
+
+        return snapshot
+
+# ################################################################################################################################
+# ################################################################################################################################
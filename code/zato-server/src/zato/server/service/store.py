@@ -15,15 +15,11 @@ from functools import total_ordering
 from hashlib import sha256
 from importlib import import_module
 from inspect import getargspec, getmodule, getmro, getsourcefile, isclass
-from pickle import HIGHEST_PROTOCOL as highest_pickle_protocol
 from random import randint
 from shutil import copy as shutil_copy
 from traceback import format_exc
 from typing import Any, List
 
-# dill
-from dill import load as dill_load
-
 # gevent
 from gevent import sleep as gevent_sleep
 from gevent.lock import RLock
@@ -55,6 +51,8 @@ from zato.server.config import ConfigDict
 from zato.server.service import after_handle_hooks, after_job_hooks, before_handle_hooks, before_job_hooks, \
     PubSubHook, SchedulerFacade, Service, WSXFacade
 from zato.server.service.internal import AdminService
+from zato.server.service.snapshot import get_snapshot_key, LazyServiceInfo, load_service_class, \
+    ModuleCtx as SnapshotCtx, ServiceSnapshot
 
 # Zato - Cython
 from zato.simpleio import CySimpleIO
@@ -105,7 +103,6 @@ internal_to_ignore.append('stomp')
 # ################################################################################################################################
 # ################################################################################################################################
 
-_unsupported_pickle_protocol_msg = 'unsupported pickle protocol:'
 data_class_model_class_name = 'zato.server.service.Model'
 
 # ################################################################################################################################
@@ -702,21 +699,20 @@ class ServiceStore:
         sync_internal, # type: bool
         is_first       # type: bool
     ) -> 'anylist':
-        """ Imports and optionally caches locally internal services.
+        """ Imports internal services or, if this is not the first worker of this server, restores them
+        from the snapshot that the first worker created.
         """
-        cache_file_path = os.path.join(base_dir, 'config', 'repo', 'internal-cache.dat')
-
-        # It is possible that the cache file exists but it is of size zero.
-        # This will happen if the process of writing data out to the file
-        # was interrupted for any reason the last time the server was starting up.
-        # In that case, we need to delete the file altogether and let it recreate.
+        items = items if isinstance(items, (list, tuple)) else [items]
 
-        if os.path.exists(cache_file_path):
-            stat = os.stat(cache_file_path)
+        snapshot_path = os.path.join(base_dir, 'config', 'repo', SnapshotCtx.File_Name)
+        snapshot_key = get_snapshot_key(item for item in items if isinstance(item, str))
 
-            if stat.st_size == 0:
-                logger.info('Deleting empty `%s` file', cache_file_path)
-                os.remove(cache_file_path)
+        # Only the first worker needs to deploy services in ODB, everyone else can use the snapshot, unless explicitly told
+        # to synchronize internal services or unless the snapshot was not created for the current sources and deployment.
+        if self.has_internal_cache and not (sync_internal or is_first or self.is_testing):
+            snapshot = ServiceSnapshot.load(snapshot_path, snapshot_key, self.server.deployment_key)
+            if snapshot:
+                return self._restore_from_snapshot(snapshot)
 
         sql_services = {}
         for item in self.odb.get_sql_internal_service_list(self.server.cluster_id):
@@ -727,105 +723,119 @@ class ServiceStore:
                 'slow_threshold': item.slow_threshold,
             }
 
-        # sync_internal may be False but if the cache does not exist (which is the case if a server starts up the first time),
-        # we need to create it anyway and sync_internal becomes True then. However, the should be created only by the very first
-        # worker in a group of workers - the rest can simply assume that the cache is ready to read.
-        # if is_first and not os.path.exists(cache_file_path):
-        sync_internal = True
+        logger.info('{} internal services (%s)'.format(self.action_internal_doing), self.server.name)
+        info = self.import_services_from_anywhere(items, base_dir)
 
-        if sync_internal:
+        # All set, write out the snapshot, assuming that we can do it.
+        # We cannot on Windows or under a debugger (as indicated by the environment variable).
+        if self.has_internal_cache:
 
-            # Synchronizing internal modules means re-building the internal cache from scratch
-            # and re-deploying everything.
+            if not os.environ.get('ZATO_SERVER_BASE_DIR'):
+                snapshot = ServiceSnapshot(snapshot_path, snapshot_key, self.server.deployment_key)
 
-            service_info = []
-            internal_cache = {
-                'service_info': service_info
-            }
+                for service in info.to_process: # type: InRAMService
+                    impl_name = service.impl_name
+                    snapshot.add(
+                        service.service_class,
+                        service.name,
+                        impl_name,
+                        self.impl_name_to_id[impl_name],
+                        self.services[impl_name]['is_active'],
+                        self.services[impl_name]['slow_threshold'],
+                        self.deployment_info.get(impl_name),
+                        service.source_code_info,
+                        service.service_class.after_add_to_store is not Service.after_add_to_store,
+                    )
 
-            # This is currently unused
-            internal_cache = internal_cache
+                try:
+                    snapshot.save()
+                except Exception:
+                    logger.warning('Could not save snapshot of internal services to `%s`, e:`%s`', snapshot_path, format_exc())
 
-            logger.info('{} internal services (%s)'.format(self.action_internal_doing), self.server.name)
-            info = self.import_services_from_anywhere(items, base_dir)
+            logger.info('{} %d internal services (%s) (%s)'.format(self.action_internal_done),
+                len(info.to_process), info.total_size_human, self.server.name)
 
-            for service in info.to_process: # type: InRAMService
+        return info.to_process
 
-                class_ = service.service_class
-                impl_name = service.impl_name
+# ################################################################################################################################
 
-                service_info.append({
-                    'service_class': class_,
-                    'mod': inspect.getmodule(class_),
-                    'impl_name': impl_name,
-                    'service_id': self.impl_name_to_id[impl_name],
-                    'is_active': self.services[impl_name]['is_active'],
-                    'slow_threshold': self.services[impl_name]['slow_threshold'],
-                    'fs_location': inspect.getfile(class_),
-                    'deployment_info': 'no-deployment-info'
-                })
+    def _restore_from_snapshot(self, snapshot:'ServiceSnapshot') -> 'inramlist':
+        """ Adds internal services from a snapshot to the store without importing them - each is imported
+        only when it is needed for the first time, e.g. when it is invoked.
+        """
+        logger.info('Deploying internal services from snapshot (%s)', self.server.name)
 
-            # All set, write out the cache file, assuming that we can do it.
-            # We cannot on Windows or under a debugger (as indicated by the environment variable).
-            if self.has_internal_cache:
+        to_process = [] # type: inramlist
 
-                if not os.environ.get('ZATO_SERVER_BASE_DIR'):
-                    f = open(cache_file_path, 'wb')
-                    # f.write(dill_dumps(internal_cache))
-                    f.close()
+        # Services may have been edited since the snapshot was created, which is why we need to read from ODB
+        # whether they are active and what their slow thresholds are.
+        sql_services = {item.impl_name: item for item in self.odb.get_sql_internal_service_list(self.server.cluster_id)}
 
-                logger.info('{} %d internal services (%s) (%s)'.format(self.action_internal_done),
-                    len(info.to_process), info.total_size_human, self.server.name)
+        with self.update_lock:
+            for entry in snapshot.services:
 
-            return info.to_process
+                name = entry['name']
+                impl_name = entry['impl_name']
+                service_id = entry['service_id']
 
-        else:
-            logger.info('Deploying cached internal services (%s)', self.server.name)
-            to_process = []
+                sql_service = sql_services.get(impl_name)
+                if sql_service:
+                    is_active = sql_service.is_active
+                    slow_threshold = sql_service.slow_threshold
+                else:
+                    is_active = entry['is_active']
+                    slow_threshold = entry['slow_threshold']
+
+                self.services[impl_name] = LazyServiceInfo(self._load_service_from_snapshot, entry,
+                    name=name,
+                    deployment_info='',
+                    is_active=is_active,
+                    slow_threshold=slow_threshold,
+                )
 
-            # Declare it upfront because we need to assume  that opening the path can fail.
-            f = None
+                self.id_to_impl_name[service_id] = impl_name
+                self.impl_name_to_id[impl_name] = service_id
+                self.name_to_impl_name[name] = impl_name
+                self.deployment_info[impl_name] = entry['deployment_info']
 
-            try:
-                f = open(cache_file_path, 'rb')
-                dill_items = dill_load(f)
-            except ValueError as e:
-                msg = e.args[0]
-                if _unsupported_pickle_protocol_msg in msg:
-                    msg = msg.replace(_unsupported_pickle_protocol_msg, '').strip()
-                    protocol_found = int(msg)
-
-                    # If the protocol found is higher than our own, it means that the cache
-                    # was built a Python version higher than our own, we are on Python 2.7
-                    # and cache was created under Python 3.4. In such a case, we need to
-                    # recreate the cache anew.
-                    if protocol_found > highest_pickle_protocol:
-                        logger.info('Cache pickle protocol found `%d` > current highest `%d`, forcing sync_internal',
-                            protocol_found, highest_pickle_protocol)
-                        return self.import_internal_services(items, base_dir, True, is_first)
-
-                    # A different reason, re-raise the erorr then
-                    else:
-                        raise
+                # Hooks that run when services are added to the store cannot wait until first use
+                if entry['needs_eager_load']:
+                    self._call_after_add_to_store(self.services[impl_name]['service_class'])
 
-                # Must be a different kind of a ValueError, propagate it then
-                else:
-                    raise
-            finally:
-                if f:
-                    f.close()
+                source_code_info = SourceCodeInfo()
+                source_code_info.path = entry['source_path']
+                source_code_info.hash = entry['source_hash']
+                source_code_info.hash_method = entry['source_hash_method']
+                source_code_info.len_source = entry['len_source']
 
-            len_si = len(dill_items['service_info'])
+                service = InRAMService()
+                service.cluster_id = self.server.cluster_id
+                service.id = service_id
+                service.is_active = is_active
+                service.is_internal = True
+                service.name = name
+                service.impl_name = impl_name
+                service.slow_threshold = slow_threshold
+                service.source_code_info = source_code_info
 
-            for _, item in enumerate(dill_items['service_info'], 1):
-                class_ = self._visit_class_for_service(item['mod'], item['service_class'], item['fs_location'], True)
-                to_process.append(class_)
+                to_process.append(service)
 
-            self._store_in_ram(None, to_process)
+        logger.info('Deployed %d internal services from snapshot (%s)', len(to_process), self.server.name)
 
-            logger.info('Deployed %d cached internal services (%s)', len_si, self.server.name)
+        return to_process
 
-            return to_process
+# ################################################################################################################################
+
+    def _load_service_from_snapshot(self, entry:'stranydict') -> 'type[Service]':
+        """ Imports and sets up a service that was restored from a snapshot, the same way as if it had been deployed.
+        """
+        class_ = load_service_class(entry)
+
+        with self.update_lock:
+            self.set_up_class_attributes(class_, self)
+            self.set_up_rate_limiting(entry['name'], class_)
+
+        return class_
 
 # ################################################################################################################################
 
@@ -878,18 +888,24 @@ class ServiceStore:
                 self.impl_name_to_id[item.impl_name] = service_id
                 self.name_to_impl_name[item.name] = item.impl_name
 
-                arg_spec = getargspec(item.service_class.after_add_to_store) # type: ArgSpec
-                args = arg_spec.args # type: list
+                self._call_after_add_to_store(item_service_class)
+
+# ################################################################################################################################
 
-                # GH #1018 made server the argument that the hook receives ..
-                if len(args) == 1 and args[0] == 'server':
-                    hook_arg = self.server
+    def _call_after_add_to_store(self, class_:'type[Service]') -> 'None':
 
-                # .. but for backward-compatibility we provide the hook with the logger object by default.
-                else:
-                    hook_arg = logger
+        arg_spec = getargspec(class_.after_add_to_store) # type: ArgSpec
+        args = arg_spec.args # type: list
+
+        # GH #1018 made server the argument that the hook receives ..
+        if len(args) == 1 and args[0] == 'server':
+            hook_arg = self.server
+
+        # .. but for backward-compatibility we provide the hook with the logger object by default.
+        else:
+            hook_arg = logger
 
-                item.service_class.after_add_to_store(hook_arg)
+        class_.after_add_to_store(hook_arg)
 
 # ################################################################################################################################
 
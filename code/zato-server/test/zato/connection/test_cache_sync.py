@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common.api import CACHE
+from zato.common.broker_message import CACHE as CACHE_BROKER_MSG
+from zato.server.connection.cache import CacheAPI
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Cache_Name = 'test.cache'
+    Worker_ID = 'worker.1'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _BrokerClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg):
+        self.published.append(msg)
+
+# ################################################################################################################################
+
+class _Server:
+    def __init__(self, cache_config):
+        self.worker_id = ModuleCtx.Worker_ID
+        self.broker_client = _BrokerClient()
+        self.fs_server_config = {'cache': cache_config}
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class CacheSyncTestCase(TestCase):
+
+    def _get_cache_api(self, batch_size=100, batch_interval=0.01):
+
+        cache_api = CacheAPI(_Server({'sync_batch_size': batch_size, 'sync_batch_interval': batch_interval}))
+        cache_api.create(Bunch({
+            'name': ModuleCtx.Cache_Name,
+            'cache_type': CACHE.TYPE.BUILTIN,
+            'is_default': False,
+            'max_size': 1000,
+            'max_item_size': 1000,
+            'extend_expiry_on_get': False,
+            'extend_expiry_on_set': False,
+            'sync_method': CACHE.SYNC_METHOD.IN_BACKGROUND.id,
+        }))
+
+        return cache_api
+
+# ################################################################################################################################
+
+    def test_batch_is_published_after_interval(self):
+
+        cache_api = self._get_cache_api()
+        cache = cache_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+        published = cache_api.server.broker_client.published
+
+        cache.set('key1', 'value1')
+        cache.set('key2', 'value2')
+        cache.set('key1', 'value3')
+        cache.delete('key2')
+        cache.delete_by_prefix('key', return_found=True)
+
+        # Nothing is published until the batch interval elapses ..
+        self.assertListEqual(published, [])
+        sleep(0.05)
+
+        # .. and then there is only one batch with repeated operations on the same key coalesced.
+        self.assertEqual(len(published), 1)
+
+        msg = published[0]
+        self.assertEqual(msg['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value)
+        self.assertEqual(msg['cache_name'], ModuleCtx.Cache_Name)
+        self.assertEqual(msg['source_worker_id'], ModuleCtx.Worker_ID)
+
+        stats = cache_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['ops_total'], 5)
+        self.assertEqual(stats['ops_coalesced'], 2)
+        self.assertEqual(stats['ops_sent'], 3)
+        self.assertEqual(stats['batches_sent'], 1)
+        self.assertEqual(stats['last_batch_size'], 3)
+        self.assertGreater(stats['last_lag'], 0)
+
+# ################################################################################################################################
+
+    def test_batch_is_published_when_full(self):
+
+        cache_api = self._get_cache_api(batch_size=10, batch_interval=60)
+        cache = cache_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+        published = cache_api.server.broker_client.published
+
+        for idx in range(25):
+            cache.set('key{}'.format(idx), idx)
+
+        self.assertEqual(len(published), 2)
+
+        stats = cache_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['batches_sent'], 2)
+        self.assertEqual(stats['max_batch_size'], 10)
+        self.assertEqual(stats['ops_pending'], 5)
+
+# ################################################################################################################################
+
+    def test_clear_drops_pending_operations(self):
+
+        cache_api = self._get_cache_api()
+        cache = cache_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        cache.set('key1', 'value1')
+        cache.set('key2', 'value2')
+        cache.clear()
+
+        cache_api.sync_queues[ModuleCtx.Cache_Name].flush()
+
+        stats = cache_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['ops_sent'], 1)
+        self.assertEqual(stats['ops_coalesced'], 2)
+
+# ################################################################################################################################
+
+    def test_batch_is_applied_by_other_worker(self):
+
+        source_api = self._get_cache_api()
+        source = source_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        target_api = self._get_cache_api()
+        target = target_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        source.set('key1', 'value1')
+        source.set('key2', {'value': 2})
+        source.set('key3', 'value3')
+        source.set('key1', 'value4')
+        source.delete('key3')
+        source.expire('key2', 3600)
+        source_api.sync_queues[ModuleCtx.Cache_Name].flush()
+
+        msg, = source_api.server.broker_client.published
+        target_api.sync_after_batch(CACHE.TYPE.BUILTIN, Bunch(msg))
+
+        self.assertListEqual(sorted(target.keys()), ['key1', 'key2'])
+        self.assertDictEqual({key: target.get(key) for key in target.keys()}, {key: source.get(key) for key in source.keys()})
+        self.assertEqual(target.get('key2', details=True).expires_at, source.get('key2', details=True).expires_at)
+
+        stats = target_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['batches_received'], 1)
+        self.assertEqual(stats['ops_received'], 4)
+
+# ################################################################################################################################
+
+    def test_unpicklable_value_is_skipped(self):
+
+        source_api = self._get_cache_api()
+        source = source_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        target_api = self._get_cache_api()
+        target = target_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        source.set('key1', 'value1')
+        source.set('key2', lambda: None)
+        source.set('key3', 'value3')
+        source_api.sync_queues[ModuleCtx.Cache_Name].flush()
+
+        # Only the operation that could not be pickled is missing from the batch
+        msg, = source_api.server.broker_client.published
+        target_api.sync_after_batch(CACHE.TYPE.BUILTIN, Bunch(msg))
+
+        self.assertListEqual(sorted(target.keys()), ['key1', 'key3'])
+
+        stats = source_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['ops_sent'], 2)
+        self.assertEqual(stats['ops_skipped'], 1)
+
+# ################################################################################################################################
+
+    def test_failed_operation_does_not_stop_batch(self):
+
+        source_api = self._get_cache_api()
+        source = source_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+
+        target_api = self._get_cache_api()
+        target = target_api.get_cache(CACHE.TYPE.BUILTIN, ModuleCtx.Cache_Name)
+        sync_after_set = target.sync_after_set
+
+        # The key cannot be set in the target worker, e.g. because it has already expired there ..
+        def _sync_after_set(data):
+            if data.key == 'key2':
+                raise Exception('Key expired')
+            sync_after_set(data)
+
+        source.set('key1', 'value1')
+        source.set('key2', 'value2')
+        source.set('key3', 'value3')
+        source_api.sync_queues[ModuleCtx.Cache_Name].flush()
+
+        msg, = source_api.server.broker_client.published
+
+        with patch.object(target, 'sync_after_set', _sync_after_set):
+            target_api.sync_after_batch(CACHE.TYPE.BUILTIN, Bunch(msg))
+
+        # .. which does not prevent the operations after it from being applied.
+        self.assertListEqual(sorted(target.keys()), ['key1', 'key3'])
+
+        stats = target_api.get_sync_stats(ModuleCtx.Cache_Name)
+        self.assertEqual(stats['batches_received'], 1)
+        self.assertEqual(stats['ops_received'], 3)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
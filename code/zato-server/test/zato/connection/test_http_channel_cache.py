@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from pickle import dumps, loads
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.server.connection.http_soap.channel import _CachedResponse, RequestHandler
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Concurrency = 20
+    Invoke_Time = 0.05
+    Payload = '{"customer_id":"123"}'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Service:
+    get_request_hash = None
+
+# ################################################################################################################################
+
+class _ServiceStore:
+    def new_instance(self, _ignored_name):
+        return _Service(), True
+
+# ################################################################################################################################
+
+class _Server:
+    def __init__(self):
+        self.cache = {}
+        self.service_store = _ServiceStore()
+
+    def get_from_cache(self, cache_type, cache_name, key):
+        return self.cache.get(key)
+
+    def set_in_cache(self, cache_type, cache_name, key, value, expiry=0.0):
+        self.cache[key] = value
+
+# ################################################################################################################################
+
+class _RequestHandler(RequestHandler):
+    """ Invokes no actual services, only counts how many times they would have been invoked.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.invoked = []
+        self.should_raise = False
+
+    def _invoke_service(self, service, cid, *ignored_args):
+        self.invoked.append(cid)
+        sleep(ModuleCtx.Invoke_Time)
+
+        if self.should_raise:
+            self.should_raise = False
+            raise Exception('Service error')
+
+        return Bunch(payload=ModuleCtx.Payload, content_type='application/json', headers={}, status_code=200)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class HTTPChannelCacheTestCase(TestCase):
+
+    def _get_channel_item(self, **kwargs):
+        channel_item = Bunch(id=1, service_impl_name='test.service', merge_url_params_req=False,
+            cache_type='builtin', cache_name='default', cache_expiry=0)
+        channel_item.update(kwargs)
+
+        return channel_item
+
+# ################################################################################################################################
+
+    def _handle(self, handler, channel_item, cid='cid.1'):
+        wsgi_environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/test'}
+        return handler.handle(cid, {}, channel_item, wsgi_environ, ModuleCtx.Payload, None, {}, None, '/test')
+
+# ################################################################################################################################
+
+    def _handle_concurrently(self, handler, channel_item):
+        greenlets = [spawn(self._handle, handler, channel_item, 'cid.{}'.format(idx))
+            for idx in range(ModuleCtx.Concurrency)]
+        _ = joinall(greenlets)
+
+        return greenlets
+
+# ################################################################################################################################
+
+    def test_concurrent_misses_invoke_service_once(self):
+
+        handler = _RequestHandler(_Server())
+        greenlets = self._handle_concurrently(handler, self._get_channel_item())
+
+        # Only one greenlet invoked the service ..
+        self.assertEqual(len(handler.invoked), 1)
+        self.assertDictEqual(handler._cache_in_flight, {})
+
+        # .. and everyone received the same response ..
+        for greenlet in greenlets:
+            self.assertEqual(greenlet.value.status_code, 200)
+
+        # .. which is stored in the cache already serialized.
+        cached, = handler.server.cache.values()
+        self.assertIsInstance(cached, _CachedResponse)
+        self.assertEqual(cached.payload, ModuleCtx.Payload.encode('utf8'))
+
+# ################################################################################################################################
+
+    def test_waiters_invoke_service_if_leader_fails(self):
+
+        handler = _RequestHandler(_Server())
+        handler.should_raise = True
+
+        greenlets = self._handle_concurrently(handler, self._get_channel_item())
+        failed = [greenlet for greenlet in greenlets if greenlet.exception]
+
+        # Only the first greenlet failed and each of the others invoked the service on its own
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(len(handler.invoked), ModuleCtx.Concurrency)
+
+# ################################################################################################################################
+
+    def test_stale_response_is_served_while_revalidating(self):
+
+        handler = _RequestHandler(_Server())
+        channel_item = self._get_channel_item(cache_soft_expiry=1, cache_stale_while_revalidate=True)
+
+        _ = self._handle(handler, channel_item)
+        self.assertEqual(len(handler.invoked), 1)
+
+        # Make the response stale ..
+        cached, = handler.server.cache.values()
+        cached.soft_expires_at = 1
+
+        # .. now, all the callers receive the stale response immediately ..
+        greenlets = self._handle_concurrently(handler, channel_item)
+        for greenlet in greenlets:
+            self.assertIs(greenlet.value, cached)
+
+        # .. while it is refreshed in background, only once.
+        sleep(ModuleCtx.Invoke_Time * 2)
+        self.assertEqual(len(handler.invoked), 2)
+
+        refreshed, = handler.server.cache.values()
+        self.assertIsNot(refreshed, cached)
+        self.assertFalse(refreshed.is_stale())
+
+# ################################################################################################################################
+
+    def test_stale_response_is_not_served_without_revalidation(self):
+
+        handler = _RequestHandler(_Server())
+        channel_item = self._get_channel_item(cache_soft_expiry=1)
+
+        _ = self._handle(handler, channel_item)
+
+        cached, = handler.server.cache.values()
+        cached.soft_expires_at = 1
+
+        # Callers wait for a new response, but the service is still invoked only once for all of them
+        greenlets = self._handle_concurrently(handler, channel_item)
+        for greenlet in greenlets:
+            self.assertIsNot(greenlet.value, cached)
+
+        self.assertEqual(len(handler.invoked), 2)
+
+# ################################################################################################################################
+
+    def test_cached_response_can_be_pickled(self):
+
+        cached = _CachedResponse(b'{}', 'application/json', {'X-Test': '1'}, 200, 123.0)
+        unpickled = loads(dumps(cached))
+
+        self.assertEqual(unpickled.payload, cached.payload)
+        self.assertEqual(unpickled.content_type, cached.content_type)
+        self.assertDictEqual(unpickled.headers, cached.headers)
+        self.assertEqual(unpickled.status_code, cached.status_code)
+        self.assertEqual(unpickled.soft_expires_at, cached.soft_expires_at)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
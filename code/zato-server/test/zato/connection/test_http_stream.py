@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from gzip import decompress
+from io import BytesIO
+from logging import getLogger
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.server.connection.http_soap.stream import gzip_response, iter_response, ModuleCtx, new_request_body
+from zato.server.service.reqresp import Request
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Input(BytesIO):
+    """ Keeps track of how much data was read at most in a single call.
+    """
+    max_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.max_read = max(self.max_read, len(data))
+        return data
+
+# ################################################################################################################################
+
+class _FileWrapper:
+    def __init__(self, filelike, block_size):
+        self.filelike = filelike
+        self.block_size = block_size
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RequestBodyTestCase(TestCase):
+
+    def _get_body(self, data, spool_threshold=ModuleCtx.Spool_Threshold, has_content_length=True):
+        wsgi_environ = {'wsgi.input': _Input(data), 'CONTENT_LENGTH': str(len(data)) if has_content_length else ''}
+        return new_request_body(wsgi_environ, {'stream_spool_threshold': spool_threshold})
+
+# ################################################################################################################################
+
+    def test_iterate_in_chunks(self):
+
+        data = b'a' * (ModuleCtx.Chunk_Size * 3 + 1)
+        body = self._get_body(data)
+
+        chunks = list(body)
+
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(body.wsgi_input.max_read, ModuleCtx.Chunk_Size)
+
+# ################################################################################################################################
+
+    def test_read_stops_at_content_length(self):
+
+        wsgi_environ = {'wsgi.input': _Input(b'abcdef'), 'CONTENT_LENGTH': '4'}
+        body = new_request_body(wsgi_environ, {})
+
+        self.assertEqual(body.read(3), b'abc')
+        self.assertEqual(body.read(), b'd')
+        self.assertEqual(body.read(), b'')
+
+# ################################################################################################################################
+
+    def test_spool_in_ram_below_threshold(self):
+
+        data = b'abc' * 10
+        body = self._get_body(data)
+
+        self.assertEqual(body.getvalue(), data)
+        self.assertFalse(body.spool_body()._rolled)
+
+        # The value can be read any number of times
+        self.assertEqual(body.getvalue(), data)
+        self.assertEqual(body.read(), data)
+
+# ################################################################################################################################
+
+    def test_spool_to_file_above_threshold(self):
+
+        data = b'abc' * 1000
+        body = self._get_body(data, spool_threshold=100, has_content_length=False)
+
+        self.assertEqual(body.getvalue(), data)
+        self.assertTrue(body.spool_body()._rolled)
+
+        body.close()
+
+# ################################################################################################################################
+
+    def test_no_spool_after_read(self):
+
+        body = self._get_body(b'abc')
+        _ = body.read(1)
+
+        with self.assertRaises(ValueError):
+            _ = body.getvalue()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyPayloadTestCase(TestCase):
+
+    def test_payload_is_loaded_on_first_access(self):
+
+        loaded = []
+
+        def loader():
+            loaded.append(True)
+            return {'customer_id': 123}
+
+        request = Request(Bunch(logger=getLogger(__name__)))
+        request.set_payload_loader(loader)
+
+        self.assertListEqual(loaded, [])
+
+        self.assertDictEqual(request.payload, {'customer_id': 123})
+        self.assertDictEqual(request.payload, {'customer_id': 123})
+        self.assertListEqual(loaded, [True])
+
+# ################################################################################################################################
+
+    def test_payload_set_explicitly_replaces_loader(self):
+
+        request = Request(Bunch(logger=getLogger(__name__)))
+        request.set_payload_loader(lambda: self.fail('Loader should not be called'))
+        request.payload = 'abc'
+
+        self.assertEqual(request.payload, 'abc')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class StreamResponseTestCase(TestCase):
+
+    def test_iter_response_file(self):
+
+        data = b'a' * (ModuleCtx.Chunk_Size + 1)
+
+        # Without a WSGI file wrapper, the file is read in chunks ..
+        chunks = list(iter_response(BytesIO(data)))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(len(chunks), 2)
+
+        # .. and with one, it is up to the wrapper to read it.
+        payload = BytesIO(data)
+        wrapper = iter_response(payload, _FileWrapper)
+
+        self.assertIsInstance(wrapper, _FileWrapper)
+        self.assertIs(wrapper.filelike, payload)
+
+# ################################################################################################################################
+
+    def test_iter_response_generator(self):
+
+        def produce():
+            yield 'abc'
+            yield b'def'
+
+        self.assertListEqual(list(iter_response(produce())), [b'abc', b'def'])
+
+# ################################################################################################################################
+
+    def test_gzip_response(self):
+
+        def produce():
+            for idx in range(100):
+                yield 'line.{}\n'.format(idx)
+
+        compressed = b''.join(gzip_response(produce()))
+        expected = ''.join('line.{}\n'.format(idx) for idx in range(100)).encode('utf8')
+
+        self.assertEqual(decompress(compressed), expected)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
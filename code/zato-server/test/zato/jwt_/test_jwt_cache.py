@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.server.jwt_cache import JWTTokenCache
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    TTL = 100
+    Now = 1_000_000.0
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class JWTTokenCacheTestCase(TestCase):
+
+    def test_token_is_found_until_it_expires(self):
+
+        cache = JWTTokenCache()
+        key = cache.get_key('my.token')
+
+        # Keys do not depend on whether tokens are given as bytes or not
+        self.assertEqual(key, cache.get_key(b'my.token'))
+
+        cache.set(key, Bunch(username='user.1'), ModuleCtx.TTL, ModuleCtx.Now)
+
+        item = cache.get(key, ModuleCtx.Now + ModuleCtx.TTL - 1)
+        self.assertEqual(item.token_data.username, 'user.1')
+
+        self.assertIsNone(cache.get(key, ModuleCtx.Now + ModuleCtx.TTL))
+        self.assertDictEqual(cache.tokens, {})
+
+# ################################################################################################################################
+
+    def test_renew_extends_expiration_and_odb_periodically(self):
+
+        cache = JWTTokenCache(renew_ratio=0.5)
+        key = cache.get_key('my.token')
+
+        cache.set(key, Bunch(username='user.1'), ModuleCtx.TTL, ModuleCtx.Now)
+        item = cache.get(key, ModuleCtx.Now)
+
+        # Each use extends the expiration time in RAM ..
+        self.assertFalse(cache.renew(item, ModuleCtx.Now + 40))
+        self.assertFalse(cache.renew(item, ModuleCtx.Now + 49))
+        self.assertIs(cache.get(key, ModuleCtx.Now + 140), item)
+
+        # .. while ODB is let know about it only after half of the TTL elapsed since the last time.
+        self.assertTrue(cache.renew(item, ModuleCtx.Now + 50))
+        self.assertFalse(cache.renew(item, ModuleCtx.Now + 99))
+        self.assertTrue(cache.renew(item, ModuleCtx.Now + 100))
+
+# ################################################################################################################################
+
+    def test_delete_and_sweep(self):
+
+        cache = JWTTokenCache(sweep_interval=10)
+        cache.next_sweep = ModuleCtx.Now + 10
+
+        cache.set('key.1', Bunch(username='user.1'), 1, ModuleCtx.Now)
+        cache.set('key.2', Bunch(username='user.2'), ModuleCtx.TTL, ModuleCtx.Now)
+        cache.set('key.3', Bunch(username='user.3'), ModuleCtx.TTL, ModuleCtx.Now)
+
+        cache.delete('key.2')
+        self.assertListEqual(sorted(cache.tokens), ['key.1', 'key.3'])
+
+        # Expired tokens that no one asks for are deleted periodically
+        cache.set('key.4', Bunch(username='user.4'), ModuleCtx.TTL, ModuleCtx.Now + 10)
+        self.assertListEqual(sorted(cache.tokens), ['key.3', 'key.4'])
+        self.assertEqual(cache.next_sweep, ModuleCtx.Now + 20)
+
+        cache.clear()
+        self.assertDictEqual(cache.tokens, {})
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
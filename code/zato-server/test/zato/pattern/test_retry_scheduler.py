@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.server.pattern.retry_scheduler import CircuitBreaker, get_callback_request, get_retry_delay, ModuleCtx, \
+     RetryJournal, RetryScheduler
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def _get_entry(target='my.target', retry_repeats=3, retry_seconds=0.01, callback='my.callback'):
+    return {
+        'source': 'my.source',
+        'target': target,
+        'retry_repeats': retry_repeats,
+        'retry_seconds': retry_seconds,
+        'orig_cid': 'orig-cid',
+        'call_cid': 'call-cid',
+        'callback': callback,
+        'callback_context': {'my': 'context'},
+        'args': ('my.request',),
+        'kwargs': {},
+        'req_ts_utc': '2023-01-01T00:00:00',
+    }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RetryDelayTestCase(TestCase):
+
+    def test_backoff(self):
+
+        # Without jitter, the delay doubles each time ..
+        delays = [get_retry_delay(attempt, 1, 2, 100, 0) for attempt in range(1, 10)]
+        self.assertListEqual(delays, [1, 2, 4, 8, 16, 32, 64, 100, 100])
+
+        # .. and with jitter, up to that fraction of it is subtracted.
+        self.assertEqual(get_retry_delay(3, 1, 2, 100, 0.5, lambda: 0.0), 4)
+        self.assertEqual(get_retry_delay(3, 1, 2, 100, 0.5, lambda: 1.0), 2)
+
+# ################################################################################################################################
+
+    def test_callback_request(self):
+
+        entry = _get_entry()
+        entry['attempt'] = 2
+
+        request = get_callback_request(entry, True, 'my.response', '2023-01-01T00:00:01')
+
+        self.assertTrue(request['ok'])
+        self.assertEqual(request['attempts'], 2)
+        self.assertEqual(request['response'], 'my.response')
+        self.assertDictEqual(request['context'], {'my': 'context'})
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class CircuitBreakerTestCase(TestCase):
+
+    def test_open_and_close(self):
+
+        breaker = CircuitBreaker(2, 10)
+
+        breaker.on_failure(100)
+        self.assertTrue(breaker.can_attempt(100))
+
+        # Enough consecutive failures open the breaker ..
+        breaker.on_failure(100)
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.can_attempt(105))
+
+        # .. invocations that cannot be made are spread over the time after it is reset ..
+        retry_at = breaker.get_retry_at(105)
+        self.assertGreaterEqual(retry_at, 110)
+        self.assertLessEqual(retry_at, 120)
+
+        # .. once it is, only one trial is let through ..
+        self.assertTrue(breaker.can_attempt(110))
+        self.assertFalse(breaker.can_attempt(110))
+
+        # .. and if it fails, the breaker opens again ..
+        breaker.on_failure(110)
+        self.assertFalse(breaker.can_attempt(115))
+        self.assertTrue(breaker.can_attempt(120))
+
+        # .. and if it succeeds, it closes.
+        breaker.on_success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.can_attempt(120))
+        self.assertTrue(breaker.can_attempt(120))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RetryJournalTestCase(TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(prefix='zato-test-retry-')
+        self.path = os.path.join(self.base_dir, ModuleCtx.Journal_Name)
+
+    def tearDown(self):
+        rmtree(self.base_dir, ignore_errors=True)
+
+    def test_pending_retries_survive_restarts(self):
+
+        journal = RetryJournal(self.path)
+        self.assertListEqual(journal.open(), [])
+
+        _ = journal.add(1, 30.0, _get_entry('my.target.1'))
+        _ = journal.add(2, 10.0, _get_entry('my.target.2'))
+        _ = journal.add(3, 20.0, _get_entry('my.target.3'))
+
+        # A retry that has been rescheduled ..
+        entry = _get_entry('my.target.1')
+        entry['attempt'] = 1
+        _ = journal.add(1, 40.0, entry)
+
+        # .. and one that has completed.
+        journal.done(3)
+        journal.close()
+
+        # A process stopped while writing to the journal
+        with open(self.path, 'ab') as f:
+            _ = f.write(b'abc')
+
+        journal = RetryJournal(self.path)
+        queue = journal.open()
+
+        # Only the latest versions of pending retries are loaded, ordered by their due times ..
+        self.assertListEqual([(due, retry_id) for due, retry_id, _ in queue], [(10.0, 2), (40.0, 1)])
+        self.assertEqual(journal.read(queue[0][2])['target'], 'my.target.2')
+        self.assertEqual(journal.read(queue[1][2])['attempt'], 1)
+
+        # .. and nothing else is kept in the journal.
+        self.assertEqual(journal.size, os.path.getsize(self.path))
+        journal.close()
+
+# ################################################################################################################################
+
+    def test_compact(self):
+
+        journal = RetryJournal(self.path)
+        _ = journal.open()
+
+        offsets = {retry_id: journal.add(retry_id, float(retry_id), _get_entry('my.target.{}'.format(retry_id)))
+            for retry_id in range(1, 11)}
+
+        for retry_id in range(1, 10):
+            journal.done(retry_id)
+
+        compacted = journal.compact([(10.0, 10, offsets[10])])
+        (due, retry_id, offset), = compacted
+
+        self.assertEqual(retry_id, 10)
+        self.assertEqual(offset, 0)
+        self.assertEqual(journal.read(offset)['target'], 'my.target.10')
+
+        journal.close()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RetrySchedulerTestCase(TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(prefix='zato-test-retry-')
+        self.attempts = []
+        self.callbacks = []
+        self.num_failures = 0
+
+    def tearDown(self):
+        rmtree(self.base_dir, ignore_errors=True)
+
+    def _attempt(self, entry):
+        self.attempts.append(entry['target'])
+        if len(self.attempts) <= self.num_failures:
+            raise Exception('Test failure')
+        return 'my.response'
+
+    def _callback(self, entry, is_ok, response):
+        self.callbacks.append((entry['target'], entry['attempt'], is_ok, response))
+
+    def _get_scheduler(self, **kwargs):
+        scheduler = RetryScheduler(self.base_dir, self._attempt, self._callback, **kwargs)
+        scheduler.start()
+        return scheduler
+
+# ################################################################################################################################
+
+    def test_retry_until_success(self):
+
+        self.num_failures = 2
+        scheduler = self._get_scheduler()
+
+        scheduler.schedule(_get_entry())
+        sleep(0.2)
+
+        self.assertListEqual(self.callbacks, [('my.target', 3, True, 'my.response')])
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['attempts'], 3)
+        self.assertEqual(stats['succeeded'], 1)
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_retry_limit_reached(self):
+
+        self.num_failures = 100
+        scheduler = self._get_scheduler()
+
+        scheduler.schedule(_get_entry(retry_repeats=2))
+        sleep(0.2)
+
+        self.assertListEqual(self.callbacks, [('my.target', 2, False, None)])
+        self.assertEqual(scheduler.get_stats()['failed'], 1)
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_pending_retries_resumed_after_restart(self):
+
+        scheduler = self._get_scheduler()
+
+        # The retry is due long after the process stops ..
+        scheduler.schedule(_get_entry(), 60)
+        scheduler.stop()
+
+        # .. which is why the next one runs it, after moving its due time closer.
+        scheduler = RetryScheduler(self.base_dir, self._attempt, self._callback)
+        queue = scheduler.journal.open()
+        scheduler.journal.close()
+
+        (_, retry_id, offset), = queue
+        journal = RetryJournal(scheduler.journal.path)
+        _ = journal.open()
+        entry = journal.read(offset)
+        _ = journal.add(retry_id, 0.0, entry)
+        journal.close()
+
+        scheduler = self._get_scheduler()
+        self.assertEqual(scheduler.get_stats()['pending'], 1)
+
+        sleep(0.1)
+        self.assertListEqual(self.callbacks, [('my.target', 1, True, 'my.response')])
+
+        # New retries do not reuse the IDs of the ones that were resumed
+        self.assertGreater(next(scheduler.retry_id), retry_id)
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_breaker_defers_retries(self):
+
+        self.num_failures = 1000
+        scheduler = self._get_scheduler(breaker_failures=3, breaker_reset_seconds=60)
+
+        for _ in range(20):
+            scheduler.schedule(_get_entry(retry_repeats=10))
+
+        sleep(0.2)
+
+        # All of the retries were attempted once but, once the breaker opened, no more attempts were made
+        # and none of the retries were given up on either, they are waiting for the breaker to close.
+        stats = scheduler.get_stats()
+
+        self.assertEqual(stats['attempts'], 20)
+        self.assertGreater(stats['deferred'], 0)
+        self.assertEqual(stats['pending'], 20)
+        self.assertEqual(stats['failed'], 0)
+        self.assertListEqual(stats['open_breakers'], ['my.target'])
+        self.assertListEqual(self.callbacks, [])
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_schedule_before_start(self):
+
+        # Startup services may schedule retries before the scheduler is started ..
+        scheduler = RetryScheduler(self.base_dir, self._attempt, self._callback)
+        scheduler.schedule(_get_entry())
+
+        self.assertEqual(scheduler.get_stats()['pending'], 1)
+        self.assertListEqual(self.attempts, [])
+
+        # .. and they run once it is.
+        scheduler.start()
+        sleep(0.1)
+
+        self.assertListEqual(self.callbacks, [('my.target', 1, True, 'my.response')])
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_breaker_trial_ends_if_retry_cannot_be_read(self):
+
+        scheduler = RetryScheduler(self.base_dir, self._attempt, self._callback)
+
+        # The breaker is half-open, so the next attempt is a trial ..
+        breaker = scheduler.get_breaker('my.target')
+        breaker.opened_until = 1.0
+
+        scheduler.schedule(_get_entry())
+
+        # .. which ends without an outcome because its retry cannot be read ..
+        with patch.object(scheduler.journal, 'read', side_effect=Exception('Read failure')):
+            scheduler.start()
+            sleep(0.1)
+
+        self.assertEqual(scheduler.get_stats()['failed'], 1)
+        self.assertListEqual(self.attempts, [])
+
+        # .. yet other trials can still be made.
+        self.assertFalse(breaker.is_trial_running)
+        self.assertTrue(breaker.can_attempt(2.0))
+
+        scheduler.stop()
+
+# ################################################################################################################################
+
+    def test_journal_compacted(self):
+
+        with patch.object(ModuleCtx, 'Compact_Min_Dead', 10):
+
+            scheduler = self._get_scheduler()
+
+            for _ in range(20):
+                scheduler.schedule(_get_entry())
+
+            scheduler.schedule(_get_entry(), 60)
+            sleep(0.2)
+
+            # Only the retry that is still pending is in the journal
+            self.assertEqual(len(self.callbacks), 20)
+            self.assertEqual(scheduler.get_stats()['pending'], 1)
+            self.assertLessEqual(scheduler.num_dead, 10)
+
+            queue = RetryJournal(scheduler.journal.path).open()
+            self.assertEqual(len(queue), 1)
+
+            scheduler.stop()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from copy import copy
+from unittest import main, TestCase
+
+# Zato
+from zato.server.pubsub.delivery.message import NonGDMessage
+from zato.server.pubsub.delivery._sorted_list import SortedList
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import list_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Sub_Key = 'sk.1'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class DeliveryListTestCase(TestCase):
+
+    def _get_messages(self, count, has_gd=False, pub_time=None):
+        # type: (int, bool, float | None) -> list_[NonGDMessage]
+        out = []
+
+        for idx in range(count):
+            msg = NonGDMessage(ModuleCtx.Sub_Key, 'server1', 123, {
+                'pub_msg_id': 'msg.{}.{}'.format(int(has_gd), idx),
+                'pub_time': pub_time or (1_000_000 + idx),
+                'data': 'data.{}'.format(idx),
+                'expiration': 0,
+                'expiration_time': 0,
+                'topic_name': '/test/topic',
+                'size': 1,
+                'published_by_id': 1,
+                'pub_pattern_matched': '',
+                'reply_to_sk': None,
+                'deliver_to_sk': None,
+                'sub_pattern_matched': {ModuleCtx.Sub_Key: 'sub=/*'},
+            })
+            msg.has_gd = has_gd
+            out.append(msg)
+
+        return out
+
+    def _assert_index(self, delivery_list):
+        # type: (SortedList) -> None
+        messages = list(delivery_list)
+        self.assertDictEqual(delivery_list._by_msg_id, {msg.pub_msg_id: msg for msg in messages})
+        self.assertEqual(delivery_list.len_gd, len([msg for msg in messages if msg.has_gd]))
+
+# ################################################################################################################################
+
+    def test_index_and_counters(self):
+
+        delivery_list = SortedList()
+
+        for msg in self._get_messages(3000, True):
+            delivery_list.add(msg)
+
+        delivery_list.update(self._get_messages(2000, False))
+        self.assertTupleEqual(delivery_list.get_queue_depth(), (3000, 2000))
+        self._assert_index(delivery_list)
+
+        # A copy of a message can be used to remove it
+        msg = delivery_list.get_pubsub_msg('msg.1.1234')
+        delivery_list.remove_pubsub_msg(copy(msg))
+        self.assertIsNone(delivery_list.get_pubsub_msg('msg.1.1234'))
+
+        _ = delivery_list.pop(0)
+        del delivery_list[10]
+        del delivery_list[100:200]
+        self._assert_index(delivery_list)
+        self.assertEqual(len(delivery_list), 4897)
+
+        delivery_list.clear()
+        self.assertTupleEqual(delivery_list.get_queue_depth(), (0, 0))
+        self._assert_index(delivery_list)
+
+# ################################################################################################################################
+
+    def test_remove_messages_with_the_same_sort_key(self):
+
+        delivery_list = SortedList(self._get_messages(2500, pub_time=1_000_000))
+
+        for idx in (2499, 0, 1700, 5):
+            msg_id = 'msg.0.{}'.format(idx)
+            delivery_list.remove_pubsub_msg(delivery_list.get_pubsub_msg(msg_id))
+            self.assertFalse(delivery_list.has_pubsub_msg(msg_id))
+            self.assertNotIn(msg_id, [msg.pub_msg_id for msg in delivery_list])
+
+        self.assertEqual(len(delivery_list), 2496)
+        self._assert_index(delivery_list)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common.api import PUBSUB
+from zato.server.pubsub.delivery.scheduler import DeliveryScheduler
+from zato.server.pubsub.delivery.tool import PubSubTool
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import anylist, callnone, dictlist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Topic_Name = '/test/topic'
+    Wait_Time = 0.05
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Session:
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class _PubSub:
+    """ Provides everything that PubSubTool and DeliveryTask need from the actual PubSub object.
+    """
+    def __init__(self, pool_size, delivery_method=PUBSUB.DELIVERY_METHOD.NOTIFY.id, deliver_func=None):
+        # type: (int, str, callnone) -> None
+        self.server = Bunch(name='server1', pid=123, odb=Bunch(session=_Session))
+        self.delivery_scheduler = DeliveryScheduler(pool_size)
+        self.delivery_method = delivery_method
+        self.deliver_func = deliver_func
+
+        # Sub key -> messages delivered, in the order of delivery
+        self.delivered = {} # type: dict
+
+        # All sub_keys in the order of deliveries
+        self.delivery_order = [] # type: anylist
+
+    def deliver_pubsub_msg(self, sub_key, msg):
+        if self.deliver_func:
+            self.deliver_func(sub_key, msg)
+        self.delivered.setdefault(sub_key, []).extend(elem.data for elem in msg)
+        self.delivery_order.append(sub_key)
+
+    def get_subscription_by_sub_key(self, sub_key):
+        return Bunch(config={
+            'topic_id': 1,
+            'topic_name': ModuleCtx.Topic_Name,
+            'endpoint_name': 'endpoint.1',
+            'delivery_method': self.delivery_method,
+            'delivery_batch_size': 1,
+            'wrap_one_msg_in_list': True,
+            'task_delivery_interval': 2000,
+            'wait_sock_err': ModuleCtx.Wait_Time,
+            'wait_non_sock_err': ModuleCtx.Wait_Time,
+        })
+
+    def get_initial_sql_msg_ids_by_sub_key(self, *ignored_args):
+        return []
+
+    def register_pubsub_tool(self, *ignored_args):
+        pass
+
+    def set_pubsub_tool_for_sub_key(self, *ignored_args):
+        pass
+
+    def wait_for_topic(self, *ignored_args):
+        return True
+
+    def get_before_delivery_hook(self, *ignored_args):
+        return None
+
+    def invoke_before_delivery_hook(self, *ignored_args):
+        pass
+
+    def set_to_delete(self, *ignored_args):
+        pass
+
+    def confirm_pubsub_msg_delivered(self, *ignored_args):
+        pass
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class DeliverySchedulerTestCase(TestCase):
+
+    def _get_tool(self, pubsub, sub_keys):
+        # type: (_PubSub, list) -> PubSubTool
+        tool = PubSubTool(pubsub, None, PUBSUB.ENDPOINT_TYPE.REST.id) # type: ignore
+        for sub_key in sub_keys:
+            tool.add_sub_key(sub_key)
+        return tool
+
+    def _get_messages(self, sub_key, count, prefix='msg', pub_time=1_000_000):
+        # type: (str, int, str, int) -> dictlist
+        return [{
+            'pub_msg_id': '{}.{}.{}'.format(prefix, sub_key, idx),
+            'pub_time': pub_time + idx,
+            'data': '{}.{}'.format(prefix, idx),
+            'expiration': 0,
+            'expiration_time': 0,
+            'topic_name': ModuleCtx.Topic_Name,
+            'size': 1,
+            'published_by_id': 1,
+            'pub_pattern_matched': '',
+            'reply_to_sk': None,
+            'deliver_to_sk': None,
+            'sub_pattern_matched': {sub_key: 'sub=/*'},
+        } for idx in range(count)]
+
+    def _get_pubsub(self, *args, **kwargs):
+        pubsub = _PubSub(*args, **kwargs)
+        self.addCleanup(pubsub.delivery_scheduler.stop)
+        return pubsub
+
+# ################################################################################################################################
+
+    def test_messages_are_delivered_in_order_once_enqueued(self):
+
+        pubsub = self._get_pubsub(4)
+        tool = self._get_tool(pubsub, ['sk.1'])
+
+        tool.add_non_gd_messages_by_sub_key('sk.1', self._get_messages('sk.1', 10))
+        sleep(0.01)
+
+        self.assertListEqual(pubsub.delivered['sk.1'], ['msg.{}'.format(idx) for idx in range(10)])
+        self.assertFalse(tool.delivery_lists['sk.1'])
+
+        # Without any new messages, the tasks are not run at all
+        len_runs = pubsub.delivery_scheduler.len_runs
+        sleep(0.2)
+        self.assertEqual(pubsub.delivery_scheduler.len_runs, len_runs)
+
+# ################################################################################################################################
+
+    def test_sub_keys_are_served_fairly(self):
+
+        # With only one worker, batches for each sub_key have to take turns
+        pubsub = self._get_pubsub(1)
+        tool = self._get_tool(pubsub, ['sk.1', 'sk.2'])
+
+        tool.add_non_gd_messages_by_sub_key('sk.1', self._get_messages('sk.1', 3))
+        tool.add_non_gd_messages_by_sub_key('sk.2', self._get_messages('sk.2', 3))
+        sleep(0.01)
+
+        self.assertListEqual(pubsub.delivery_order, ['sk.1', 'sk.2'] * 3)
+        self.assertListEqual(pubsub.delivered['sk.2'], ['msg.0', 'msg.1', 'msg.2'])
+
+# ################################################################################################################################
+
+    def test_delivery_is_retried_after_error(self):
+
+        errors = []
+
+        def deliver_func(sub_key, msg):
+            if not errors:
+                errors.append(msg[0].data)
+                raise IOError('Delivery error')
+
+        pubsub = self._get_pubsub(4, deliver_func=deliver_func)
+        tool = self._get_tool(pubsub, ['sk.1'])
+
+        tool.add_non_gd_messages_by_sub_key('sk.1', self._get_messages('sk.1', 2))
+        sleep(0.01)
+
+        # Nothing is delivered until the wait time elapses, not even if new messages arrive ..
+        tool.add_non_gd_messages_by_sub_key('sk.1', self._get_messages('sk.1', 1, 'new', 2_000_000))
+        sleep(0.01)
+        self.assertListEqual(errors, ['msg.0'])
+        self.assertNotIn('sk.1', pubsub.delivered)
+
+        # .. and then all the messages are delivered in order.
+        sleep(ModuleCtx.Wait_Time * 2)
+        self.assertListEqual(pubsub.delivered['sk.1'], ['msg.0', 'msg.1', 'new.0'])
+
+# ################################################################################################################################
+
+    def test_pull_tasks_are_not_run(self):
+
+        pubsub = self._get_pubsub(4, PUBSUB.DELIVERY_METHOD.PULL.id)
+        tool = self._get_tool(pubsub, ['sk.1'])
+
+        tool.add_non_gd_messages_by_sub_key('sk.1', self._get_messages('sk.1', 3))
+        sleep(0.01)
+
+        self.assertEqual(pubsub.delivery_scheduler.len_runs, 0)
+        self.assertEqual(len(tool.pull_messages('sk.1')), 1)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.common.exception import ServiceUnavailable
+from zato.server.pubsub.publisher import GDBatchWriter
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, anylist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Topic_ID = 1
+    Topic_Name = '/test/topic'
+    Batch_Interval = 0.01
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Session:
+    def __init__(self, sql:'_SQL') -> 'None':
+        self.sql = sql
+        self.pending = [] # type: anylist
+
+    def commit(self):
+        self.sql.commits += 1
+        self.sql.committed.extend(self.pending)
+        self.pending[:] = []
+
+    def rollback(self):
+        self.pending[:] = []
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class _SQL:
+    """ Stands for the ODB, along with the publisher's callbacks that GDBatchWriter uses.
+    """
+    def __init__(self, fail_on:'str'='') -> 'None':
+        self.fail_on = fail_on
+        self.commits = 0
+        self.inserts = 0
+        self.committed = [] # type: anylist
+        self.pub_counter = 0
+
+    def new_session(self):
+        return _Session(self)
+
+    def insert_gd_messages(self, session, now, cid, topic, gd_msg_list, subscriptions_by_topic):
+        # type: (_Session, float, str, any_, anylist, anylist) -> None
+        self.inserts += 1
+        for msg in gd_msg_list:
+            if msg['pub_msg_id'] == self.fail_on:
+                raise Exception('Duplicate message ID `{}`'.format(msg['pub_msg_id']))
+            session.pending.append(msg['pub_msg_id'])
+
+    def reject_publication(self, cid, topic_name, is_gd):
+        raise ServiceUnavailable(cid, 'Publication rejected - would exceed GD max depth for `{}`'.format(topic_name))
+
+    def incr_pub_counter(self):
+        self.pub_counter += 1
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class GDBatchWriterTestCase(TestCase):
+
+    def _get_writer(self, sql, batch_size=100, max_depth=10_000):
+        # type: (_SQL, int, int) -> GDBatchWriter
+        writer = GDBatchWriter(
+            server = Bunch(incr_pub_counter=sql.incr_pub_counter), # type: ignore
+            new_session_func = sql.new_session,
+            insert_gd_messages_func = sql.insert_gd_messages,
+            reject_publication_func = sql.reject_publication,
+            batch_size = batch_size,
+            batch_interval = ModuleCtx.Batch_Interval,
+        )
+
+        self.topic = Bunch(id=ModuleCtx.Topic_ID, name=ModuleCtx.Topic_Name, max_depth_gd=max_depth,
+            needs_depth_check=lambda: False)
+
+        # The depth is known upfront, so no SQL query is needed to obtain it
+        writer.depth[ModuleCtx.Topic_ID] = 0
+
+        return writer
+
+    def _get_ctx(self, idx, len_msg=1, sub_keys=('sk.1',)):
+        return Bunch(
+            cid = 'cid.{}'.format(idx),
+            cluster_id = 1,
+            topic = self.topic,
+            now = 1_000_000 + idx,
+            current_depth = 0,
+            subscriptions_by_topic = [Bunch(sub_key=sub_key) for sub_key in sub_keys],
+            gd_msg_list = [{
+                'pub_msg_id': 'msg.{}.{}'.format(idx, msg_idx),
+                'is_in_sub_queue': False,
+            } for msg_idx in range(len_msg)],
+        )
+
+    def _publish(self, writer, ctx_list):
+        # type: (GDBatchWriter, anylist) -> anylist
+        greenlets = [spawn(writer.publish, ctx) for ctx in ctx_list]
+        _ = joinall(greenlets)
+        return greenlets
+
+# ################################################################################################################################
+
+    def test_concurrent_publications_are_committed_together(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql)
+
+        greenlets = self._publish(writer, [self._get_ctx(idx) for idx in range(50)])
+
+        # Every publisher was acknowledged ..
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+        self.assertEqual(sql.pub_counter, 50)
+
+        # .. after all of their messages were inserted and committed at once ..
+        self.assertEqual(sql.inserts, 1)
+        self.assertEqual(sql.commits, 1)
+        self.assertEqual(len(sql.committed), 50)
+
+        # .. which is reflected in the depth of the topic.
+        self.assertEqual(writer.depth[ModuleCtx.Topic_ID], 50)
+        self.assertEqual(writer.pending_depth[ModuleCtx.Topic_ID], 0)
+
+# ################################################################################################################################
+
+    def test_full_batch_is_written_immediately(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql, batch_size=10)
+
+        greenlets = self._publish(writer, [self._get_ctx(idx, 5) for idx in range(6)])
+
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+        self.assertEqual(sql.commits, 3)
+        self.assertEqual(writer.len_batches, 3)
+        self.assertEqual(len(sql.committed), 30)
+
+# ################################################################################################################################
+
+    def test_publications_to_different_subscribers_are_inserted_separately(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql)
+
+        ctx_list = [self._get_ctx(idx, sub_keys=('sk.{}'.format(idx % 2),)) for idx in range(10)]
+        _ = self._publish(writer, ctx_list)
+
+        self.assertEqual(sql.inserts, 2)
+        self.assertEqual(sql.commits, 1)
+
+# ################################################################################################################################
+
+    def test_failed_batch_is_retried_one_by_one(self):
+
+        sql = _SQL(fail_on='msg.3.0')
+        writer = self._get_writer(sql)
+
+        greenlets = self._publish(writer, [self._get_ctx(idx) for idx in range(5)])
+
+        # Only the publication with the offending message failed ..
+        self.assertListEqual([greenlet.successful() for greenlet in greenlets], [True, True, True, False, True])
+        self.assertIn('Duplicate message ID', str(greenlets[3].exception))
+
+        # .. and all the other ones were committed.
+        self.assertListEqual(sorted(sql.committed), ['msg.0.0', 'msg.1.0', 'msg.2.0', 'msg.4.0'])
+        self.assertEqual(sql.pub_counter, 4)
+
+# ################################################################################################################################
+
+    def test_max_depth_is_enforced_for_pending_messages(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql, max_depth=10)
+
+        greenlets = self._publish(writer, [self._get_ctx(idx, 4) for idx in range(3)])
+
+        # The third publication would exceed max depth even though nothing had been committed yet when it arrived
+        self.assertListEqual([greenlet.successful() for greenlet in greenlets], [True, True, False])
+        self.assertIsInstance(greenlets[2].exception, ServiceUnavailable)
+        self.assertEqual(writer.depth[ModuleCtx.Topic_ID], 8)
+
+# ################################################################################################################################
+
+    def test_max_depth_ignores_messages_in_sub_queues(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql, max_depth=4)
+
+        # Messages that go straight to subscriber queues do not count towards the depth ..
+        ctx = self._get_ctx(1, 8)
+        for msg in ctx.gd_msg_list:
+            msg['is_in_sub_queue'] = True
+
+        # .. so both publications fit even though they have more messages than max depth in total.
+        greenlets = self._publish(writer, [ctx, self._get_ctx(2, 4)])
+
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+        self.assertEqual(writer.depth[ModuleCtx.Topic_ID], 4)
+
+# ################################################################################################################################
+
+    def test_depth_query_does_not_block_other_topics(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql)
+
+        # The depth of another topic is not known yet and reading it takes a while ..
+        def get_gd_depth_topic(session, cluster_id, topic_id):
+            sleep(0.5)
+            return 0
+
+        other_ctx = self._get_ctx(1)
+        other_ctx.topic = Bunch(id=2, name='/test/other', max_depth_gd=10_000, needs_depth_check=lambda: False)
+
+        with patch('zato.server.pubsub.publisher.get_gd_depth_topic', get_gd_depth_topic):
+
+            other = spawn(writer.publish, other_ctx)
+            sleep(0.01)
+
+            # .. but publications to our topic do not wait for it.
+            greenlet = spawn(writer.publish, self._get_ctx(2))
+            _ = joinall([greenlet], timeout=0.2)
+
+            self.assertTrue(greenlet.successful())
+            self.assertFalse(other.ready())
+
+            _ = joinall([other])
+            self.assertTrue(other.successful())
+            self.assertEqual(writer.depth[2], 1)
+
+# ################################################################################################################################
+
+    def test_topic_deleted(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql)
+
+        _ = self._publish(writer, [self._get_ctx(idx) for idx in range(5)])
+
+        self.assertIn(ModuleCtx.Topic_ID, writer.write_locks)
+        self.assertIn(ModuleCtx.Topic_ID, writer.depth)
+
+        # Once the topic is deleted, nothing about it is kept ..
+        writer.on_topic_deleted(ModuleCtx.Topic_ID)
+
+        self.assertDictEqual(writer.write_locks, {})
+        self.assertDictEqual(writer.depth, {})
+        self.assertDictEqual(writer.pending_depth, {})
+
+# ################################################################################################################################
+
+    def test_topic_deleted_while_batch_pending(self):
+
+        sql = _SQL()
+        writer = self._get_writer(sql)
+
+        greenlets = [spawn(writer.publish, self._get_ctx(idx)) for idx in range(5)]
+        sleep(0)
+
+        # The topic is deleted before its batch is written ..
+        writer.on_topic_deleted(ModuleCtx.Topic_ID)
+        _ = joinall(greenlets)
+
+        # .. which still lets the publishers know the outcome ..
+        self.assertTrue(all(greenlet.successful() for greenlet in greenlets))
+
+        # .. but the batch does not bring back what was kept about the topic.
+        self.assertDictEqual(writer.write_locks, {})
+        self.assertDictEqual(writer.depth, {})
+        self.assertDictEqual(writer.pending_depth, {})
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+from time import time
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.server.pubsub.sync import InRAMSync
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import dictlist, strlist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+    Topic_ID = 1
+    Topic_Name = '/test/topic'
+    Max_Depth = 10 ** 9
+    Now = 1_000_000_000_000
+    Load_Test_Messages = int(os.environ.get('ZATO_TEST_PUBSUB_SYNC_BACKLOG_SIZE') or 100_000)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _PubSub:
+    def __init__(self):
+        self.server = Bunch(name='server1', pid=123)
+        self.data_prefix_len = 100
+        self.data_prefix_short_len = 10
+
+    def get_endpoint_by_id(self, endpoint_id):
+        return Bunch(name='endpoint.{}'.format(endpoint_id))
+
+    def get_topic_by_id(self, topic_id):
+        return Bunch(name=ModuleCtx.Topic_Name)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class InRAMSyncTestCase(TestCase):
+
+    def _get_messages(self, count, expiration_time, prefix='msg'):
+        # type: (int, int, str) -> dictlist
+        return [{
+            'pub_msg_id': '{}.{}'.format(prefix, idx),
+            'pub_time': str(ModuleCtx.Now / 1000.0),
+            'topic_id': ModuleCtx.Topic_ID,
+            'topic_name': ModuleCtx.Topic_Name,
+            'published_by_id': 1,
+            'data': 'data.{}'.format(idx),
+            'expiration': 1000,
+            'expiration_time': expiration_time,
+        } for idx in range(count)]
+
+    def _add_messages(self, sync, sub_keys, messages):
+        # type: (InRAMSync, strlist, dictlist) -> None
+        sync.add_messages('cid', ModuleCtx.Topic_ID, ModuleCtx.Topic_Name, ModuleCtx.Max_Depth, sub_keys, messages)
+
+    def _assert_empty(self, sync):
+        # type: (InRAMSync) -> None
+        self.assertDictEqual(sync.msg_id_to_msg, {})
+        self.assertDictEqual(sync.msg_id_to_sub_key, {})
+        self.assertFalse(any(sync.topic_id_msg_id.values()))
+        self.assertFalse(any(sync.sub_key_to_msg_id.values()))
+
+# ################################################################################################################################
+
+    def test_messages_are_returned_in_insertion_order(self):
+
+        sync = InRAMSync(_PubSub())
+        messages = self._get_messages(100, ModuleCtx.Now + 1000)
+        self._add_messages(sync, ['sk.1'], messages)
+
+        msg_ids = [msg['pub_msg_id'] for msg in messages]
+        out = sync.get_messages_by_topic_id(ModuleCtx.Topic_ID, False)
+        self.assertListEqual([msg['pub_msg_id'] for msg in out], msg_ids)
+
+        sync.delete_msg_by_id('msg.50')
+        self.assertEqual(sync.get_topic_depth(ModuleCtx.Topic_ID), 99)
+        self.assertListEqual(list(sync.sub_key_to_msg_id['sk.1']), msg_ids[:50] + msg_ids[51:])
+
+# ################################################################################################################################
+
+    def test_expired_messages_are_deleted(self):
+
+        sync = InRAMSync(_PubSub())
+        self._add_messages(sync, ['sk.1', 'sk.2'], self._get_messages(10, ModuleCtx.Now + 1000, 'short'))
+        self._add_messages(sync, ['sk.1'], self._get_messages(10, ModuleCtx.Now + 5000, 'long'))
+
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now), 0)
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 1000), 10)
+
+        self.assertEqual(sync.get_topic_depth(ModuleCtx.Topic_ID), 10)
+        self.assertFalse(sync.has_messages_by_sub_key('sk.2'))
+        self.assertTrue(sync.has_messages_by_sub_key('sk.1'))
+
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 5000), 10)
+        self._assert_empty(sync)
+
+# ################################################################################################################################
+
+    def test_updated_expiration_is_respected(self):
+
+        sync = InRAMSync(_PubSub())
+        msg, = self._get_messages(1, ModuleCtx.Now + 1000)
+        self._add_messages(sync, ['sk.1'], [msg])
+
+        update = dict(msg, msg_id=msg['pub_msg_id'], size=1, priority=5, pub_correl_id=None, in_reply_to=None, mime_type=None)
+        update['expiration_time'] = ModuleCtx.Now + 9000
+        self.assertTrue(sync.update_msg(update))
+
+        # The old expiration time no longer applies ..
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 1000), 0)
+
+        # .. but the new one does.
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 9000), 1)
+        self._assert_empty(sync)
+
+# ################################################################################################################################
+
+    def test_retrieve_and_unsubscribe(self):
+
+        sync = InRAMSync(_PubSub())
+        self._add_messages(sync, ['sk.1'], self._get_messages(5, ModuleCtx.Now * 2, 'a'))
+        self._add_messages(sync, ['sk.1', 'sk.2'], self._get_messages(5, ModuleCtx.Now * 2, 'b'))
+
+        out = sync.retrieve_messages_by_sub_keys(ModuleCtx.Topic_ID, ['sk.1'])
+        self.assertEqual(len(out), 10)
+        self.assertEqual(sync.get_topic_depth(ModuleCtx.Topic_ID), 0)
+        self.assertFalse(sync.has_messages_by_sub_key('sk.1'))
+
+        # Messages shared with sk.2 are still known to be of interest to it ..
+        self.assertSetEqual(set(sync.msg_id_to_sub_key), {'b.{}'.format(idx) for idx in range(5)})
+
+        # .. until it unsubscribes.
+        sync.unsubscribe(ModuleCtx.Topic_ID, ModuleCtx.Topic_Name, ['sk.2'])
+        self._assert_empty(sync)
+
+# ################################################################################################################################
+
+    def test_expiry_heap_is_compacted(self):
+
+        sync = InRAMSync(_PubSub())
+        self._add_messages(sync, ['sk.1'], self._get_messages(5000, ModuleCtx.Now + 1000))
+
+        _ = sync.retrieve_messages_by_sub_keys(ModuleCtx.Topic_ID, ['sk.1'])
+        self.assertEqual(len(sync.expiry_heap), 5000)
+
+        # None of the messages expired yet but all of them were consumed so the heap can be rebuilt
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now), 0)
+        self.assertListEqual(sync.expiry_heap, [])
+
+# ################################################################################################################################
+
+    def test_load(self):
+
+        count = ModuleCtx.Load_Test_Messages
+        batch_size = 100
+
+        sync = InRAMSync(_PubSub())
+        sub_keys = ['sk.{}'.format(idx) for idx in range(10)]
+
+        # Half of the messages expire after one second and the other half after one hour
+        messages = self._get_messages(count // 2, ModuleCtx.Now + 1000, 'short')
+        messages += self._get_messages(count // 2, ModuleCtx.Now + 3_600_000, 'long')
+
+        start = time()
+        for idx in range(0, count, batch_size):
+            self._add_messages(sync, sub_keys, messages[idx:idx+batch_size])
+        add_time = time() - start
+
+        # Only the expired messages are visited ..
+        start = time()
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 1000), count // 2)
+        expire_time = time() - start
+
+        # .. and nothing is visited if there are no expired messages.
+        start = time()
+        self.assertEqual(sync._delete_expired_messages(ModuleCtx.Now + 1000), 0)
+        idle_time = time() - start
+
+        # Individual deletes do not scan other topics or sub_keys
+        start = time()
+        for idx in range(count // 2):
+            sync.delete_msg_by_id('long.{}'.format(idx))
+        delete_time = time() - start
+
+        self._assert_empty(sync)
+
+        # Without the heap and reverse mappings, deletes alone would take hours with this many messages
+        self.assertLess(idle_time, 0.01)
+        self.assertLess(expire_time + delete_time, 60)
+
+        if os.environ.get('ZATO_TEST_PUBSUB_SYNC_BACKLOG_SIZE'):
+            print('\nmessages:{}; add:{:.3f}s; expire:{:.3f}s; idle:{:.6f}s; delete:{:.3f}s'.format(
+                count, add_time, expire_time, idle_time, delete_time))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import sys
+from importlib import import_module
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+# Zato
+from zato.common.api import SourceCodeInfo
+from zato.server.service.snapshot import find_module_file, get_snapshot_key, LazyServiceInfo, load_service_class, \
+     ModuleCtx, ServiceSnapshot
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Service:
+    @staticmethod
+    def get_name():
+        return 'my.service'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+
+        self.base_dir = mkdtemp(prefix='zato-test-snapshot-')
+
+        # Each test has a package of its own, with one module in it
+        self.package_name = 'zato_test_snapshot_{}'.format(self._testMethodName)
+        self.mod_name = self.package_name + '.my_services'
+
+        package_dir = os.path.join(self.base_dir, self.package_name)
+        os.mkdir(package_dir)
+
+        with open(os.path.join(package_dir, '__init__.py'), 'w') as f:
+            _ = f.write('')
+
+        self.mod_path = os.path.join(package_dir, 'my_services.py')
+        self._write_module('class MyService:\n    pass\n')
+
+        sys.path.insert(0, self.base_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.base_dir)
+        for name in list(sys.modules):
+            if name.startswith(self.package_name):
+                del sys.modules[name]
+        rmtree(self.base_dir, ignore_errors=True)
+
+    def _write_module(self, source):
+        with open(self.mod_path, 'w') as f:
+            _ = f.write(source)
+
+    def _get_snapshot(self, key='key.1', deployment_key='deployment.1'):
+
+        source_code_info = SourceCodeInfo()
+        source_code_info.path = '/path/to/source.py'
+        source_code_info.hash = 'abc'
+        source_code_info.hash_method = 'SHA-256'
+        source_code_info.len_source = 123
+
+        snapshot = ServiceSnapshot(os.path.join(self.base_dir, ModuleCtx.File_Name), key, deployment_key)
+        snapshot.add(_Service, 'my.service', 'my.module.MyService', 1, True, 99999, {'fs_location': '/path/to/source.py'},
+            source_code_info, False)
+
+        return snapshot
+
+# ################################################################################################################################
+
+    def test_find_module_file_without_import(self):
+
+        _ = import_module(self.package_name)
+
+        self.assertEqual(find_module_file(self.mod_name), self.mod_path)
+        self.assertNotIn(self.mod_name, sys.modules)
+
+# ################################################################################################################################
+
+    def test_key_follows_sources(self):
+
+        key1 = get_snapshot_key([self.mod_name])
+        key2 = get_snapshot_key([self.mod_name])
+
+        self.assertEqual(key1, key2)
+
+        self._write_module('class MyService:\n    name = "my.service.2"\n')
+        key3 = get_snapshot_key([self.mod_name])
+
+        self.assertNotEqual(key1, key3)
+
+# ################################################################################################################################
+
+    def test_save_and_load(self):
+
+        snapshot = self._get_snapshot()
+        snapshot.save()
+
+        # No temporary files are left behind
+        self.assertListEqual(sorted(os.listdir(self.base_dir)), sorted([ModuleCtx.File_Name, self.package_name]))
+
+        loaded = ServiceSnapshot.load(snapshot.path, 'key.1', 'deployment.1')
+
+        entry, = loaded.services # type: ignore
+        self.assertEqual(entry['name'], 'my.service')
+        self.assertEqual(entry['impl_name'], 'my.module.MyService')
+        self.assertEqual(entry['mod_name'], __name__)
+        self.assertEqual(entry['class_name'], '_Service')
+        self.assertEqual(entry['service_id'], 1)
+        self.assertEqual(entry['len_source'], 123)
+        self.assertDictEqual(entry['deployment_info'], {'fs_location': '/path/to/source.py'})
+
+# ################################################################################################################################
+
+    def test_load_invalid(self):
+
+        snapshot = self._get_snapshot()
+
+        # Does not exist yet
+        self.assertIsNone(ServiceSnapshot.load(snapshot.path, 'key.1', 'deployment.1'))
+
+        snapshot.save()
+
+        # Sources or deployment are different
+        self.assertIsNone(ServiceSnapshot.load(snapshot.path, 'key.2', 'deployment.1'))
+        self.assertIsNone(ServiceSnapshot.load(snapshot.path, 'key.1', 'deployment.2'))
+
+        # The file cannot be read
+        with open(snapshot.path, 'wb') as f:
+            _ = f.write(b'abc')
+
+        self.assertIsNone(ServiceSnapshot.load(snapshot.path, 'key.1', 'deployment.1'))
+
+# ################################################################################################################################
+
+    def test_lazy_service_info(self):
+
+        loaded = []
+
+        def load_func(entry):
+            loaded.append(entry['mod_name'])
+            return load_service_class(entry)
+
+        info = LazyServiceInfo(load_func, {'mod_name': self.mod_name, 'class_name': 'MyService'}, name='my.service')
+
+        # Nothing is imported until the class is needed ..
+        self.assertEqual(info['name'], 'my.service')
+        self.assertNotIn(self.mod_name, sys.modules)
+
+        # .. and it is imported only once.
+        self.assertEqual(info['service_class'].__name__, 'MyService')
+        self.assertEqual(info['service_class'].__name__, 'MyService')
+        self.assertListEqual(loaded, [self.mod_name])
+
+        with self.assertRaises(KeyError):
+            _ = info['invalid']
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
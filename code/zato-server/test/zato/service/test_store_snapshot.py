@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common.api import SourceCodeInfo
+from zato.server.service.snapshot import get_snapshot_key, LazyServiceInfo, ModuleCtx as SnapshotCtx, ServiceSnapshot
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ModuleCtx:
+
+    # There is no such module, which is fine because services restored from a snapshot are not imported until first use
+    Mod_Name = 'zato_test_store_snapshot_services'
+
+    Impl_Name = Mod_Name + '.MyService'
+    Deployment_Key = 'deployment.1'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MyService:
+    __module__ = ModuleCtx.Mod_Name
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _ODB:
+
+    def __init__(self, is_active, slow_threshold):
+        self.is_active = is_active
+        self.slow_threshold = slow_threshold
+
+    def get_sql_internal_service_list(self, cluster_id):
+        return [Bunch(id=1, impl_name=ModuleCtx.Impl_Name, is_active=self.is_active, slow_threshold=self.slow_threshold)]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ServiceStoreSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(prefix='zato-test-store-snapshot-')
+
+    def tearDown(self):
+        rmtree(self.base_dir, ignore_errors=True)
+
+    def _save_snapshot(self):
+
+        source_code_info = SourceCodeInfo()
+        source_code_info.path = '/path/to/source.py'
+        source_code_info.hash = 'abc'
+        source_code_info.hash_method = 'SHA-256'
+        source_code_info.len_source = 123
+
+        repo_dir = os.path.join(self.base_dir, 'config', 'repo')
+        os.makedirs(repo_dir)
+
+        key = get_snapshot_key([ModuleCtx.Mod_Name])
+
+        # The first worker created the snapshot while the service was active and had the default slow threshold
+        snapshot = ServiceSnapshot(os.path.join(repo_dir, SnapshotCtx.File_Name), key, ModuleCtx.Deployment_Key)
+        snapshot.add(MyService, 'my.service', ModuleCtx.Impl_Name, 1, True, 99999, {'fs_location': '/path/to/source.py'},
+            source_code_info, False)
+        snapshot.save()
+
+    def _get_store(self, odb):
+        server = Bunch(name='server1', cluster_id=1, deployment_key=ModuleCtx.Deployment_Key)
+        return ServiceStore(services={}, odb=odb, server=server, is_testing=False)
+
+# ################################################################################################################################
+
+    def test_import_internal_services_from_snapshot(self):
+
+        self._save_snapshot()
+
+        # The service was deactivated and given a different slow threshold after the snapshot had been created
+        store = self._get_store(_ODB(False, 123))
+
+        # Nothing is imported if there is a snapshot to restore the services from ..
+        with patch.object(ServiceStore, 'import_services_from_anywhere', side_effect=Exception('Unexpected import')), \
+             patch.object(store, 'has_internal_cache', True):
+            to_process = store.import_internal_services([ModuleCtx.Mod_Name], self.base_dir, False, False)
+
+        # .. the service is known to the store ..
+        self.assertEqual(len(to_process), 1)
+        self.assertEqual(store.name_to_impl_name['my.service'], ModuleCtx.Impl_Name)
+        self.assertEqual(store.impl_name_to_id[ModuleCtx.Impl_Name], 1)
+        self.assertIsInstance(store.services[ModuleCtx.Impl_Name], LazyServiceInfo)
+
+        # .. and whether it is active and its slow threshold are the current ones, read from ODB.
+        service = to_process[0]
+        self.assertFalse(service.is_active)
+        self.assertEqual(service.slow_threshold, 123)
+
+        self.assertFalse(store.services[ModuleCtx.Impl_Name]['is_active'])
+        self.assertEqual(store.services[ModuleCtx.Impl_Name]['slow_threshold'], 123)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyServiceInfoTestCase(TestCase):
+
+    def test_lookups(self):
+
+        loaded = []
+
+        def load(entry):
+            loaded.append(entry['impl_name'])
+            return MyService
+
+        info = LazyServiceInfo(load, {'impl_name': ModuleCtx.Impl_Name}, name='my.service', is_active=True)
+
+        # The class is known to exist before it is imported ..
+        self.assertIn('service_class', info)
+        self.assertIn('name', info)
+        self.assertNotIn('invalid', info)
+        self.assertListEqual(loaded, [])
+
+        # .. other keys can be looked up without importing it ..
+        self.assertEqual(info.get('name'), 'my.service')
+        self.assertEqual(info.get('invalid', 'my.default'), 'my.default')
+        self.assertListEqual(loaded, [])
+
+        # .. and it is imported only once, however it is looked up.
+        self.assertIs(info.get('service_class'), MyService)
+        self.assertIs(info['service_class'], MyService)
+        self.assertIs(info.get('service_class'), MyService)
+        self.assertListEqual(loaded, [ModuleCtx.Impl_Name])
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -864,6 +864,212 @@ class EventsDatabaseTestCase(TestCase):
         self.assertEqual(service3['item_total_time'],  39_600)
         self.assertEqual(service3['item_total_usage'],  480.0)
 
+# ################################################################################################################################
+
+    def test_push_batch(self):
+
+        events_db = self.get_events_db(sync_threshold=100)
+
+        # A batch is counted as many events as it contains ..
+        events_db.access_state(OpCode.PushBatch, list(self.yield_scenario_events(len_services=1)), 480)
+
+        self.assertEqual(events_db.total_events, 480)
+        self.assertEqual(events_db.telemetry[OpCode.Internal.SyncState], 1)
+        self.assertEqual(events_db.num_events_since_sync, 0)
+
+        # .. and all of them are tabulated.
+        tabulated = events_db.get_table().to_dict()
+        self.assertEqual(tabulated['service-1']['item_total_usage'], 480)
+
+# ################################################################################################################################
+
+    def test_sync_is_append_only(self):
+
+        fs_data_path = self.get_random_fs_data_path()
+        events_db = self.get_events_db(fs_data_path=fs_data_path)
+
+        events_dir, summary_dir = events_db.get_partition_dirs('2056-01-02')
+
+        # Sync events for the first time ..
+        for event_data in self.yield_scenario_events():
+            events_db.access_state(OpCode.Push, event_data)
+        events_db.sync_state()
+
+        # .. remember the files it created ..
+        first_file_list = events_db.list_files(events_dir)
+        first_mtime_list = [os.path.getmtime(path) for path in first_file_list]
+
+        # .. sync the same events again ..
+        for event_data in self.yield_scenario_events():
+            events_db.access_state(OpCode.Push, event_data)
+        events_db.sync_state()
+
+        # .. each sync added new files and the first one was not modified ..
+        self.assertEqual(len(events_db.list_files(events_dir)), 2)
+        self.assertEqual(len(events_db.list_files(summary_dir)), 2)
+        self.assertEqual([os.path.getmtime(path) for path in first_file_list], first_mtime_list)
+
+        # .. all the events are there ..
+        self.assertEqual(len(events_db.load_data_from_storage()), 2 * 120 * Default.LenEvents * Default.LenServices)
+
+        # .. and a new instance tabulates them without reading any of the raw events.
+        events_db = self.get_events_db(fs_data_path=fs_data_path)
+        tabulated = events_db.get_table().to_dict()
+
+        self.assertEqual(tabulated['service-1']['item_total_usage'], 960)
+        self.assertEqual(tabulated['service-1']['item_mean'], 27.5)
+        self.assertEqual(tabulated['service-3']['item_max'], 132)
+        self.assertEqual(events_db.telemetry[OpCode.Internal.SyncState], 0)
+
+# ################################################################################################################################
+
+    def test_tabulate_does_not_sync(self):
+
+        events_db = self.get_events_db()
+
+        # Events already synced ..
+        for event_data in self.yield_scenario_events(len_services=1):
+            events_db.access_state(OpCode.Push, event_data)
+        events_db.sync_state()
+
+        # .. and ones that are still in RAM ..
+        events_db.access_state(OpCode.Push, {
+            'timestamp': '2056-01-02T03:06:00.123456',
+            'object_id': 'service-1',
+            'total_time_ms': 1000,
+        })
+
+        tabulated = events_db.get_table().to_dict()
+
+        # .. are all tabulated but no new sync took place.
+        self.assertEqual(tabulated['service-1']['item_total_usage'], 481)
+        self.assertEqual(tabulated['service-1']['item_max'], 1000)
+        self.assertEqual(events_db.telemetry[OpCode.Internal.SyncState], 1)
+        self.assertEqual(len(events_db.in_ram_store), 1)
+
+# ################################################################################################################################
+
+    def test_retention_drops_partitions(self):
+
+        # One day, in milliseconds
+        max_retention = 1000 * 60 * 60 * 24
+
+        events_db = self.get_events_db(max_retention=max_retention)
+
+        for day in (1, 2, 3):
+            events_db.access_state(OpCode.Push, {
+                'timestamp': '2056-01-0{}T12:00:00'.format(day),
+                'object_id': 'service-1',
+                'total_time_ms': day,
+            })
+        events_db.sync_state()
+
+        self.assertListEqual(events_db.list_partitions(), ['2056-01-01', '2056-01-02', '2056-01-03'])
+
+        # A day past the second partition, which means that only the last one is still retained
+        events_db.drop_expired_partitions(lambda: datetime(2056, 1, 4, 0, 0, 0))
+
+        self.assertListEqual(events_db.list_partitions(), ['2056-01-03'])
+        self.assertListEqual(sorted(events_db.partition_totals), ['2056-01-03'])
+        self.assertEqual(events_db.telemetry[OpCode.Internal.DropPartition], 2)
+
+        tabulated = events_db.get_table().to_dict()
+        self.assertEqual(tabulated['service-1']['item_total_usage'], 1)
+        self.assertEqual(tabulated['service-1']['item_total_time'], 3)
+
+# ################################################################################################################################
+
+    def test_retention_trims_boundary_partition(self):
+
+        # One day, in milliseconds
+        max_retention = 1000 * 60 * 60 * 24
+
+        events_db = self.get_events_db(max_retention=max_retention)
+
+        for timestamp, total_time_ms in (
+            ('2056-01-02T01:00:00', 1),
+            ('2056-01-02T12:00:00', 12),
+            ('2056-01-02T23:00:00', 23),
+            ('2056-01-03T01:00:00', 100),
+            ):
+            events_db.access_state(OpCode.Push, {
+                'timestamp': timestamp,
+                'object_id': 'service-1',
+                'total_time_ms': total_time_ms,
+            })
+        events_db.sync_state()
+
+        def get_table(now):
+            return events_db.get_table(lambda: now).to_dict()['service-1']
+
+        # The first partition is only partly past the retention threshold, so only its events that are not are tabulated ..
+        tabulated = get_table(datetime(2056, 1, 3, 6, 0, 0))
+        self.assertEqual(tabulated['item_total_usage'], 3)
+        self.assertEqual(tabulated['item_total_time'], 135)
+        self.assertEqual(tabulated['item_min'], 12)
+
+        # .. and fewer of them as time passes ..
+        tabulated = get_table(datetime(2056, 1, 3, 18, 0, 0))
+        self.assertEqual(tabulated['item_total_usage'], 2)
+        self.assertEqual(tabulated['item_total_time'], 123)
+
+        # .. until none of them are, even if the partition has not been dropped yet.
+        tabulated = get_table(datetime(2056, 1, 4, 0, 0, 0))
+        self.assertEqual(tabulated['item_total_usage'], 1)
+        self.assertEqual(tabulated['item_total_time'], 100)
+        self.assertListEqual(events_db.list_partitions(), ['2056-01-02', '2056-01-03'])
+
+# ################################################################################################################################
+
+    def test_compact_closed_partitions(self):
+
+        events_db = self.get_events_db()
+        events_dir, summary_dir = events_db.get_partition_dirs('2056-01-02')
+
+        # Three syncs, each of them with one third of events ..
+        event_list = list(self.yield_scenario_events())
+
+        for idx in range(3):
+            for event_data in event_list[idx::3]:
+                events_db.access_state(OpCode.Push, event_data)
+            events_db.sync_state()
+
+        self.assertEqual(len(events_db.list_files(events_dir)), 3)
+        before = events_db.get_table().to_dict()
+
+        # .. and a day later, the partition is closed so it can be compacted ..
+        events_db.compact_closed_partitions(lambda: datetime(2056, 1, 3, 0, 0, 0))
+
+        self.assertEqual(len(events_db.list_files(events_dir)), 1)
+        self.assertEqual(len(events_db.list_files(summary_dir)), 1)
+        self.assertEqual(len(events_db.load_data_from_storage()), len(event_list))
+        self.assertEqual(events_db.telemetry[OpCode.Internal.Compact], 1)
+
+        # .. which does not change the statistics, also when they are read from storage again.
+        self.assertDictEqual(self.get_events_db(fs_data_path=events_db.fs_data_path).get_table().to_dict(), before)
+
+# ################################################################################################################################
+
+    def test_migrate_single_file(self):
+
+        # Pandas
+        import pandas as pd
+
+        # Data from before partitioning is kept in a single file ..
+        fs_data_path = self.get_random_fs_data_path()
+        pd.DataFrame(list(self.yield_scenario_events())).to_parquet(fs_data_path)
+
+        # .. which is partitioned when the database starts.
+        events_db = self.get_events_db(fs_data_path=fs_data_path)
+        tabulated = events_db.get_table().to_dict()
+
+        self.assertTrue(os.path.isdir(fs_data_path))
+        self.assertFalse(os.path.exists(fs_data_path + '.legacy'))
+        self.assertListEqual(events_db.list_partitions(), ['2056-01-02'])
+
+        self.assertEqual(tabulated['service-2']['item_total_usage'], 480)
+        self.assertEqual(tabulated['service-2']['item_mean'], 55.0)
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
@@ -12,7 +12,8 @@ from unittest import main, TestCase
 # Zato
 from zato.common.test import rand_int, rand_string
 from zato.common.events.client import Client as EventsClient
-from zato.common.events.common import EventInfo
+from zato.common.events.common import BatchCodec, EventInfo
+from zato.common.typing_ import asdict
 from zato.server.connection.stats import ServiceStatsClient
 
 # ################################################################################################################################
@@ -35,6 +36,7 @@ class TestImplClass(EventsClient):
         self.port = port
 
         self.push_counter      = 0
+        self.push_batch_list   = []
         self.is_run_called     = False
         self.is_connect_called = False
 
@@ -53,6 +55,11 @@ class TestImplClass(EventsClient):
     def push(self, *args, **kwargs):
         self.push_counter += 1
 
+# ################################################################################################################################
+
+    def push_batch(self, ctx_list):
+        self.push_batch_list.append(ctx_list)
+
 # ################################################################################################################################
 
     def close(self):
@@ -66,6 +73,41 @@ class TestImplClass(EventsClient):
 # ################################################################################################################################
 # ################################################################################################################################
 
+class _Socket:
+    """ A socket whose writes fail until a test says otherwise.
+    """
+    def __init__(self):
+        self.is_failing = True
+        self.sent = []
+
+    def sendall(self, data):
+        if self.is_failing:
+            raise OSError('Broken pipe')
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+
+class _SocketEventsClient(EventsClient):
+    """ An events client that writes to a socket from a test rather than to the events database.
+    """
+    def __init__(self, host, port):
+        # type: (str, int) -> None
+        super().__init__(host, port)
+        self.test_socket = _Socket()
+        self.connect_counter = 0
+
+    def connect(self):
+        if not self.is_connected:
+            self.socket = self.test_socket
+            self.is_connected = True
+            self.connect_counter += 1
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class ServiceStatsClientTestCase(TestCase):
 
 # ################################################################################################################################
@@ -258,8 +300,8 @@ class ServiceStatsClientTestCase(TestCase):
 
     def test_push_has_impl(self):
 
-        # The client has self.impl so there should be no enqueued messages. Moreover, the implementation
-        # should be called twice because there are two requests.
+        # The client has self.impl but the messages are only enqueued until the backlog is flushed. Then, there should be
+        # no enqueued messages and the implementation should be called once, with a batch of the two requests.
 
         host = rand_string()
         port = rand_int()
@@ -302,8 +344,160 @@ class ServiceStatsClientTestCase(TestCase):
         stats_client.push(**request1)
         stats_client.push(**request2)
 
+        self.assertEqual(len(stats_client.backlog), 2)
+        stats_client.flush()
+
+        self.assertEqual(len(stats_client.backlog), 0)
+        self.assertEqual(stats_client.impl.push_counter, 0)
+        self.assertEqual(len(stats_client.impl.push_batch_list), 1)
+
+        ctx1, ctx2 = stats_client.impl.push_batch_list[0] # type: PushCtx, PushCtx
+
+        self.assertEqual(ctx1.cid, cid1)
+        self.assertEqual(ctx2.cid, cid2)
+
+# ################################################################################################################################
+
+    def test_push_batches(self):
+
+        stats_client = ServiceStatsClient(impl_class=TestImplClass, batch_size=3)
+        stats_client.init(rand_string(), rand_int())
+
+        for idx in range(7):
+
+            # The flusher is told about a full batch only once it is ready
+            self.assertEqual(stats_client.batch_ready.is_set(), idx >= 3)
+
+            stats_client.push(rand_string(), None, 'my.service', True, idx)
+
+        stats_client.flush()
+
+        batch_list = stats_client.impl.push_batch_list
+        self.assertListEqual([len(batch) for batch in batch_list], [3, 3, 1])
+        self.assertListEqual([ctx.total_time_ms for batch in batch_list for ctx in batch], list(range(7)))
+
+# ################################################################################################################################
+
+    def test_push_batch_failure_keeps_events(self):
+
+        stats_client = ServiceStatsClient(impl_class=TestImplClass, batch_size=3)
+        stats_client.init(rand_string(), rand_int())
+
+        for idx in range(5):
+            stats_client.push(rand_string(), None, 'my.service', True, idx)
+
+        # The first batch is sent but the second one fails ..
+        push_batch = stats_client.impl.push_batch
+
+        def push_batch_fails_once(ctx_list):
+            if stats_client.impl.push_batch_list:
+                stats_client.impl.push_batch = push_batch
+                raise Exception('Push failure')
+            push_batch(ctx_list)
+
+        stats_client.impl.push_batch = push_batch_fails_once
+
+        with self.assertRaises(Exception):
+            stats_client.flush()
+
+        # .. which is why its events are still in the backlog ..
+        self.assertListEqual([ctx.total_time_ms for ctx in stats_client.backlog], [3, 4])
+
+        # .. and they are sent the next time.
+        stats_client.flush()
+
+        batch_list = stats_client.impl.push_batch_list
+        self.assertListEqual([ctx.total_time_ms for batch in batch_list for ctx in batch], list(range(5)))
+        self.assertEqual(len(stats_client.backlog), 0)
+
+# ################################################################################################################################
+
+    def test_push_batch_socket_failure_keeps_events(self):
+
+        stats_client = ServiceStatsClient(impl_class=_SocketEventsClient, batch_size=3)
+        stats_client.init(rand_string(), rand_int())
+
+        for idx in range(5):
+            stats_client.push(rand_string(), None, 'my.service', True, idx)
+
+        # The socket cannot be written to ..
+        with self.assertRaises(OSError):
+            stats_client.flush()
+
+        # .. so none of the events are removed from the backlog ..
+        self.assertEqual(len(stats_client.backlog), 5)
+        self.assertFalse(stats_client.impl.is_connected)
+
+        # .. and once it can be, the client reconnects and sends all of them.
+        stats_client.impl.test_socket.is_failing = False
+        stats_client.flush()
+
         self.assertEqual(len(stats_client.backlog), 0)
-        self.assertEqual(stats_client.impl.push_counter, 2)
+        self.assertEqual(len(stats_client.impl.test_socket.sent), 2)
+        self.assertEqual(stats_client.impl.connect_counter, 2)
+
+# ################################################################################################################################
+
+    def test_push_backlog_full(self):
+
+        stats_client = ServiceStatsClient(buffer_size=2)
+
+        for _ in range(5):
+            stats_client.push(rand_string(), None, 'my.service', True)
+
+        # Events that did not fit in the backlog were dropped and counted ..
+        self.assertEqual(len(stats_client.backlog), 2)
+        self.assertEqual(stats_client.num_dropped, 3)
+
+        # .. and the flusher reports them, even if it is not connected yet.
+        stats_client.flush()
+
+        self.assertEqual(stats_client.num_dropped_reported, 3)
+        self.assertEqual(len(stats_client.backlog), 2)
+
+# ################################################################################################################################
+
+    def test_batch_codec(self):
+
+        stats_client = ServiceStatsClient()
+
+        stats_client.push('cid.1', '2056-01-02T03:04:05.123456', 'my.service.1', True, 123, 'id.1')
+        stats_client.push('cid.2', '2056-01-02T03:04:05.234567', 'my.service.2', False, 0, 'id.2')
+        stats_client.push(None, None, 'my.service.1', False, None, 'id.3')
+
+        # Encoded events decode to the same dicts that the events database accepts individually
+        data = BatchCodec.encode(stats_client.backlog)
+        self.assertListEqual(BatchCodec.decode(data), [asdict(ctx) for ctx in stats_client.backlog])
+
+# ################################################################################################################################
+
+    def test_batch_codec_long_strings(self):
+
+        stats_client = ServiceStatsClient()
+
+        # Strings longer than 64 KiB are encoded as any other ones
+        stats_client.push('c' * 70_000, None, 's' * 70_000, True, 123, 'id.1')
+        stats_client.push('cid.2', None, 's' * 70_000, False, 0, 'id.2')
+
+        data = BatchCodec.encode(stats_client.backlog)
+        self.assertListEqual(BatchCodec.decode(data), [asdict(ctx) for ctx in stats_client.backlog])
+
+# ################################################################################################################################
+
+    def test_batch_codec_drops_invalid_events(self):
+
+        stats_client = ServiceStatsClient()
+
+        stats_client.push('cid.1', None, 'my.service.1', True, 123, 'id.1')
+        stats_client.push('cid.2', None, 'my.service.2', True, 'invalid', 'id.2')
+        stats_client.push('cid.3', None, 'my.service.3', False, 456, 'id.3')
+
+        ctx1, _, ctx3 = stats_client.backlog
+
+        # Only the event that could not be encoded is missing from the batch, including its object ID
+        data = BatchCodec.encode(stats_client.backlog)
+        self.assertListEqual(BatchCodec.decode(data), [asdict(ctx1), asdict(ctx3)])
+        self.assertNotIn(b'my.service.2', data)
 
 # ################################################################################################################################
 
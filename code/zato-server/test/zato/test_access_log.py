@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from datetime import datetime, timedelta
+from logging import Formatter, getLogger, Handler, INFO
+from unittest import main, TestCase
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.server.access_log import AccessLogWriter, ModuleCtx, Overflow
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Handler(Handler):
+    """ Keeps all the messages that it was to write.
+    """
+    def __init__(self, fmt):
+        super().__init__()
+        self.setFormatter(Formatter(fmt))
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AccessLogWriterTestCase(TestCase):
+
+    def _get_writer(self, fmt=ModuleCtx.Default_Format, **kwargs):
+
+        # Each test needs a logger of its own
+        access_logger = getLogger('zato_access_log.test.{}'.format(self.id()))
+        access_logger.propagate = False
+        access_logger.setLevel(INFO)
+
+        handler = _Handler(fmt)
+        access_logger.addHandler(handler)
+
+        writer = AccessLogWriter(access_logger, **kwargs)
+        writer.start()
+
+        return writer, handler
+
+# ################################################################################################################################
+
+    def _get_record(self, idx, status='200 OK'):
+        req_ts_utc = datetime(2023, 1, 2, 3, 4, 5, idx)
+        return ('10.0.0.{}'.format(idx), 'cid.{}'.format(idx), timedelta(milliseconds=idx), 'channel.1', req_ts_utc,
+            req_ts_utc, 'GET', '/api/{}'.format(idx), 'HTTP/1.1', status, idx, 'agent.1')
+
+# ################################################################################################################################
+
+    def test_batch_is_written_as_one_record(self):
+
+        writer, handler = self._get_writer(batch_size=100, flush_interval=0.01)
+
+        for idx in range(10):
+            writer.push(self._get_record(idx))
+
+        # Nothing is written by requests themselves ..
+        self.assertListEqual(handler.messages, [])
+
+        # .. only by the writer, with all the entries in one message ..
+        sleep(0.05)
+
+        message, = handler.messages
+        lines = message.splitlines()
+
+        self.assertEqual(len(lines), 10)
+
+        # .. formatted the same way that they would have been if each had been logged on its own.
+        self.assertEqual(lines[1],
+            '10.0.0.1 cid.1/0.001 "channel.1" [02/Jan/2023:03:04:05 ] "GET /api/1 HTTP/1.1" 200 1 "-" "agent.1"')
+
+        writer.stop()
+
+# ################################################################################################################################
+
+    def test_full_batch_is_written_immediately(self):
+
+        writer, handler = self._get_writer(batch_size=5, flush_interval=60)
+
+        for idx in range(5):
+            writer.push(self._get_record(idx))
+
+        sleep(0.01)
+        self.assertEqual(len(handler.messages), 1)
+
+        writer.stop()
+
+# ################################################################################################################################
+
+    def test_missing_fields(self):
+
+        writer, handler = self._get_writer(fmt='%(path)s %(asctime)s', flush_interval=60)
+
+        writer.push(self._get_record(1))
+        writer.stop()
+
+        self.assertListEqual(handler.messages, ['/api/1 -'])
+
+# ################################################################################################################################
+
+    def test_overflow_drop_oldest(self):
+
+        writer, handler = self._get_writer(buffer_size=3, flush_interval=60, overflow=Overflow.Drop_Oldest)
+
+        for idx in range(5):
+            writer.push(self._get_record(idx))
+
+        writer.stop()
+
+        self.assertEqual(writer.num_dropped, 2)
+        self.assertListEqual([line.split()[0] for line in handler.messages[0].splitlines()],
+            ['10.0.0.2', '10.0.0.3', '10.0.0.4'])
+
+# ################################################################################################################################
+
+    def test_overflow_drop_newest(self):
+
+        writer, handler = self._get_writer(buffer_size=3, flush_interval=60, overflow=Overflow.Drop_Newest)
+
+        for idx in range(5):
+            writer.push(self._get_record(idx))
+
+        writer.stop()
+
+        self.assertEqual(writer.num_dropped, 2)
+        self.assertListEqual([line.split()[0] for line in handler.messages[0].splitlines()],
+            ['10.0.0.0', '10.0.0.1', '10.0.0.2'])
+
+# ################################################################################################################################
+
+    def test_invalid_overflow(self):
+
+        with self.assertRaises(ValueError):
+            _ = AccessLogWriter(getLogger('zato_access_log.test'), overflow='invalid')
+
+# ################################################################################################################################
+
+    def test_sampling_keeps_errors(self):
+
+        writer, handler = self._get_writer(flush_interval=60, sample_rate=0.25)
+
+        for idx in range(100):
+            writer.push(self._get_record(idx))
+
+        for idx in range(10):
+            writer.push(self._get_record(idx, '500 Internal Server Error'))
+
+        writer.stop()
+
+        lines = handler.messages[0].splitlines()
+        errors = [line for line in lines if ' 500 ' in line]
+
+        self.assertEqual(len(lines), 35)
+        self.assertEqual(len(errors), 10)
+        self.assertEqual(writer.num_skipped, 75)
+
+# ################################################################################################################################
+
+    def test_from_config(self):
+
+        writer = AccessLogWriter.from_config(getLogger('zato_access_log.test'), {
+            'http_access_log_buffer_size': '10',
+            'http_access_log_batch_size': '2',
+            'http_access_log_flush_interval': '0.5',
+            'http_access_log_overflow': Overflow.Drop_Newest,
+            'http_access_log_sample_rate': '0.1',
+        })
+
+        self.assertEqual(writer.buffer_size, 10)
+        self.assertEqual(writer.buffer.maxlen, 10)
+        self.assertEqual(writer.batch_size, 2)
+        self.assertEqual(writer.flush_interval, 0.5)
+        self.assertEqual(writer.overflow, Overflow.Drop_Newest)
+        self.assertEqual(writer.sample_rate, 0.1)
+
+# ################################################################################################################################
+
+    def test_from_config_sample_rate(self):
+
+        logger = getLogger('zato_access_log.test')
+
+        # Only errors are logged with a sample rate of 0 ..
+        writer = AccessLogWriter.from_config(logger, {'http_access_log_sample_rate': 0})
+        self.assertEqual(writer.sample_rate, 0.0)
+
+        writer = AccessLogWriter.from_config(logger, {'http_access_log_sample_rate': '0'})
+        self.assertEqual(writer.sample_rate, 0.0)
+
+        # .. and all requests are logged if it is not given at all.
+        writer = AccessLogWriter.from_config(logger, {})
+        self.assertEqual(writer.sample_rate, 1.0)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
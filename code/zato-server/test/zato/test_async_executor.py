@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+# gevent
+from gevent import sleep, spawn
+from gevent.event import Event
+
+# Zato
+from zato.server.async_executor import AsyncExecutor, AsyncPool, AsyncPoolFull, Default, ModuleCtx, Overflow
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AsyncPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.spill_dir = mkdtemp(prefix='zato-test-async-')
+        self.release = Event()
+        self.done = []
+
+    def tearDown(self):
+        self.release.set()
+        rmtree(self.spill_dir, ignore_errors=True)
+
+    def _task(self, value):
+        _ = self.release.wait()
+        self.done.append(value)
+
+# ################################################################################################################################
+
+    def test_concurrency_is_limited(self):
+
+        pool = AsyncPool('test', None, max_concurrency=2, queue_size=10)
+
+        for idx in range(5):
+            pool.submit(self._task, idx)
+
+        sleep(0.01)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['running'], 2)
+        self.assertEqual(stats['queue_depth'], 3)
+        self.assertEqual(stats['queue_max_depth'], 3)
+
+        self.release.set()
+        sleep(0.01)
+
+        # Tasks that waited in the queue run in the order they were submitted in
+        self.assertListEqual(self.done, [0, 1, 2, 3, 4])
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['submitted'], 5)
+        self.assertEqual(stats['completed'], 5)
+        self.assertGreater(stats['wait_time_max'], 0)
+
+# ################################################################################################################################
+
+    def test_failed_tasks_are_counted(self):
+
+        def fail():
+            raise Exception('Test failure')
+
+        pool = AsyncPool('test', None)
+        pool.submit(fail)
+        sleep(0.01)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['running'], 0)
+
+# ################################################################################################################################
+
+    def test_overflow_reject(self):
+
+        pool = AsyncPool('test', None, max_concurrency=1, queue_size=1, overflow=Overflow.Reject)
+
+        pool.submit(self._task, 1)
+        pool.submit(self._task, 2)
+
+        with self.assertRaises(AsyncPoolFull):
+            pool.submit(self._task, 3)
+
+        self.assertEqual(pool.get_stats()['rejected'], 1)
+
+# ################################################################################################################################
+
+    def test_overflow_block(self):
+
+        pool = AsyncPool('test', None, max_concurrency=1, queue_size=1, overflow=Overflow.Block, block_timeout=5)
+
+        pool.submit(self._task, 1)
+        pool.submit(self._task, 2)
+
+        # The third task can be submitted only once there is room for it ..
+        submitter = spawn(pool.submit, self._task, 3)
+        sleep(0.01)
+        self.assertFalse(submitter.ready())
+
+        # .. which is when the first one completes.
+        self.release.set()
+        submitter.join(1)
+        sleep(0.01)
+
+        self.assertTrue(submitter.successful())
+        self.assertListEqual(self.done, [1, 2, 3])
+        self.assertEqual(pool.get_stats()['blocked'], 1)
+
+# ################################################################################################################################
+
+    def test_overflow_block_timeout(self):
+
+        pool = AsyncPool('test', None, max_concurrency=1, queue_size=1, overflow=Overflow.Block, block_timeout=0.01)
+
+        pool.submit(self._task, 1)
+        pool.submit(self._task, 2)
+
+        with self.assertRaises(AsyncPoolFull):
+            pool.submit(self._task, 3)
+
+# ################################################################################################################################
+
+    def test_overflow_block_in_task(self):
+
+        pool = AsyncPool('test', None, max_concurrency=1, queue_size=1, overflow=Overflow.Block, block_timeout=5)
+        errors = []
+
+        # A task submits another one to its own pool, which is full ..
+        def submit_from_task():
+            try:
+                pool.submit(self._task, 3)
+            except AsyncPoolFull as e:
+                errors.append(e)
+
+        pool.submit(submit_from_task)
+        pool.submit(self._task, 2)
+        sleep(0.01)
+
+        # .. so, rather than wait for room that only its own completion could make, it is told that the pool is full.
+        self.assertEqual(len(errors), 1)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['blocked'], 0)
+        self.assertEqual(stats['rejected'], 1)
+
+# ################################################################################################################################
+
+    def test_overflow_spawn(self):
+
+        pool = AsyncPool('test', None, max_concurrency=1, queue_size=1, overflow=Overflow.Spawn)
+
+        # Tasks that do not fit in the queue run immediately, without making anyone wait
+        for idx in range(4):
+            pool.submit(self._task, idx)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['running'], 3)
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertEqual(stats['spawned'], 2)
+
+        self.release.set()
+        sleep(0.01)
+
+        self.assertListEqual(sorted(self.done), [0, 1, 2, 3])
+        self.assertEqual(pool.get_stats()['running'], 0)
+
+# ################################################################################################################################
+
+    def test_overflow_spill(self):
+
+        resumed = []
+
+        def resume(value):
+            resumed.append(value)
+
+        pool = AsyncPool('test', resume, max_concurrency=1, queue_size=1, overflow=Overflow.Spill, spill_dir=self.spill_dir)
+
+        for idx in range(4):
+            pool.submit(self._task, idx)
+
+        # Two tasks did not fit in the queue so they were written to disk ..
+        names = os.listdir(self.spill_dir)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith(ModuleCtx.Spill_Suffix) for name in names))
+
+        # .. and once there is room for them, they are read back and given to the resume function, in order.
+        self.release.set()
+        sleep(0.05)
+
+        self.assertListEqual(self.done, [0, 1])
+        self.assertListEqual(resumed, [2, 3])
+        self.assertListEqual(os.listdir(self.spill_dir), [])
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['spilled'], 2)
+        self.assertEqual(stats['spilled_pending'], 0)
+
+# ################################################################################################################################
+
+    def test_spilled_tasks_survive_restarts(self):
+
+        pool = AsyncPool('test', self.fail, max_concurrency=1, queue_size=1, overflow=Overflow.Spill,
+            spill_dir=self.spill_dir)
+
+        for idx in range(4):
+            pool.submit(self._task, idx)
+
+        # The process that spilled the tasks stops without running them ..
+        pool.spilled.clear()
+
+        # .. possibly leaving behind a write that did not complete, which must be ignored.
+        with open(os.path.join(self.spill_dir, 'abc' + ModuleCtx.Spill_Temp_Suffix), 'wb') as f:
+            _ = f.write(b'abc')
+
+        # A new pool, in a new process, finds the tasks that the previous one spilled and runs them
+        resumed = []
+
+        def resume(value):
+            resumed.append(value)
+
+        _ = AsyncPool('test', resume, overflow=Overflow.Spill, spill_dir=self.spill_dir)
+        sleep(0.01)
+
+        self.assertListEqual(resumed, [2, 3])
+        self.assertListEqual(os.listdir(self.spill_dir), [])
+
+# ################################################################################################################################
+
+    def test_invalid_config(self):
+
+        with self.assertRaises(ValueError):
+            _ = AsyncPool('test', None, overflow='invalid')
+
+        with self.assertRaises(ValueError):
+            _ = AsyncPool('test', None, overflow=Overflow.Spill)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class AsyncExecutorTestCase(TestCase):
+
+    def test_from_config(self):
+
+        spill_dir = mkdtemp(prefix='zato-test-async-')
+
+        try:
+            executor = AsyncExecutor.from_config({
+                'reports': {
+                    'max_concurrency': '5',
+                    'queue_size': '50',
+                    'overflow': Overflow.Spill,
+                    'services': ['my.service.1', 'my.service.2'],
+                },
+                'partners': {
+                    'overflow': Overflow.Reject,
+                    'channels': 'scheduler',
+                },
+            }, spill_dir, print)
+
+            reports = executor.pools['reports']
+            partners = executor.pools['partners']
+            default = executor.pools[Default.pool_name]
+
+            self.assertEqual(reports.max_concurrency, 5)
+            self.assertEqual(reports.queue_size, 50)
+            self.assertEqual(reports.spill_dir, os.path.join(spill_dir, 'reports'))
+            self.assertEqual(partners.max_concurrency, Default.max_concurrency)
+            self.assertEqual(partners.overflow, Overflow.Reject)
+
+            # The default pool never makes its callers wait, unless it is configured to
+            self.assertEqual(default.overflow, Overflow.Spawn)
+            executor_default = AsyncExecutor.from_config({Default.pool_name: {'max_concurrency': '10'}}, spill_dir, print)
+            self.assertEqual(executor_default.pools[Default.pool_name].overflow, Overflow.Spawn)
+
+            # An explicit name takes precedence over services, which take precedence over channels ..
+            self.assertIs(executor.get_pool('partners', 'my.service.1', 'scheduler'), partners)
+            self.assertIs(executor.get_pool('', 'my.service.1', 'scheduler'), reports)
+            self.assertIs(executor.get_pool('', 'my.service.3', 'scheduler'), partners)
+
+            # .. and everything else goes to the default pool.
+            self.assertIs(executor.get_pool('', 'my.service.3', 'invoke-async'), default)
+
+            with self.assertRaises(ValueError):
+                _ = executor.get_pool('invalid', '', '')
+
+            self.assertListEqual(sorted(executor.get_stats()), ['default', 'partners', 'reports'])
+
+        finally:
+            rmtree(spill_dir, ignore_errors=True)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
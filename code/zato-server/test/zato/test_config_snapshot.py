@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from collections import namedtuple
+from pickle import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+# Zato
+from zato.common.broker_message import CACHE, SECURITY
+from zato.common.const import SECRETS
+from zato.server.config import ConfigDict
+from zato.server.config_snapshot import ConfigSnapshotStore, ModuleCtx, SnapshotRow
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+_Row = namedtuple('_Row', ['id', 'name', 'password'])
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _ODB:
+    """ Returns the same results as ODB does - some queries return columns along with rows, some return rows only.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def get_basic_auth_list(self, cluster_id, cluster_name, needs_columns=False):
+        self.calls.append('get_basic_auth_list')
+        rows = [_Row(1, 'my.sec.1', 'my.password'), _Row(2, 'my.sec.2', SECRETS.PREFIX + 'abc')]
+        return (rows, dict.fromkeys(_Row._fields)) if needs_columns else rows
+
+    def get_http_soap_list(self, cluster_id, connection):
+        self.calls.append('get_http_soap_list')
+        return [{'id': 1, 'name': 'my.channel', 'url_path': '/my/channel'}]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _Lock:
+
+    def __init__(self):
+        self.calls = []
+
+    def acquire(self):
+        self.calls.append('acquire')
+        return True
+
+    def release(self):
+        self.calls.append('release')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ConfigSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(prefix='zato-test-config-snapshot-')
+        self.store = ConfigSnapshotStore(os.path.join(self.base_dir, ModuleCtx.Dir_Name))
+
+    def tearDown(self):
+        rmtree(self.base_dir, ignore_errors=True)
+
+    def _encrypt(self, data):
+        return SECRETS.PREFIX + data[::-1]
+
+    def _decrypt(self, data):
+        return data[len(SECRETS.PREFIX):][::-1]
+
+    def _create_snapshot(self, deployment_key='deployment.1'):
+
+        odb = _ODB()
+        lock = _Lock()
+
+        source = self.store.get_source(odb, deployment_key, self._encrypt, lambda: lock)
+        self.assertFalse(source.is_snapshot)
+
+        # Results from ODB are returned as they are ..
+        rows, columns = source.get_basic_auth_list(1, None, True)
+        self.assertEqual(rows[0].password, 'my.password')
+        self.assertListEqual(list(columns), ['id', 'name', 'password'])
+
+        rows = source.get_http_soap_list(1, 'channel')
+        self.assertEqual(rows[0]['url_path'], '/my/channel')
+
+        # .. and only one worker at a time can create a snapshot.
+        self.assertListEqual(lock.calls, ['acquire'])
+        source.save()
+        self.assertListEqual(lock.calls, ['acquire', 'release'])
+
+        return odb
+
+# ################################################################################################################################
+
+    def test_save_and_load(self):
+
+        _ = self._create_snapshot()
+
+        # No temporary files are left behind
+        self.assertListEqual(os.listdir(self.store.base_dir), [ModuleCtx.File_Name])
+
+        odb = _ODB()
+        lock = _Lock()
+
+        source = self.store.get_source(odb, 'deployment.1', self._encrypt, lambda: lock)
+        self.assertTrue(source.is_snapshot)
+
+        rows, columns = source.get_basic_auth_list(1, None, True)
+        row1, row2 = rows
+
+        self.assertEqual(row1.name, 'my.sec.1')
+        self.assertEqual(row2.get_name(), 'my.sec.2')
+        self.assertListEqual(list(columns), ['id', 'name', 'password'])
+
+        # Secrets are always encrypted in snapshots
+        self.assertEqual(row1.password, self._encrypt('my.password'))
+        self.assertEqual(row2.password, SECRETS.PREFIX + 'abc')
+
+        row, = source.get_http_soap_list(1, 'channel')
+        self.assertEqual(row['url_path'], '/my/channel')
+
+        # Neither ODB nor the lock were needed
+        self.assertListEqual(odb.calls, [])
+        self.assertListEqual(lock.calls, [])
+
+        # Saving a snapshot read from a snapshot does nothing
+        source.save()
+        self.assertListEqual(lock.calls, [])
+
+# ################################################################################################################################
+
+    def test_lock_released_if_queries_fail(self):
+
+        lock = _Lock()
+        source = self.store.get_source(_ODB(), 'deployment.1', self._encrypt, lambda: lock)
+
+        # This is what set_up_config does if any of the queries fails ..
+        try:
+            _ = source.get_basic_auth_list(1, None, True)
+            raise Exception('Query failure')
+        except Exception:
+            pass
+        finally:
+            source.release()
+
+        # .. the lock is released but nothing is saved ..
+        self.assertListEqual(lock.calls, ['acquire', 'release'])
+        self.assertIsNone(self.store.load('deployment.1'))
+
+        # .. so another worker will create the snapshot ..
+        odb = self._create_snapshot()
+        self.assertListEqual(odb.calls, ['get_basic_auth_list', 'get_http_soap_list'])
+
+        # .. whereas a lock that was released by save is not released again.
+        lock = _Lock()
+        source = self.store.get_source(_ODB(), 'deployment.2', self._encrypt, lambda: lock)
+        source.save()
+        source.release()
+
+        self.assertListEqual(lock.calls, ['acquire', 'release'])
+
+# ################################################################################################################################
+
+    def test_config_dict_from_snapshot(self):
+
+        _ = self._create_snapshot()
+
+        source = self.store.get_source(_ODB(), 'deployment.1', self._encrypt)
+        query = source.get_basic_auth_list(1, None, True)
+
+        config_dict = ConfigDict.from_query('basic_auth', query, decrypt_func=self._decrypt)
+        config = config_dict['my.sec.1']['config']
+
+        self.assertEqual(config['id'], 1)
+        self.assertEqual(config['password'], 'my.password')
+        self.assertTrue(config['_encrypted_in_odb'])
+
+# ################################################################################################################################
+
+    def test_query_not_in_snapshot(self):
+
+        _ = self._create_snapshot()
+
+        odb = _ODB()
+        source = self.store.get_source(odb, 'deployment.1', self._encrypt)
+
+        # Called with different arguments than when the snapshot was created
+        _ = source.get_http_soap_list(1, 'outgoing')
+        self.assertListEqual(odb.calls, ['get_http_soap_list'])
+
+# ################################################################################################################################
+
+    def test_invalidation(self):
+
+        _ = self._create_snapshot()
+
+        # A different deployment needs a new snapshot ..
+        self.assertIsNone(self.store.load('deployment.2'))
+        self.assertIsNotNone(self.store.load('deployment.1'))
+
+        # .. messages that do not change configuration keep it valid ..
+        self.store.on_broker_msg(CACHE.BUILTIN_STATE_CHANGED_SET.value)
+        self.assertIsNotNone(self.store.load('deployment.1'))
+        self.assertEqual(self.store.get_change_counter(), 0)
+
+        # .. and the ones that do change it invalidate it.
+        self.store.on_broker_msg(SECURITY.BASIC_AUTH_CREATE.value)
+        self.assertIsNone(self.store.load('deployment.1'))
+        self.assertEqual(self.store.get_change_counter(), 1)
+
+        # A snapshot created after the change is valid again
+        _ = self._create_snapshot()
+        self.assertIsNotNone(self.store.load('deployment.1'))
+
+        # A file that cannot be read is ignored
+        with open(self.store.path, 'wb') as f:
+            _ = f.write(b'abc')
+
+        self.assertIsNone(self.store.load('deployment.1'))
+
+# ################################################################################################################################
+
+    def test_snapshot_row_pickle(self):
+
+        row = SnapshotRow({'id': 1, 'name': 'my.name'})
+        row.row_name = 'my.name'
+
+        loaded = loads(dumps(row))
+
+        self.assertDictEqual(loaded, {'id': 1, 'name': 'my.name'})
+        self.assertEqual(loaded.get_name(), 'my.name')
+        self.assertDictEqual(loaded._asdict(), {'id': 1, 'name': 'my.name'})
+
+        with self.assertRaises(AttributeError):
+            _ = loaded.invalid
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from json import dumps, loads
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# ws4py
+from ws4py.streaming import Stream
+
+# Zato
+from zato.server.connection.web_socket import _cannot_send, close_code, WebSocket, WebSocketContainer
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _WebSocket(WebSocket):
+    """ A WebSocket whose socket only records what is written to it.
+    """
+    def __init__(self, idx, is_initialized=True):
+
+        # We do not call the parent's __init__ because there is no socket
+        self._json_dump_func = dumps
+        self._initialized = is_initialized
+        self.pub_client_id = 'test.pub_client_id.{}'.format(idx)
+        self.peer_conn_info_pretty = 'test.peer.{}'.format(idx)
+        self.is_audit_log_sent_active = False
+        self.stream = Stream(always_mask=False)
+        self.frames_pending = []
+        self.is_sending_frames = False
+        self._disconnect_requested = False
+
+        # Data written to the socket, one element per write ..
+        self.written = []
+
+        # .. each of them taking that long ..
+        self.write_time = 0
+
+        # .. unless it raises this exception.
+        self.write_exception = None
+
+        # Codes of close frames sent to the client
+        self.disconnected = []
+
+    def _write(self, data):
+        if self.write_exception:
+            raise self.write_exception
+        if self.write_time:
+            sleep(self.write_time)
+        self.written.append(data)
+
+    def disconnect_client(self, cid='', code=close_code.default_diconnect, reason=''):
+        self.disconnected.append(code)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class BroadcastTestCase(TestCase):
+
+    def _get_container(self, *clients):
+
+        container = WebSocketContainer.__new__(WebSocketContainer)
+        container.config = Bunch(name='test.channel')
+        container.clients = {client.pub_client_id: client for client in clients}
+
+        return container
+
+    def _wait_until_sent(self, *clients):
+        for _ in range(100):
+            if not any(client.is_sending_frames for client in clients):
+                break
+            sleep(0.01)
+
+    def _get_request(self, data):
+        """ Returns the request that a single frame sent to a client carries.
+        """
+        # Frames sent by servers are not masked, and our payloads are short enough not to need a 64-bit length
+        offset = 2 if data[1] < 126 else 4
+        return loads(data[offset:])['data']
+
+# ################################################################################################################################
+
+    def test_one_frame_for_all_clients(self):
+
+        clients = [_WebSocket(idx) for idx in range(3)]
+        container = self._get_container(*clients)
+
+        container.broadcast('test.cid', {'my.key': 'my.value'})
+
+        # The same frame was queued for each of the clients, rather than each of them building its own ..
+        frame = clients[0].frames_pending[0]
+        self.assertTrue(all(client.frames_pending[0] is frame for client in clients))
+
+        # .. and it is written to each of them as it is.
+        self._wait_until_sent(*clients)
+
+        for client in clients:
+            self.assertListEqual(client.written, [frame])
+            self.assertDictEqual(self._get_request(client.written[0]), {'my.key': 'my.value'})
+
+# ################################################################################################################################
+
+    def test_frames_queued_during_write_joined(self):
+
+        client = _WebSocket(1)
+        client.write_time = 0.05
+
+        client.send_frame(b'frame.1', None, 'test.cid.1')
+
+        # The first frame is being written ..
+        sleep(0.01)
+        self.assertTrue(client.is_sending_frames)
+
+        # .. so these ones need to wait ..
+        client.send_frame(b'frame.2', None, 'test.cid.2')
+        client.send_frame(b'frame.3', None, 'test.cid.3')
+
+        # .. and they are written together once it is.
+        self._wait_until_sent(client)
+
+        self.assertListEqual(client.written, [b'frame.1', b'frame.2frame.3'])
+        self.assertListEqual(client.frames_pending, [])
+
+# ################################################################################################################################
+
+    def test_uninitialised_clients_skipped(self):
+
+        client1 = _WebSocket(1)
+        client2 = _WebSocket(2, is_initialized=False)
+        container = self._get_container(client1, client2)
+
+        container.broadcast('test.cid', {'my.key': 'my.value'})
+        self._wait_until_sent(client1, client2)
+
+        self.assertEqual(len(client1.written), 1)
+        self.assertListEqual(client2.written, [])
+
+        # Nothing is built if there is no client to send it to
+        container = self._get_container(client2)
+        container.broadcast('test.cid', {'my.key': 'my.value'})
+
+        self.assertListEqual(client2.frames_pending, [])
+        self.assertFalse(client2.is_sending_frames)
+
+# ################################################################################################################################
+
+    def test_send_failure_disconnects_only_that_client(self):
+
+        clients = [_WebSocket(idx) for idx in range(3)]
+        clients[1].write_exception = RuntimeError(_cannot_send)
+
+        container = self._get_container(*clients)
+        container.broadcast('test.cid', {'my.key': 'my.value'})
+
+        self._wait_until_sent(*clients)
+
+        # The client whose socket failed is disconnected ..
+        self.assertListEqual(clients[1].disconnected, [close_code.runtime_invoke_client])
+        self.assertListEqual(clients[1].written, [])
+        self.assertListEqual(clients[1].frames_pending, [])
+
+        # .. whereas the other ones still receive the message.
+        for client in clients[0], clients[2]:
+            self.assertListEqual(client.disconnected, [])
+            self.assertEqual(len(client.written), 1)
+
+# ################################################################################################################################
+
+    def test_slow_client_disconnected(self):
+
+        slow = _WebSocket(1)
+        slow.write_time = 0.5
+
+        fast = _WebSocket(2)
+        container = self._get_container(slow, fast)
+
+        with patch('zato.server.connection.web_socket.frames_pending_max', 3):
+
+            # The slow client is still writing the first message when the next ones arrive ..
+            for idx in range(6):
+                container.broadcast('test.cid.{}'.format(idx), {'idx': idx})
+                sleep(0.01)
+
+        # .. so, once it has too many of them waiting, it is disconnected and its frames are dropped ..
+        self.assertListEqual(slow.disconnected, [close_code.too_many_frames_pending])
+        self.assertListEqual(slow.frames_pending, [])
+
+        # .. whereas the other client receives all of the messages.
+        self._wait_until_sent(fast)
+
+        self.assertListEqual(fast.disconnected, [])
+        self.assertListEqual([self._get_request(data)['idx'] for data in fast.written], list(range(6)))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
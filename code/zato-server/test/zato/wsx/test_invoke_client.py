@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from json import dumps
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.server.connection.web_socket import WebSocket
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _WebSocket(WebSocket):
+    """ A WebSocket without a socket, whose client responds only when a test tells it to.
+    """
+    def __init__(self):
+
+        # We do not call the parent's __init__ because there is no socket
+        self._json_dump_func = dumps
+        self.python_id = 'test.python_id'
+        self.pub_client_id = 'test.pub_client_id'
+        self.ext_client_id = 'test.ext_client_id'
+        self.ext_client_name = 'test.ext_client_name'
+        self.peer_conn_info_pretty = 'test.peer'
+        self.responses_pending = {}
+
+        # What _close_connection needs
+        self.config = Bunch(name='test.channel')
+        self.container = Bunch(clients={})
+        self._peer_address = 'test.peer_address'
+        self._peer_fqdn = 'test.peer_fqdn'
+        self._local_address = 'test.local_address'
+        self.is_audit_log_sent_active = False
+        self.is_audit_log_received_active = False
+
+        # IDs of the requests sent to the client
+        self.sent = []
+
+    def send(self, data='', cid='', in_reply_to=''):
+        self.sent.append(cid)
+
+    def unregister_auth_client(self):
+        pass
+
+    def respond(self, request_id, data):
+        self._handle_client_response(request_id, Bunch(in_reply_to=request_id, data=data))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class InvokeClientTestCase(TestCase):
+
+    def _invoke(self, ws, cid, timeout=5):
+        greenlet = spawn(ws.invoke_client, cid, {'cid': cid}, timeout)
+
+        # Let the greenlet send its request
+        sleep(0)
+
+        return greenlet
+
+# ################################################################################################################################
+
+    def test_response(self):
+
+        ws = _WebSocket()
+        greenlet = self._invoke(ws, 'test.cid.1')
+
+        # The request was sent and its response is waited for ..
+        self.assertListEqual(ws.sent, ['test.cid.1'])
+        self.assertIn('test.cid.1', ws.responses_pending)
+
+        # .. until it arrives ..
+        ws.respond('test.cid.1', {'my.key': 'my.value'})
+        self.assertDictEqual(greenlet.get(timeout=1), {'my.key': 'my.value'})
+
+        # .. after which it is no longer pending.
+        self.assertDictEqual(ws.responses_pending, {})
+
+# ################################################################################################################################
+
+    def test_concurrent_responses_out_of_order(self):
+
+        ws = _WebSocket()
+        greenlets = [self._invoke(ws, 'test.cid.{}'.format(idx)) for idx in range(3)]
+
+        # Each response wakes up only the greenlet that waits for it
+        for idx in (2, 0, 1):
+            ws.respond('test.cid.{}'.format(idx), idx)
+
+        self.assertListEqual([greenlet.get(timeout=1) for greenlet in greenlets], [0, 1, 2])
+        self.assertDictEqual(ws.responses_pending, {})
+
+# ################################################################################################################################
+
+    def test_timeout(self):
+
+        ws = _WebSocket()
+
+        response = ws.invoke_client('test.cid.1', {}, 0.05)
+
+        self.assertIsNone(response)
+        self.assertDictEqual(ws.responses_pending, {})
+
+# ################################################################################################################################
+
+    def test_disconnect_wakes_up_waiters(self):
+
+        ws = _WebSocket()
+        greenlets = [self._invoke(ws, 'test.cid.{}'.format(idx)) for idx in range(2)]
+
+        # The client disconnects long before the requests would time out ..
+        ws._close_connection('Test disconnect')
+
+        # .. which means that no response will arrive and there is no point in waiting for one.
+        _ = joinall(greenlets, timeout=1)
+
+        self.assertTrue(all(greenlet.ready() for greenlet in greenlets))
+        self.assertListEqual([greenlet.value for greenlet in greenlets], [None, None])
+        self.assertDictEqual(ws.responses_pending, {})
+
+# ################################################################################################################################
+
+    def test_late_and_unknown_responses_dropped(self):
+
+        ws = _WebSocket()
+
+        # A response arrives after its request timed out ..
+        self.assertIsNone(ws.invoke_client('test.cid.1', {}, 0.05))
+        ws.respond('test.cid.1', 'my.late.response')
+
+        # .. and another to a request that was never sent ..
+        ws.respond('test.cid.unknown', 'my.unknown.response')
+
+        # .. and neither of them is kept.
+        self.assertDictEqual(ws.responses_pending, {})
+
+        # The next request is not affected by them
+        greenlet = self._invoke(ws, 'test.cid.2')
+        ws.respond('test.cid.2', 'my.response')
+
+        self.assertEqual(greenlet.get(timeout=1), 'my.response')
+
+# ################################################################################################################################
+
+    def test_pending_removed_when_waiter_killed(self):
+
+        ws = _WebSocket()
+        greenlet = self._invoke(ws, 'test.cid.1')
+
+        self.assertIn('test.cid.1', ws.responses_pending)
+
+        greenlet.kill()
+
+        self.assertDictEqual(ws.responses_pending, {})
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -28,6 +28,7 @@ class CreateForm(forms.Form):
         initial=CACHE.DEFAULT.MAX_ITEM_SIZE, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
     extend_expiry_on_get = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
     extend_expiry_on_set = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
+    has_key_index = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     sync_method = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
     persistent_storage = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
     cache_id = forms.CharField(widget=forms.HiddenInput())
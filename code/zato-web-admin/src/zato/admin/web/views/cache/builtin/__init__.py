@@ -29,6 +29,7 @@ class Index(_Index):
         input_required = ('cluster_id',)
         output_required = ('cache_id', 'name', 'is_active', 'is_default', 'max_size', 'max_item_size', 'extend_expiry_on_get',
             'extend_expiry_on_set', 'sync_method', 'persistent_storage', 'cache_type', 'current_size')
+        output_optional = ('has_key_index',)
         output_repeated = True
 
     def handle(self):
@@ -47,6 +48,7 @@ class _CreateEdit(CreateEdit):
     class SimpleIO(CreateEdit.SimpleIO):
         input_required = ('cache_id', 'name', 'is_active', 'is_default', 'max_size', 'max_item_size', 'extend_expiry_on_get',
             'extend_expiry_on_set', 'sync_method', 'persistent_storage', 'cache_type', 'current_size')
+        input_optional = ('has_key_index',)
         output_required = ('cache_id', 'name', 'id')
 
     def success_message(self, item):